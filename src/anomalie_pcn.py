@@ -0,0 +1,209 @@
+"""
+Anomalie PCN - Analizzatore DB OpenFiber
+Distanza di ogni edificio dal PCN assegnato (POP) e dal PCN più vicino,
+calcolate in blocco con array numpy costruiti da PCN_VALLE_AOSTA, e report
+ordinato degli edifici sospetti: troppo lontani dal proprio PCN o
+sensibilmente più vicini a un altro
+"""
+
+import argparse
+import os
+import sys
+import time
+from datetime import datetime
+
+import numpy as np
+import pandas as pd
+
+from config import ANOMALIE_PCN_CONFIG
+from coordinate import parse_coordinate_building
+from indice_spaziale import distanza_km, indice_pcn, carica_edifici
+
+# Colonne aggiunte all'estrazione
+COLONNE_DISTANZE = ['DISTANZA_PCN_KM', 'PCN_VICINO', 'DISTANZA_PCN_VICINO_KM', 'SCARTO_PCN_KM']
+
+# Motivi di anomalia (colonna ANOMALIA del report)
+ANOMALIA_LONTANO = 'PCN lontano'
+ANOMALIA_PIU_VICINO = 'Altro PCN più vicino'
+ANOMALIA_SENZA_COORDINATE = 'PCN senza coordinate'
+
+# Colonne dell'edificio riportate nel report
+COLONNE_REPORT = ['COMUNE', 'ISTAT', 'INDIRIZZO', 'CIVICO', 'ID_BUILDING', 'COORDINATE_BUILDING',
+                  'STATO_UI', 'POP', 'NOME_PCN']
+
+
+def aggiungi_distanze_pcn(df, indice=None):
+    """
+    Aggiunge a un'estrazione arricchita (o a un suo batch) le distanze dai PCN
+
+    Tutto vettoriale: coordinate edificio con parse_coordinate_building, PCN
+    assegnato tramite get_indexer sulla tabella PCN, PCN più vicino con
+    IndiceSpaziale.piu_vicini_multipli. Le righe sono indipendenti: si può
+    applicare batch per batch (es. comune per comune di una EstrazioneSpill).
+
+    Args:
+        df: Estrazione arricchita (COORDINATE_BUILDING, POP)
+        indice: Indice dei PCN (default indice_pcn() su PCN_VALLE_AOSTA)
+
+    Returns:
+        Copia di df con COLONNE_DISTANZE: DISTANZA_PCN_KM (NaN se POP senza
+        coordinate o edificio non valido), PCN_VICINO, DISTANZA_PCN_VICINO_KM
+        e SCARTO_PCN_KM (quanto il PCN assegnato è più lontano del più vicino)
+    """
+    indice = indice or indice_pcn()
+    tabella = indice.dati
+    lon, lat, _ = parse_coordinate_building(df['COORDINATE_BUILDING'])
+
+    # POP sconosciuto -> -1 -> ultima voce NaN degli array PCN
+    assegnati = pd.Index(tabella['POP'].to_numpy(dtype=object)).get_indexer(df['POP'].to_numpy(dtype=object))
+    lat_pcn = np.append(tabella['LAT_PCN'].to_numpy(dtype=np.float64), np.nan)[assegnati]
+    lon_pcn = np.append(tabella['LON_PCN'].to_numpy(dtype=np.float64), np.nan)[assegnati]
+    distanza = distanza_km(lat, lon, lat_pcn, lon_pcn)
+
+    posizioni, distanze = indice.piu_vicini_multipli(lat, lon, 1)
+    codici = np.append(tabella['POP'].to_numpy(dtype=object), None)
+    vicino = distanze[:, 0]
+
+    return df.assign(
+        DISTANZA_PCN_KM=distanza,
+        PCN_VICINO=codici[posizioni[:, 0]],
+        DISTANZA_PCN_VICINO_KM=vicino,
+        SCARTO_PCN_KM=distanza - vicino
+    )
+
+
+def report_anomalie(df, distanza_max_km=None, scarto_min_km=None, indice=None):
+    """
+    Edifici anomali ordinati per gravità
+
+    Anomalie (anche più di una per edificio):
+    - PCN lontano: oltre distanza_max_km dal PCN assegnato
+    - Altro PCN più vicino: il PCN più vicino non è quello assegnato e il
+      PCN assegnato è più lontano di almeno scarto_min_km
+    - PCN senza coordinate: POP assente dalla tabella PCN (edificio valido)
+
+    Ordine: SCARTO_PCN_KM decrescente, poi DISTANZA_PCN_KM decrescente; gli
+    edifici senza distanza in coda.
+
+    Args:
+        df: Estrazione arricchita, con o senza COLONNE_DISTANZE
+        distanza_max_km, scarto_min_km: Soglie (default ANOMALIE_PCN_CONFIG)
+        indice: Indice dei PCN se le distanze vanno calcolate
+
+    Returns:
+        DataFrame con RANK, ANOMALIA, colonne edificio e COLONNE_DISTANZE
+    """
+    distanza_max_km = ANOMALIE_PCN_CONFIG['distanza_max_km'] if distanza_max_km is None else distanza_max_km
+    scarto_min_km = ANOMALIE_PCN_CONFIG['scarto_min_km'] if scarto_min_km is None else scarto_min_km
+    if not set(COLONNE_DISTANZE) <= set(df.columns):
+        df = aggiungi_distanze_pcn(df, indice)
+
+    distanza = df['DISTANZA_PCN_KM'].to_numpy(dtype=np.float64)
+    scarto = df['SCARTO_PCN_KM'].to_numpy(dtype=np.float64)
+    vicino_valido = ~np.isnan(df['DISTANZA_PCN_VICINO_KM'].to_numpy(dtype=np.float64))
+    maschere = [
+        distanza > distanza_max_km,
+        (scarto >= scarto_min_km) & (df['PCN_VICINO'].to_numpy(dtype=object) != df['POP'].to_numpy(dtype=object)),
+        np.isnan(distanza) & vicino_valido
+    ]
+    motivi = [ANOMALIA_LONTANO, ANOMALIA_PIU_VICINO, ANOMALIA_SENZA_COORDINATE]
+
+    # Combinazione di motivi come bit: etichette delle 8 combinazioni precalcolate
+    codici = sum(maschera.astype(np.int64) << bit for bit, maschera in enumerate(maschere))
+    etichette = np.array([' + '.join(m for bit, m in enumerate(motivi) if combinazione >> bit & 1)
+                          for combinazione in range(1 << len(motivi))], dtype=object)
+    anomale = np.flatnonzero(codici)
+
+    # Ordinamento numpy sulle sole righe anomale (decrescente, NaN in coda), una sola take
+    ordine = np.lexsort((-np.nan_to_num(distanza[anomale], nan=-np.inf),
+                         -np.nan_to_num(scarto[anomale], nan=-np.inf)))
+    righe = anomale[ordine]
+    colonne = [c for c in COLONNE_REPORT if c in df.columns] + COLONNE_DISTANZE
+    report = df[colonne].iloc[righe].reset_index(drop=True)
+    report.insert(0, 'ANOMALIA', etichette[codici[righe]])
+    report.insert(0, 'RANK', np.arange(1, len(report) + 1))
+    return report
+
+
+def riepilogo_pcn(df, report):
+    """
+    Riepilogo per PCN assegnato: edifici, anomalie e distanze
+
+    Returns:
+        DataFrame ordinato per anomalie decrescenti
+    """
+    distanze = df[['POP', 'DISTANZA_PCN_KM', 'PCN_VICINO']].assign(
+        ALTRO_PIU_VICINO=(df['PCN_VICINO'] != df['POP']) & df['PCN_VICINO'].notna())
+    riepilogo = distanze.groupby('POP', observed=True, dropna=False).agg(
+        EDIFICI=('POP', 'size'),
+        DISTANZA_MEDIA_KM=('DISTANZA_PCN_KM', 'mean'),
+        DISTANZA_MAX_KM=('DISTANZA_PCN_KM', 'max'),
+        ALTRO_PIU_VICINO=('ALTRO_PIU_VICINO', 'sum')
+    )
+    riepilogo['ANOMALIE'] = report.groupby('POP', observed=True, dropna=False).size()
+    riepilogo['ANOMALIE'] = riepilogo['ANOMALIE'].fillna(0).astype(int)
+    riepilogo = riepilogo.round({'DISTANZA_MEDIA_KM': 3, 'DISTANZA_MAX_KM': 3}).reset_index()
+    return riepilogo.sort_values(['ANOMALIE', 'EDIFICI'], ascending=False, kind='stable').reset_index(drop=True)
+
+
+def scrivi_report_anomalie(report, riepilogo, file_output):
+    """Excel con il report ordinato delle anomalie e il riepilogo per PCN"""
+    with pd.ExcelWriter(file_output, engine='openpyxl') as writer:
+        report.round(4).to_excel(writer, sheet_name='Anomalie', index=False)
+        riepilogo.to_excel(writer, sheet_name='Riepilogo PCN', index=False)
+
+
+def crea_parser():
+    """Parser argomenti della CLI del report anomalie"""
+    parser = argparse.ArgumentParser(
+        description="Distanze edificio-PCN e report degli edifici lontani dal PCN assegnato (regione 02)"
+    )
+    parser.add_argument('input', help="File CSV del dump")
+    parser.add_argument('-o', '--output-dir', default="output", help="Cartella di output")
+    parser.add_argument('--distanza-max', type=float, metavar='KM',
+                        help=f"Distanza massima dal PCN assegnato (default {ANOMALIE_PCN_CONFIG['distanza_max_km']})")
+    parser.add_argument('--scarto-min', type=float, metavar='KM',
+                        help=f"Scarto minimo verso un PCN più vicino (default {ANOMALIE_PCN_CONFIG['scarto_min_km']})")
+    parser.add_argument('--stato-ui', nargs='+', metavar='CODICE', help="Codici STATO_UI degli edifici")
+    parser.add_argument('--chunk-size', type=int, default=10000, help="Righe per chunk in lettura")
+    parser.add_argument('--cache', action='store_true', help="Riusa/salva l'estrazione in cache")
+    parser.add_argument('--max-righe', type=int, default=10, help="Anomalie mostrate a console")
+    return parser
+
+
+def main(argv=None):
+    """CLI: report anomalie PCN dell'estrazione regione 02 (exit code 1 se errore)"""
+    args = crea_parser().parse_args(argv)
+    if not os.path.exists(args.input):
+        print(f"❌ ERRORE: File {args.input} non trovato!")
+        return 1
+
+    df = carica_edifici(args.input, ['02'], args.chunk_size, args.stato_ui, args.cache)
+    if df is None:
+        return 1
+    if df.empty:
+        print("❌ Nessun dato Valle d'Aosta trovato!")
+        return 1
+
+    inizio = time.perf_counter()
+    df = aggiungi_distanze_pcn(df)
+    tempo_distanze = time.perf_counter() - inizio
+    report = report_anomalie(df, args.distanza_max, args.scarto_min)
+    riepilogo = riepilogo_pcn(df, report)
+    print(f"📏 Distanze PCN: {len(df):,} edifici in {tempo_distanze:.2f}s")
+    print(f"⚠️ Anomalie: {len(report):,} edifici "
+          f"({(report['ANOMALIA'].str.contains(ANOMALIA_PIU_VICINO, regex=False)).sum():,} più vicini "
+          f"a un altro PCN, {(report['ANOMALIA'].str.contains(ANOMALIA_LONTANO, regex=False)).sum():,} "
+          f"oltre la distanza massima)")
+    if len(report):
+        print(report.head(args.max_righe).to_string(index=False))
+
+    os.makedirs(args.output_dir, exist_ok=True)
+    file_output = os.path.join(args.output_dir, f"anomalie_pcn_{datetime.now().strftime('%Y%m%d')}.xlsx")
+    scrivi_report_anomalie(report, riepilogo, file_output)
+    print(f"💾 Report anomalie: {file_output}")
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -0,0 +1,248 @@
+"""
+Estrazioni batch - Analizzatore DB OpenFiber
+Esecuzione headless di job di estrazione (uno per dump/regioni) da file
+JSON, in un pool di processi, con log per job e riepilogo JSON
+"""
+
+import json
+import os
+import time
+from concurrent.futures import ProcessPoolExecutor, as_completed
+from contextlib import redirect_stdout, nullcontext
+from datetime import datetime
+
+from estrattore_of import estrai_regione_02, EXCEL_ENGINES, READER_BACKENDS, CSV_ENGINES
+from estrattore_multiregione import estrai_regioni
+from config import get_stati_ui_filtri, get_comuni_filtri, STATI_UI_KMZ
+from chunk_adattivo import valida_chunk_size
+
+# Formati di output selezionabili
+FORMATI_EXPORT = ('excel', 'kmz')
+
+# Nome base dell'Excel regione 02 (la data viene aggiunta da estrai_regione_02)
+NOME_OUTPUT_REGIONE_02 = "valle_aosta_estratto.xlsx"
+
+# Parametri di un job e valori predefiniti
+PARAMETRI_JOB = {
+    'id': None,
+    'input': None,
+    'regioni': ['02'],
+    'output_dir': 'output',
+    'chunk_size': 10000,
+    'stati_ui': None,
+    'tipologie': None,
+    'comuni': None,
+    'aree': None,
+    'formati': ['excel', 'kmz'],
+    'excel_engine': 'openpyxl',
+    'reader': 'pandas',
+    'csv_engine': 'auto',
+    'spill_mb': None,
+    'pipeline': False,
+    'kmz_tile': False,
+    'stati_ui_kmz': list(STATI_UI_KMZ),   # null = tutti gli edifici nel KMZ
+    'use_index': False,
+    'use_cache': False,
+    'n_workers': None
+}
+
+
+def normalizza_job(job, predefiniti=None):
+    """
+    Completa un job con i valori predefiniti e ne valida i parametri
+
+    Raises:
+        ValueError: parametro sconosciuto o valore non valido
+    """
+    sconosciuti = set(job) - set(PARAMETRI_JOB)
+    if sconosciuti:
+        raise ValueError(f"Parametri job sconosciuti: {', '.join(sorted(sconosciuti))}")
+
+    completo = {**PARAMETRI_JOB, **(predefiniti or {}), **job}
+    if not completo['input']:
+        raise ValueError("Parametro 'input' mancante")
+    if isinstance(completo['regioni'], str):
+        completo['regioni'] = [completo['regioni']]
+    completo['regioni'] = [str(codice).zfill(2) for codice in completo['regioni']]
+
+    # Filtri predefiniti di config espansi in codici STATO_UI / ISTAT
+    try:
+        stati_ui = set(completo['stati_ui'] or []) | set(get_stati_ui_filtri(completo['tipologie'] or []))
+        comuni = set(completo['comuni'] or []) | set(get_comuni_filtri(completo['aree'] or []))
+    except KeyError as e:
+        raise ValueError(e.args[0])
+    completo['stati_ui'] = sorted(str(codice) for codice in stati_ui) or None
+    completo['comuni'] = sorted(str(codice) for codice in comuni) or None
+
+    if completo['stati_ui_kmz'] is not None:
+        if isinstance(completo['stati_ui_kmz'], (str, int)):
+            completo['stati_ui_kmz'] = [completo['stati_ui_kmz']]
+        completo['stati_ui_kmz'] = sorted({str(codice).strip() for codice in completo['stati_ui_kmz']})
+        if not completo['stati_ui_kmz']:
+            raise ValueError("Selezione KMZ vuota: null per tutti gli edifici")
+
+    if isinstance(completo['formati'], str):
+        completo['formati'] = [completo['formati']]
+    formati_non_validi = set(completo['formati']) - set(FORMATI_EXPORT)
+    if formati_non_validi or not completo['formati']:
+        raise ValueError(f"Formati non validi: {completo['formati']} (disponibili: {', '.join(FORMATI_EXPORT)})")
+    valida_chunk_size(completo['chunk_size'])
+    spill_mb = completo['spill_mb']
+    if spill_mb is not None and (isinstance(spill_mb, bool) or not isinstance(spill_mb, (int, float))
+                                 or spill_mb < 0):
+        raise ValueError(f"Soglia spill non valida: {spill_mb}")
+    if completo['excel_engine'] not in EXCEL_ENGINES:
+        raise ValueError(f"Motore Excel non valido: {completo['excel_engine']}")
+    if completo['reader'] not in READER_BACKENDS:
+        raise ValueError(f"Backend di lettura non valido: {completo['reader']}")
+    if completo['csv_engine'] not in CSV_ENGINES:
+        raise ValueError(f"Motore CSV non valido: {completo['csv_engine']}")
+    return completo
+
+
+def carica_jobs(file_jobs):
+    """
+    Legge un file di job JSON
+
+    Formati accettati: lista di job, oppure
+    {"default": {parametri comuni}, "jobs": [job, ...]}
+    I job senza 'output_dir' proprio scrivono in <output_dir default>/<id>,
+    così job sullo stesso dump o regione non si sovrascrivono gli output.
+
+    Returns:
+        Lista di job normalizzati (id assegnato se mancante)
+    """
+    with open(file_jobs, 'r', encoding='utf-8') as f:
+        contenuto = json.load(f)
+
+    if isinstance(contenuto, list):
+        predefiniti, jobs = {}, contenuto
+    else:
+        predefiniti, jobs = contenuto.get('default', {}), contenuto.get('jobs', [])
+
+    normalizzati = []
+    for i, job in enumerate(jobs, start=1):
+        completo = normalizza_job(job, predefiniti)
+        completo['id'] = str(completo['id'] or f"job{i:03d}")
+        if 'output_dir' not in job:
+            completo['output_dir'] = os.path.join(completo['output_dir'], completo['id'])
+        normalizzati.append(completo)
+
+    id_job = [job['id'] for job in normalizzati]
+    id_duplicati = {id_ for id_ in id_job if id_job.count(id_) > 1}
+    if id_duplicati:
+        raise ValueError(f"Id job duplicati: {', '.join(sorted(id_duplicati))}")
+    return normalizzati
+
+
+def esegui_job(job, file_log=None):
+    """
+    Esegue un job: regione 02 con estrai_regione_02, altre regioni (o più
+    regioni) con l'estrazione multi-regione in una sola passata
+
+    Args:
+        job: Job normalizzato (normalizza_job)
+        file_log: Se indicato, l'output a console del job viene scritto qui
+
+    Returns:
+        dict riepilogo: id, input, regioni, successo, errore, tempo e
+        per regione record e file generati (+ metriche per la regione 02)
+    """
+    inizio = time.time()
+    riepilogo = {'id': job['id'], 'input': job['input'], 'regioni': {}, 'successo': False,
+                 'errore': None, 'log': file_log}
+    export_excel = 'excel' in job['formati']
+    export_kmz = 'kmz' in job['formati']
+
+    os.makedirs(job['output_dir'], exist_ok=True)
+    with (open(file_log, 'w', encoding='utf-8') if file_log else nullcontext()) as log:
+        with (redirect_stdout(log) if log else nullcontext()):
+            try:
+                if job['regioni'] == ['02']:
+                    risultato = estrai_regione_02(
+                        job['input'], os.path.join(job['output_dir'], NOME_OUTPUT_REGIONE_02),
+                        job['chunk_size'], export_kmz=export_kmz, use_index=job['use_index'],
+                        reader=job['reader'], excel_engine=job['excel_engine'],
+                        use_cache=job['use_cache'], stati_ui=job['stati_ui'], export_excel=export_excel,
+                        comuni=job['comuni'], csv_engine=job['csv_engine'], spill_mb=job['spill_mb'],
+                        pipeline=job['pipeline'], kmz_tile=job['kmz_tile'], stati_ui_kmz=job['stati_ui_kmz']
+                    )
+                    riepilogo['regioni']['02'] = risultato.to_dict()
+                    riepilogo['successo'] = bool(risultato)
+                    riepilogo['errore'] = risultato.errore
+                else:
+                    risultati = estrai_regioni(
+                        job['input'], job['regioni'], job['output_dir'], job['chunk_size'],
+                        job['n_workers'], export_kmz, job['stati_ui'], export_excel, job['comuni'],
+                        job['csv_engine'], job['spill_mb'], job['kmz_tile'], job['stati_ui_kmz']
+                    )
+                    if risultati is None:
+                        riepilogo['errore'] = "Input o regioni non validi"
+                    else:
+                        riepilogo['regioni'] = risultati
+                        errori = [f"{codice}: {r['errore']}" for codice, r in risultati.items() if r['errore']]
+                        riepilogo['successo'] = not errori
+                        riepilogo['errore'] = '; '.join(errori) or None
+            except Exception as e:
+                riepilogo['errore'] = f"{type(e).__name__}: {e}"
+
+    riepilogo['tempo'] = time.time() - inizio
+    return riepilogo
+
+
+def esegui_batch(jobs, n_workers=None, file_riepilogo=None):
+    """
+    Esegue una lista di job in un pool di processi
+
+    Ogni job scrive il proprio log in <output_dir>/<id>.log; il riepilogo
+    JSON contiene l'esito di tutti i job nell'ordine del file.
+
+    Args:
+        jobs: Lista di job normalizzati (carica_jobs)
+        n_workers: Job eseguiti in parallelo (default: metà dei core, almeno 1)
+        file_riepilogo: Path del riepilogo JSON (None = non salvato)
+
+    Returns:
+        dict riepilogo batch (jobs, successi, falliti, tempo)
+    """
+    n_workers = n_workers or max((os.cpu_count() or 2) // 2, 1)
+    print(f"📦 Batch: {len(jobs)} job su {n_workers} processi")
+
+    inizio = time.time()
+    esiti = {}
+    with ProcessPoolExecutor(max_workers=n_workers) as executor:
+        futures = {
+            executor.submit(esegui_job, job, os.path.join(job['output_dir'], f"{job['id']}.log")): job
+            for job in jobs
+        }
+        for future in as_completed(futures):
+            job = futures[future]
+            try:
+                esito = future.result()
+            except Exception as e:
+                # Worker terminato in modo anomalo (es. memoria esaurita)
+                esito = {'id': job['id'], 'input': job['input'], 'regioni': {}, 'successo': False,
+                         'errore': f"{type(e).__name__}: {e}", 'tempo': None}
+            esiti[job['id']] = esito
+            stato = "✅" if esito['successo'] else f"❌ {esito['errore']}"
+            print(f"  {job['id']} ({os.path.basename(job['input'])}): {stato}")
+
+    riepilogo = {
+        'data': datetime.now().isoformat(timespec='seconds'),
+        'jobs': [esiti[job['id']] for job in jobs],
+        'successi': sum(e['successo'] for e in esiti.values()),
+        'falliti': sum(not e['successo'] for e in esiti.values()),
+        'tempo': time.time() - inizio
+    }
+
+    if file_riepilogo:
+        cartella = os.path.dirname(file_riepilogo)
+        if cartella:
+            os.makedirs(cartella, exist_ok=True)
+        with open(file_riepilogo, 'w', encoding='utf-8') as f:
+            json.dump(riepilogo, f, indent=2, default=str)
+        print(f"💾 Riepilogo batch: {file_riepilogo}")
+
+    print(f"📊 Job completati: {riepilogo['successi']} ✅ | {riepilogo['falliti']} ❌ "
+          f"in {riepilogo['tempo']:.1f}s")
+    return riepilogo
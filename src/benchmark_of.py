@@ -0,0 +1,551 @@
+"""
+Benchmark Estrattore OpenFiber
+Generatore di DB copertura sintetico + confronto scansione iterrows vs vettoriale
+(la versione vettoriale include l'arricchimento batch con join categorici)
+e suite riproducibile per fase (scansione, arricchimento, DataFrame, Excel,
+KMZ) con report JSON confrontabile tra commit
+"""
+
+import argparse
+import json
+import os
+import platform
+import shutil
+import subprocess
+import sys
+import tempfile
+import time
+import tracemalloc
+from contextlib import redirect_stdout
+from datetime import datetime
+
+import numpy as np
+import pandas as pd
+
+from config import CSV_COLUMNS, REGIONI, COMUNI_VALLE_AOSTA, PCN_VALLE_AOSTA
+from metriche import Metriche, tempo_cpu
+
+# Quota di righe Valle d'Aosta sul totale (46.323 / 770.000 nel file reale)
+QUOTA_VALLE_AOSTA = 0.06
+
+# Distribuzione STATO_UI realistica (PAC/PAL ~1%)
+PESI_STATO_UI = {
+    '101': 0.10, '102': 0.55, '201': 0.03, '202': 0.12, '205': 0.01,
+    '302': 0.01, '80': 0.08, '602': 0.04, '603': 0.02, '604': 0.01,
+    '902': 0.02, '905': 0.01
+}
+
+# Righe generate per blocco nel file sintetico (memoria costante)
+BLOCCO_GENERAZIONE = 200000
+
+# Dimensioni di riferimento della suite (righe totali del file sintetico)
+DIMENSIONI_BENCHMARK = (100000, 1000000, 10000000)
+
+# Versione schema del report JSON
+VERSIONE_REPORT = 1
+
+# Regressione: fase più lenta del riferimento oltre questa quota...
+SOGLIA_REGRESSIONE = 0.25
+# ...ignorando le fasi troppo brevi per una misura stabile (secondi)
+DURATA_MINIMA_CONFRONTO = 0.05
+
+
+def _blocco_sintetico(rng, codice_regione, comune, progressivo):
+    """Righe sintetiche di una regione (comune già ordinato, ID progressivi)"""
+    n = len(comune)
+    is_vda = codice_regione == '02'
+
+    # POP: PCN reali per la 02, codici fittizi altrove
+    if is_vda:
+        pop = rng.choice(np.array(list(PCN_VALLE_AOSTA.keys())), size=n)
+    else:
+        pop = np.char.add('XX', rng.choice(np.array(['AAA', 'ABA', 'ACA', 'ADA']), size=n))
+
+    # Coordinate nel bounding box Valle d'Aosta (formato N45.123456_E7.123456)
+    lat = rng.uniform(45.47, 45.99, size=n)
+    lon = rng.uniform(6.80, 7.94, size=n)
+    coordinate = np.char.add(
+        np.char.add('N', np.char.mod('%.6f', lat)),
+        np.char.add('_E', np.char.mod('%.6f', lon))
+    )
+
+    stati = list(PESI_STATO_UI.keys())
+    pesi = np.array([PESI_STATO_UI[s] for s in stati])
+    stato_ui = rng.choice(np.array(stati), size=n, p=pesi / pesi.sum())
+
+    id_building = np.char.add('B', np.char.zfill(progressivo.astype(str), 10))
+    date = np.array(['2024-03-12', '2024-11-05', '2025-02-20', '2025-06-30', '2025-07-14'])
+    provincia = codice_regione.zfill(3)
+
+    return pd.DataFrame({
+        'ID_SCALA': np.char.add('S', np.char.zfill(progressivo.astype(str), 10)),
+        'REGIONE': codice_regione,
+        'PROVINCIA': provincia,
+        'COMUNE': comune,
+        'FRAZIONE': '',
+        'PARTICELLA_TOP': rng.choice(np.array(['VIA', 'PIAZZA', 'CORSO', 'LOCALITA', 'FRAZIONE']), size=n),
+        'INDIRIZZO': np.char.add('STRADA ', rng.integers(1, 500, size=n).astype(str)),
+        'CIVICO': rng.integers(1, 200, size=n).astype(str),
+        'SCALA_PALAZZINA': '',
+        'CODICE_VIA': rng.integers(10000, 99999, size=n).astype(str),
+        'ID_BUILDING': id_building,
+        'COORDINATE_BUILDING': coordinate,
+        'POP': pop,
+        'TOTALE_UI': rng.integers(1, 40, size=n).astype(str),
+        'STATO_UI': stato_ui,
+        'STATO_SCALA_PALAZZINA': rng.choice(np.array(['100', '101', '200', '202']), size=n),
+        'DATA_RFC_INDICATIVA': '',
+        'DATA_RFC_EFFETTIVA': rng.choice(date, size=n),
+        'DATA_RFA_INDICATIVA': '',
+        'DATA_RFA_EFFETTIVA': rng.choice(date, size=n),
+        'DATA_ULTIMA_MODIFICA_RECORD': rng.choice(date, size=n),
+        'DATA_ULTIMA_VARIAZIONE_STATO_BUILDING': rng.choice(date, size=n),
+        'DATA_ULTIMA_VARIAZIONE_STATO_SCALA_PALAZZINA': rng.choice(date, size=n),
+        'ID_EGON_CIVICO': rng.integers(10**7, 10**8, size=n).astype(str),
+        'ID_EGON_STRADA': rng.integers(10**6, 10**7, size=n).astype(str),
+    }, columns=CSV_COLUMNS)
+
+
+def genera_csv_sintetico(file_output, n_righe=770000, seed=42, blocco_righe=BLOCCO_GENERAZIONE):
+    """
+    Genera un DB copertura sintetico con lo schema CSV_COLUMNS
+
+    Le righe sono ordinate per REGIONE (01 → 20) e, dentro la regione, per
+    COMUNE, come nel dump OpenFiber reale. La regione 02 usa codici ISTAT
+    di COMUNI_VALLE_AOSTA e POP di PCN_VALLE_AOSTA. Il file viene scritto
+    regione per regione a blocchi di righe: la memoria usata non dipende
+    dalla dimensione totale (fino a 10M+ righe).
+
+    Args:
+        file_output: Path del file CSV pipe-separated da generare
+        n_righe: Numero totale di righe
+        seed: Seed del generatore casuale (output riproducibile)
+        blocco_righe: Righe generate e scritte per volta
+
+    Returns:
+        dict: Numero di righe per codice regione
+    """
+    rng = np.random.default_rng(seed)
+    codici_regione = sorted(REGIONI.keys())
+
+    # Ripartizione righe: 02 con quota fissa, resto distribuito uniformemente
+    n_vda = int(n_righe * QUOTA_VALLE_AOSTA)
+    altre = [c for c in codici_regione if c != '02']
+    base, resto = divmod(n_righe - n_vda, len(altre))
+    righe_per_regione = {c: base + (1 if i < resto else 0) for i, c in enumerate(altre)}
+    righe_per_regione['02'] = n_vda
+
+    output_dir = os.path.dirname(file_output)
+    if output_dir:
+        os.makedirs(output_dir, exist_ok=True)
+
+    istat_vda = np.array(sorted(COMUNI_VALLE_AOSTA.keys()))
+    progressivo = 0
+    with open(file_output, 'w', encoding='utf-8', newline='') as f:
+        f.write('|'.join(CSV_COLUMNS) + '\n')
+
+        for codice in codici_regione:
+            n = righe_per_regione[codice]
+
+            # COMUNE: ISTAT reali per la 02, codici fittizi per le altre regioni
+            if codice == '02':
+                comune = rng.choice(istat_vda, size=n)
+            else:
+                codici_altri = np.char.zfill(rng.integers(1, 120, size=n).astype(str), 3)
+                comune = np.char.add(codice.zfill(3), codici_altri)
+            comune = np.sort(comune)
+
+            for inizio in range(0, n, blocco_righe):
+                fine = min(inizio + blocco_righe, n)
+                blocco = _blocco_sintetico(rng, codice, comune[inizio:fine],
+                                           np.arange(progressivo + inizio, progressivo + fine))
+                blocco.to_csv(f, sep='|', index=False, header=False)
+            progressivo += n
+
+    return righe_per_regione
+
+
+def benchmark_scansione(file_input, chunk_size=10000, codice_regione='02'):
+    """
+    Confronta scansione iterrows (legacy) e vettoriale sullo stesso file
+
+    Args:
+        file_input: CSV pipe-separated (reale o sintetico)
+        chunk_size: Righe per chunk
+        codice_regione: Regione da estrarre
+
+    Returns:
+        dict con tempi, speedup e verifica di uguaglianza dei risultati
+    """
+    from estrattore_of import scan_regione_iterrows, scan_regione_vettoriale
+
+    risultati = {}
+    output = {}
+
+    for nome, scan_func in [('iterrows', scan_regione_iterrows), ('vettoriale', scan_regione_vettoriale)]:
+        chunk_iterator = pd.read_csv(file_input, sep='|', chunksize=chunk_size, dtype=str, low_memory=False)
+
+        # Silenzia i print di progress durante la misura
+        stdout_originale = sys.stdout
+        sys.stdout = open(os.devnull, 'w')
+        try:
+            t0 = time.perf_counter()
+            df_records, scan_info = scan_func(chunk_iterator, codice_regione)
+            elapsed = time.perf_counter() - t0
+        finally:
+            sys.stdout.close()
+            sys.stdout = stdout_originale
+
+        output[nome] = (df_records, scan_info)
+        risultati[nome] = {
+            'secondi': elapsed,
+            'record': len(df_records),
+            'righe_scansionate': scan_info['righe_totali'],
+        }
+
+    df_legacy, info_legacy = output['iterrows']
+    df_vett, info_vett = output['vettoriale']
+    risultati['identici'] = bool(info_legacy == info_vett and df_legacy.equals(df_vett))
+    risultati['speedup'] = risultati['iterrows']['secondi'] / max(risultati['vettoriale']['secondi'], 1e-9)
+
+    return risultati
+
+
+def benchmark_coordinate(valori):
+    """
+    Confronta KMZExporter.parse_coordinates (per riga) e parse_coordinate_building (vettoriale)
+
+    Args:
+        valori: Series COORDINATE_BUILDING
+
+    Returns:
+        dict con tempi, speedup, numero valori validi e verifica di uguaglianza
+    """
+    from coordinate import parse_coordinate_building
+    from kmz_exporter import KMZExporter
+
+    stdout_originale = sys.stdout
+    sys.stdout = open(os.devnull, 'w')
+    try:
+        exporter = KMZExporter()
+        t0 = time.perf_counter()
+        per_riga = [exporter.parse_coordinates(v) for v in valori]
+        secondi_per_riga = time.perf_counter() - t0
+    finally:
+        sys.stdout.close()
+        sys.stdout = stdout_originale
+
+    t0 = time.perf_counter()
+    lon, lat, validi = parse_coordinate_building(valori)
+    secondi_vettoriale = time.perf_counter() - t0
+
+    attesi_validi = np.array([c is not None for c in per_riga])
+    attesi_lon = np.array([c[0] if c else np.nan for c in per_riga])
+    attesi_lat = np.array([c[1] if c else np.nan for c in per_riga])
+
+    return {
+        'valori': len(valori),
+        'validi': int(validi.sum()),
+        'per_riga': secondi_per_riga,
+        'vettoriale': secondi_vettoriale,
+        'speedup': secondi_per_riga / max(secondi_vettoriale, 1e-9),
+        'identici': bool(np.array_equal(validi, attesi_validi)
+                         and np.array_equal(lon, attesi_lon, equal_nan=True)
+                         and np.array_equal(lat, attesi_lat, equal_nan=True)),
+    }
+
+
+def _misura(funzione, memoria=False):
+    """
+    Esegue funzione() senza output a console misurando wall e CPU
+
+    Returns:
+        Tuple (valore restituito, dict wall/cpu[/picco_mb])
+    """
+    if memoria:
+        tracemalloc.start()
+    wall, cpu = time.perf_counter(), tempo_cpu()
+    try:
+        with open(os.devnull, 'w') as devnull, redirect_stdout(devnull):
+            valore = funzione()
+        misura = {'wall': time.perf_counter() - wall, 'cpu': tempo_cpu() - cpu}
+        if memoria:
+            misura['picco_mb'] = tracemalloc.get_traced_memory()[1] / (1024 * 1024)
+    finally:
+        if memoria:
+            tracemalloc.stop()
+    return valore, misura
+
+
+def benchmark_pipeline(file_input, output_dir, chunk_size=10000, excel_engines=('parallelo', 'streaming'),
+                       export_kmz=True, memoria=False):
+    """
+    Misura ogni fase della pipeline regione 02 su un file
+
+    Fasi: scansione, arricchimento, dataframe (da leggi_regione), confronto
+    dei lettori lettura_pandas/lettura_mmap (leggi_regione completo per
+    backend) e blocco_mmap (solo trova_blocco_regione), coordinate (parsing
+    vettoriale), excel_<motore> per ogni motore richiesto
+    (generate_multisheet_excel) e kmz (KMZExporter.export_kmz).
+
+    Args:
+        file_input: CSV pipe-separated (reale o sintetico)
+        output_dir: Cartella per i file Excel/KMZ generati
+        chunk_size: Righe per chunk in lettura
+        excel_engines: Motori Excel da misurare (EXCEL_ENGINES)
+        export_kmz: Se True misura anche la generazione KMZ
+        memoria: Se True misura il picco di memoria Python per fase
+            (tracemalloc: rallenta l'esecuzione)
+
+    Returns:
+        dict con righe scansionate, record, comuni, lettori_identici (stesso
+        DataFrame da pandas e mmap) e misure per fase (wall, cpu, throughput
+        in righe o record al secondo)
+    """
+    from estrattore_of import leggi_regione, generate_multisheet_excel
+    from mmap_scanner import trova_blocco_regione
+    from coordinate import parse_coordinate_building
+    from kmz_exporter import KMZExporter
+
+    os.makedirs(output_dir, exist_ok=True)
+    fasi = {}
+
+    # Lettura: i tempi interni vengono separati da Metriche
+    metriche = Metriche()
+    (df, scan_info), lettura = _misura(
+        lambda: leggi_regione(file_input, '02', chunk_size, metriche=metriche), memoria)
+    for nome in ('scansione', 'arricchimento', 'dataframe'):
+        fasi[nome] = dict(metriche.fasi.get(nome, {'wall': 0.0, 'cpu': 0.0}))
+    if memoria:
+        fasi['scansione']['picco_mb'] = lettura['picco_mb']
+    fasi['scansione']['righe_al_secondo'] = scan_info['righe_totali'] / max(lettura['wall'], 1e-9)
+
+    # Confronto lettori: il backend mmap individua il blocco sul buffer grezzo
+    # e passa al parser CSV solo le righe della regione
+    fasi['lettura_pandas'] = lettura
+    (df_mmap, _), fasi['lettura_mmap'] = _misura(
+        lambda: leggi_regione(file_input, '02', chunk_size, reader='mmap'), memoria)
+    _, fasi['blocco_mmap'] = _misura(lambda: trova_blocco_regione(file_input, '02'), memoria)
+
+    risultato = {
+        'file_bytes': os.path.getsize(file_input),
+        'righe_scansionate': scan_info['righe_totali'],
+        'record': len(df),
+        'comuni': int(df['COMUNE'].nunique()) if len(df) else 0,
+        'lettori_identici': bool(df.equals(df_mmap)),
+        'fasi': fasi
+    }
+    if df.empty:
+        return risultato
+
+    _, fasi['coordinate'] = _misura(lambda: parse_coordinate_building(df['COORDINATE_BUILDING']), memoria)
+
+    for engine in excel_engines:
+        file_excel = os.path.join(output_dir, f"benchmark_{engine}.xlsx")
+        _, fasi[f'excel_{engine}'] = _misura(
+            lambda: generate_multisheet_excel(df, file_excel, engine=engine), memoria)
+        fasi[f'excel_{engine}']['bytes'] = os.path.getsize(file_excel)
+
+    if export_kmz:
+        file_kmz = os.path.join(output_dir, "benchmark_PAC_PAL.kmz")
+        _, fasi['kmz'] = _misura(lambda: KMZExporter().export_kmz(df, file_kmz), memoria)
+
+    for nome, misura in fasi.items():
+        if nome != 'scansione':
+            misura['record_al_secondo'] = len(df) / max(misura['wall'], 1e-9)
+    return risultato
+
+
+def _commit_corrente():
+    """Hash del commit git corrente (None fuori da un repository)"""
+    try:
+        esito = subprocess.run(['git', 'rev-parse', '--short', 'HEAD'], capture_output=True, text=True,
+                               cwd=os.path.dirname(os.path.abspath(__file__)), timeout=10)
+    except (OSError, subprocess.SubprocessError):
+        return None
+    return esito.stdout.strip() or None
+
+
+def esegui_suite(dimensioni=DIMENSIONI_BENCHMARK, file_report=None, seed=42, chunk_size=10000,
+                 excel_engines=('parallelo', 'streaming'), export_kmz=True, memoria=False,
+                 cartella_dati=os.path.join("output", "benchmark")):
+    """
+    Suite benchmark riproducibile: file sintetici (riusati se già generati
+    con stessa dimensione e seed) e misura di ogni fase per dimensione
+
+    Returns:
+        dict report (salvato in JSON se file_report è indicato)
+    """
+    report = {
+        'versione': VERSIONE_REPORT,
+        'data': datetime.now().isoformat(timespec='seconds'),
+        'commit': _commit_corrente(),
+        'ambiente': {
+            'python': platform.python_version(),
+            'pandas': pd.__version__,
+            'numpy': np.__version__,
+            'piattaforma': platform.platform(),
+            'cpu': os.cpu_count()
+        },
+        'parametri': {
+            'seed': seed,
+            'chunk_size': chunk_size,
+            'excel_engines': list(excel_engines),
+            'export_kmz': export_kmz,
+            'memoria': memoria
+        },
+        'risultati': {}
+    }
+
+    for n_righe in dimensioni:
+        file_sintetico = os.path.join(cartella_dati, f"sintetico_{n_righe}_{seed}.csv")
+        if not os.path.exists(file_sintetico):
+            print(f"🧪 Generazione file sintetico: {n_righe:,} righe...")
+            t0 = time.perf_counter()
+            genera_csv_sintetico(file_sintetico, n_righe, seed)
+            print(f"✅ Generato {file_sintetico} in {time.perf_counter() - t0:.1f}s")
+
+        print(f"⏱️ Benchmark pipeline: {n_righe:,} righe...")
+        risultato = benchmark_pipeline(file_sintetico, os.path.join(cartella_dati, f"output_{n_righe}"),
+                                       chunk_size, excel_engines, export_kmz, memoria)
+        report['risultati'][str(n_righe)] = risultato
+
+        for nome, misura in risultato['fasi'].items():
+            memoria_fase = f"  picco {misura['picco_mb']:,.0f} MB" if 'picco_mb' in misura else ""
+            print(f"  📊 {nome:<18} {misura['wall']:8.2f}s wall {misura['cpu']:8.2f}s CPU{memoria_fase}")
+
+    if file_report:
+        cartella = os.path.dirname(file_report)
+        if cartella:
+            os.makedirs(cartella, exist_ok=True)
+        with open(file_report, 'w', encoding='utf-8') as f:
+            json.dump(report, f, indent=2)
+        print(f"💾 Report salvato: {file_report}")
+
+    return report
+
+
+def confronta_report(report, riferimento, soglia=SOGLIA_REGRESSIONE):
+    """
+    Confronta due report della suite (stesse dimensioni e fasi)
+
+    Args:
+        report: Report corrente
+        riferimento: Report di riferimento (es. commit precedente)
+        soglia: Rallentamento relativo oltre cui una fase è una regressione
+
+    Returns:
+        Lista di dict (dimensione, fase, secondi, riferimento, rapporto)
+        ordinata per rapporto decrescente
+    """
+    regressioni = []
+    for dimensione, risultato in report['risultati'].items():
+        fasi_riferimento = riferimento.get('risultati', {}).get(dimensione, {}).get('fasi', {})
+        for fase, misura in risultato['fasi'].items():
+            base = fasi_riferimento.get(fase)
+            if base is None or base['wall'] < DURATA_MINIMA_CONFRONTO:
+                continue
+            rapporto = misura['wall'] / base['wall']
+            if rapporto > 1 + soglia:
+                regressioni.append({
+                    'dimensione': int(dimensione),
+                    'fase': fase,
+                    'secondi': misura['wall'],
+                    'riferimento': base['wall'],
+                    'rapporto': rapporto
+                })
+    return sorted(regressioni, key=lambda r: r['rapporto'], reverse=True)
+
+
+def benchmark_legacy(n_righe):
+    """
+    Confronto iterrows vs vettoriale e parsing coordinate per riga vs vettoriale
+
+    Il file sintetico è generato in una cartella temporanea, eliminata alla fine
+    """
+    cartella = tempfile.mkdtemp(prefix="benchmark_of_")
+    try:
+        file_sintetico = os.path.join(cartella, f"benchmark_sintetico_{n_righe}.csv")
+        print(f"🧪 Generazione file sintetico: {n_righe:,} righe...")
+        t0 = time.perf_counter()
+        genera_csv_sintetico(file_sintetico, n_righe)
+        print(f"✅ Generato {file_sintetico} in {time.perf_counter() - t0:.1f}s")
+        _confronto_legacy(file_sintetico)
+    finally:
+        shutil.rmtree(cartella, ignore_errors=True)
+
+
+def _confronto_legacy(file_sintetico):
+    """Stampa i confronti legacy vs vettoriale su un file sintetico"""
+    risultati = benchmark_scansione(file_sintetico)
+
+    for nome in ('iterrows', 'vettoriale'):
+        r = risultati[nome]
+        print(f"📊 {nome:<11} {r['secondi']:7.2f}s - {r['record']:,} record "
+              f"({r['righe_scansionate']:,} righe scansionate)")
+
+    print(f"⚡ Speedup: {risultati['speedup']:.1f}x")
+    print(f"🔍 Output identico: {'✅' if risultati['identici'] else '❌'}")
+
+    print("-" * 60)
+    coordinate = pd.read_csv(file_sintetico, sep='|', usecols=['COORDINATE_BUILDING'],
+                             dtype=str)['COORDINATE_BUILDING']
+    risultati = benchmark_coordinate(coordinate)
+    print(f"📍 Parsing coordinate: {risultati['valori']:,} valori ({risultati['validi']:,} validi)")
+    print(f"📊 per riga    {risultati['per_riga']:7.2f}s")
+    print(f"📊 vettoriale  {risultati['vettoriale']:7.2f}s")
+    print(f"⚡ Speedup: {risultati['speedup']:.1f}x")
+    print(f"🔍 Output identico: {'✅' if risultati['identici'] else '❌'}")
+
+
+def main():
+    """Suite benchmark da riga di comando (exit code 1 se ci sono regressioni)"""
+    parser = argparse.ArgumentParser(description="Benchmark estrazione regione 02 su DB sintetico")
+    parser.add_argument('dimensioni', nargs='*', type=int, default=[770000],
+                        help="Righe totali dei file sintetici (es. 100000 1000000 10000000)")
+    parser.add_argument('--report', default=os.path.join("output", "benchmark_report.json"),
+                        help="File JSON del report")
+    parser.add_argument('--confronta', help="Report di riferimento per il controllo regressioni")
+    parser.add_argument('--soglia', type=float, default=SOGLIA_REGRESSIONE,
+                        help="Rallentamento relativo tollerato (default 0.25)")
+    parser.add_argument('--seed', type=int, default=42)
+    parser.add_argument('--chunk-size', type=int, default=10000)
+    parser.add_argument('--excel-engines', nargs='+', default=['parallelo', 'streaming'])
+    parser.add_argument('--no-kmz', action='store_true', help="Non misurare la generazione KMZ")
+    parser.add_argument('--memoria', action='store_true', help="Picco memoria per fase (tracemalloc)")
+    parser.add_argument('--legacy', action='store_true',
+                        help="Confronto iterrows vs vettoriale e parsing coordinate (prima dimensione)")
+    args = parser.parse_args()
+
+    print("=" * 60)
+    print("⏱️ BENCHMARK ESTRAZIONE REGIONE 02")
+    print("=" * 60)
+
+    if args.legacy:
+        benchmark_legacy(args.dimensioni[0])
+        print("=" * 60)
+        return 0
+
+    report = esegui_suite(args.dimensioni, args.report, args.seed, args.chunk_size,
+                          args.excel_engines, not args.no_kmz, args.memoria)
+
+    if args.confronta:
+        with open(args.confronta, 'r', encoding='utf-8') as f:
+            riferimento = json.load(f)
+        regressioni = confronta_report(report, riferimento, args.soglia)
+        print("-" * 60)
+        print(f"🔍 Confronto con {args.confronta} (commit {riferimento.get('commit')})")
+        for r in regressioni:
+            print(f"  ❌ {r['dimensione']:,} righe - {r['fase']}: {r['secondi']:.2f}s "
+                  f"vs {r['riferimento']:.2f}s ({r['rapporto']:.2f}x)")
+        if not regressioni:
+            print("  ✅ Nessuna regressione")
+        print("=" * 60)
+        return 1 if regressioni else 0
+
+    print("=" * 60)
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -0,0 +1,471 @@
+"""
+Cache estrazioni - Analizzatore DB OpenFiber
+Salva il DataFrame arricchito di una regione in un file colonnare compresso
+(Parquet se pyarrow è disponibile, altrimenti pickle compresso) con chiave
+path + dimensione + mtime del CSV + codice regione, limite di dimensione ed
+eviction LRU; l'indice è condiviso fra processi (batch, multi-regione) con
+un lock file
+"""
+
+import hashlib
+import json
+import os
+import re
+import time
+from contextlib import contextmanager
+
+import pandas as pd
+
+from config import CACHE_CONFIG
+
+# Parquet opzionale (richiede pyarrow)
+try:
+    import pyarrow  # noqa: F401
+    PARQUET_SUPPORT = True
+except ImportError:
+    PARQUET_SUPPORT = False
+
+# Versione formato cache (incrementare se cambia lo schema del DataFrame arricchito)
+CACHE_VERSION = 4
+
+# Formati disponibili
+CACHE_FORMATI = ('auto', 'parquet', 'pickle')
+
+# Indice delle voci in cache (una per estrazione)
+INDICE_CACHE = 'cache_index.json'
+
+_ESTENSIONI = {'parquet': '.parquet', 'pickle': '.pkl.gz'}
+
+# Lock dell'indice: attesa massima (s) ed età oltre cui un lock è di un processo terminato
+ATTESA_LOCK = 60.0
+ETA_LOCK_ORFANO = 300.0
+
+# File dati di una voce (<regione>_<hash>), anche temporaneo (.<pid>.tmp) durante la scrittura
+_FILE_VOCE = re.compile(r'^\w+_[0-9a-f]{16}(\.\d+\.tmp)?(\.parquet|\.pkl\.gz)$')
+
+# Età minima (s) di un file temporaneo non più in scrittura prima di rimuoverlo
+ETA_TEMPORANEI_ORFANI = 3600.0
+
+
+def _cartella(cache_dir):
+    return cache_dir or CACHE_CONFIG['cache_dir']
+
+
+def chiave_cache(file_input, codice_regione, parametri=None):
+    """
+    Chiave di una estrazione: path assoluto, dimensione e mtime del CSV,
+    codice regione ed eventuali parametri che cambiano il risultato
+    """
+    stat = os.stat(file_input)
+    return {
+        'versione': CACHE_VERSION,
+        'file_input': os.path.abspath(file_input),
+        'file_size': stat.st_size,
+        'file_mtime_ns': stat.st_mtime_ns,
+        'regione': codice_regione,
+        'parametri': parametri or {}
+    }
+
+
+def _id_voce(chiave):
+    """Identificativo file-safe della voce (hash della chiave)"""
+    serializzata = json.dumps(chiave, sort_keys=True).encode('utf-8')
+    return f"{chiave['regione']}_{hashlib.sha1(serializzata).hexdigest()[:16]}"
+
+
+def _carica_indice(cache_dir):
+    path = os.path.join(cache_dir, INDICE_CACHE)
+    if not os.path.exists(path):
+        return {}
+    try:
+        with open(path, 'r', encoding='utf-8') as f:
+            return json.load(f).get('voci', {})
+    except (OSError, ValueError) as e:
+        print(f"⚠️ Indice cache non leggibile, verrà ricreato: {e}")
+        return {}
+
+
+def _salva_indice(cache_dir, voci):
+    """Scrittura atomica dell'indice (file temporaneo + replace)"""
+    path = os.path.join(cache_dir, INDICE_CACHE)
+    temporaneo = f"{path}.{os.getpid()}.tmp"
+    with open(temporaneo, 'w', encoding='utf-8') as f:
+        json.dump({'versione': CACHE_VERSION, 'voci': voci}, f, indent=1)
+    os.replace(temporaneo, path)
+
+
+@contextmanager
+def _indice_bloccato(cache_dir):
+    """
+    Lettura-modifica-scrittura dell'indice in esclusiva fra processi
+
+    Il lock è un file creato con O_EXCL e rimosso all'uscita; un lock più
+    vecchio di ETA_LOCK_ORFANO (processo terminato) viene eliminato.
+    L'indice è riletto sotto lock e salvato all'uscita senza errori.
+
+    Yields:
+        dict voci dell'indice, da modificare sul posto
+
+    Raises:
+        TimeoutError: lock non ottenuto entro ATTESA_LOCK secondi
+    """
+    path_lock = os.path.join(cache_dir, INDICE_CACHE + '.lock')
+    scadenza = time.monotonic() + ATTESA_LOCK
+    while True:
+        try:
+            descrittore = os.open(path_lock, os.O_CREAT | os.O_EXCL | os.O_WRONLY)
+            break
+        except FileExistsError:
+            try:
+                if time.time() - os.path.getmtime(path_lock) > ETA_LOCK_ORFANO:
+                    os.remove(path_lock)
+                    continue
+            except FileNotFoundError:
+                continue
+            if time.monotonic() > scadenza:
+                raise TimeoutError(f"Indice cache bloccato da un altro processo ({path_lock})")
+            time.sleep(0.05)
+
+    try:
+        os.write(descrittore, str(os.getpid()).encode('ascii'))
+        os.close(descrittore)
+        voci = _carica_indice(cache_dir)
+        yield voci
+        _salva_indice(cache_dir, voci)
+    finally:
+        try:
+            os.remove(path_lock)
+        except FileNotFoundError:
+            pass
+
+
+def _rimuovi_file(cache_dir, nome_file):
+    try:
+        os.remove(os.path.join(cache_dir, nome_file))
+    except FileNotFoundError:
+        pass
+
+
+def _rimuovi_voce(cache_dir, voci, id_voce):
+    _rimuovi_file(cache_dir, voci.pop(id_voce)['file'])
+
+
+def _rimuovi_orfani(cache_dir, voci):
+    """
+    File dati senza voce nell'indice (voci perse, scritture interrotte):
+    rimossi perché fuori dal limite LRU. Da chiamare con l'indice bloccato;
+    i temporanei recenti sono scritture in corso e restano.
+
+    Returns:
+        int: Numero di file rimossi
+    """
+    in_indice = {voce['file'] for voce in voci.values()}
+    limite_temporanei = time.time() - ETA_TEMPORANEI_ORFANI
+    rimossi = 0
+    for nome_file in os.listdir(cache_dir):
+        corrispondenza = _FILE_VOCE.match(nome_file)
+        if corrispondenza is None or nome_file in in_indice:
+            continue
+        try:
+            if corrispondenza.group(1) and os.path.getmtime(os.path.join(cache_dir, nome_file)) > limite_temporanei:
+                continue
+        except FileNotFoundError:
+            continue
+        _rimuovi_file(cache_dir, nome_file)
+        rimossi += 1
+    return rimossi
+
+
+def _scrivi_dataframe(df, path_base, formato):
+    """
+    Scrive il DataFrame nel formato richiesto
+
+    Returns:
+        Tuple (formato effettivo, nome file)
+    """
+    if formato in ('auto', 'parquet') and PARQUET_SUPPORT:
+        path = path_base + _ESTENSIONI['parquet']
+        try:
+            df.to_parquet(path, compression='zstd', index=False)
+            return 'parquet', os.path.basename(path)
+        except Exception as e:
+            # Colonne a tipo misto (es. LAT_PCN '' per PCN sconosciuti): fallback pickle
+            if os.path.exists(path):
+                os.remove(path)
+            if formato == 'parquet':
+                print(f"⚠️ Parquet non applicabile ({e}): uso pickle")
+    elif formato == 'parquet':
+        print("⚠️ Parquet richiesto ma pyarrow non disponibile: uso pickle")
+
+    path = path_base + _ESTENSIONI['pickle']
+    df.to_pickle(path, compression={'method': 'gzip', 'compresslevel': 1})
+    return 'pickle', os.path.basename(path)
+
+
+def _leggi_dataframe(path, formato):
+    if formato == 'parquet':
+        return pd.read_parquet(path)
+    return pd.read_pickle(path, compression='gzip')
+
+
+def applica_limite(cache_dir=None, max_mb=None):
+    """
+    Eviction LRU: rimuove le voci usate meno di recente finché la cache
+    rientra nel limite di dimensione, e i file dati senza voce nell'indice
+
+    Args:
+        cache_dir: Cartella cache (default CACHE_CONFIG)
+        max_mb: Limite in MB (default CACHE_CONFIG)
+
+    Returns:
+        int: Numero di voci rimosse
+    """
+    cache_dir = _cartella(cache_dir)
+    if not os.path.isdir(cache_dir):
+        return 0
+    with _indice_bloccato(cache_dir) as voci:
+        return _applica_limite(cache_dir, max_mb, voci)
+
+
+def _applica_limite(cache_dir, max_mb, voci, proteggi=None):
+    """
+    Eviction LRU sull'indice già bloccato (_indice_bloccato lo salva)
+
+    Args:
+        proteggi: Id voce da non rimuovere se possibile (appena scritta)
+    """
+    max_bytes = (CACHE_CONFIG['max_mb'] if max_mb is None else max_mb) * 1024 * 1024
+    orfani = _rimuovi_orfani(cache_dir, voci)
+    if orfani:
+        print(f"🧹 Cache: rimossi {orfani} file senza voce nell'indice")
+
+    rimosse = 0
+    totale = sum(v['bytes'] for v in voci.values())
+    for id_voce in sorted(voci, key=lambda k: (k == proteggi, voci[k]['ultimo_accesso'])):
+        if totale <= max_bytes:
+            break
+        totale -= voci[id_voce]['bytes']
+        if id_voce == proteggi:
+            print("⚠️ Estrazione più grande del limite cache: non conservata")
+        _rimuovi_voce(cache_dir, voci, id_voce)
+        rimosse += 1
+
+    if rimosse:
+        print(f"🧹 Cache: rimosse {rimosse} estrazioni meno recenti")
+    return rimosse
+
+
+def salva_estrazione(file_input, codice_regione, df, scan_info=None, parametri=None,
+                     cache_dir=None, max_mb=None, formato=None):
+    """
+    Salva in cache il DataFrame arricchito di una regione
+
+    Returns:
+        str: Path del file in cache, None se non salvato
+    """
+    cache_dir = _cartella(cache_dir)
+    formato = formato or CACHE_CONFIG['formato']
+    if formato not in CACHE_FORMATI:
+        print(f"⚠️ Formato cache non valido: {formato} (disponibili: {', '.join(CACHE_FORMATI)})")
+        return None
+
+    try:
+        os.makedirs(cache_dir, exist_ok=True)
+        chiave = chiave_cache(file_input, codice_regione, parametri)
+        id_voce = _id_voce(chiave)
+
+        # Dati scritti fuori dal lock con nome temporaneo, resi visibili sotto lock
+        suffisso = f".{os.getpid()}.tmp"
+        formato_usato, nome_temporaneo = _scrivi_dataframe(df, os.path.join(cache_dir, id_voce + suffisso),
+                                                           formato)
+        nome_file = nome_temporaneo.replace(suffisso, '', 1)
+        path = os.path.join(cache_dir, nome_file)
+        try:
+            with _indice_bloccato(cache_dir) as voci:
+                os.replace(os.path.join(cache_dir, nome_temporaneo), path)
+                precedente = voci.pop(id_voce, None)
+                if precedente and precedente['file'] != nome_file:
+                    _rimuovi_file(cache_dir, precedente['file'])
+
+                adesso = time.time()
+                voci[id_voce] = {
+                    **chiave,
+                    'file': nome_file,
+                    'formato': formato_usato,
+                    'bytes': os.path.getsize(path),
+                    'record': len(df),
+                    'scan_info': scan_info or {},
+                    'creato': adesso,
+                    'ultimo_accesso': adesso
+                }
+                _applica_limite(cache_dir, max_mb, voci, proteggi=id_voce)
+        finally:
+            _rimuovi_file(cache_dir, nome_temporaneo)
+    except OSError as e:
+        print(f"⚠️ Impossibile salvare estrazione in cache: {e}")
+        return None
+
+    if id_voce not in voci:
+        return None
+    print(f"💾 Estrazione in cache: {nome_file} ({voci[id_voce]['bytes'] / (1024 * 1024):.1f} MB, {formato_usato})")
+    return path
+
+
+def carica_estrazione(file_input, codice_regione, parametri=None, cache_dir=None):
+    """
+    Carica dalla cache l'estrazione di una regione se il CSV non è cambiato
+
+    Returns:
+        Tuple (DataFrame arricchito, scan_info) oppure None se assente
+    """
+    cache_dir = _cartella(cache_dir)
+    if not os.path.exists(file_input):
+        return None
+
+    id_voce = _id_voce(chiave_cache(file_input, codice_regione, parametri))
+    voci = _carica_indice(cache_dir)
+    voce = voci.get(id_voce)
+    if voce is None:
+        return None
+
+    path = os.path.join(cache_dir, voce['file'])
+    try:
+        df = _leggi_dataframe(path, voce['formato'])
+        leggibile = True
+    except Exception as e:
+        print(f"⚠️ Voce cache non leggibile, verrà ricreata: {e}")
+        leggibile = False
+
+    # Sotto lock la voce può essere cambiata (riscritta o rimossa da un altro processo)
+    try:
+        with _indice_bloccato(cache_dir) as voci:
+            attuale = voci.get(id_voce)
+            if attuale is not None and attuale['file'] == voce['file']:
+                if leggibile:
+                    attuale['ultimo_accesso'] = time.time()
+                else:
+                    _rimuovi_voce(cache_dir, voci, id_voce)
+    except OSError:
+        pass
+
+    if not leggibile:
+        return None
+    return df, voce['scan_info']
+
+
+def ultima_estrazione(codice_regione, cache_dir=None):
+    """
+    Estrazione valida usata più di recente per una regione (qualsiasi CSV)
+
+    Returns:
+        Tuple (DataFrame arricchito, voce indice) oppure None
+    """
+    cache_dir = _cartella(cache_dir)
+    voci = _carica_indice(cache_dir)
+    candidate = sorted(
+        (v for v in voci.values() if v['regione'] == codice_regione and not v['parametri']),
+        key=lambda v: v['ultimo_accesso'], reverse=True
+    )
+
+    for voce in candidate:
+        if os.path.exists(voce['file_input']):
+            risultato = carica_estrazione(voce['file_input'], codice_regione, cache_dir=cache_dir)
+            if risultato is not None:
+                return risultato[0], voce
+    return None
+
+
+def _path_baseline(cache_dir, codice_regione):
+    return os.path.join(cache_dir, f"baseline_{codice_regione}")
+
+
+def salva_baseline(codice_regione, df, metadati=None, cache_dir=None, formato=None):
+    """
+    Salva l'estrazione di riferimento per il confronto incrementale della
+    regione (una sola per regione, esclusa dall'eviction LRU)
+
+    Args:
+        metadati: Informazioni serializzabili JSON (CSV di origine, file di output)
+
+    Returns:
+        str: Path del file baseline, None se non salvato
+    """
+    cache_dir = _cartella(cache_dir)
+    formato = formato or CACHE_CONFIG['formato']
+    path_base = _path_baseline(cache_dir, codice_regione)
+    try:
+        os.makedirs(cache_dir, exist_ok=True)
+        precedente = carica_metadati_baseline(codice_regione, cache_dir)
+        formato_usato, nome_nuovo = _scrivi_dataframe(df, f"{path_base}.nuova", formato)
+        nome_file = nome_nuovo.replace('.nuova', '', 1)
+
+        temporaneo = f"{path_base}.json.{os.getpid()}.tmp"
+        with open(temporaneo, 'w', encoding='utf-8') as f:
+            json.dump({
+                'versione': CACHE_VERSION,
+                'regione': codice_regione,
+                'file': nome_file,
+                'formato': formato_usato,
+                'record': len(df),
+                'creato': time.time(),
+                'metadati': metadati or {}
+            }, f, indent=1)
+
+        # Sostituzione finale con replace atomici (file dati, poi metadati)
+        if precedente and precedente['file'] != nome_file:
+            try:
+                os.remove(os.path.join(cache_dir, precedente['file']))
+            except FileNotFoundError:
+                pass
+        path = os.path.join(cache_dir, nome_file)
+        os.replace(os.path.join(cache_dir, nome_nuovo), path)
+        os.replace(temporaneo, f"{path_base}.json")
+    except OSError as e:
+        print(f"⚠️ Impossibile salvare baseline regione {codice_regione}: {e}")
+        return None
+
+    print(f"📌 Baseline regione {codice_regione} aggiornata: {len(df):,} record")
+    return path
+
+
+def carica_metadati_baseline(codice_regione, cache_dir=None):
+    """Metadati della baseline di una regione, None se assente"""
+    path = f"{_path_baseline(_cartella(cache_dir), codice_regione)}.json"
+    if not os.path.exists(path):
+        return None
+    try:
+        with open(path, 'r', encoding='utf-8') as f:
+            voce = json.load(f)
+    except (OSError, ValueError):
+        return None
+    return voce if voce.get('versione') == CACHE_VERSION else None
+
+
+def carica_baseline(codice_regione, cache_dir=None):
+    """
+    Carica l'estrazione di riferimento di una regione
+
+    Returns:
+        Tuple (DataFrame arricchito, metadati) oppure None se assente
+    """
+    cache_dir = _cartella(cache_dir)
+    voce = carica_metadati_baseline(codice_regione, cache_dir)
+    if voce is None:
+        return None
+    try:
+        df = _leggi_dataframe(os.path.join(cache_dir, voce['file']), voce['formato'])
+    except Exception as e:
+        print(f"⚠️ Baseline regione {codice_regione} non leggibile: {e}")
+        return None
+    return df, voce['metadati']
+
+
+def svuota_cache(cache_dir=None):
+    """Rimuove tutte le estrazioni in cache"""
+    cache_dir = _cartella(cache_dir)
+    if os.path.isdir(cache_dir):
+        with _indice_bloccato(cache_dir) as voci:
+            for id_voce in list(voci):
+                _rimuovi_voce(cache_dir, voci, id_voce)
+            _rimuovi_orfani(cache_dir, voci)
+    print("🗑️ Cache estrazioni svuotata")
@@ -0,0 +1,137 @@
+"""
+Chunk size adattivo - Analizzatore DB OpenFiber
+Modalità chunk_size='auto': i primi chunk vengono misurati (righe/s
+dell'intero ciclo lettura + scansione e memoria per riga) e il chunk
+raddoppia finché la velocità migliora, senza superare un budget ricavato
+dalla RAM disponibile; il budget viene ricontrollato durante la lettura
+"""
+
+import time
+
+from config import CHUNK_AUTO_CONFIG
+from metriche import memoria_disponibile_mb
+
+# Valore di chunk_size che attiva la modalità adattiva
+CHUNK_AUTO = 'auto'
+
+
+def valida_chunk_size(chunk_size):
+    """
+    chunk_size valido: intero positivo o CHUNK_AUTO
+
+    Raises:
+        ValueError: valore non valido
+    """
+    if chunk_size == CHUNK_AUTO:
+        return chunk_size
+    if isinstance(chunk_size, bool) or not isinstance(chunk_size, int) or chunk_size <= 0:
+        raise ValueError(f"Chunk size non valido: {chunk_size} (intero positivo o '{CHUNK_AUTO}')")
+    return chunk_size
+
+
+class ChunkAdattivo:
+    """
+    Sceglie la dimensione del prossimo chunk dalle misure dei precedenti
+
+    Fase di campionamento: un chunk per dimensione, raddoppiando finché le
+    righe/s crescono almeno di guadagno_minimo; poi resta sulla dimensione
+    più veloce. In ogni fase il chunk non supera il tetto di memoria:
+    (RAM disponibile x quota_memoria / processi) / (byte per riga x fattore_picco).
+    """
+
+    def __init__(self, processi=1, configurazione=None):
+        """
+        Args:
+            processi: Lettori in parallelo che si dividono il budget di memoria
+            configurazione: Override di config.CHUNK_AUTO_CONFIG
+        """
+        self.config = {**CHUNK_AUTO_CONFIG, **(configurazione or {})}
+        self.processi = max(processi, 1)
+        self.dimensione = self.config['iniziale']
+        self.campionamento = True
+        self.byte_per_riga = None
+        self.budget_mb = None
+        self.chunk_letti = 0
+        self.migliore = (self.dimensione, 0.0)
+        self.storia = []
+        self.aggiorna_budget()
+
+    def aggiorna_budget(self):
+        """Ricalcola il budget di memoria dalla RAM disponibile ora"""
+        disponibile = memoria_disponibile_mb() or self.config['memoria_predefinita_mb']
+        self.budget_mb = disponibile * self.config['quota_memoria'] / self.processi
+
+    def tetto_memoria(self):
+        """Righe massime per chunk entro il budget (massimo di config se byte per riga ignoti)"""
+        if not self.byte_per_riga:
+            return self.config['massimo']
+        return int(self.budget_mb * 1024 * 1024 / (self.byte_per_riga * self.config['fattore_picco']))
+
+    def osserva(self, righe, secondi, byte=None):
+        """
+        Registra un chunk elaborato e sceglie la dimensione del successivo
+
+        Args:
+            righe: Righe del chunk
+            secondi: Tempo wall di lettura + elaborazione del chunk
+            byte: Memoria del chunk (None = non misurata)
+        """
+        self.chunk_letti += 1
+        if byte is not None and righe:
+            self.byte_per_riga = byte / righe
+        if self.chunk_letti % self.config['ricontrollo_chunk'] == 0:
+            self.aggiorna_budget()
+
+        velocita = righe / secondi if secondi > 0 else 0.0
+        self.storia.append({'chunk': self.dimensione, 'righe': righe, 'righe_al_secondo': velocita})
+
+        # Un chunk incompleto (fine file o blocco) non è un campione confrontabile
+        if self.campionamento and righe >= self.dimensione:
+            if velocita > self.migliore[1] * (1 + self.config['guadagno_minimo']):
+                self.migliore = (self.dimensione, velocita)
+                self.dimensione *= 2
+            else:
+                self.dimensione = self.migliore[0]
+                self.campionamento = False
+
+        limite = min(self.config['massimo'], self.tetto_memoria())
+        if self.dimensione >= limite:
+            self.campionamento = False
+        self.dimensione = max(self.config['minimo'], min(self.dimensione, limite))
+
+    def misura(self, chunks):
+        """
+        Passa i chunk al consumatore misurando ciascun ciclo lettura + elaborazione
+
+        La memoria per riga (memory_usage deep) è misurata solo in
+        campionamento e ai ricontrolli del budget.
+        """
+        inizio = time.perf_counter()
+        for chunk in chunks:
+            da_misurare = self.campionamento or (self.chunk_letti + 1) % self.config['ricontrollo_chunk'] == 0
+            byte = int(chunk.memory_usage(deep=True).sum()) if da_misurare else None
+            yield chunk
+            fine = time.perf_counter()
+            self.osserva(len(chunk), fine - inizio, byte)
+            inizio = fine
+
+    def to_dict(self):
+        """Chunk size scelto e misure (RisultatoEstrazione.chunk)"""
+        velocita = [campione['righe_al_secondo'] for campione in self.storia]
+        return {
+            'modalita': CHUNK_AUTO,
+            'dimensione': self.dimensione,
+            'iniziale': self.config['iniziale'],
+            'budget_mb': round(self.budget_mb, 1),
+            'byte_per_riga': round(self.byte_per_riga, 1) if self.byte_per_riga else None,
+            'righe_al_secondo': max(velocita) if velocita else 0.0,
+            'chunk_letti': self.chunk_letti,
+            'campioni': self.storia[:8]
+        }
+
+
+def info_chunk(chunk_size, adattivo=None):
+    """Chunk size usato in lettura, per scan_info e RisultatoEstrazione"""
+    if adattivo is not None:
+        return adattivo.to_dict()
+    return {'modalita': 'fisso', 'dimensione': chunk_size}
@@ -38,12 +38,71 @@ PROCESSING = {
     'extract_progress': 1000,    # Mostra conteggio ogni N record estratti
 }
 
+# Cache estrazioni (DataFrame arricchito in formato colonnare, vedi cache_estrazioni.py)
+CACHE_CONFIG = {
+    'cache_dir': os.path.join(PATHS['output_dir'], 'cache'),
+    'max_mb': 2048,              # Dimensione massima cache (oltre: eviction LRU)
+    'formato': 'auto',           # 'auto' (parquet se pyarrow disponibile), 'parquet', 'pickle'
+}
+
+# Spill su disco dell'estrazione (vedi spill_estrazione.py): oltre la soglia i
+# batch arricchiti vengono scritti in parti colonnari temporanee per comune
+SPILL_CONFIG = {
+    'soglia_mb': 1024,           # Memoria massima dei batch in memoria (None = mai su disco)
+    'cartella': None,            # Cartella dei file temporanei (None = temp di sistema)
+    'formato': 'auto',           # 'auto' (parquet se pyarrow disponibile), 'parquet', 'pickle'
+}
+
+# Export KMZ a tile (kmz_exporter.export_kmz_tile): quadtree di KML con Region/Lod e NetworkLink
+KMZ_TILE_CONFIG = {
+    'placemark_per_tile': 500,   # Sedi mostrate da un tile prima di dividerlo in 4 quadranti
+    'profondita_max': 8,         # Livelli del quadtree (l'ultimo mostra tutte le sedi rimaste)
+    'min_lod_pixels': 256,       # Lato a schermo (pixel) da cui un tile figlio viene caricato
+}
+
+# Codici STATO_UI delle sedi esportate nel KMZ (None = tutti gli edifici)
+STATI_UI_KMZ = ('302',)
+
+# Pipeline a stadi per comune (pipeline_comuni.py): code limitate tra gli stadi
+PIPELINE_CONFIG = {
+    'coda_chunk': 2,             # Chunk letti in attesa di scansione/arricchimento
+    'coda_comuni': 4,            # Comuni completi in attesa degli writer di output
+    'lavori_per_worker': 2,      # Fogli/cartelle in elaborazione per processo del pool
+}
+
+# Indice spaziale a griglia su edifici e PCN (indice_spaziale.py)
+INDICE_SPAZIALE_CONFIG = {
+    'cella_km': 1.0,             # Lato delle celle della griglia
+    'max_forza_bruta': 4096,     # Fino a questi punti (es. PCN) distanze a matrice con più interrogazioni
+    'celle_matrice': 4000000,    # Distanze per blocco della matrice (limita la memoria)
+}
+
+# Report anomalie edificio-PCN (anomalie_pcn.py)
+ANOMALIE_PCN_CONFIG = {
+    'distanza_max_km': 10.0,     # Oltre: edificio lontano dal PCN assegnato
+    'scarto_min_km': 1.0,        # PCN assegnato più lontano del più vicino di almeno questo
+}
+
 # Ottimizzazioni per diversi sistemi
 CHUNK_SIZE_PROFILES = {
     'low_memory': 5000,      # Sistemi con poca RAM
     'balanced': 10000,       # Default - buon compromesso
     'high_performance': 25000,  # Sistemi performanti
-    'maximum': 50000         # Performance massime (richiede molta RAM)
+    'maximum': 50000,        # Performance massime (richiede molta RAM)
+    'auto': 'auto'           # Adattivo: misurato durante la lettura (chunk_adattivo.py)
+}
+
+# Chunk size adattivo: campiona i primi chunk (righe/s e memoria per riga) e
+# raddoppia finché la velocità migliora, entro un budget di RAM disponibile
+CHUNK_AUTO_CONFIG = {
+    'iniziale': 10000,             # Righe del primo chunk campione
+    'minimo': 1000,
+    'massimo': 200000,
+    'quota_memoria': 0.10,         # Quota della RAM disponibile per il chunk in elaborazione
+    'fattore_picco': 4,            # Picco di memoria per chunk rispetto al DataFrame (parsing + copie)
+    'guadagno_minimo': 0.05,       # Crescita fermata se le righe/s migliorano meno del 5%
+    'ricontrollo_chunk': 10,       # Ogni quanti chunk ricontrollare la RAM disponibile
+    'memoria_predefinita_mb': 1024  # RAM assunta disponibile se non misurabile
 }
 
 # =============================================================================
@@ -58,6 +117,10 @@ CSV_CONFIG = {
     'low_memory': False         # Disabilita ottimizzazioni che causano warning
 }
 
+# Codici a bassa cardinalità letti come categoriali (un valore per categoria
+# invece di una stringa per riga)
+CSV_COLONNE_CATEGORIALI = ['REGIONE', 'COMUNE', 'POP', 'STATO_UI']
+
 # Schema colonne CSV (ordine importante)
 CSV_COLUMNS = [
     'ID_SCALA',
@@ -451,6 +514,15 @@ PCN_VALLE_AOSTA = {
     }
 }
 
+# Mappature disponibili per regione (codice regione -> comuni ISTAT / PCN)
+# Le regioni senza mappatura vengono estratte con nomi "sconosciuto"
+MAPPATURE_REGIONI = {
+    '02': {
+        'comuni': COMUNI_VALLE_AOSTA,
+        'pcn': PCN_VALLE_AOSTA
+    }
+}
+
 # Stati UI documentati (Specifiche OF_DB_Copertura_CD v1.7)
 STATI_UI = {
     '101': 'Sede FTTH - NON VENDIBILE',
@@ -558,6 +630,16 @@ FILTRI_TIPOLOGIE_SEDE = {
         'descrizione': '🏛️ PAC/PAL',
         'tooltip': 'Solo sedi Pubblica Amministrazione'
     },
+    'residenziali': {
+        'codici': ['102'],
+        'descrizione': '🏠 Residenziali',
+        'tooltip': 'Solo sedi residenziali'
+    },
+    'residenziali_e_pac_pal': {
+        'codici': ['102', '302'],
+        'descrizione': '🏠🏛️ Residenziali + PAC/PAL',
+        'tooltip': 'Sedi residenziali + Pubblica Amministrazione'
+    },
     'prevendibili': {
         'codici': ['80'],
         'descrizione': '⏳ Prevendibilità',
@@ -742,21 +824,39 @@ def get_sedi_pac_pal(df):
     """
     return df[df['STATO_UI'] == '302']
 
-# Filtri specifici per tipologie di sede
-FILTRI_TIPOLOGIE_SEDE = {
-    'solo_pac_pal': {
-        'STATO_UI': ['302'],
-        'description': 'Solo sedi Pubblica Amministrazione (PAC/PAL)'
-    },
-    'solo_residenziali': {
-        'STATO_UI': ['102'],
-        'description': 'Solo sedi residenziali'
-    },
-    'sedi_pubbliche_e_residenziali': {
-        'STATO_UI': ['102', '302'],
-        'description': 'Sedi residenziali + Pubblica Amministrazione'
-    }
-}
+def get_stati_ui_filtri(nomi):
+    """
+    Codici STATO_UI dei filtri predefiniti (FILTRI_TIPOLOGIE_SEDE)
+    
+    Args:
+        nomi: Nomi dei filtri (es. ['pac_pal', 'residenziali'])
+    
+    Returns:
+        Lista ordinata dell'unione dei codici
+    
+    Raises:
+        KeyError: filtro sconosciuto
+    """
+    codici = set()
+    for nome in nomi:
+        if nome not in FILTRI_TIPOLOGIE_SEDE:
+            raise KeyError(f"Filtro tipologia sede sconosciuto: {nome}")
+        codici.update(FILTRI_TIPOLOGIE_SEDE[nome]['codici'])
+    return sorted(codici)
+
+def get_comuni_filtri(nomi):
+    """
+    Codici ISTAT dei filtri comuni predefiniti (FILTRI_COMUNI_VDA)
+    
+    Raises:
+        KeyError: filtro sconosciuto
+    """
+    codici = set()
+    for nome in nomi:
+        if nome not in FILTRI_COMUNI_VDA:
+            raise KeyError(f"Filtro comuni sconosciuto: {nome}")
+        codici.update(FILTRI_COMUNI_VDA[nome]['COMUNE'])
+    return sorted(codici)
 
 def get_all_pcn_valle_aosta():
     """
@@ -0,0 +1,174 @@
+"""
+Parsing coordinate COORDINATE_BUILDING - Analizzatore DB OpenFiber
+Conversione vettoriale dell'intera colonna (formato N45.123456_E7.123456)
+in array float64 longitudine/latitudine con maschera di validità
+"""
+
+import re
+
+import numpy as np
+import pandas as pd
+
+# Formato COORDINATE_BUILDING: direzione + valore latitudine, '_', direzione + valore longitudine
+# (match solo all'inizio della stringa, come re.match nel parser per riga)
+PATTERN_COORDINATE = re.compile(r'([NS])([0-9.]+)_([EW])([0-9.]+)')
+
+# Caratteri letti per ogni valore numerico nel parsing da buffer: valori più
+# lunghi (o con più di 15 cifre) passano dal parser per riga
+_LARGHEZZA_NUMERO = 17
+_MAX_CIFRE = 15
+
+_POTENZE_10 = 10.0 ** np.arange(_LARGHEZZA_NUMERO + 1)
+
+
+def _parse_per_riga(testi):
+    """Parser regex su lista di stringhe (fallback per i casi non standard)"""
+    n = len(testi)
+    lon = np.full(n, np.nan)
+    lat = np.full(n, np.nan)
+    for i, testo in enumerate(testi):
+        match = PATTERN_COORDINATE.match(testo)
+        if not match:
+            continue
+        lat_dir, lat_val, lon_dir, lon_val = match.groups()
+        try:
+            lat[i] = -float(lat_val) if lat_dir == 'S' else float(lat_val)
+            lon[i] = -float(lon_val) if lon_dir == 'W' else float(lon_val)
+        except ValueError:
+            lat[i] = lon[i] = np.nan
+    return lon, lat
+
+
+def _numeri_da_buffer(buf, inizi, fini):
+    """
+    Converte gli span [inizi, fini) di buf (solo cifre e '.') in float64
+
+    Le cifre vengono accumulate colonna per colonna (schema di Horner) su
+    tutti gli span insieme: al massimo _LARGHEZZA_NUMERO iterazioni numpy.
+
+    Returns:
+        Tuple (valori, validi, da_verificare): da_verificare segnala gli
+        span troppo lunghi, da ripassare al parser per riga
+    """
+    lunghezze = fini - inizi
+    mantissa = np.zeros(len(inizi), dtype=np.int64)
+    n_cifre = np.zeros(len(inizi), dtype=np.int64)
+    n_punti = np.zeros(len(inizi), dtype=np.int64)
+    decimali = np.zeros(len(inizi), dtype=np.int64)
+    ultimo = len(buf) - 1
+
+    larghezza = int(min(lunghezze.max(initial=0), _LARGHEZZA_NUMERO))
+    for j in range(larghezza):
+        dentro = lunghezze > j
+        carattere = buf[np.minimum(inizi + j, ultimo)]
+        punto = dentro & (carattere == ord('.'))
+        cifra = dentro & ~punto
+
+        # Cifra: mantissa * 10 + valore; altrimenti invariata
+        mantissa = mantissa * np.where(cifra, 10, 1) + np.where(cifra, carattere - ord('0'), 0)
+        decimali += cifra & (n_punti > 0)
+        n_cifre += cifra
+        n_punti += punto
+
+    da_verificare = (lunghezze > _LARGHEZZA_NUMERO) | (n_cifre > _MAX_CIFRE)
+    validi = (n_cifre > 0) & (n_punti <= 1) & ~da_verificare
+    # Mantissa intera esatta / potenza di 10 esatta: un solo arrotondamento come float()
+    valori = mantissa / _POTENZE_10[decimali]
+    return valori, validi, da_verificare
+
+
+def parse_coordinate_building(valori):
+    """
+    Converte in blocco una colonna COORDINATE_BUILDING
+
+    Il testo di tutti i valori viene unito in un unico buffer di byte e
+    interpretato con operazioni numpy (direzioni, separatore, cifre); i pochi
+    valori fuori standard (spazi iniziali, numeri molto lunghi, a capo)
+    passano dal parser regex per riga. Stesso risultato di
+    KMZExporter.parse_coordinates.
+
+    Args:
+        valori: Series (o sequenza) di stringhe coordinate
+
+    Returns:
+        Tuple (lon, lat, validi): array float64 (NaN dove non valido) e
+        maschera booleana dei valori interpretati correttamente
+    """
+    serie = pd.Series(valori, dtype=object)
+    originali = serie.to_numpy()
+    n = len(originali)
+    if n == 0:
+        return np.empty(0), np.empty(0), np.zeros(0, dtype=bool)
+
+    def testo_riga(i):
+        valore = originali[i]
+        return '' if valore is None or (not isinstance(valore, str) and pd.isna(valore)) else str(valore).strip()
+
+    testi = serie.fillna('').to_numpy()
+    try:
+        testo = '\n'.join(testi)
+    except TypeError:
+        # Valori non stringa (es. numeri): conversione esplicita
+        testi = [testo_riga(i) for i in range(n)]
+        testo = '\n'.join(testi)
+
+    if testo.count('\n') != n - 1:
+        # A capo dentro un valore: allineamento righe non garantito
+        lon, lat = _parse_per_riga([testo_riga(i) for i in range(n)])
+        return lon, lat, ~np.isnan(lat)
+
+    # Sentinelle finali: gli indici calcolati oltre l'ultima riga restano nel buffer
+    buf = np.frombuffer((testo + '\n\0\0').encode('utf-8'), dtype=np.uint8)
+    a_capo = np.flatnonzero(buf == ord('\n'))
+    inizi = np.concatenate(([0], a_capo[:-1] + 1))
+
+    # Posizioni dei caratteri che non sono cifre o punto (terminano i numeri)
+    numerico = ((buf >= ord('0')) & (buf <= ord('9'))) | (buf == ord('.'))
+    non_numerici = np.flatnonzero(~numerico)
+
+    lat_dir = buf[inizi]
+    lat_inizio = inizi + 1
+    lat_fine = non_numerici[np.searchsorted(non_numerici, lat_inizio)]
+    lon_dir = buf[np.minimum(lat_fine + 1, len(buf) - 1)]
+    lon_inizio = lat_fine + 2
+    lon_fine = non_numerici[np.minimum(np.searchsorted(non_numerici, lon_inizio), len(non_numerici) - 1)]
+
+    formato = (((lat_dir == ord('N')) | (lat_dir == ord('S')))
+               & (buf[lat_fine] == ord('_'))
+               & ((lon_dir == ord('E')) | (lon_dir == ord('W'))))
+
+    lat, lat_validi, lat_verifica = _numeri_da_buffer(buf, lat_inizio, lat_fine)
+    lon, lon_validi, lon_verifica = _numeri_da_buffer(buf, lon_inizio, lon_fine)
+
+    lat = np.where(lat_dir == ord('S'), -lat, lat)
+    lon = np.where(lon_dir == ord('W'), -lon, lon)
+
+    validi = formato & lat_validi & lon_validi
+    lat[~validi] = np.nan
+    lon[~validi] = np.nan
+
+    # Casi non standard: numeri molto lunghi o possibili spazi iniziali
+    # (spazi ASCII, separatori \x1c-\x1f e caratteri non ASCII come \xa0)
+    spazio_iniziale = ((lat_dir == 9) | (lat_dir == 11) | (lat_dir == 12) | (lat_dir == 13)
+                       | ((lat_dir >= 28) & (lat_dir <= 32)) | (lat_dir >= 128))
+    verifica = np.flatnonzero((formato & (lat_verifica | lon_verifica)) | spazio_iniziale)
+    if len(verifica):
+        lon[verifica], lat[verifica] = _parse_per_riga([testo_riga(i) for i in verifica])
+        validi[verifica] = ~np.isnan(lat[verifica])
+
+    return lon, lat, validi
+
+
+def riepilogo_non_validi(valori, validi, max_esempi=5):
+    """
+    Riepilogo unico delle coordinate non interpretabili (invece di una riga per valore)
+
+    Returns:
+        str vuota se tutte valide, altrimenti conteggio ed esempi
+    """
+    non_validi = np.flatnonzero(~np.asarray(validi))
+    if not len(non_validi):
+        return ""
+    esempi = pd.Series(valori, dtype=object).iloc[non_validi[:max_esempi]]
+    return (f"{len(non_validi):,} coordinate non valide "
+            f"(es. {', '.join(repr(v) for v in esempi)})")
@@ -0,0 +1,239 @@
+"""
+Estrazione incrementale - Analizzatore DB OpenFiber
+Confronta il nuovo dump mensile con l'estrazione precedente della regione
+(baseline in cache): emette solo i record aggiunti, rimossi e modificati e
+rigenera solo i fogli Excel e le cartelle KMZ dei comuni toccati, copiando
+gli altri dagli output precedenti
+"""
+
+import os
+import time
+from datetime import datetime
+
+import pandas as pd
+
+from estrattore_of import (leggi_regione, generate_multisheet_excel, sanitize_sheet_name,
+                           tipizza_estrazione, COLONNE_ARRICCHITE, KMZ_SUPPORT)
+from estrattore_multiregione import slug_regione
+from cache_estrazioni import carica_estrazione, salva_estrazione, carica_baseline, salva_baseline
+from config import STATI_UI_KMZ
+
+if KMZ_SUPPORT:
+    from kmz_exporter import genera_kmz_pac_pal
+
+# Chiave record (ID_SCALA non è tra le colonne dell'estrazione arricchita)
+CHIAVE_DELTA = 'ID_BUILDING'
+
+
+def _righe_esclusive(df_a, df_b, chiave):
+    """
+    Righe di df_a senza una riga identica in df_b (confronto come multinsieme)
+
+    Ogni riga è rappresentata da chiave + hash di tutte le colonne (inclusa
+    DATA_ULTIMA_MODIFICA_RECORD); le righe identiche ripetute sono
+    distinte dal numero di occorrenza.
+    """
+    colonne = [c for c in df_a.columns if c in df_b.columns]
+
+    def firme(df):
+        risultato = pd.DataFrame({
+            'chiave': df[chiave].to_numpy(dtype=object),
+            'hash': pd.util.hash_pandas_object(df[colonne].astype(object), index=False).to_numpy()
+        })
+        risultato['occorrenza'] = risultato.groupby(['chiave', 'hash'], dropna=False).cumcount()
+        return risultato
+
+    firme_a = firme(df_a)
+    firme_b = firme(df_b).drop_duplicates()
+    confronto = firme_a.merge(firme_b, on=['chiave', 'hash', 'occorrenza'], how='left', indicator=True)
+    return df_a.iloc[(confronto['_merge'] == 'left_only').to_numpy().nonzero()[0]]
+
+
+def calcola_delta(df_precedente, df_corrente, chiave=CHIAVE_DELTA):
+    """
+    Differenze tra due estrazioni arricchite della stessa regione
+
+    Args:
+        df_precedente: Estrazione di riferimento (baseline)
+        df_corrente: Estrazione del nuovo dump
+        chiave: Colonna identificativa del record
+
+    Returns:
+        dict con DataFrame 'aggiunti', 'rimossi', 'modificati' (nuova versione),
+        'modificati_prima' (versione precedente) e set 'comuni_toccati'
+    """
+    nuove = _righe_esclusive(df_corrente, df_precedente, chiave)
+    vecchie = _righe_esclusive(df_precedente, df_corrente, chiave)
+
+    chiavi_precedenti = df_precedente[chiave]
+    chiavi_correnti = df_corrente[chiave]
+    nuove_esistenti = nuove[chiave].isin(chiavi_precedenti).to_numpy()
+    vecchie_esistenti = vecchie[chiave].isin(chiavi_correnti).to_numpy()
+
+    delta = {
+        'aggiunti': nuove[~nuove_esistenti],
+        'rimossi': vecchie[~vecchie_esistenti],
+        'modificati': nuove[nuove_esistenti],
+        'modificati_prima': vecchie[vecchie_esistenti]
+    }
+    delta['comuni_toccati'] = set(pd.concat([nuove['COMUNE'], vecchie['COMUNE']]).dropna())
+    return delta
+
+
+def scrivi_excel_delta(delta, file_output):
+    """Excel con un foglio per tipo di variazione"""
+    fogli = [
+        ('Aggiunti', delta['aggiunti']),
+        ('Rimossi', delta['rimossi']),
+        ('Modificati', delta['modificati']),
+        ('Modificati (prima)', delta['modificati_prima'])
+    ]
+    with pd.ExcelWriter(file_output, engine='openpyxl') as writer:
+        for nome_foglio, df in fogli:
+            df.to_excel(writer, sheet_name=nome_foglio, index=False)
+
+
+def _leggi_corrente(file_input, codice_regione, chunk_size, cache_dir):
+    """Estrazione del nuovo dump: dalla cache se disponibile, altrimenti dal CSV"""
+    risultato = carica_estrazione(file_input, codice_regione, cache_dir=cache_dir)
+    if risultato is not None:
+        print("⚡ Estrazione corrente caricata dalla cache")
+        return risultato[0]
+
+    risultato = leggi_regione(file_input, codice_regione, chunk_size)
+    if risultato is None:
+        return None
+    df, scan_info = risultato
+    if not df.empty:
+        salva_estrazione(file_input, codice_regione, df, scan_info, cache_dir=cache_dir)
+    return df
+
+
+def _selezione_kmz(stati_ui):
+    """Selezione STATO_UI del KMZ in forma confrontabile e serializzabile JSON"""
+    return None if stati_ui is None else sorted({str(codice).strip() for codice in stati_ui})
+
+
+def estrai_delta(file_input, output_dir="output", codice_regione='02', chunk_size=10000,
+                 export_kmz=False, n_workers=None, cache_dir=None, stati_ui_kmz=STATI_UI_KMZ):
+    """
+    Aggiornamento incrementale degli output di una regione da un nuovo dump
+
+    Al primo utilizzo (nessuna baseline) genera gli output completi; nei
+    successivi scrive l'Excel delle variazioni e riscrive Excel e KMZ
+    completi rigenerando solo fogli/cartelle dei comuni toccati.
+
+    Args:
+        file_input: Path del nuovo dump CSV
+        output_dir: Cartella di output
+        codice_regione: Codice regione (es. '02')
+        chunk_size: Righe per chunk in lettura
+        export_kmz: Se True aggiorna anche il KMZ PAC/PAL
+        n_workers: Processi per la generazione dei fogli Excel
+        cache_dir: Cartella cache/baseline (default CACHE_CONFIG)
+        stati_ui_kmz: Codici STATO_UI delle sedi nel KMZ (default sedi
+            PAC/PAL), None = tutti gli edifici; con una selezione diversa
+            dal KMZ precedente nessuna cartella viene riusata
+
+    Returns:
+        dict riepilogo (record aggiunti/rimossi/modificati, comuni toccati,
+        file generati) oppure None se errore
+    """
+    print("=" * 60)
+    print(f"🔄 ESTRAZIONE INCREMENTALE REGIONE {codice_regione}")
+    print("=" * 60)
+
+    start_time = time.time()
+
+    if not os.path.exists(file_input):
+        print(f"❌ ERRORE: File {file_input} non trovato!")
+        return None
+    if export_kmz and not KMZ_SUPPORT:
+        print("⚠️ Export KMZ: Richiesto ma modulo non disponibile")
+        export_kmz = False
+
+    df_corrente = _leggi_corrente(file_input, codice_regione, chunk_size, cache_dir)
+    if df_corrente is None:
+        return None
+    if df_corrente.empty:
+        print(f"❌ ERRORE: Nessun dato regione {codice_regione} trovato!")
+        return None
+    df_corrente = df_corrente.reindex(columns=COLONNE_ARRICCHITE)
+
+    os.makedirs(output_dir, exist_ok=True)
+    data_oggi = datetime.now().strftime("%Y%m%d")
+    nome_base = f"{slug_regione(codice_regione)}_estratto_{data_oggi}"
+    file_excel = os.path.join(output_dir, f"{nome_base}.xlsx")
+    file_kmz = os.path.join(output_dir, f"{nome_base}_PAC_PAL.kmz")
+
+    baseline = carica_baseline(codice_regione, cache_dir)
+    riepilogo = {
+        'regione': codice_regione,
+        'record': len(df_corrente),
+        'baseline_creata': baseline is None,
+        'excel': file_excel,
+        'excel_delta': None,
+        'kmz': None
+    }
+
+    if baseline is None:
+        # Primo utilizzo: output completi, tutti i record contano come aggiunti
+        print("📌 Nessuna estrazione precedente: generazione completa")
+        comuni_toccati = set(df_corrente['COMUNE'].dropna())
+        excel_precedente = kmz_precedente = None
+        riepilogo.update(aggiunti=len(df_corrente), rimossi=0, modificati=0)
+    else:
+        df_precedente, metadati = baseline
+        # Baseline salvata prima della tipizzazione: stessi tipi dell'estrazione corrente
+        df_precedente = tipizza_estrazione(df_precedente.reindex(columns=COLONNE_ARRICCHITE))
+        delta = calcola_delta(df_precedente, df_corrente)
+        comuni_toccati = delta['comuni_toccati']
+        excel_precedente = metadati.get('excel')
+        kmz_precedente = metadati.get('kmz')
+        # Baseline senza selezione registrata: KMZ delle sole sedi PAC/PAL
+        if metadati.get('kmz_stati_ui', _selezione_kmz(STATI_UI_KMZ)) != _selezione_kmz(stati_ui_kmz):
+            kmz_precedente = None
+        riepilogo.update(aggiunti=len(delta['aggiunti']), rimossi=len(delta['rimossi']),
+                         modificati=len(delta['modificati']))
+
+        print(f"➕ Aggiunti: {riepilogo['aggiunti']:,} | ➖ Rimossi: {riepilogo['rimossi']:,} | "
+              f"✏️ Modificati: {riepilogo['modificati']:,}")
+
+        file_delta = os.path.join(output_dir, f"{slug_regione(codice_regione)}_delta_{data_oggi}.xlsx")
+        scrivi_excel_delta(delta, file_delta)
+        riepilogo['excel_delta'] = file_delta
+        print(f"📄 Variazioni salvate: {os.path.basename(file_delta)}")
+
+    comuni = set(df_corrente['COMUNE'].dropna())
+    comuni_invariati = comuni - comuni_toccati
+    riepilogo['comuni_toccati'] = sorted(comuni_toccati)
+    print(f"🏘️ Comuni toccati: {len(comuni_toccati & comuni)}/{len(comuni)}")
+
+    # === EXCEL COMPLETO (fogli invariati copiati dal file precedente) ===
+    if excel_precedente and not os.path.exists(excel_precedente):
+        excel_precedente = None
+    generate_multisheet_excel(
+        df_corrente, file_excel, engine='parallelo', n_workers=n_workers,
+        riusa_da=excel_precedente,
+        # Nomi foglio condivisi con un comune toccato (troncamento a 31 caratteri) sempre rigenerati
+        fogli_invariati=({sanitize_sheet_name(comune) for comune in comuni_invariati}
+                         - {sanitize_sheet_name(comune) for comune in comuni_toccati})
+    )
+
+    # === KMZ (cartelle comuni invariate copiate dal file precedente) ===
+    if export_kmz:
+        if genera_kmz_pac_pal(df_corrente, file_kmz, riusa_da=kmz_precedente,
+                              comuni_invariati=comuni_invariati, stati_ui=stati_ui_kmz,
+                              regione=codice_regione):
+            riepilogo['kmz'] = file_kmz
+
+    salva_baseline(codice_regione, df_corrente, {
+        'file_input': os.path.abspath(file_input),
+        'excel': os.path.abspath(file_excel),
+        'kmz': os.path.abspath(riepilogo['kmz']) if riepilogo['kmz'] else None,
+        'kmz_stati_ui': _selezione_kmz(stati_ui_kmz)
+    }, cache_dir=cache_dir)
+
+    riepilogo['tempo'] = time.time() - start_time
+    print(f"⏱️ Aggiornamento completato in {riepilogo['tempo']:.1f}s")
+    return riepilogo
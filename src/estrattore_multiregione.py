@@ -0,0 +1,301 @@
+"""
+Estrattore Multi-Regione - Analizzatore DB OpenFiber
+Una sola passata sul DB nazionale per N regioni: il file viene diviso in
+range di byte allineati a inizio riga ed elaborato in un process pool;
+i record di ogni regione vengono instradati alla propria pipeline di output
+"""
+
+import os
+import re
+import time
+from concurrent.futures import ProcessPoolExecutor
+from datetime import datetime
+
+import pandas as pd
+
+from config import REGIONI, SPILL_CONFIG, STATI_UI_KMZ
+from region_index import apri_range
+from chunk_adattivo import ChunkAdattivo, CHUNK_AUTO
+from spill_estrazione import AccumulatoreEstrazione, EstrazioneSpill
+from estrattore_of import (arricchisci_batch, lookup_regione, generate_multisheet_excel,
+                           costruisci_filtro, maschera_filtro, leggi_chunks, tipizza_estrazione,
+                           risolvi_engine, dati_kmz, selezione_kmz_applicata, COLONNE_ARRICCHITE,
+                           KMZ_SUPPORT)
+
+if KMZ_SUPPORT:
+    from kmz_exporter import genera_kmz_pac_pal
+
+
+def slug_regione(codice_regione):
+    """Nome file-safe della regione (es. '02' -> 'valle_d_aosta')"""
+    nome = REGIONI.get(codice_regione, f'regione_{codice_regione}')
+    return re.sub(r'[^a-z0-9]+', '_', nome.lower()).strip('_')
+
+
+def dividi_in_range(file_input, n_parti):
+    """
+    Divide il file in range di byte allineati a inizio riga (header escluso)
+
+    Args:
+        file_input: Path file CSV
+        n_parti: Numero di range desiderati
+
+    Returns:
+        Tuple (lunghezza header in byte, lista di (start_byte, end_byte))
+    """
+    size = os.path.getsize(file_input)
+
+    with open(file_input, 'rb') as f:
+        header_bytes = len(f.readline())
+        dati = size - header_bytes
+        confini = [header_bytes]
+
+        for i in range(1, max(n_parti, 1)):
+            f.seek(header_bytes + dati * i // n_parti)
+            f.readline()  # Salta la riga parziale: il confine è sempre a inizio riga
+            confine = min(f.tell(), size)
+            if confine > confini[-1]:
+                confini.append(confine)
+
+    if confini[-1] < size:
+        confini.append(size)
+
+    return header_bytes, list(zip(confini[:-1], confini[1:]))
+
+
+def _elabora_range(file_input, header_bytes, byte_range, regioni, chunk_size, filtro=None,
+                   csv_engine='pandas', processi=1):
+    """
+    Worker: legge un range di byte e arricchisce i record delle regioni richieste
+    (solo quelli che soddisfano l'eventuale filtro STATO_UI/COMUNE); con
+    chunk_size CHUNK_AUTO il budget di memoria è diviso tra i processi
+
+    Returns:
+        Tuple (dict codice regione -> DataFrame arricchito, righe lette)
+    """
+    parti = {codice: [] for codice in regioni}
+    righe = 0
+
+    with apri_range(file_input, header_bytes, [byte_range]) as sorgente:
+        adattivo = ChunkAdattivo(processi) if chunk_size == CHUNK_AUTO else None
+        chunk_iterator = leggi_chunks(sorgente.buffer, chunk_size, csv_engine, adattivo)
+
+        for chunk in chunk_iterator:
+            righe += len(chunk)
+            regione = chunk['REGIONE'].str.strip().fillna('nan')
+            selezione = regione.isin(regioni).to_numpy()
+            if filtro is not None:
+                selezione &= maschera_filtro(chunk, filtro)
+            if not selezione.any():
+                continue
+
+            for codice, block in chunk[selezione].groupby(regione[selezione], sort=False):
+                parti[codice].append(arricchisci_batch(block, *lookup_regione(codice)))
+
+    risultati = {
+        codice: pd.concat(blocchi, ignore_index=True)
+        for codice, blocchi in parti.items() if blocchi
+    }
+    return risultati, righe
+
+
+def _pipeline_output_regione(codice_regione, df_regione, output_dir, export_kmz, export_excel=True,
+                             selezione_applicata=False, kmz_tile=False, stati_ui_kmz=STATI_UI_KMZ):
+    """
+    Pipeline di output di una regione: Excel multi-foglio e KMZ opzionali
+    (stati_ui_kmz: sedi del KMZ, None = tutti gli edifici; selezione_applicata:
+    dati già filtrati in scansione, il KMZ non rifiltra; kmz_tile: KMZ a
+    livelli di dettaglio); df_regione può essere una EstrazioneSpill,
+    riletta per comune
+
+    Returns:
+        dict con path generati ed eventuale errore
+    """
+    data_oggi = datetime.now().strftime("%Y%m%d")
+    file_excel = os.path.join(output_dir, f"{slug_regione(codice_regione)}_estratto_{data_oggi}.xlsx")
+    esito = {'excel': None, 'kmz': None, 'errore': None}
+
+    try:
+        if export_excel:
+            generate_multisheet_excel(df_regione, file_excel)
+            esito['excel'] = file_excel
+
+        if export_kmz and KMZ_SUPPORT:
+            file_kmz = f"{os.path.splitext(file_excel)[0]}_PAC_PAL.kmz"
+            df_kmz, selezione_applicata = dati_kmz(df_regione, selezione_applicata, stati_ui=stati_ui_kmz)
+            if genera_kmz_pac_pal(df_kmz, file_kmz, filtrato=selezione_applicata, tile=kmz_tile,
+                                  stati_ui=stati_ui_kmz, regione=codice_regione):
+                esito['kmz'] = file_kmz
+    except Exception as e:
+        esito['errore'] = str(e)
+
+    return esito
+
+
+def estrai_regioni_df(file_input, regioni, chunk_size=10000, n_workers=None, filtro=None,
+                      csv_engine='pandas', spill_mb=None):
+    """
+    Estrae e arricchisce più regioni con una sola passata parallela sul file
+
+    A differenza della state machine di estrai_regione_02 vengono raccolte
+    tutte le righe di ogni regione, anche se non contigue. L'ordine dei record
+    segue l'ordine del file.
+
+    Args:
+        file_input: Path file CSV di input
+        regioni: Lista codici regione (es. ['02', '03'])
+        chunk_size: Righe per chunk in ogni worker (o CHUNK_AUTO)
+        n_workers: Processi da usare (default: tutti i core)
+        filtro: Filtro STATO_UI/COMUNE (costruisci_filtro) applicato nei worker
+        csv_engine: Motore di parsing dei worker (CSV_ENGINES)
+        spill_mb: Memoria massima per regione dei record raccolti dai worker:
+            oltre, la regione va su disco (None = tutto in memoria)
+
+    Returns:
+        Tuple (dict codice regione -> DataFrame arricchito o EstrazioneSpill,
+        righe totali lette)
+    """
+    n_workers = n_workers or os.cpu_count() or 1
+    csv_engine = risolvi_engine(csv_engine)
+    header_bytes, ranges = dividi_in_range(file_input, n_workers * 4)
+
+    print(f"🧩 File diviso in {len(ranges)} range su {n_workers} processi")
+
+    # Risultati dei range raccolti nell'ordine del file, regione per regione
+    accumulatori = {codice: AccumulatoreEstrazione(spill_mb) for codice in regioni}
+    righe_totali = 0
+    try:
+        with ProcessPoolExecutor(max_workers=n_workers) as executor:
+            futures = [
+                executor.submit(_elabora_range, file_input, header_bytes, byte_range, list(regioni), chunk_size,
+                                filtro, csv_engine, n_workers)
+                for byte_range in ranges
+            ]
+            while futures:
+                # Future rilasciato subito: i suoi DataFrame restano solo nell'accumulatore
+                parziali, righe = futures.pop(0).result()
+                righe_totali += righe
+                for codice, blocco in parziali.items():
+                    accumulatori[codice].aggiungi(blocco)
+    except BaseException:
+        for accumulatore in accumulatori.values():
+            accumulatore.scarta()
+        raise
+
+    dataframes = {}
+    for codice in regioni:
+        estrazione = accumulatori[codice].risultato(COLONNE_ARRICCHITE)
+        if not isinstance(estrazione, EstrazioneSpill):
+            estrazione = tipizza_estrazione(estrazione)
+        dataframes[codice] = estrazione
+
+    return dataframes, righe_totali
+
+
+def estrai_regioni(file_input, regioni, output_dir="output", chunk_size=10000,
+                   n_workers=None, export_kmz=False, stati_ui=None, export_excel=True, comuni=None,
+                   csv_engine='pandas', spill_mb=None, kmz_tile=False, stati_ui_kmz=STATI_UI_KMZ):
+    """
+    Estrazione multi-regione completa: scansione parallela + output per regione
+
+    Args:
+        file_input: Path file CSV di input
+        regioni: Lista codici regione (vedi config.REGIONI)
+        output_dir: Cartella di output
+        chunk_size: Righe per chunk (o CHUNK_AUTO)
+        n_workers: Processi da usare (default: tutti i core)
+        export_kmz: Se True genera anche il KMZ PAC/PAL di ogni regione
+        stati_ui: Codici STATO_UI da mantenere (None = tutti)
+        export_excel: Se False non genera gli Excel
+        comuni: Codici ISTAT dei comuni da mantenere (None = tutti)
+        csv_engine: Motore di parsing CSV (CSV_ENGINES)
+        spill_mb: Soglia in MB per regione oltre cui i record vanno su disco
+            (None = SPILL_CONFIG['soglia_mb'])
+        kmz_tile: Se True i KMZ sono a livelli di dettaglio (export_kmz_tile)
+        stati_ui_kmz: Codici STATO_UI delle sedi nei KMZ (default sedi
+            PAC/PAL), None = tutti gli edifici estratti
+
+    Returns:
+        dict codice regione -> {record, excel, kmz, errore}, None se errore input
+    """
+    print("=" * 60)
+    print("🚀 ESTRAZIONE MULTI-REGIONE")
+    print("=" * 60)
+
+    if not os.path.exists(file_input):
+        print(f"❌ ERRORE: File {file_input} non trovato!")
+        return None
+
+    sconosciute = [codice for codice in regioni if codice not in REGIONI]
+    if sconosciute:
+        print(f"⚠️ Codici regione ignorati (non in config.REGIONI): {', '.join(sconosciute)}")
+    regioni = [codice for codice in dict.fromkeys(regioni) if codice in REGIONI]
+    if not regioni:
+        print("❌ Nessuna regione valida richiesta")
+        return None
+
+    if export_kmz and not KMZ_SUPPORT:
+        print("⚠️ Export KMZ: Richiesto ma modulo non disponibile")
+        export_kmz = False
+
+    os.makedirs(output_dir, exist_ok=True)
+    n_workers = n_workers or os.cpu_count() or 1
+
+    print(f"📁 File input: {file_input}")
+    print(f"📍 Regioni: {', '.join(f'{c} {REGIONI[c]}' for c in regioni)}")
+    descrizione_chunk = "auto" if chunk_size == CHUNK_AUTO else f"{chunk_size:,} righe"
+    print(f"⚙️ Processi: {n_workers} - Chunk size: {descrizione_chunk} - Parser CSV: {csv_engine}")
+    print("-" * 60)
+
+    filtro = costruisci_filtro(stati_ui, comuni)
+    if filtro is not None:
+        print("🔍 Filtri in scansione: " + " | ".join(
+            f"{colonna} {', '.join(sorted(codici))}" for colonna, codici in filtro.items()))
+
+    start_time = time.time()
+    dataframes, righe_totali = estrai_regioni_df(file_input, regioni, chunk_size, n_workers, filtro,
+                                                   csv_engine,
+                                                   SPILL_CONFIG['soglia_mb'] if spill_mb is None else spill_mb)
+    scan_time = time.time() - start_time
+    print(f"✅ Scansione completata: {righe_totali:,} righe in {scan_time:.1f}s")
+
+    # Ogni regione con dati va alla propria pipeline di output (in parallelo)
+    risultati = {}
+    with ProcessPoolExecutor(max_workers=n_workers) as executor:
+        futures = {}
+        for codice in regioni:
+            df_regione = dataframes[codice]
+            risultati[codice] = {'record': len(df_regione), 'excel': None, 'kmz': None, 'errore': None}
+            if df_regione.empty:
+                print(f"⚠️ {codice} {REGIONI[codice]}: nessun record")
+                continue
+            futures[codice] = executor.submit(
+                _pipeline_output_regione, codice, df_regione, output_dir, export_kmz, export_excel,
+                selezione_kmz_applicata(filtro, stati_ui_kmz), kmz_tile, stati_ui_kmz
+            )
+
+        for codice, future in futures.items():
+            risultati[codice].update(future.result())
+            stato = "❌" if risultati[codice]['errore'] else "✅"
+            print(f"{stato} {codice} {REGIONI[codice]}: {risultati[codice]['record']:,} record")
+
+    # File di spill eliminati dopo che tutte le pipeline li hanno riletti
+    for estrazione in dataframes.values():
+        if isinstance(estrazione, EstrazioneSpill):
+            estrazione.chiudi()
+
+    elapsed_time = time.time() - start_time
+    print("-" * 60)
+    print(f"⏱️  Tempo totale: {elapsed_time:.1f} secondi")
+    print(f"📋 Record estratti: {sum(r['record'] for r in risultati.values()):,}")
+    print("=" * 60)
+
+    return risultati
+
+
+if __name__ == "__main__":
+    import sys
+
+    file_input = sys.argv[1] if len(sys.argv) > 1 else "data/dbcopertura_CD_20250715.csv"
+    regioni = sys.argv[2].split(',') if len(sys.argv) > 2 else sorted(REGIONI.keys())
+    estrai_regioni(file_input, regioni)
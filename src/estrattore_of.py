@@ -4,12 +4,31 @@ Aggiornato per compatibilità con export KMZ Google Earth e nome file automatico
 """
 
 import pandas as pd
+import numpy as np
+import argparse
+import io
+import json
 import os
+import sys
 import time
+from concurrent.futures import ProcessPoolExecutor
+from contextlib import redirect_stdout
 from datetime import datetime
 
 # Import configurazioni 2
-from config import COMUNI_VALLE_AOSTA, PCN_VALLE_AOSTA
+from config import (COMUNI_VALLE_AOSTA, PCN_VALLE_AOSTA, MAPPATURE_REGIONI, CSV_CONFIG,
+                    CSV_COLONNE_CATEGORIALI, FILTRI_TIPOLOGIE_SEDE, FILTRI_COMUNI_VDA, SPILL_CONFIG,
+                    STATI_UI_KMZ)
+from region_index import ottieni_indice, range_regione, apri_range
+from mmap_scanner import trova_blocco_regione
+from excel_writer import scrivi_excel_parallelo, scrivi_excel_streaming, dataframe_foglio, testo_foglio
+from cache_estrazioni import carica_estrazione, salva_estrazione
+from progresso import Avanzamento
+from spill_estrazione import AccumulatoreEstrazione, EstrazioneSpill
+from chunk_adattivo import ChunkAdattivo, CHUNK_AUTO, valida_chunk_size, info_chunk
+# Motori di parsing CSV: pandas o pyarrow multithread ('auto' = pyarrow se installato)
+from lettore_csv import leggi_csv_chunks, risolvi_engine, CSV_ENGINES, PYARROW_SUPPORT
+from metriche import Metriche, RisultatoEstrazione, misura, tempo_cpu, picco_memoria_mb
 
 # Import export KMZ (opzionale)
 try:
@@ -19,6 +38,17 @@ except ImportError:
     KMZ_SUPPORT = False
     print("ℹ️ Modulo KMZ non disponibile - export KMZ disabilitato")
 
+# Backend di lettura disponibili per estrai_regione_02
+# - pandas: pd.read_csv chunked sull'intero file
+# - mmap: scanner grezzo sul campo REGIONE, al parser solo il blocco regione
+READER_BACKENDS = ('pandas', 'mmap')
+
+# Motori di scrittura Excel per generate_multisheet_excel
+# - openpyxl: pd.ExcelWriter + apply_professional_formatting cella per cella
+# - parallelo: XML dei fogli generato in un process pool (excel_writer)
+# - streaming: openpyxl write-only a memoria costante (excel_writer)
+EXCEL_ENGINES = ('openpyxl', 'parallelo', 'streaming')
+
 # Colonne da mantenere nell'output finale
 COLONNE_OUTPUT = [
     'COMUNE',  # → Verrà trasformato in nome italiano
@@ -34,6 +64,72 @@ COLONNE_OUTPUT = [
     'DATA_ULTIMA_VARIAZIONE_STATO_BUILDING'
 ]
 
+# Colonne lette dal CSV (usecols): REGIONE per la state machine + colonne di output
+COLONNE_LETTURA = ['REGIONE'] + COLONNE_OUTPUT
+
+# Tipi dell'estrazione arricchita (tipizza_estrazione); numeriche e date tornano
+# testo in scrittura Excel (excel_writer.testo_colonna)
+COLONNE_CATEGORIALI = ['COMUNE', 'ISTAT', 'STATO_UI', 'POP', 'NOME_PCN', 'COMUNE_PCN']
+COLONNE_NUMERICHE = ['TOTALE_UI']
+COLONNE_DATA = ['DATA_ULTIMA_MODIFICA_RECORD', 'DATA_ULTIMA_VARIAZIONE_STATO_BUILDING']
+FORMATI_DATA = ('%Y-%m-%d', '%Y-%m-%d %H:%M:%S', '%Y-%m-%dT%H:%M:%S', '%d/%m/%Y', '%Y%m%d')
+
+# Colonne del record arricchito (ordine dell'output Excel/KMZ)
+COLONNE_ARRICCHITE = [
+    'COMUNE',
+    'ISTAT',
+    'PARTICELLA_TOP',
+    'INDIRIZZO',
+    'CIVICO',
+    'ID_BUILDING',
+    'COORDINATE_BUILDING',
+    'STATO_UI',
+    'POP',
+    'NOME_PCN',
+    'COMUNE_PCN',
+    'LAT_PCN',
+    'LON_PCN',
+    'TOTALE_UI',
+    'DATA_ULTIMA_MODIFICA_RECORD',
+    'DATA_ULTIMA_VARIAZIONE_STATO_BUILDING'
+]
+
+def costruisci_lookup(comuni, pcn):
+    """
+    Costruisce i lookup frame per l'arricchimento batch (join categorici)
+    
+    Args:
+        comuni: Dict codice ISTAT -> nome comune
+        pcn: Dict ID PCN -> dict nome/comune/latitudine/longitudine
+    
+    Returns:
+        Tuple (lookup comuni indicizzato per ISTAT, lookup PCN indicizzato per POP)
+    """
+    lookup_comuni = pd.DataFrame(
+        {'COMUNE': list(comuni.values())},
+        index=pd.Index(list(comuni.keys()), name='ISTAT', dtype=object)
+    )
+    lookup_pcn = pd.DataFrame.from_dict(
+        pcn, orient='index', columns=['nome', 'comune', 'latitudine', 'longitudine']
+    )
+    lookup_pcn.index.name = 'POP'
+    return lookup_comuni, lookup_pcn
+
+# Lookup frame precostruiti Valle d'Aosta
+LOOKUP_COMUNI, LOOKUP_PCN = costruisci_lookup(COMUNI_VALLE_AOSTA, PCN_VALLE_AOSTA)
+
+# Cache lookup per regione (costruiti al primo utilizzo)
+_LOOKUP_REGIONI = {'02': (LOOKUP_COMUNI, LOOKUP_PCN)}
+
+def lookup_regione(codice_regione):
+    """Lookup frame (comuni, PCN) per una regione, vuoti se senza mappatura"""
+    if codice_regione not in _LOOKUP_REGIONI:
+        mappatura = MAPPATURE_REGIONI.get(codice_regione, {})
+        _LOOKUP_REGIONI[codice_regione] = costruisci_lookup(
+            mappatura.get('comuni', {}), mappatura.get('pcn', {})
+        )
+    return _LOOKUP_REGIONI[codice_regione]
+
 def process_record(row):
     """
     Arricchisce un record CSV con dati da mappature esterne
@@ -78,6 +174,261 @@ def process_record(row):
     
     return record_arricchito
 
+def _normalizza_codice(serie):
+    """Equivalente vettoriale di str(valore).strip() su colonne lette come stringa"""
+    return serie.str.strip().fillna('nan')
+
+def maschera_codici(serie, codici):
+    """
+    Maschera booleana dei valori (normalizzati come _normalizza_codice) tra i
+    codici indicati; sulle colonne categoriali il confronto è fatto una sola
+    volta per categoria
+    """
+    if isinstance(serie.dtype, pd.CategoricalDtype):
+        ammesse = np.append(_normalizza_codice(serie.cat.categories.to_series()).isin(codici).to_numpy(),
+                            'nan' in codici)
+        # Codice -1 (mancante) → ultimo elemento: 'nan' come in _normalizza_codice
+        return ammesse[serie.cat.codes.to_numpy()]
+    return _normalizza_codice(serie).isin(codici).to_numpy()
+
+def leggi_chunks(sorgente, chunk_size, csv_engine='pandas', adattivo=None):
+    """
+    Lettura a chunk comune ai lettori del DB (lettore_csv): proiezione sulle
+    sole COLONNE_LETTURA (colonne assenti ignorate) e codici a bassa
+    cardinalità come categoriali; le altre colonne restano stringhe
+
+    Args:
+        sorgente: File binario bufferizzato posizionato sull'intestazione
+        chunk_size: Righe per chunk (con pyarrow: righe stimate per blocco)
+        csv_engine: Motore di parsing (CSV_ENGINES)
+        adattivo: ChunkAdattivo (chunk_adattivo.py) che misura i chunk e ne
+            sceglie la dimensione durante la lettura; chunk_size è ignorato
+    """
+    if adattivo is None:
+        return leggi_csv_chunks(sorgente, chunk_size, COLONNE_LETTURA, CSV_COLONNE_CATEGORIALI, csv_engine,
+                                CSV_CONFIG['separator'], CSV_CONFIG['encoding'])
+    chunks = leggi_csv_chunks(sorgente, adattivo.dimensione, COLONNE_LETTURA, CSV_COLONNE_CATEGORIALI,
+                              csv_engine, CSV_CONFIG['separator'], CSV_CONFIG['encoding'],
+                              dimensione=lambda: adattivo.dimensione)
+    return adattivo.misura(chunks)
+
+def _converti_date(serie):
+    """Date nei FORMATI_DATA, in alternativa giorno/mese/anno valore per valore; non valide → NaT"""
+    date = pd.Series(pd.NaT, index=serie.index, dtype='datetime64[ns]')
+    for formato in FORMATI_DATA:
+        residue = date.isna() & serie.notna()
+        if not residue.any():
+            return date
+        date[residue] = pd.to_datetime(serie[residue], format=formato, errors='coerce')
+    residue = date.isna() & serie.notna()
+    if residue.any():
+        # Formati diversi nella stessa colonna: un parsing per valore distinto
+        valori = serie[residue].astype(str)
+        convertiti = {v: pd.to_datetime(v, dayfirst=True, errors='coerce') for v in valori.unique()}
+        date[residue] = pd.to_datetime(valori.map(convertiti))
+    return date
+
+def tipizza_estrazione(df):
+    """
+    Tipi definitivi dell'estrazione arricchita (idempotente)
+    
+    Codici e nomi a bassa cardinalità diventano categoriali (groupby per
+    comune e filtri più rapidi, meno memoria), TOTALE_UI intero nullable e
+    le date datetime64. La conversione avviene sul solo blocco estratto; i
+    valori non convertibili diventano mancanti e vengono segnalati. In Excel
+    numeri e date tornano testo come nel CSV (excel_writer.testo_colonna).
+    
+    Returns:
+        Lo stesso DataFrame con le colonne convertite
+    """
+    for col in COLONNE_CATEGORIALI:
+        if col in df.columns and not isinstance(df[col].dtype, pd.CategoricalDtype):
+            df[col] = df[col].astype('category')
+    
+    for col in COLONNE_NUMERICHE + COLONNE_DATA:
+        if col not in df.columns or df[col].dtype.kind in 'iuMm':
+            continue
+        valori = df[col].where(df[col].astype(str).str.strip() != '')
+        if col in COLONNE_NUMERICHE:
+            convertiti = pd.to_numeric(valori, errors='coerce')
+            if (convertiti.dropna() % 1 == 0).all():
+                convertiti = convertiti.astype('Int64')
+        else:
+            convertiti = _converti_date(valori)
+        non_validi = int((convertiti.isna() & valori.notna()).sum())
+        if non_validi:
+            print(f"⚠️ {col}: {non_validi:,} valori non convertibili (lasciati vuoti)")
+        df[col] = convertiti
+    return df
+
+def _colonna_pcn(valori, noti):
+    """
+    Colonna coordinate PCN: float se tutti i PCN sono noti,
+    altrimenti object con '' per i PCN sconosciuti (come process_record)
+    """
+    if noti.all():
+        return valori.to_numpy(dtype=float)
+    return valori.astype(object).where(noti, '').to_numpy()
+
+def arricchisci_batch(block, lookup_comuni=None, lookup_pcn=None):
+    """
+    Arricchimento vettoriale di un blocco di righe CSV (equivalente a process_record)
+    
+    I codici ISTAT e POP vengono convertiti in categoriali: il join con i
+    lookup frame avviene una sola volta per valore distinto e i risultati
+    vengono espansi sulle righe tramite i codici categoriali.
+    
+    Args:
+        block: DataFrame con le colonne CSV originali (lette come stringa)
+        lookup_comuni: Lookup comuni (default Valle d'Aosta, vedi lookup_regione)
+        lookup_pcn: Lookup PCN (default Valle d'Aosta, vedi lookup_regione)
+    
+    Returns:
+        DataFrame con colonne COLONNE_ARRICCHITE
+    """
+    if lookup_comuni is None:
+        lookup_comuni = LOOKUP_COMUNI
+    if lookup_pcn is None:
+        lookup_pcn = LOOKUP_PCN
+    
+    istat = _normalizza_codice(block['COMUNE'])
+    id_pcn = _normalizza_codice(block['POP'])
+    
+    # Join categorico comuni: ISTAT → nome italiano
+    cat_istat = pd.Categorical(istat)
+    nomi_comuni = lookup_comuni['COMUNE'].reindex(cat_istat.categories).astype(object)
+    sconosciuti = nomi_comuni.isna()
+    nomi_comuni[sconosciuti] = 'Comune sconosciuto (' + nomi_comuni.index[sconosciuti] + ')'
+    nome_comune = nomi_comuni.to_numpy(dtype=object)[cat_istat.codes]
+    
+    # Join categorico PCN: ID → nome, comune, coordinate
+    cat_pcn = pd.Categorical(id_pcn)
+    pcn = lookup_pcn.reindex(cat_pcn.categories)
+    noti = pcn['nome'].notna()
+    nome_pcn = pcn['nome'].astype(object).where(noti, 'PCN sconosciuto (' + pcn.index.to_series() + ')')
+    comune_pcn = pcn['comune'].astype(object).where(noti, 'Comune PCN sconosciuto')
+    codici_pcn = cat_pcn.codes
+    
+    def colonna(col):
+        return block[col].to_numpy() if col in block.columns else ''
+    
+    return pd.DataFrame({
+        'COMUNE': nome_comune,
+        'ISTAT': istat.to_numpy(),
+        'PARTICELLA_TOP': colonna('PARTICELLA_TOP'),
+        'INDIRIZZO': colonna('INDIRIZZO'),
+        'CIVICO': colonna('CIVICO'),
+        'ID_BUILDING': colonna('ID_BUILDING'),
+        'COORDINATE_BUILDING': colonna('COORDINATE_BUILDING'),
+        'STATO_UI': colonna('STATO_UI'),
+        'POP': id_pcn.to_numpy(),
+        'NOME_PCN': nome_pcn.to_numpy(dtype=object)[codici_pcn],
+        'COMUNE_PCN': comune_pcn.to_numpy(dtype=object)[codici_pcn],
+        'LAT_PCN': _colonna_pcn(pcn['latitudine'], noti)[codici_pcn],
+        'LON_PCN': _colonna_pcn(pcn['longitudine'], noti)[codici_pcn],
+        'TOTALE_UI': colonna('TOTALE_UI'),
+        'DATA_ULTIMA_MODIFICA_RECORD': colonna('DATA_ULTIMA_MODIFICA_RECORD'),
+        'DATA_ULTIMA_VARIAZIONE_STATO_BUILDING': colonna('DATA_ULTIMA_VARIAZIONE_STATO_BUILDING')
+    }, columns=COLONNE_ARRICCHITE)
+
+def costruisci_filtro(stati_ui=None, comuni=None):
+    """
+    Predicato di filtro applicato durante la scansione, prima dell'arricchimento
+
+    Args:
+        stati_ui: Codici STATO_UI da mantenere (es. ['302'] per le sedi PAC/PAL)
+        comuni: Codici ISTAT del campo COMUNE del CSV (es. ['007003'])
+
+    Returns:
+        dict colonna CSV -> frozenset codici ammessi, None se nessun filtro
+    """
+    filtro = {}
+    if stati_ui:
+        filtro['STATO_UI'] = frozenset(str(codice).strip() for codice in stati_ui)
+    if comuni:
+        filtro['COMUNE'] = frozenset(str(codice).strip() for codice in comuni)
+    return filtro or None
+
+def maschera_filtro(block, filtro):
+    """Maschera booleana delle righe CSV del blocco che soddisfano il filtro"""
+    mask = np.ones(len(block), dtype=bool)
+    for colonna, codici in filtro.items():
+        mask &= maschera_codici(block[colonna], codici)
+    return mask
+
+def record_nel_filtro(row, filtro):
+    """Equivalente per riga di maschera_filtro (scansione iterrows)"""
+    return all(str(row[colonna]).strip() in codici for colonna, codici in filtro.items())
+
+def filtra_estrazione(df, filtro):
+    """
+    Applica il filtro a un'estrazione già arricchita (es. caricata dalla cache)
+
+    Nel record arricchito il codice ISTAT del comune è nella colonna ISTAT.
+    """
+    if not filtro:
+        return df
+    colonne = {'STATO_UI': 'STATO_UI', 'COMUNE': 'ISTAT'}
+    mask = np.ones(len(df), dtype=bool)
+    for colonna, codici in filtro.items():
+        mask &= df[colonne[colonna]].astype(str).str.strip().isin(codici).to_numpy()
+    return df[mask].reset_index(drop=True)
+
+def selezione_kmz_applicata(filtro, stati_ui_kmz=STATI_UI_KMZ):
+    """
+    True se il filtro in scansione lascia solo sedi con STATO_UI fra quelle
+    del KMZ: l'exporter non deve rifiltrare
+    """
+    if stati_ui_kmz is None or filtro is None or 'STATO_UI' not in filtro:
+        return False
+    return filtro['STATO_UI'] <= {str(codice).strip() for codice in stati_ui_kmz}
+
+def dati_kmz(estrazione, filtrato=False, seleziona=False, stati_ui=STATI_UI_KMZ):
+    """
+    Dati per il KMZ: il DataFrame così com'è, oppure da una EstrazioneSpill
+    le sole sedi selezionate rilette un comune alla volta
+
+    Args:
+        estrazione: DataFrame arricchito o EstrazioneSpill
+        filtrato: True se la selezione è già stata applicata in scansione
+            (selezione_kmz_applicata)
+        seleziona: Seleziona le sedi anche da un DataFrame (es. da passare
+            a un altro processo senza copiare l'intera estrazione)
+        stati_ui: Codici STATO_UI delle sedi del KMZ (default STATI_UI_KMZ,
+            sedi PAC/PAL), None = tutti gli edifici
+
+    Returns:
+        Tuple (DataFrame, filtrato) da passare a genera_kmz_pac_pal con gli
+        stessi stati_ui
+    """
+    selezione = costruisci_filtro(stati_ui=stati_ui)
+    if isinstance(estrazione, EstrazioneSpill):
+        return tipizza_estrazione(estrazione.carica(lambda df: filtra_estrazione(df, selezione))), True
+    if seleziona and not filtrato:
+        return filtra_estrazione(estrazione, selezione), True
+    return estrazione, filtrato
+
+def _genera_kmz_processo(df_kmz, kmz_file, tile=False, stati_ui=STATI_UI_KMZ):
+    """
+    Worker: KMZ generato in un processo separato (in parallelo all'Excel)
+    da sedi già selezionate con dati_kmz
+
+    Log, ultimo avanzamento e tempi tornano al processo principale con l'esito.
+
+    Returns:
+        Tuple (successo, (placemark scritti, placemark totali), (wall, CPU), log)
+    """
+    placemark = [0, 0]
+    def progresso(scritti, totali):
+        placemark[:] = [scritti, totali]
+    
+    log = io.StringIO()
+    wall, cpu = time.perf_counter(), tempo_cpu()
+    with redirect_stdout(log):
+        successo = genera_kmz_pac_pal(df_kmz, kmz_file, progresso=progresso, filtrato=True, tile=tile,
+                                      stati_ui=stati_ui)
+    return successo, tuple(placemark), (time.perf_counter() - wall, tempo_cpu() - cpu), log.getvalue()
+
 def sanitize_sheet_name(name):
     """
     Converte nomi comuni in nomi fogli Excel validi
@@ -126,20 +477,53 @@ def apply_professional_formatting(worksheet):
         adjusted_width = min(max(max_length + 2, 10), 50)
         worksheet.column_dimensions[column_letter].width = adjusted_width
 
-def generate_multisheet_excel(df_valle_aosta, file_output):
+def _foglio_excel(df):
+    """Foglio riletto da disco con i tipi dell'estrazione"""
+    return tipizza_estrazione(df)
+
+def generate_multisheet_excel(df_valle_aosta, file_output, engine='openpyxl', n_workers=None,
+                              riusa_da=None, fogli_invariati=(), progresso=None):
     """
     Genera file Excel multi-foglio con formattazione professionale
     Versione ottimizzata per grandi dataset
+    
+    Args:
+        df_valle_aosta: DataFrame arricchito, oppure EstrazioneSpill (fogli
+            riletti da disco un comune alla volta)
+        file_output: Path file .xlsx
+        engine: Motore di scrittura (EXCEL_ENGINES)
+        n_workers: Processi per il motore 'parallelo' (default: tutti i core)
+        riusa_da: Excel precedente da cui copiare i fogli invariati (solo 'parallelo')
+        fogli_invariati: Nomi dei fogli copiabili da riusa_da (aggiornamento incrementale)
+        progresso: Callback (fogli scritti, fogli totali) dopo ogni foglio
     """
-    print(f"📊 Generazione Excel multi-foglio: {len(df_valle_aosta)} record")
+    if engine not in EXCEL_ENGINES:
+        raise ValueError(f"Motore Excel non valido: {engine} (disponibili: {', '.join(EXCEL_ENGINES)})")
     
-    # Ordinamento per comune
-    df_valle_aosta = df_valle_aosta.sort_values('COMUNE')
+    print(f"📊 Generazione Excel multi-foglio: {len(df_valle_aosta)} record")
     
-    # Raggruppamento per comune
-    comuni_groups = df_valle_aosta.groupby('COMUNE')
+    if isinstance(df_valle_aosta, EstrazioneSpill):
+        # Un comune alla volta dalle parti su disco (tipi applicati al foglio)
+        comuni_groups = df_valle_aosta.gruppi(trasforma=_foglio_excel)
+    else:
+        # Ordinamento stabile per comune: nel foglio i record restano nell'ordine del file
+        df_valle_aosta = df_valle_aosta.sort_values('COMUNE', kind='stable')
+        
+        # Raggruppamento per comune (solo i comuni presenti se COMUNE è categoriale)
+        comuni_groups = df_valle_aosta.groupby('COMUNE', observed=True)
     print(f"🏘️ Trovati {len(comuni_groups)} comuni")
     
+    if engine in ('parallelo', 'streaming'):
+        fogli = [(sanitize_sheet_name(comune_nome), gruppo_data)
+                 for comune_nome, gruppo_data in comuni_groups]
+        if engine == 'parallelo':
+            comuni_processati = scrivi_excel_parallelo(fogli, file_output, n_workers,
+                                                       riusa_da, fogli_invariati, progresso)
+        else:
+            comuni_processati = scrivi_excel_streaming(fogli, file_output, progresso=progresso)
+        print(f"✅ Excel generato: {comuni_processati} fogli")
+        return
+    
     # Generazione Excel con writer
     with pd.ExcelWriter(file_output, engine='openpyxl') as writer:
         comuni_processati = 0
@@ -149,13 +533,15 @@ def generate_multisheet_excel(df_valle_aosta, file_output):
             nome_foglio = sanitize_sheet_name(comune_nome)
             
             # Scrivi dati nel foglio
-            gruppo_data.to_excel(writer, sheet_name=nome_foglio, index=False)
+            testo_foglio(dataframe_foglio(gruppo_data)).to_excel(writer, sheet_name=nome_foglio, index=False)
             
             # Applica formattazione professionale
             worksheet = writer.sheets[nome_foglio]
             apply_professional_formatting(worksheet)
             
             comuni_processati += 1
+            if progresso is not None:
+                progresso(comuni_processati, len(comuni_groups))
             
             # Progress ogni 10 comuni
             if comuni_processati % 10 == 0:
@@ -163,10 +549,406 @@ def generate_multisheet_excel(df_valle_aosta, file_output):
         
         print(f"✅ Excel generato: {comuni_processati} fogli")
 
+def scan_regione_iterrows(chunk_iterator, codice_regione='02', riga_iniziale=0, progresso=None,
+                          metriche=None, filtro=None, accumulatore=None):
+    """
+    Scansione legacy riga per riga con state machine (iterrows)
+    Mantenuta come riferimento per confronti e benchmark
+    
+    Args:
+        chunk_iterator: Iteratore di chunk DataFrame (pd.read_csv con chunksize)
+        codice_regione: Codice regione da estrarre (es. '02')
+        riga_iniziale: Righe già saltate prima del primo chunk (lettura da indice)
+        progresso: Callback (righe scansionate, record estratti) chiamata a ogni chunk
+        metriche: Metriche (metriche.py) in cui registrare i tempi delle fasi
+            'dataframe' (l'arricchimento per riga resta nella scansione)
+        filtro: Filtro (costruisci_filtro): i record della regione che non lo
+            soddisfano non vengono arricchiti
+        accumulatore: AccumulatoreEstrazione (spill_estrazione.py) che riceve
+            i record di ogni chunk (default: tutto in memoria)
+    
+    Returns:
+        Tuple (DataFrame record arricchiti - o EstrazioneSpill se l'accumulatore
+        è andato su disco -, dict con righe_totali/start_row/end_row)
+    """
+    if accumulatore is None:
+        accumulatore = AccumulatoreEstrazione()
+    records = []
+    found_start = False
+    found_end = False
+    total_rows_processed = riga_iniziale
+    start_row = 0
+    end_row = 0
+    
+    for chunk_num, chunk in enumerate(chunk_iterator):
+        # Progress tracking
+        if chunk_num % 10 == 0:
+            print(f"📊 Chunk {chunk_num + 1:,} - Righe totali: {total_rows_processed:,}")
+        
+        for idx, row in chunk.iterrows():
+            total_rows_processed += 1
+            regione = str(row['REGIONE']).strip()
+            
+            # State machine logic
+            if not found_start and regione == codice_regione:
+                found_start = True
+                start_row = total_rows_processed
+                print(f"✅ Trovato INIZIO regione {codice_regione} alla riga {start_row:,}")
+            
+            if found_start:
+                if regione == codice_regione:
+                    if filtro is not None and not record_nel_filtro(row, filtro):
+                        continue
+                    # Processa e arricchisce record
+                    record_arricchito = process_record(row)
+                    records.append(record_arricchito)
+                    
+                    # Progress estrazione
+                    n_records = len(accumulatore) + len(records)
+                    if n_records % 1000 == 0:
+                        print(f"  📋 Record estratti: {n_records:,}")
+                else:
+                    found_end = True
+                    end_row = total_rows_processed
+                    print(f"🏁 Trovata FINE regione {codice_regione} alla riga {end_row:,}")
+                    break
+        
+        # Record del chunk all'accumulatore (a memoria limitata se con soglia)
+        if records:
+            with misura(metriche, 'dataframe'):
+                accumulatore.aggiungi(pd.DataFrame(records))
+            records = []
+        
+        if progresso is not None:
+            progresso(total_rows_processed, len(accumulatore))
+        
+        if found_end:
+            break
+    
+    scan_info = {
+        'righe_totali': total_rows_processed,
+        'start_row': start_row,
+        'end_row': end_row
+    }
+    with misura(metriche, 'dataframe'):
+        return accumulatore.risultato(), scan_info
+
+def batch_regione_vettoriale(chunk_iterator, codice_regione='02', riga_iniziale=0, progresso=None,
+                             metriche=None, filtro=None, scan_info=None):
+    """
+    Scansione vettoriale come generatore dei batch arricchiti, nell'ordine del file
+    
+    Il blocco della regione è contiguo nel file ordinato per REGIONE: per ogni
+    chunk si calcola la maschera una sola volta, si individua la prima riga
+    della regione e la prima riga successiva che non le appartiene, e si
+    arricchisce l'intero blocco con arricchisci_batch. L'early-exit a fine
+    blocco è mantenuto.
+    
+    Args:
+        chunk_iterator: Iteratore di chunk DataFrame (pd.read_csv con chunksize)
+        codice_regione: Codice regione da estrarre (es. '02')
+        riga_iniziale: Righe già saltate prima del primo chunk (lettura da indice)
+        progresso: Callback (righe scansionate, record estratti) chiamata a ogni chunk
+        metriche: Metriche (metriche.py) in cui registrare il tempo della fase
+            'arricchimento'
+        filtro: Filtro (costruisci_filtro) applicato al blocco regione prima
+            dell'arricchimento; i confini della regione non cambiano
+        scan_info: dict aggiornato con righe_totali/start_row/end_row a fine
+            scansione
+    
+    Yields:
+        DataFrame con colonne COLONNE_ARRICCHITE (batch non vuoti)
+    """
+    if scan_info is None:
+        scan_info = {}
+    n_records = 0
+    found_start = False
+    found_end = False
+    total_rows_processed = riga_iniziale
+    start_row = 0
+    end_row = 0
+    
+    for chunk_num, chunk in enumerate(chunk_iterator):
+        # Progress tracking
+        if chunk_num % 10 == 0:
+            print(f"📊 Chunk {chunk_num + 1:,} - Righe totali: {total_rows_processed:,}")
+        
+        # Maschera booleana sull'intero chunk (stessa normalizzazione di str().strip())
+        mask = maschera_codici(chunk['REGIONE'], [codice_regione])
+        
+        if not found_start:
+            positions = np.flatnonzero(mask)
+            if len(positions) == 0:
+                total_rows_processed += len(chunk)
+                if progresso is not None:
+                    progresso(total_rows_processed, n_records)
+                continue
+            first = int(positions[0])
+            found_start = True
+            start_row = total_rows_processed + first + 1
+            print(f"✅ Trovato INIZIO regione {codice_regione} alla riga {start_row:,}")
+        else:
+            first = 0
+        
+        # Prima riga non appartenente alla regione dopo l'inizio del blocco
+        outside = np.flatnonzero(~mask[first:])
+        if len(outside) > 0:
+            last = first + int(outside[0])
+            found_end = True
+        else:
+            last = len(chunk)
+        
+        records_before = n_records
+        block = chunk.iloc[first:last]
+        if filtro is not None:
+            block = block[maschera_filtro(block, filtro)]
+        if len(block) > 0:
+            with misura(metriche, 'arricchimento'):
+                batch = arricchisci_batch(block, *lookup_regione(codice_regione))
+            n_records += len(block)
+            yield batch
+        
+        # Progress estrazione (una riga per ogni migliaio superato)
+        for milestone in range((records_before // 1000 + 1) * 1000, n_records + 1, 1000):
+            print(f"  📋 Record estratti: {milestone:,}")
+        
+        if found_end:
+            end_row = total_rows_processed + last + 1
+            total_rows_processed = end_row
+            print(f"🏁 Trovata FINE regione {codice_regione} alla riga {end_row:,}")
+            if progresso is not None:
+                progresso(total_rows_processed, n_records)
+            break
+        
+        total_rows_processed += len(chunk)
+        if progresso is not None:
+            progresso(total_rows_processed, n_records)
+    
+    scan_info.update({
+        'righe_totali': total_rows_processed,
+        'start_row': start_row,
+        'end_row': end_row
+    })
+
+def scan_regione_vettoriale(chunk_iterator, codice_regione='02', riga_iniziale=0, progresso=None,
+                            metriche=None, filtro=None, accumulatore=None):
+    """
+    Scansione vettoriale: maschera booleana per chunk + aritmetica sugli indici
+    
+    Raccoglie i batch di batch_regione_vettoriale. Produce gli stessi record
+    (e gli stessi numeri di riga) della versione iterrows.
+    
+    Args:
+        chunk_iterator: Iteratore di chunk DataFrame (pd.read_csv con chunksize)
+        codice_regione: Codice regione da estrarre (es. '02')
+        riga_iniziale: Righe già saltate prima del primo chunk (lettura da indice)
+        progresso: Callback (righe scansionate, record estratti) chiamata a ogni chunk
+        metriche: Metriche (metriche.py) in cui registrare i tempi delle fasi
+            'arricchimento' e 'dataframe'
+        filtro: Filtro (costruisci_filtro) applicato al blocco regione prima
+            dell'arricchimento; i confini della regione non cambiano
+        accumulatore: AccumulatoreEstrazione (spill_estrazione.py) che riceve
+            i batch arricchiti (default: tutto in memoria)
+    
+    Returns:
+        Tuple (DataFrame record arricchiti - o EstrazioneSpill se l'accumulatore
+        è andato su disco -, dict con righe_totali/start_row/end_row)
+    """
+    if accumulatore is None:
+        accumulatore = AccumulatoreEstrazione()
+    scan_info = {}
+    for batch in batch_regione_vettoriale(chunk_iterator, codice_regione, riga_iniziale, progresso,
+                                          metriche, filtro, scan_info):
+        accumulatore.aggiungi(batch)
+    with misura(metriche, 'dataframe'):
+        return accumulatore.risultato(COLONNE_ARRICCHITE), scan_info
+
+def localizza_blocco_regione(file_input, codice_regione='02', use_index=False):
+    """
+    Individua il blocco di byte di una regione senza passare dal parser CSV
+    
+    Con use_index usa (o costruisce) l'indice sidecar, altrimenti esegue lo
+    scanner mmap sul solo campo REGIONE.
+    
+    Returns:
+        dict blocco (header_bytes, start_byte, end_byte, start_row, n_rows,
+        end_row, righe_scansionate) o None se la regione non è presente
+    """
+    if not use_index:
+        return trova_blocco_regione(file_input, codice_regione)
+    
+    indice = ottieni_indice(file_input)
+    ranges = range_regione(indice, codice_regione)
+    if not ranges:
+        return None
+    if len(ranges) > 1:
+        print(f"⚠️ Regione {codice_regione} frammentata in {len(ranges)} blocchi: letto solo il primo")
+    
+    start_byte, end_byte, start_row, n_rows = ranges[0]
+    riga_dopo = start_row + n_rows
+    return {
+        'header_bytes': indice['header_bytes'],
+        'start_byte': start_byte,
+        'end_byte': end_byte,
+        'start_row': start_row,
+        'n_rows': n_rows,
+        'end_row': riga_dopo if riga_dopo <= indice['righe_totali'] else 0,
+        'righe_scansionate': n_rows
+    }
+
+def apri_lettura_regione(file_input, codice_regione='02', chunk_size=10000, use_index=False, reader='pandas',
+                         csv_engine='pandas', adattivo=None):
+    """
+    Apre la lettura a chunk di una regione: l'intero file, oppure il solo
+    blocco individuato dall'indice sidecar o dallo scanner mmap
+    
+    Returns:
+        dict con sorgente (file da chiudere), chunks (iteratore di chunk),
+        blocco (localizza_blocco_regione, None se si legge tutto il file),
+        bytes_totali e byte_letti (funzione); None se il blocco della regione
+        non esiste
+    
+    Raises:
+        Errori di apertura del file o di lettura dell'intestazione CSV
+    """
+    blocco = None
+    sorgente = None
+    try:
+        if use_index or reader == 'mmap':
+            blocco = localizza_blocco_regione(file_input, codice_regione, use_index=use_index)
+            if blocco is None:
+                return None
+            print(f"⏩ Blocco regione {codice_regione} al byte {blocco['start_byte']:,} "
+                  f"({blocco['n_rows']:,} righe da leggere)")
+            sorgente = apri_range(file_input, blocco['header_bytes'],
+                                  [(blocco['start_byte'], blocco['end_byte'])])
+            bytes_totali = blocco['header_bytes'] + blocco['end_byte'] - blocco['start_byte']
+            byte_letti = lambda: sorgente.buffer.raw.byte_letti  # noqa: E731
+            binario = sorgente.buffer
+        else:
+            # Handle binario: la posizione nel file misura i byte letti dal parser
+            sorgente = open(file_input, 'rb')
+            bytes_totali = os.path.getsize(file_input)
+            byte_letti = sorgente.tell
+            binario = sorgente
+        
+        # Solo le colonne necessarie, codici a bassa cardinalità categoriali
+        chunk_iterator = leggi_chunks(binario, chunk_size, csv_engine, adattivo)
+    except Exception:
+        if sorgente is not None:
+            sorgente.close()
+        raise
+    return {
+        'sorgente': sorgente,
+        'chunks': chunk_iterator,
+        'blocco': blocco,
+        'bytes_totali': bytes_totali,
+        'byte_letti': byte_letti
+    }
+
+def leggi_regione(file_input, codice_regione='02', chunk_size=10000, vectorized=True,
+                  use_index=False, reader='pandas', avanzamento=None, metriche=None, filtro=None,
+                  csv_engine='pandas', spill_mb=None):
+    """
+    Legge il CSV ed estrae il blocco arricchito di una regione (state machine)
+    
+    Args:
+        file_input: Path file CSV di input
+        codice_regione: Codice regione (es. '02')
+        chunk_size: Righe per chunk, oppure CHUNK_AUTO (scelto durante la lettura)
+        vectorized: Scansione vettoriale (True) o iterrows legacy (False)
+        use_index: Usa l'indice byte-offset sidecar
+        reader: Backend di lettura (READER_BACKENDS)
+        avanzamento: Avanzamento (progresso.py) aggiornato con byte letti,
+            righe scansionate e record estratti
+        metriche: Metriche (metriche.py): tempi 'scansione' (esclusi
+            arricchimento e costruzione DataFrame), 'arricchimento', 'dataframe'
+        filtro: Filtro STATO_UI/COMUNE (costruisci_filtro) applicato in scansione
+        csv_engine: Motore di parsing (CSV_ENGINES); l'output è identico
+        spill_mb: Oltre questa memoria i batch arricchiti vanno su disco e si
+            ottiene una EstrazioneSpill (None = estrazione tutta in memoria)
+    
+    Returns:
+        Tuple (DataFrame arricchito o EstrazioneSpill, scan_info) oppure None
+        se errore di lettura; scan_info['chunk'] riporta il chunk size usato
+        (info_chunk)
+    """
+    adattivo = ChunkAdattivo() if chunk_size == CHUNK_AUTO else None
+    try:
+        lettura = apri_lettura_regione(file_input, codice_regione, chunk_size, use_index, reader,
+                                       csv_engine, adattivo)
+    except Exception as e:
+        print(f"❌ Errore lettura CSV: {e}")
+        return None
+    if lettura is None:
+        return (pd.DataFrame(columns=COLONNE_ARRICCHITE),
+                {'righe_totali': 0, 'start_row': 0, 'end_row': 0, 'chunk': info_chunk(chunk_size, adattivo)})
+    sorgente, chunk_iterator, blocco = lettura['sorgente'], lettura['chunks'], lettura['blocco']
+    byte_letti = lettura['byte_letti']
+    
+    # === STATE MACHINE EXTRACTION ===
+    print(f"🔍 Ricerca dati regione {codice_regione}...")
+    
+    # Con blocco pre-individuato i numeri di riga restano riferiti al file completo
+    riga_iniziale = blocco['start_row'] - 1 if blocco is not None else 0
+    
+    progresso = None
+    if avanzamento is not None:
+        avanzamento.aggiorna('lettura', forza=True, bytes_totali=lettura['bytes_totali'])
+        progresso = avanzamento.lettura(byte_letti)
+    
+    accumulatore = AccumulatoreEstrazione(spill_mb)
+    try:
+        with misura(metriche, 'scansione'):
+            if vectorized:
+                df_regione, scan_info = scan_regione_vettoriale(chunk_iterator, codice_regione,
+                                                                riga_iniziale, progresso, metriche, filtro,
+                                                                accumulatore)
+            else:
+                df_regione, scan_info = scan_regione_iterrows(chunk_iterator, codice_regione,
+                                                              riga_iniziale, progresso, metriche, filtro,
+                                                              accumulatore)
+            # Su disco i tipi vengono applicati a ogni comune riletto
+            if not isinstance(df_regione, EstrazioneSpill):
+                with misura(metriche, 'dataframe'):
+                    df_regione = tipizza_estrazione(df_regione)
+    except BaseException:
+        accumulatore.scarta()
+        raise
+    else:
+        if metriche is not None:
+            metriche.escludi('scansione', 'arricchimento', 'dataframe')
+        if avanzamento is not None:
+            avanzamento.aggiorna('lettura', forza=True, bytes_letti=byte_letti())
+    finally:
+        sorgente.close()
+    
+    if blocco is not None:
+        scan_info['end_row'] = blocco['end_row']
+        if blocco['end_row']:
+            scan_info['righe_totali'] = blocco['end_row']
+    scan_info['chunk'] = info_chunk(chunk_size, adattivo)
+    
+    return df_regione, scan_info
+
 def estrai_regione_02(file_input="data/dbcopertura_CD_20250715.csv", 
                      file_output="output/valle_aosta_estratto.xlsx", 
                      chunk_size=10000,
-                     export_kmz=False):
+                     export_kmz=False,
+                     vectorized=True,
+                     use_index=False,
+                     reader='pandas',
+                     excel_engine='openpyxl',
+                     use_cache=False,
+                     progress_callback=None,
+                     stati_ui=None,
+                     export_excel=True,
+                     comuni=None,
+                     csv_engine='pandas',
+                     spill_mb=None,
+                     pipeline=False,
+                     kmz_tile=False,
+                     stati_ui_kmz=STATI_UI_KMZ):
     """
     Estrae dati regione 02 (Valle d'Aosta) con supporto export KMZ opzionale
     VERSIONE AGGIORNATA v2.1.1 con nome file automatico
@@ -174,11 +956,51 @@ def estrai_regione_02(file_input="data/dbcopertura_CD_20250715.csv",
     Args:
         file_input: Path file CSV di input
         file_output: Path file Excel di output (verrà aggiunta data automaticamente)
-        chunk_size: Dimensione chunk per ottimizzazione memoria
+        chunk_size: Dimensione chunk per ottimizzazione memoria, oppure
+            CHUNK_AUTO: campiona i primi chunk (righe/s, memoria per riga) e
+            sceglie la dimensione entro un budget della RAM disponibile
         export_kmz: Se True, genera anche file KMZ per Google Earth
+        vectorized: Se True usa la scansione vettoriale a maschera booleana,
+            se False la scansione legacy riga per riga (iterrows)
+        use_index: Se True usa l'indice byte-offset sidecar (costruito al primo
+            utilizzo) per leggere solo i byte della regione 02
+        reader: Backend di lettura (READER_BACKENDS): 'pandas' legge tutto il
+            file in chunk, 'mmap' individua il blocco regione con lo scanner
+            grezzo e passa al parser solo quelle righe
+        excel_engine: Motore di scrittura Excel (EXCEL_ENGINES): 'parallelo'
+            genera i fogli comune in un process pool, 'streaming' scrive in
+            modalità write-only a memoria costante
+        use_cache: Se True riusa l'estrazione in cache (CSV invariato per
+            path, dimensione e mtime) e salva in cache quella appena letta
+        progress_callback: Funzione chiamata con un evento dict (progresso.py)
+            a ogni avanzamento reale: byte letti, righe scansionate, record
+            estratti, fogli Excel scritti, placemark KMZ e percentuale
+        stati_ui: Codici STATO_UI da mantenere (es. ['302']), None = tutti;
+            applicato in scansione prima dell'arricchimento
+        export_excel: Se False non genera l'Excel (es. solo KMZ da CLI)
+        comuni: Codici ISTAT dei comuni da mantenere (es. ['007003']), None = tutti
+        csv_engine: Motore di parsing CSV (CSV_ENGINES): 'pyarrow' converte
+            blocchi di byte con più thread (chunk_size = righe stimate per
+            blocco), 'auto' lo usa se installato; output identico a 'pandas'
+        spill_mb: Memoria massima in MB dei record estratti: oltre, i batch
+            arricchiti vanno su disco (spill_estrazione.py) ed Excel e KMZ li
+            rileggono per comune (None = SPILL_CONFIG['soglia_mb'])
+        pipeline: Se True lettura, arricchimento e output si sovrappongono
+            (pipeline_comuni.py): il foglio Excel e la cartella KMZ di ogni
+            comune vengono generati in un process pool appena il suo blocco
+            è completo, senza costruire il DataFrame dell'intera regione.
+            Fogli con il writer XML del motore 'parallelo'; se l'input non è
+            raggruppato per comune si torna all'estrazione sequenziale
+        kmz_tile: Se True il KMZ è a livelli di dettaglio (export_kmz_tile):
+            quadtree di KML con Region/NetworkLink, che Google Earth carica
+            solo per l'area inquadrata (KMZ_TILE_CONFIG)
+        stati_ui_kmz: Codici STATO_UI delle sedi del KMZ (default
+            STATI_UI_KMZ, sedi PAC/PAL), None = tutti gli edifici estratti
     
     Returns:
-        bool: True se successo, False se errore
+        RisultatoEstrazione (metriche.py): vero se successo, falso se errore;
+        contiene tempi wall/CPU per fase, conteggi, picco di memoria e path
+        dei file generati
     """
     print("=" * 60)
     print("🚀 ANALIZZATORE DB OPENFIBER v2.1.1")
@@ -186,6 +1008,26 @@ def estrai_regione_02(file_input="data/dbcopertura_CD_20250715.csv",
     print("=" * 60)
     
     start_time = time.time()
+    cpu_iniziale = tempo_cpu()
+    metriche = Metriche()
+    risultato = RisultatoEstrazione(file_input, {
+        'chunk_size': chunk_size,
+        'export_kmz': export_kmz,
+        'vectorized': vectorized,
+        'use_index': use_index,
+        'reader': reader,
+        'excel_engine': excel_engine,
+        'use_cache': use_cache,
+        'stati_ui': list(stati_ui) if stati_ui else None,
+        'export_excel': export_excel,
+        'comuni': list(comuni) if comuni else None,
+        'csv_engine': csv_engine,
+        'spill_mb': spill_mb,
+        'pipeline': pipeline,
+        'kmz_tile': kmz_tile,
+        'stati_ui_kmz': list(stati_ui_kmz) if stati_ui_kmz is not None else None
+    })
+    risultato.fasi = metriche.fasi
     
     # === AGGIUNTA DATA AUTOMATICA AL FILENAME ===
     output_dir = os.path.dirname(file_output)
@@ -200,14 +1042,17 @@ def estrai_regione_02(file_input="data/dbcopertura_CD_20250715.csv",
     # === VALIDAZIONE INPUT ===
     if not os.path.exists(file_input):
         print(f"❌ ERRORE: File {file_input} non trovato!")
-        return False
+        return risultato.fallito(f"File {file_input} non trovato")
     
     # Creazione directory output
     os.makedirs(output_dir, exist_ok=True)
     
     print(f"📁 File input: {file_input}")
     print(f"📂 File output: {file_output_final}")
-    print(f"⚙️ Chunk size: {chunk_size:,} righe")
+    if chunk_size == CHUNK_AUTO:
+        print("⚙️ Chunk size: auto (adattivo in lettura)")
+    elif isinstance(chunk_size, int):
+        print(f"⚙️ Chunk size: {chunk_size:,} righe")
     
     if export_kmz:
         if KMZ_SUPPORT:
@@ -218,153 +1063,366 @@ def estrai_regione_02(file_input="data/dbcopertura_CD_20250715.csv",
     
     print("-" * 60)
     
-    # === CHUNKED READING ===
+    # === VALIDAZIONE BACKEND ===
     try:
-        chunk_iterator = pd.read_csv(
-            file_input,
-            sep='|',
-            chunksize=chunk_size,
-            dtype=str,
-            low_memory=False
-        )
-    except Exception as e:
-        print(f"❌ Errore lettura CSV: {e}")
-        return False
+        valida_chunk_size(chunk_size)
+    except ValueError as e:
+        print(f"❌ {e}")
+        return risultato.fallito(str(e))
+    if reader not in READER_BACKENDS:
+        print(f"❌ Backend di lettura non valido: {reader} (disponibili: {', '.join(READER_BACKENDS)})")
+        return risultato.fallito(f"Backend di lettura non valido: {reader}")
+    if excel_engine not in EXCEL_ENGINES:
+        print(f"❌ Motore Excel non valido: {excel_engine} (disponibili: {', '.join(EXCEL_ENGINES)})")
+        return risultato.fallito(f"Motore Excel non valido: {excel_engine}")
+    if csv_engine not in CSV_ENGINES:
+        print(f"❌ Motore CSV non valido: {csv_engine} (disponibili: {', '.join(CSV_ENGINES)})")
+        return risultato.fallito(f"Motore CSV non valido: {csv_engine}")
+    csv_engine = risolvi_engine(csv_engine)
+    print(f"⚙️ Parser CSV: {csv_engine}")
     
-    # === STATE MACHINE EXTRACTION ===
-    valle_aosta_data = []
-    found_start = False
-    found_end = False
-    total_rows_processed = 0
-    start_row = 0
-    end_row = 0
+    avanzamento = Avanzamento(progress_callback, export_kmz)
     
-    print("🔍 Ricerca dati Valle d'Aosta...")
+    filtro = costruisci_filtro(stati_ui, comuni)
+    if filtro is not None:
+        print("🔍 Filtri in scansione: " + " | ".join(
+            f"{colonna} {', '.join(sorted(codici))}" for colonna, codici in filtro.items()))
     
-    for chunk_num, chunk in enumerate(chunk_iterator):
-        # Progress tracking
-        if chunk_num % 10 == 0:
-            print(f"📊 Chunk {chunk_num + 1:,} - Righe totali: {total_rows_processed:,}")
-        
-        for idx, row in chunk.iterrows():
-            total_rows_processed += 1
-            regione = str(row['REGIONE']).strip()
-            
-            # State machine logic
-            if not found_start and regione == '02':
-                found_start = True
-                start_row = total_rows_processed
-                print(f"✅ Trovato INIZIO Valle d'Aosta alla riga {start_row:,}")
-            
-            if found_start:
-                if regione == '02':
-                    # Processa e arricchisce record
-                    record_arricchito = process_record(row)
-                    valle_aosta_data.append(record_arricchito)
-                    
-                    # Progress estrazione
-                    if len(valle_aosta_data) % 1000 == 0:
-                        print(f"  📋 Record estratti: {len(valle_aosta_data):,}")
-                else:
-                    found_end = True
-                    end_row = total_rows_processed
-                    print(f"🏁 Trovata FINE Valle d'Aosta alla riga {end_row:,}")
-                    break
-        
-        if found_end:
-            break
+    # === CACHE ESTRAZIONE ===
+    estrazione = carica_estrazione(file_input, '02') if use_cache else None
+    
+    # === PIPELINE A STADI (lettura, arricchimento e output sovrapposti) ===
+    esito_pipeline = None
+    if pipeline and estrazione is None:
+        from pipeline_comuni import esegui_pipeline_regione, ComuniNonOrdinati
+        print("⚡ Pipeline a stadi: fogli Excel e cartelle KMZ generati per comune durante la lettura")
+        if export_excel and excel_engine != 'parallelo':
+            print("ℹ️ Pipeline: fogli generati con il writer XML del motore 'parallelo'")
+        try:
+            esito_pipeline = esegui_pipeline_regione(file_input, file_output_final if export_excel else None,
+                                                     export_kmz, '02', chunk_size, use_index, reader,
+                                                     csv_engine, filtro, avanzamento, metriche,
+                                                     stati_ui_kmz=stati_ui_kmz, kmz_tile=kmz_tile)
+        except ComuniNonOrdinati as e:
+            print(f"⚠️ {e}: estrazione senza pipeline")
+        except Exception as e:
+            print(f"❌ Errore pipeline: {e}")
+            return risultato.fallito(f"Errore pipeline: {e}")
+    
+    if estrazione is not None:
+        df_valle_aosta, scan_info = estrazione
+        print(f"⚡ Estrazione caricata dalla cache: {len(df_valle_aosta):,} record (CSV invariato)")
+        risultato.da_cache = True
+        # La cache contiene l'estrazione completa: filtri applicati in memoria
+        df_valle_aosta = filtra_estrazione(df_valle_aosta, filtro)
+        dimensione_csv = os.path.getsize(file_input)
+        avanzamento.aggiorna('lettura', forza=True, bytes_letti=dimensione_csv, bytes_totali=dimensione_csv,
+                             righe_scansionate=scan_info['righe_totali'], record_estratti=len(df_valle_aosta))
+    elif esito_pipeline is not None:
+        df_valle_aosta, scan_info = esito_pipeline, esito_pipeline.scan_info
+        if use_cache:
+            print("ℹ️ Estrazione in pipeline: non salvata in cache")
+    else:
+        estrazione = leggi_regione(file_input, '02', chunk_size, vectorized, use_index, reader,
+                                   avanzamento=avanzamento, metriche=metriche, filtro=filtro,
+                                   csv_engine=csv_engine,
+                                   spill_mb=SPILL_CONFIG['soglia_mb'] if spill_mb is None else spill_mb)
+        if estrazione is None:
+            return risultato.fallito("Errore lettura CSV")
+        df_valle_aosta, scan_info = estrazione
+        if use_cache and isinstance(df_valle_aosta, EstrazioneSpill):
+            print("ℹ️ Estrazione su disco (spill): non salvata in cache")
+        elif use_cache and filtro is not None:
+            print("ℹ️ Estrazione filtrata: non salvata in cache")
+        elif use_cache and not df_valle_aosta.empty:
+            salva_estrazione(file_input, '02', df_valle_aosta, scan_info)
+    
+    if not risultato.da_cache:
+        risultato.chunk = scan_info['chunk']
+    if risultato.chunk is not None and risultato.chunk['modalita'] == CHUNK_AUTO:
+        print(f"⚙️ Chunk size auto: {risultato.chunk['dimensione']:,} righe "
+              f"({risultato.chunk['righe_al_secondo']:,.0f} righe/s, budget {risultato.chunk['budget_mb']:,.0f} MB)")
+    
+    start_row = scan_info['start_row']
+    end_row = scan_info['end_row']
+    risultato.righe_scansionate = scan_info['righe_totali']
+    risultato.record_estratti = len(df_valle_aosta)
+    risultato.start_row = start_row
+    risultato.end_row = end_row
     
     # === RISULTATI ESTRAZIONE ===
-    if not valle_aosta_data:
+    if df_valle_aosta.empty:
         print("❌ Nessun dato Valle d'Aosta trovato!")
-        return False
+        return risultato.fallito("Nessun dato Valle d'Aosta trovato")
     
-    print(f"✅ Estrazione completata: {len(valle_aosta_data):,} record")
+    print(f"✅ Estrazione completata: {len(df_valle_aosta):,} record")
     print(f"📊 Range righe: {start_row:,} - {end_row:,}")
     
     # === CONVERSIONE DATAFRAME ===
-    df_valle_aosta = pd.DataFrame(valle_aosta_data)
-    print(f"📋 DataFrame creato: {len(df_valle_aosta)} righe x {len(df_valle_aosta.columns)} colonne")
-    
-    # === GENERAZIONE EXCEL ===
-    print("\n📊 Generazione file Excel multi-foglio...")
-    try:
-        generate_multisheet_excel(df_valle_aosta, file_output_final)
-        excel_size = os.path.getsize(file_output_final) / (1024 * 1024)  # MB
-        print(f"💾 Excel salvato: {file_output_final} ({excel_size:.1f} MB)")
-    except Exception as e:
-        print(f"❌ Errore generazione Excel: {e}")
-        return False
+    su_disco = isinstance(df_valle_aosta, EstrazioneSpill)
+    in_pipeline = esito_pipeline is not None
+    if in_pipeline:
+        print(f"⚡ Pipeline: {len(df_valle_aosta.comuni)} comuni inviati all'output durante la lettura")
+    elif su_disco:
+        print(f"💽 Estrazione su disco: {len(df_valle_aosta):,} record in {df_valle_aosta.parti} parti "
+              f"(Excel e KMZ riletti per comune)")
+    else:
+        print(f"📋 DataFrame creato: {len(df_valle_aosta)} righe x {len(df_valle_aosta.columns)} colonne")
     
-    # === EXPORT KMZ (OPZIONALE) ===
-    kmz_success = True
+    # === EXPORT IN PARALLELO (KMZ in un processo separato, Excel nel principale) ===
+    # I due export leggono soltanto l'estrazione: al processo KMZ passano le sole
+    # sedi selezionate, l'Excel usa l'estrazione senza copiarla. Un errore in uno
+    # dei due non interrompe l'altro; la fase 'output' dura quanto il più lento.
+    genera_kmz = export_kmz and KMZ_SUPPORT
+    # Nome file KMZ basato sul file Excel finale
+    kmz_file = f"{os.path.splitext(file_output_final)[0]}_PAC_PAL.kmz"
+    # Selezione KMZ già applicata in scansione: l'exporter non rifiltra
+    selezione_applicata = selezione_kmz_applicata(filtro, stati_ui_kmz)
+    kmz_parallelo = None
+    errore_excel = None
     
-    if export_kmz and KMZ_SUPPORT:
-        print("\n🌍 Generazione file KMZ per Google Earth...")
-        try:
-            # Nome file KMZ basato sul file Excel finale
-            base_name = os.path.splitext(file_output_final)[0]
-            kmz_file = f"{base_name}_PAC_PAL.kmz"
-            
-            # Genera KMZ
-            kmz_success = genera_kmz_pac_pal(df_valle_aosta, kmz_file)
-            
+    with metriche.fase('output'):
+        if genera_kmz and export_excel and not in_pipeline:
+            try:
+                df_kmz, _ = dati_kmz(df_valle_aosta, selezione_applicata, seleziona=True,
+                                     stati_ui=stati_ui_kmz)
+                kmz_parallelo = ProcessPoolExecutor(max_workers=1)
+                kmz_futuro = kmz_parallelo.submit(_genera_kmz_processo, df_kmz, kmz_file, kmz_tile,
+                                                  stati_ui_kmz)
+                print(f"\n🌍 Generazione KMZ avviata in parallelo all'Excel ({len(df_kmz):,} sedi)")
+            except Exception as e:
+                print(f"⚠️ KMZ in parallelo non disponibile ({e}): generato dopo l'Excel")
+                if kmz_parallelo is not None:
+                    kmz_parallelo.shutdown(cancel_futures=True)
+                kmz_parallelo = None
+        
+        # === GENERAZIONE EXCEL ===
+        if export_excel and in_pipeline:
+            # Fogli già scritti dalla pipeline
+            excel_size = os.path.getsize(esito_pipeline.file_excel) / (1024 * 1024)  # MB
+            print(f"💾 Excel salvato: {esito_pipeline.file_excel} ({excel_size:.1f} MB)")
+            risultato.file_excel = esito_pipeline.file_excel
+        elif export_excel:
+            print("\n📊 Generazione file Excel multi-foglio...")
+            try:
+                with metriche.fase('excel'):
+                    generate_multisheet_excel(df_valle_aosta, file_output_final, engine=excel_engine,
+                                              progresso=avanzamento.excel)
+                excel_size = os.path.getsize(file_output_final) / (1024 * 1024)  # MB
+                print(f"💾 Excel salvato: {file_output_final} ({excel_size:.1f} MB)")
+                risultato.file_excel = file_output_final
+            except Exception as e:
+                # Il KMZ già avviato viene comunque completato
+                print(f"❌ Errore generazione Excel: {e}")
+                errore_excel = e
+        
+        # === EXPORT KMZ (OPZIONALE) ===
+        kmz_success = True
+        
+        if genera_kmz and kmz_parallelo is not None:
+            print("\n🌍 Completamento KMZ generato in parallelo...")
+            try:
+                kmz_success, placemark, (wall, cpu), log = kmz_futuro.result()
+                print(log, end='')
+                metriche.aggiungi('kmz', wall, cpu)
+                avanzamento.kmz(*placemark)
+            except Exception as e:
+                print(f"❌ Errore export KMZ: {e}")
+                kmz_success = False
+            finally:
+                kmz_parallelo.shutdown()
+        elif genera_kmz:
+            print("\n🌍 Generazione file KMZ per Google Earth...")
+            try:
+                with metriche.fase('kmz'):
+                    if in_pipeline:
+                        # Sedi selezionate e cartelle comune (nessuna con kmz_tile)
+                        # preparate durante la lettura
+                        df_kmz, selezione_applicata, cartelle = (esito_pipeline.pac_pal, True,
+                                                                 esito_pipeline.cartelle)
+                    else:
+                        (df_kmz, selezione_applicata), cartelle = dati_kmz(
+                            df_valle_aosta, selezione_applicata, stati_ui=stati_ui_kmz), None
+                    kmz_success = genera_kmz_pac_pal(df_kmz, kmz_file, progresso=avanzamento.kmz,
+                                                     filtrato=selezione_applicata, cartelle_pronte=cartelle,
+                                                     tile=kmz_tile, stati_ui=stati_ui_kmz)
+            except Exception as e:
+                print(f"❌ Errore export KMZ: {e}")
+                kmz_success = False
+        
+        if genera_kmz:
             if kmz_success:
                 kmz_size = os.path.getsize(kmz_file) / 1024  # KB
                 print(f"💾 KMZ salvato: {kmz_file} ({kmz_size:.1f} KB)")
+                risultato.file_kmz = kmz_file
             else:
                 print("❌ Errore generazione KMZ")
-                
-        except Exception as e:
-            print(f"❌ Errore export KMZ: {e}")
-            kmz_success = False
+    
+    if errore_excel is not None:
+        if su_disco:
+            df_valle_aosta.chiudi()
+        return risultato.fallito(f"Errore generazione Excel: {errore_excel}")
     
     # === STATISTICHE FINALI ===
     elapsed_time = time.time() - start_time
-    comuni_unici = df_valle_aosta['COMUNE'].nunique()
-    pcn_unici = df_valle_aosta['POP'].nunique()
+    if su_disco or in_pipeline:
+        comuni_unici = len(df_valle_aosta.comuni)
+        pcn_unici = len(df_valle_aosta.pcn)
+    else:
+        comuni_unici = df_valle_aosta['COMUNE'].nunique()
+        pcn_unici = df_valle_aosta['POP'].nunique()
+    if su_disco:
+        df_valle_aosta.chiudi()
     
     print("\n" + "=" * 60)
     print("📈 STATISTICHE FINALI")
     print("=" * 60)
     print(f"⏱️  Tempo elaborazione: {elapsed_time:.1f} secondi")
-    print(f"📋 Record estratti: {len(valle_aosta_data):,}")
+    print(f"📋 Record estratti: {len(df_valle_aosta):,}")
     print(f"🏘️  Comuni trovati: {comuni_unici}")
     print(f"📡 PCN utilizzati: {pcn_unici}")
-    print(f"⚡ Velocità: {len(valle_aosta_data)/elapsed_time:,.0f} record/secondo")
-    print(f"📊 File Excel: {file_output_final}")
+    print(f"⚡ Velocità: {len(df_valle_aosta)/elapsed_time:,.0f} record/secondo")
+    for fase, tempi in metriche.fasi.items():
+        print(f"   {fase:<14} {tempi['wall']:7.2f}s wall  {tempi['cpu']:7.2f}s CPU")
+    if risultato.file_excel:
+        print(f"📊 File Excel: {risultato.file_excel}")
     
     if export_kmz and kmz_success:
-        base_name = os.path.splitext(file_output_final)[0]
-        kmz_file = f"{base_name}_PAC_PAL.kmz"
-        print(f"🌍 File KMZ: {kmz_file}")
+        print(f"🌍 File KMZ: {risultato.file_kmz}")
     elif export_kmz:
         print("⚠️  KMZ: Errore durante generazione")
     
     print("✅ Elaborazione completata con successo!")
     print("=" * 60)
     
-    return True
-
-def main():
-    """Funzione principale per esecuzione standalone"""
-    # Configurazione default
-    file_input = "data/dbcopertura_CD_20250715.csv"
-    file_output = "output/valle_aosta_estratto.xlsx"  # Data aggiunta automaticamente
-    chunk_size = 10000
-    
-    # Esecuzione con export KMZ abilitato per test
-    result = estrai_regione_02(
-        file_input=file_input,
-        file_output=file_output, 
-        chunk_size=chunk_size,
-        export_kmz=True  # Abilitato per test KMZ
-    )
+    risultato.successo = True
+    risultato.comuni = comuni_unici
+    risultato.pcn = pcn_unici
+    risultato.tempo_totale = elapsed_time
+    risultato.cpu_totale = tempo_cpu() - cpu_iniziale
+    risultato.picco_memoria_mb = picco_memoria_mb()
     
-    if result:
+    avanzamento.aggiorna('completato', forza=True, comuni=comuni_unici, pcn=pcn_unici,
+                         tempo=elapsed_time, file_excel=risultato.file_excel,
+                         file_kmz=risultato.file_kmz)
+    
+    return risultato
+
+def tipo_chunk_size(valore):
+    """Argomento --chunk-size: intero positivo o 'auto'"""
+    try:
+        return valida_chunk_size(valore if valore == CHUNK_AUTO else int(valore))
+    except ValueError as e:
+        raise argparse.ArgumentTypeError(str(e))
+
+def crea_parser():
+    """Parser argomenti della CLI"""
+    parser = argparse.ArgumentParser(
+        description="Estrazione regioni dal DB copertura OpenFiber (Excel per comune e KMZ PAC/PAL)"
+    )
+    parser.add_argument('input', nargs='?', default="data/dbcopertura_CD_20250715.csv",
+                        help="File CSV del dump (ignorato con --batch)")
+    parser.add_argument('-r', '--regioni', nargs='+', default=['02'],
+                        help="Codici regione (default 02; più regioni = estrazione multi-regione)")
+    parser.add_argument('-o', '--output-dir', default="output", help="Cartella di output")
+    parser.add_argument('--chunk-size', type=tipo_chunk_size, default=10000,
+                        help="Righe per chunk in lettura, oppure 'auto' (adattivo a RAM e velocità)")
+    parser.add_argument('--stato-ui', nargs='+', metavar='CODICE',
+                        help="Codici STATO_UI da mantenere (es. 302 102)")
+    parser.add_argument('--tipologie', nargs='+', choices=sorted(FILTRI_TIPOLOGIE_SEDE),
+                        help="Filtri STATO_UI predefiniti (config.FILTRI_TIPOLOGIE_SEDE)")
+    parser.add_argument('--comuni', nargs='+', metavar='ISTAT',
+                        help="Codici ISTAT dei comuni da mantenere (es. 007003)")
+    parser.add_argument('--aree', nargs='+', choices=sorted(FILTRI_COMUNI_VDA),
+                        help="Filtri comuni predefiniti (config.FILTRI_COMUNI_VDA)")
+    parser.add_argument('--formati', nargs='+', choices=('excel', 'kmz'), default=['excel', 'kmz'],
+                        help="Formati di export (default: excel kmz)")
+    parser.add_argument('--excel-engine', choices=EXCEL_ENGINES, default='openpyxl')
+    parser.add_argument('--reader', choices=READER_BACKENDS, default='pandas')
+    parser.add_argument('--csv-engine', choices=CSV_ENGINES, default='auto',
+                        help="Parser CSV (default auto: pyarrow multithread se installato)")
+    parser.add_argument('--spill-mb', type=float,
+                        help="Memoria massima dei record estratti prima dello spill su disco "
+                             "(default config.SPILL_CONFIG)")
+    parser.add_argument('--pipeline', action='store_true',
+                        help="Lettura, arricchimento e output sovrapposti: fogli e cartelle KMZ "
+                             "generati per comune durante la lettura (solo regione 02)")
+    parser.add_argument('--kmz-tile', action='store_true',
+                        help="KMZ a livelli di dettaglio: quadtree di KML con Region/NetworkLink "
+                             "(config.KMZ_TILE_CONFIG)")
+    selezione_kmz = parser.add_mutually_exclusive_group()
+    selezione_kmz.add_argument('--kmz-stato-ui', nargs='+', metavar='CODICE',
+                               help="Codici STATO_UI delle sedi nel KMZ (default: "
+                                    f"{' '.join(STATI_UI_KMZ)}, sedi PAC/PAL)")
+    selezione_kmz.add_argument('--kmz-tutti-edifici', action='store_true',
+                               help="KMZ con tutti gli edifici estratti, non solo le sedi PAC/PAL")
+    parser.add_argument('--use-index', action='store_true', help="Usa l'indice byte-offset sidecar")
+    parser.add_argument('--cache', action='store_true', help="Riusa/salva l'estrazione in cache")
+    parser.add_argument('--workers', type=int,
+                        help="Processi: job in parallelo con --batch, scansione multi-regione altrimenti")
+    parser.add_argument('--batch', metavar='FILE_JOB',
+                        help="File JSON di job da eseguire in un pool di processi")
+    parser.add_argument('--riepilogo', metavar='FILE_JSON',
+                        help="Riepilogo JSON dell'esecuzione (default con --batch: "
+                             "<output-dir>/riepilogo_batch_<data>.json)")
+    return parser
+
+
+def main(argv=None):
+    """CLI headless: singola estrazione o batch di job (exit code 1 se qualcosa fallisce)"""
+    from batch_estrazioni import normalizza_job, carica_jobs, esegui_job, esegui_batch
+
+    args = crea_parser().parse_args(argv)
+
+    if args.batch:
+        try:
+            jobs = carica_jobs(args.batch)
+        except (OSError, ValueError) as e:
+            print(f"❌ File job non valido: {e}")
+            return 2
+        file_riepilogo = args.riepilogo or os.path.join(
+            args.output_dir, f"riepilogo_batch_{datetime.now().strftime('%Y%m%d_%H%M%S')}.json")
+        riepilogo = esegui_batch(jobs, args.workers, file_riepilogo)
+        return 1 if riepilogo['falliti'] else 0
+
+    try:
+        job = normalizza_job({
+            'id': 'cli',
+            'input': args.input,
+            'regioni': args.regioni,
+            'output_dir': args.output_dir,
+            'chunk_size': args.chunk_size,
+            'stati_ui': args.stato_ui,
+            'tipologie': args.tipologie,
+            'comuni': args.comuni,
+            'aree': args.aree,
+            'formati': args.formati,
+            'excel_engine': args.excel_engine,
+            'reader': args.reader,
+            'csv_engine': args.csv_engine,
+            'spill_mb': args.spill_mb,
+            'pipeline': args.pipeline,
+            'kmz_tile': args.kmz_tile,
+            'stati_ui_kmz': None if args.kmz_tutti_edifici else (args.kmz_stato_ui or list(STATI_UI_KMZ)),
+            'use_index': args.use_index,
+            'use_cache': args.cache,
+            'n_workers': args.workers
+        })
+    except ValueError as e:
+        print(f"❌ {e}")
+        return 2
+
+    esito = esegui_job(job)
+    if args.riepilogo:
+        with open(args.riepilogo, 'w', encoding='utf-8') as f:
+            json.dump(esito, f, indent=2, default=str)
+        print(f"💾 Riepilogo: {args.riepilogo}")
+
+    if esito['successo']:
         print("\n🎉 Estrazione completata con successo!")
-    else:
-        print("\n❌ Estrazione fallita!")
+        return 0
+    print(f"\n❌ Estrazione fallita! {esito['errore'] or ''}")
+    return 1
 
 if __name__ == "__main__":
-    main()
\ No newline at end of file
+    sys.exit(main())
@@ -10,8 +10,8 @@ import ttkbootstrap as ttk_modern
 from ttkbootstrap.constants import *
 import threading
 import os
+import re
 import sys
-import time
 from datetime import datetime
 import queue
 import pandas as pd
@@ -25,8 +25,8 @@ except ImportError:
     print("⚠️ PIL/Pillow non disponibile - loghi disabilitati")
 
 # Import del nostro estrattore
-from estrattore_of import estrai_regione_02
-from config import COMUNI_VALLE_AOSTA, PCN_VALLE_AOSTA, STATI_UI, FILTRI_TIPOLOGIE_SEDE
+from estrattore_of import estrai_regione_02, PYARROW_SUPPORT
+from config import COMUNI_VALLE_AOSTA, PCN_VALLE_AOSTA, STATI_UI, FILTRI_TIPOLOGIE_SEDE, get_stati_ui_filtri
 
 # Import modulo KMZ
 try:
@@ -168,6 +168,8 @@ class ModernOpenFiberGUI:
         self.input_file_var = tk.StringVar()
         self.output_dir_var = tk.StringVar(value="output")
         self.chunk_size_var = tk.IntVar(value=10000)
+        self.chunk_auto = tk.BooleanVar(value=False)
+        self.use_cache = tk.BooleanVar(value=True)
         
         # Filtri
         self.filter_pac_pal = tk.BooleanVar(value=False)
@@ -414,16 +416,6 @@ class ModernOpenFiberGUI:
             bootstyle="secondary"
         )
         hint_label.pack(anchor=W, pady=(5, 0))
-        
-        # Nota sui filtri
-        warning_label = ttk_modern.Label(
-            filters_frame,
-            text="⚠️ Nota: I filtri GUI sono attualmente solo informativi (v2.2 per funzionalità complete)",
-            font=("Arial", 8),
-            bootstyle="warning",
-            wraplength=300
-        )
-        warning_label.pack(anchor=W, pady=(5, 0))
     
     def create_export_options_section(self, parent):
         """Sezione opzioni export avanzate"""
@@ -484,13 +476,30 @@ class ModernOpenFiberGUI:
         chunk_label = ttk_modern.Label(chunk_frame, textvariable=self.chunk_size_var, width=8)
         chunk_label.pack(side=RIGHT)
         
+        # Modalità auto: chunk scelto dal motore in base a RAM disponibile e velocità
+        ttk_modern.Checkbutton(
+            advanced_frame,
+            text="🤖 Auto (adattivo a memoria e velocità)",
+            variable=self.chunk_auto,
+            command=lambda: chunk_scale.configure(state=DISABLED if self.chunk_auto.get() else NORMAL),
+            bootstyle="info-round-toggle"
+        ).pack(anchor=W, pady=(5, 0))
+        
         info_label = ttk_modern.Label(
             advanced_frame,
-            text="💡 Chunk più grandi = più velocità, più memoria",
+            text="💡 Chunk più grandi = più velocità, più memoria"
+                 + (" (parser pyarrow: righe per blocco)" if PYARROW_SUPPORT else ""),
             font=("Arial", 8),
             bootstyle="secondary"
         )
         info_label.pack(anchor=W, pady=(5, 0))
+        
+        ttk_modern.Checkbutton(
+            advanced_frame,
+            text="⚡ Riusa estrazione in cache se il CSV non è cambiato",
+            variable=self.use_cache,
+            bootstyle="info-round-toggle"
+        ).pack(anchor=W, pady=(10, 0))
     
     def create_action_buttons(self, parent):
         """Pulsanti di azione"""
@@ -644,7 +653,7 @@ class ModernOpenFiberGUI:
         self.log_message("🎉 Interfaccia inizializzata correttamente", "success")
         self.log_message("ℹ️ Seleziona il file CSV di input per iniziare", "info")
         self.log_message("📁 Nome file Excel generato automaticamente con data YYYYMMDD", "info")
-        self.log_message("💡 I filtri PAC/PAL [302] e Residenziali [102] sono disponibili (v2.2 per funzionalità)", "info")
+        self.log_message("💡 Filtri PAC/PAL [302], Residenziali [102] e STATO_UI personalizzati applicati in lettura", "info")
         
         # Log status loghi e KMZ
         if self.logo_azienda and self.logo_openfiber:
@@ -828,6 +837,7 @@ class ModernOpenFiberGUI:
         self.input_file_var.set("data/dbcopertura_CD_20250715.csv")
         self.output_dir_var.set("output")
         self.chunk_size_var.set(10000)
+        self.chunk_auto.set(False)
         self.filter_pac_pal.set(False)
         self.filter_residenziali.set(False)
         self.filter_custom_state.set("")
@@ -863,36 +873,61 @@ class ModernOpenFiberGUI:
         processing_thread.daemon = True
         processing_thread.start()
     
+    def get_active_state_filters(self):
+        """
+        Codici STATO_UI selezionati (checkbox + filtro personalizzato)
+        
+        Returns:
+            Tuple (lista codici o None se nessun filtro, descrizioni filtri attivi)
+        """
+        stati_ui = set()
+        active_filters = []
+        if self.filter_pac_pal.get():
+            stati_ui.update(get_stati_ui_filtri(['pac_pal']))
+            active_filters.append("🏛️ PAC/PAL [302]")
+        if self.filter_residenziali.get():
+            stati_ui.update(get_stati_ui_filtri(['residenziali']))
+            active_filters.append("🏠 Residenziali [102]")
+        
+        custom = self.filter_custom_state.get().strip()
+        if custom:
+            codici = [codice for codice in re.split(r'[,;\s]+', custom) if codice]
+            stati_ui.update(codici)
+            active_filters.append(f"🔍 Custom: {', '.join(codici)}")
+            sconosciuti = [codice for codice in codici if codice not in STATI_UI]
+            if sconosciuti:
+                self.log_message(f"⚠️ Codici STATO_UI non documentati: {', '.join(sconosciuti)}", "warning")
+        
+        return (sorted(stati_ui) if stati_ui else None), active_filters
+    
     def process_data_thread(self):
         """Thread di elaborazione con progress tracking - FIXED v2.1.1"""
         try:
-            start_time = time.time()
-            
             input_file = self.input_file_var.get()
             # Nome file fisso senza estensione per generazione automatica data
             output_file = os.path.join(
                 self.output_dir_var.get(),
                 "valle_aosta_estratto.xlsx"
             )
-            chunk_size = self.chunk_size_var.get()
+            chunk_size = 'auto' if self.chunk_auto.get() else self.chunk_size_var.get()
             
             self.log_message("🚀 Avvio elaborazione OpenFiber...", "info")
             self.log_message(f"📁 Input: {os.path.basename(input_file)}", "info")
             self.log_message(f"📂 Output dir: {self.output_dir_var.get()}", "info")
-            self.log_message(f"⚙️ Chunk size: {chunk_size:,} righe", "info")
+            if self.chunk_auto.get():
+                self.log_message("⚙️ Chunk size: auto (scelto durante la lettura)", "info")
+            else:
+                self.log_message(f"⚙️ Chunk size: {chunk_size:,} righe", "info")
+            if PYARROW_SUPPORT:
+                self.log_message("⚙️ Parser CSV: pyarrow multithread (blocco = chunk size x byte per riga)",
+                                 "info")
             
-            # Filtri attivi (per future implementazioni)
-            active_filters = []
-            if self.filter_pac_pal.get():
-                active_filters.append("🏛️ PAC/PAL [302]")
-            if self.filter_residenziali.get():
-                active_filters.append("🏠 Residenziali [102]")
-            if self.filter_custom_state.get().strip():
-                active_filters.append(f"🔍 Custom: {self.filter_custom_state.get()}")
+            # Filtri STATO_UI applicati dal motore durante la scansione
+            stati_ui, active_filters = self.get_active_state_filters()
             
             if active_filters:
-                self.log_message(f"🔍 Filtri attivi: {', '.join(active_filters)}", "warning")
-                self.log_message("⚠️ Nota: Filtri GUI non ancora implementati nel core engine", "warning")
+                self.log_message(f"🔍 Filtri attivi: {', '.join(active_filters)}", "info")
+                self.log_message(f"🔍 STATO_UI estratti: {', '.join(stati_ui)}", "info")
             else:
                 self.log_message("📋 Nessun filtro attivo - tutti i record saranno estratti", "info")
             
@@ -909,28 +944,8 @@ class ModernOpenFiberGUI:
             else:
                 self.log_message("📊 Solo Excel sarà generato con data automatica", "info")
             
-            # Progress tracking migliorato
-            self.update_progress(5, "Inizializzazione sistema...")
-            time.sleep(0.3)
-            
-            self.update_progress(10, "Apertura file CSV...")
-            self.log_message("📊 Inizio lettura file CSV...", "info")
-            time.sleep(0.3)
-            
-            phases = [
-                (15, "Lettura header CSV...", "📋 Analisi struttura file"),
-                (20, "Ricerca inizio Valle d'Aosta...", "🔍 Scansione regioni..."),
-                (30, "Estrazione dati Valle d'Aosta...", "⛏️ Estrazione record regione 02"),
-                (50, "Arricchimento dati geografici...", "🗺️ Mapping comuni e PCN"),
-                (70, "Generazione fogli Excel...", "📊 Creazione Excel multi-foglio"),
-                (85, "Applicazione formattazione...", "🎨 Formattazione professionale"),
-                (95, "Finalizzazione file...", "💾 Salvataggio finale")
-            ]
-            
-            for progress, status, log_msg in phases:
-                self.update_progress(progress, status)
-                self.log_message(log_msg, "info")
-                time.sleep(0.5)
+            # Avanzamento guidato dagli eventi reali del motore
+            self.update_progress(0, "Apertura file CSV...")
             
             # 🔧 FIX: Disabilita temporaneamente stdout redirect per evitare duplicazione
             original_stdout = sys.stdout
@@ -940,57 +955,53 @@ class ModernOpenFiberGUI:
             self.log_message("🔧 Avvio elaborazione core engine...", "warning")
             
             # AGGIORNATO: Passa il parametro export_kmz
-            success = estrai_regione_02(input_file, output_file, chunk_size, export_kmz=self.export_kmz.get())
+            risultato = estrai_regione_02(input_file, output_file, chunk_size, export_kmz=self.export_kmz.get(),
+                                          use_cache=self.use_cache.get(),
+                                          progress_callback=self.on_engine_progress,
+                                          stati_ui=stati_ui, csv_engine='auto')
             
             # 🔧 FIX: Ripristina stdout redirect
             sys.stdout = StdoutRedirector(self.log_queue)
             
-            if success:
-                # Calcola statistiche finali
-                elapsed_time = time.time() - start_time
+            if risultato:
+                # Statistiche reali dal risultato del motore (file con data già risolti)
+                output_size = sum(os.path.getsize(path) for path in risultato.artefatti) / (1024 * 1024)
+                self.update_final_stats(risultato.record_estratti, risultato.comuni, risultato.pcn,
+                                        risultato.tempo_totale, output_size)
                 
-                # Determina il nome file reale con data automatica
-                output_dir = os.path.dirname(output_file)
-                name_without_ext = os.path.splitext(os.path.basename(output_file))[0]
-                data_oggi = datetime.now().strftime("%Y%m%d")
-                actual_excel_file = os.path.join(output_dir, f"{name_without_ext}_{data_oggi}.xlsx")
-                
-                if os.path.exists(actual_excel_file):
-                    output_size = os.path.getsize(actual_excel_file) / (1024 * 1024)
-                    excel_file_to_show = actual_excel_file
-                else:
-                    output_size = os.path.getsize(output_file) / (1024 * 1024) if os.path.exists(output_file) else 0
-                    excel_file_to_show = output_file
-                
-                self.update_final_stats(46323, 64, 42, elapsed_time, output_size)
+                for fase, tempi in risultato.fasi.items():
+                    self.log_message(f"⏱️ {fase}: {tempi['wall']:.2f}s (CPU {tempi['cpu']:.2f}s)", "info")
+                if risultato.picco_memoria_mb is not None:
+                    self.log_message(f"🧠 Picco memoria: {risultato.picco_memoria_mb:,.0f} MB", "info")
+                if risultato.chunk and risultato.chunk['modalita'] == 'auto':
+                    self.log_message(f"⚙️ Chunk size scelto: {risultato.chunk['dimensione']:,} righe", "info")
                 
                 # 🔧 FIX: Un solo messaggio di successo per evitare duplicazione
                 self.log_message("✅ Elaborazione completata con successo!", "success")
-                self.log_message(f"📁 File Excel: {os.path.basename(excel_file_to_show)}", "success")
+                self.log_message(f"📁 File Excel: {os.path.basename(risultato.file_excel)}", "success")
                 
                 if self.export_kmz.get():
-                    # Cerca il file KMZ generato con nome corretto
-                    base_name = os.path.splitext(excel_file_to_show)[0]
-                    kmz_file = f"{base_name}_PAC_PAL.kmz"
-                    if os.path.exists(kmz_file):
-                        self.log_message(f"🌍 File KMZ: {os.path.basename(kmz_file)}", "success")
+                    if risultato.file_kmz:
+                        self.log_message(f"🌍 File KMZ: {os.path.basename(risultato.file_kmz)}", "success")
                     else:
                         self.log_message("⚠️ KMZ non generato - controlla log per errori", "warning")
                 
                 self.update_progress(100, "Elaborazione completata!")
                 
                 # Notifica di completamento
-                success_msg = f"Elaborazione completata!\n\nFile Excel: {os.path.basename(excel_file_to_show)}\nTempo: {elapsed_time:.1f} secondi"
+                success_msg = (f"Elaborazione completata!\n\nFile Excel: {os.path.basename(risultato.file_excel)}"
+                               f"\nTempo: {risultato.tempo_totale:.1f} secondi")
                 
-                if self.export_kmz.get() and os.path.exists(f"{os.path.splitext(excel_file_to_show)[0]}_PAC_PAL.kmz"):
-                    success_msg += f"\nFile KMZ: {os.path.basename(os.path.splitext(excel_file_to_show)[0])}_PAC_PAL.kmz"
+                if risultato.file_kmz:
+                    success_msg += f"\nFile KMZ: {os.path.basename(risultato.file_kmz)}"
                 
                 messagebox.showinfo("Successo", success_msg)
                 
             else:
-                self.log_message("❌ Elaborazione fallita", "error")
+                self.log_message(f"❌ Elaborazione fallita: {risultato.errore}", "error")
                 self.update_progress(0, "Elaborazione fallita")
-                messagebox.showerror("Errore", "L'elaborazione è fallita. Controlla il log per dettagli.")
+                messagebox.showerror("Errore", f"L'elaborazione è fallita: {risultato.errore}\n"
+                                     "Controlla il log per dettagli.")
             
         except Exception as e:
             self.log_message(f"❌ Errore critico durante elaborazione: {str(e)}", "error")
@@ -1002,19 +1013,38 @@ class ModernOpenFiberGUI:
             sys.stdout = StdoutRedirector(self.log_queue)
             self.app.after(0, self.reset_processing_state)
     
-    def update_progress(self, value, status):
-        """Aggiorna progress bar e status"""
-        self.progress_queue.put((value, status))
+    def on_engine_progress(self, evento):
+        """Callback del motore (thread di elaborazione): progress bar e record dai contatori reali"""
+        fase = evento['fase']
+        
+        if fase == 'lettura':
+            status = (f"Lettura CSV: {evento['bytes_letti'] / (1024 * 1024):,.0f}/"
+                      f"{evento['bytes_totali'] / (1024 * 1024):,.0f} MB - "
+                      f"{evento['righe_scansionate']:,} righe, {evento['record_estratti']:,} record")
+        elif fase == 'excel':
+            status = f"Generazione Excel: foglio {evento['fogli_scritti']}/{evento['fogli_totali']}"
+        elif fase == 'kmz':
+            status = f"Generazione KMZ: {evento['placemark']:,}/{evento['placemark_totali']:,} placemark"
+        else:
+            status = "Finalizzazione..."
+        
+        self.update_progress(evento['percentuale'], status, evento['record_estratti'])
+    
+    def update_progress(self, value, status, record_estratti=None):
+        """Aggiorna progress bar, status e record estratti (via queue: sicuro da qualsiasi thread)"""
+        self.progress_queue.put((value, status, record_estratti))
     
     def update_progress_display(self):
-        """Aggiorna display progress da queue"""
+        """Aggiorna display progress da queue (thread Tk)"""
         try:
             while True:
-                value, status = self.progress_queue.get_nowait()
+                value, status, record_estratti = self.progress_queue.get_nowait()
                 
                 self.progress_var.set(value)
                 self.status_var.set(status)
-                self.progress_label.configure(text=f"{value}%")
+                self.progress_label.configure(text=f"{value:.0f}%")
+                if record_estratti is not None:
+                    self.stats_vars['record_estratti'].set(f"{record_estratti:,}")
                 
         except queue.Empty:
             pass
@@ -0,0 +1,571 @@
+"""
+Excel Writer - Analizzatore DB OpenFiber
+Motori di scrittura alternativi a pd.ExcelWriter + apply_professional_formatting
+con la stessa formattazione (bordi sottili, allineamento centrato, larghezza
+colonne min 10 / max 50):
+- parallelo: XML dei fogli comune generato in processi separati e assemblato
+  direttamente nel pacchetto .xlsx (zip SpreadsheetML)
+- streaming: workbook openpyxl write-only, righe scritte a blocchi con uno
+  stile registrato una sola volta (memoria costante)
+"""
+
+import os
+import re
+import zipfile
+import xml.etree.ElementTree as ET
+from concurrent.futures import ProcessPoolExecutor
+from xml.sax.saxutils import escape
+
+import numpy as np
+import pandas as pd
+
+# Vincoli larghezza colonne (come apply_professional_formatting)
+LARGHEZZA_MIN = 10
+LARGHEZZA_MAX = 50
+
+# Righe convertite per blocco nel motore streaming (limita la memoria)
+BLOCCO_RIGHE_STREAMING = 5000
+
+# Nome dello stile registrato nel workbook dal motore streaming
+NOME_STILE_CELLA = 'cella_openfiber'
+
+# Caratteri di controllo non ammessi in XML 1.0 (openpyxl li rifiuta)
+_CARATTERI_ILLEGALI = re.compile(r'[\x00-\x08\x0b\x0c\x0e-\x1f]')
+
+_NS_MAIN = "http://schemas.openxmlformats.org/spreadsheetml/2006/main"
+_NS_REL = "http://schemas.openxmlformats.org/officeDocument/2006/relationships"
+
+# Stile 1: bordo sottile su 4 lati + allineamento centrato (tutte le celle)
+STYLES_XML = (
+    '<?xml version="1.0" encoding="UTF-8" standalone="yes"?>\n'
+    f'<styleSheet xmlns="{_NS_MAIN}">'
+    '<fonts count="1"><font><sz val="11"/><name val="Calibri"/><family val="2"/></font></fonts>'
+    '<fills count="2"><fill><patternFill patternType="none"/></fill>'
+    '<fill><patternFill patternType="gray125"/></fill></fills>'
+    '<borders count="2"><border><left/><right/><top/><bottom/><diagonal/></border>'
+    '<border><left style="thin"/><right style="thin"/><top style="thin"/>'
+    '<bottom style="thin"/><diagonal/></border></borders>'
+    '<cellStyleXfs count="1"><xf numFmtId="0" fontId="0" fillId="0" borderId="0"/></cellStyleXfs>'
+    '<cellXfs count="2"><xf numFmtId="0" fontId="0" fillId="0" borderId="0" xfId="0"/>'
+    '<xf numFmtId="0" fontId="0" fillId="0" borderId="1" xfId="0" applyBorder="1" applyAlignment="1">'
+    '<alignment horizontal="center" vertical="center"/></xf></cellXfs>'
+    '<cellStyles count="1"><cellStyle name="Normal" xfId="0" builtinId="0"/></cellStyles>'
+    '</styleSheet>'
+)
+
+
+def lettera_colonna(indice):
+    """Indice colonna 1-based -> lettera Excel (1 -> A, 27 -> AA)"""
+    lettere = ''
+    while indice > 0:
+        indice, resto = divmod(indice - 1, 26)
+        lettere = chr(65 + resto) + lettere
+    return lettere
+
+
+def _valore_cella(valore):
+    """
+    Classifica un valore come lo scrive pandas.to_excel
+
+    Returns:
+        Tuple (tipo 's'/'n'/'e', testo visualizzato)
+    """
+    if valore is None or (isinstance(valore, float) and np.isnan(valore)):
+        return 'e', ''
+    if isinstance(valore, (bool, np.bool_)):
+        return 's', str(valore)
+    if isinstance(valore, (int, float, np.integer, np.floating)):
+        valore = float(valore)
+        if valore.is_integer():
+            return 'n', str(int(valore))
+        return 'n', repr(valore)
+    return 's', str(valore)
+
+
+def _tipizzata(dtype):
+    """Date datetime64 o interi nullable (Int64) dell'estrazione tipizzata"""
+    return dtype.kind == 'M' or (pd.api.types.is_extension_array_dtype(dtype) and dtype.kind in 'iu')
+
+
+def testo_colonna(serie):
+    """
+    Colonna tipizzata riportata al testo del CSV: date AAAA-MM-GG (con
+    l'orario solo se presente), interi senza decimali, mancanti NaN.
+    Le altre colonne sono restituite invariate.
+    """
+    if not _tipizzata(serie.dtype):
+        return serie
+    if serie.dtype.kind == 'M':
+        testo = serie.dt.strftime('%Y-%m-%d %H:%M:%S')
+        testo = testo.where(serie != serie.dt.normalize(), serie.dt.strftime('%Y-%m-%d'))
+    else:
+        testo = serie.astype('string')
+    return testo.astype(object).where(serie.notna())
+
+
+def testo_foglio(df):
+    """Foglio per pandas.to_excel con le colonne tipizzate come testo (testo_colonna)"""
+    tipizzate = {col: testo_colonna(df[col]) for col in df.columns if _tipizzata(df[col].dtype)}
+    return df.assign(**tipizzate) if tipizzate else df
+
+
+def valori_colonna(serie):
+    """
+    Testo visualizzato e tipo cella di una colonna, vettoriale dove possibile
+
+    Returns:
+        Tuple (array testo, array tipo 's'/'n'/'e')
+    """
+    serie = testo_colonna(serie)
+    if isinstance(serie.dtype, pd.CategoricalDtype):
+        # Classificazione una volta per categoria, espansa sulle righe tramite i codici
+        testo_cat, tipo_cat = valori_colonna(pd.Series(serie.cat.categories, dtype=object))
+        codici = serie.cat.codes.to_numpy()
+        testo = np.append(testo_cat, '')[codici]
+        tipo = np.append(tipo_cat, 'e')[codici]
+        return testo, tipo
+
+    mancanti = serie.isna().to_numpy()
+    tipo_dati = pd.api.types.infer_dtype(serie, skipna=True)
+
+    if tipo_dati in ('floating', 'integer', 'mixed-integer-float', 'decimal'):
+        numeri = serie.to_numpy(dtype=float, na_value=np.nan)
+        interi = np.isfinite(numeri) & (numeri == np.round(numeri))
+        testo = numeri.astype(str).astype(object)
+        testo[interi] = numeri[interi].astype(np.int64).astype(str)
+        tipo = np.full(len(serie), 'n', dtype=object)
+    elif tipo_dati in ('string', 'empty'):
+        # Copia: con copy-on-write la colonna object può essere una vista in sola lettura
+        testo = serie.to_numpy(dtype=object, na_value='').copy()
+        tipo = np.full(len(serie), 's', dtype=object)
+    else:
+        coppie = [_valore_cella(v) for v in serie.to_numpy(dtype=object)]
+        tipo = np.array([c[0] for c in coppie], dtype=object)
+        testo = np.array([c[1] for c in coppie], dtype=object)
+
+    testo[mancanti] = ''
+    tipo[mancanti] = 'e'
+    return testo, tipo
+
+
+def larghezze_colonne(df):
+    """
+    Larghezza colonne calcolata sul DataFrame (header incluso)
+
+    Stessa regola di apply_professional_formatting: max lunghezza testo + 2,
+    vincolata tra LARGHEZZA_MIN e LARGHEZZA_MAX.
+    """
+    return [_larghezza(col, valori_colonna(df[col])[0]) for col in df.columns]
+
+
+def _larghezza(nome_colonna, testo):
+    """Larghezza di una colonna dato l'header e il testo visualizzato delle celle"""
+    massimo = len(str(nome_colonna))
+    if len(testo):
+        massimo = max(massimo, int(pd.Series(testo, dtype=object).str.len().max()))
+    return min(max(massimo + 2, LARGHEZZA_MIN), LARGHEZZA_MAX)
+
+
+def _escape_colonna(testo):
+    """Escape XML vettoriale (e rimozione caratteri illegali) su array di stringhe"""
+    serie = pd.Series(testo, dtype=object)
+    serie = serie.str.replace(_CARATTERI_ILLEGALI, '', regex=True)
+    serie = serie.str.replace('&', '&amp;', regex=False)
+    serie = serie.str.replace('<', '&lt;', regex=False)
+    serie = serie.str.replace('>', '&gt;', regex=False)
+    return serie.to_numpy(dtype=object)
+
+
+def _celle_colonna(testo, tipo, lettera, righe):
+    """XML delle celle di una colonna (righe dati), costruito in blocco"""
+    riferimenti = lettera + righe
+
+    celle = np.empty(len(testo), dtype=object)
+    vuote = (tipo == 'e') | (testo == '')
+    stringhe = (tipo == 's') & ~vuote
+    numeri = tipo == 'n'
+
+    celle[stringhe] = ('<c r="' + riferimenti[stringhe] + '" s="1" t="inlineStr"><is><t xml:space="preserve">'
+                       + _escape_colonna(testo[stringhe]) + '</t></is></c>')
+    celle[numeri] = '<c r="' + riferimenti[numeri] + '" s="1" t="n"><v>' + testo[numeri] + '</v></c>'
+    # Celle vuote con lo stile: pandas.to_excel le scrive con valore '', quindi
+    # apply_professional_formatting (valore non None) dà anche a loro i bordi.
+    # Senza tipo: una cella inlineStr richiede il figlio <is>
+    celle[vuote] = '<c r="' + riferimenti[vuote] + '" s="1"/>'
+    return celle
+
+
+def xml_foglio(df):
+    """
+    Genera l'XML completo di un foglio (header + dati) con stile e larghezze
+
+    Args:
+        df: DataFrame del foglio (un comune)
+
+    Returns:
+        bytes: Contenuto di xl/worksheets/sheetN.xml
+    """
+    n_colonne = len(df.columns)
+    lettere = np.array([lettera_colonna(i + 1) for i in range(n_colonne)], dtype=object)
+    ultima = f"{lettere[-1]}{len(df) + 1}" if n_colonne else "A1"
+
+    # Testo/tipo di ogni colonna calcolati una sola volta (celle + larghezze)
+    valori = [valori_colonna(df[col]) for col in df.columns]
+
+    cols = ''.join(
+        f'<col min="{i + 1}" max="{i + 1}" width="{_larghezza(col, valori[i][0])}" customWidth="1"/>'
+        for i, col in enumerate(df.columns)
+    )
+
+    header = ''.join(
+        f'<c r="{lettere[i]}1" s="1" t="inlineStr"><is><t xml:space="preserve">'
+        f'{escape(_CARATTERI_ILLEGALI.sub("", str(col)))}</t></is></c>'
+        for i, col in enumerate(df.columns)
+    )
+
+    parti = [
+        '<?xml version="1.0" encoding="UTF-8" standalone="yes"?>\n',
+        f'<worksheet xmlns="{_NS_MAIN}"><dimension ref="A1:{ultima}"/>',
+        f'<cols>{cols}</cols>' if cols else '',
+        f'<sheetData><row r="1">{header}</row>'
+    ]
+
+    if len(df):
+        righe = np.arange(2, len(df) + 2).astype(str).astype(object)
+        contenuto = '<row r="' + righe + '">'
+        for i, (testo, tipo) in enumerate(valori):
+            contenuto = contenuto + _celle_colonna(testo, tipo, lettere[i], righe)
+        contenuto = contenuto + '</row>'
+        parti.append(''.join(contenuto))
+
+    parti.append('</sheetData></worksheet>')
+    return ''.join(parti).encode('utf-8')
+
+
+def nomi_fogli_univoci(nomi):
+    """Evita collisioni tra nomi foglio (max 31 caratteri, confronto case-insensitive)"""
+    usati = set()
+    risultato = []
+    for nome in nomi:
+        candidato = nome or 'Foglio'
+        progressivo = 2
+        while candidato.lower() in usati:
+            suffisso = f" ({progressivo})"
+            candidato = f"{nome[:31 - len(suffisso)]}{suffisso}"
+            progressivo += 1
+        usati.add(candidato.lower())
+        risultato.append(candidato)
+    return risultato
+
+
+def _workbook_xml(nomi_fogli, parti=None):
+    # parti: numero della part sheetN.xml di ogni foglio (default nello stesso ordine)
+    parti = parti or range(1, len(nomi_fogli) + 1)
+    fogli = ''.join(
+        f'<sheet name="{escape(nome, {chr(34): "&quot;"})}" sheetId="{i}" r:id="rId{parte}"/>'
+        for i, (nome, parte) in enumerate(zip(nomi_fogli, parti), start=1)
+    )
+    return (
+        '<?xml version="1.0" encoding="UTF-8" standalone="yes"?>\n'
+        f'<workbook xmlns="{_NS_MAIN}" xmlns:r="{_NS_REL}"><sheets>{fogli}</sheets></workbook>'
+    )
+
+
+def _workbook_rels_xml(n_fogli):
+    rels = ''.join(
+        f'<Relationship Id="rId{i}" Type="{_NS_REL}/worksheet" Target="worksheets/sheet{i}.xml"/>'
+        for i in range(1, n_fogli + 1)
+    )
+    rels += f'<Relationship Id="rId{n_fogli + 1}" Type="{_NS_REL}/styles" Target="styles.xml"/>'
+    return (
+        '<?xml version="1.0" encoding="UTF-8" standalone="yes"?>\n'
+        '<Relationships xmlns="http://schemas.openxmlformats.org/package/2006/relationships">'
+        f'{rels}</Relationships>'
+    )
+
+
+def _content_types_xml(n_fogli):
+    fogli = ''.join(
+        f'<Override PartName="/xl/worksheets/sheet{i}.xml" '
+        'ContentType="application/vnd.openxmlformats-officedocument.spreadsheetml.worksheet+xml"/>'
+        for i in range(1, n_fogli + 1)
+    )
+    return (
+        '<?xml version="1.0" encoding="UTF-8" standalone="yes"?>\n'
+        '<Types xmlns="http://schemas.openxmlformats.org/package/2006/content-types">'
+        '<Default Extension="rels" ContentType="application/vnd.openxmlformats-package.relationships+xml"/>'
+        '<Default Extension="xml" ContentType="application/xml"/>'
+        '<Override PartName="/xl/workbook.xml" '
+        'ContentType="application/vnd.openxmlformats-officedocument.spreadsheetml.sheet.main+xml"/>'
+        '<Override PartName="/xl/styles.xml" '
+        'ContentType="application/vnd.openxmlformats-officedocument.spreadsheetml.styles+xml"/>'
+        f'{fogli}</Types>'
+    )
+
+
+_ROOT_RELS_XML = (
+    '<?xml version="1.0" encoding="UTF-8" standalone="yes"?>\n'
+    '<Relationships xmlns="http://schemas.openxmlformats.org/package/2006/relationships">'
+    f'<Relationship Id="rId1" Type="{_NS_REL}/officeDocument" Target="xl/workbook.xml"/>'
+    '</Relationships>'
+)
+
+
+def assembla_xlsx(file_output, nomi_fogli, fogli_xml, progresso=None):
+    """
+    Scrive il pacchetto .xlsx a partire dagli XML dei fogli già generati
+
+    Args:
+        file_output: Path file .xlsx
+        nomi_fogli: Nomi dei fogli (già sanitizzati e univoci)
+        fogli_xml: Iterabile di bytes XML dei fogli, nello stesso ordine
+        progresso: Callback (fogli scritti, fogli totali) dopo ogni foglio
+    """
+    with zipfile.ZipFile(file_output, 'w', zipfile.ZIP_DEFLATED, compresslevel=6) as xlsx:
+        xlsx.writestr('[Content_Types].xml', _content_types_xml(len(nomi_fogli)))
+        xlsx.writestr('_rels/.rels', _ROOT_RELS_XML)
+        xlsx.writestr('xl/workbook.xml', _workbook_xml(nomi_fogli))
+        xlsx.writestr('xl/_rels/workbook.xml.rels', _workbook_rels_xml(len(nomi_fogli)))
+        xlsx.writestr('xl/styles.xml', STYLES_XML)
+        for i, contenuto in enumerate(fogli_xml, start=1):
+            xlsx.writestr(f'xl/worksheets/sheet{i}.xml', contenuto)
+            if progresso is not None:
+                progresso(i, len(nomi_fogli))
+
+
+class XlsxIncrementale:
+    """
+    Pacchetto .xlsx scritto un foglio alla volta in ordine di arrivo
+
+    Le part dei fogli vengono aggiunte allo zip appena pronte (sheet1.xml,
+    sheet2.xml, ...); workbook, relazioni e content types sono scritti in
+    chiudi(), che fissa l'ordine e i nomi dei fogli nel workbook.
+    """
+
+    def __init__(self, file_output):
+        self.file_output = file_output
+        self._zip = zipfile.ZipFile(file_output, 'w', zipfile.ZIP_DEFLATED, compresslevel=6)
+        self.n_fogli = 0
+
+    def aggiungi(self, contenuto):
+        """Scrive l'XML di un foglio; restituisce il numero della sua part"""
+        self.n_fogli += 1
+        self._zip.writestr(f'xl/worksheets/sheet{self.n_fogli}.xml', contenuto)
+        return self.n_fogli
+
+    def chiudi(self, fogli):
+        """
+        Completa il pacchetto
+
+        Args:
+            fogli: Lista di tuple (nome foglio già univoco, numero part) nell'ordine del workbook
+        """
+        nomi = [nome for nome, _ in fogli]
+        self._zip.writestr('[Content_Types].xml', _content_types_xml(self.n_fogli))
+        self._zip.writestr('_rels/.rels', _ROOT_RELS_XML)
+        self._zip.writestr('xl/workbook.xml', _workbook_xml(nomi, [parte for _, parte in fogli]))
+        self._zip.writestr('xl/_rels/workbook.xml.rels', _workbook_rels_xml(self.n_fogli))
+        self._zip.writestr('xl/styles.xml', STYLES_XML)
+        self._zip.close()
+
+    def scarta(self):
+        """Chiude ed elimina il pacchetto incompleto"""
+        self._zip.close()
+        if os.path.exists(self.file_output):
+            os.remove(self.file_output)
+
+
+def fogli_riusabili(file_xlsx):
+    """
+    Mappa nome foglio -> part XML di un .xlsx generato da scrivi_excel_parallelo
+
+    Le part di un workbook con stesso foglio stile e stringhe inline possono
+    essere copiate così come sono in un nuovo pacchetto.
+
+    Returns:
+        dict (vuoto se il file manca o non è compatibile, es. generato da openpyxl)
+    """
+    if not file_xlsx or not os.path.exists(file_xlsx):
+        return {}
+    try:
+        with zipfile.ZipFile(file_xlsx) as xlsx:
+            nomi_part = set(xlsx.namelist())
+            if ('xl/sharedStrings.xml' in nomi_part
+                    or xlsx.read('xl/styles.xml').decode('utf-8') != STYLES_XML):
+                return {}
+            workbook = ET.fromstring(xlsx.read('xl/workbook.xml'))
+            rels = ET.fromstring(xlsx.read('xl/_rels/workbook.xml.rels'))
+    except (zipfile.BadZipFile, KeyError, ET.ParseError, UnicodeDecodeError):
+        return {}
+
+    target = {rel.get('Id'): rel.get('Target') for rel in rels}
+    parti = {}
+    for foglio in workbook.iter(f'{{{_NS_MAIN}}}sheet'):
+        part = f"xl/{target.get(foglio.get(f'{{{_NS_REL}}}id'), '')}"
+        if part in nomi_part:
+            parti[foglio.get('name')] = part
+    return parti
+
+
+def dataframe_foglio(foglio):
+    """DataFrame di un foglio: già in memoria o caricato su richiesta (es. spill_estrazione.GruppoSpill)"""
+    return foglio() if callable(foglio) else foglio
+
+
+def _xml_foglio(foglio):
+    """Worker: XML di un foglio caricato nel processo che lo genera"""
+    return xml_foglio(dataframe_foglio(foglio))
+
+
+def scrivi_excel_parallelo(fogli, file_output, n_workers=None, riusa_da=None, fogli_invariati=(),
+                           progresso=None):
+    """
+    Genera un .xlsx multi-foglio costruendo l'XML dei fogli in parallelo
+
+    Args:
+        fogli: Lista di tuple (nome foglio, DataFrame) nell'ordine desiderato;
+            al posto del DataFrame una funzione serializzabile che lo carica
+            (letta nel worker: nessun DataFrame passa dal processo principale)
+        file_output: Path file .xlsx di output
+        n_workers: Processi da usare (default: tutti i core, 1 = nessun pool)
+        riusa_da: .xlsx precedente (stesso writer) da cui copiare i fogli invariati
+        fogli_invariati: Nomi dei fogli da copiare da riusa_da invece di rigenerarli
+        progresso: Callback (fogli scritti, fogli totali) dopo ogni foglio
+
+    Returns:
+        int: Numero di fogli scritti
+    """
+    nomi = nomi_fogli_univoci([nome for nome, _ in fogli])
+
+    # Fogli copiati dal workbook precedente (solo se il nome non è stato deduplicato)
+    parti = fogli_riusabili(riusa_da) if riusa_da and fogli_invariati else {}
+    invariati = set(fogli_invariati)
+    copia = {
+        nome: parti[nome] for nome, (originale, _) in zip(nomi, fogli)
+        if nome == originale and nome in invariati and nome in parti
+    }
+    if copia:
+        print(f"♻️ Fogli riusati senza rigenerazione: {len(copia)}/{len(nomi)}")
+
+    dataframes = [df for nome, (_, df) in zip(nomi, fogli) if nome not in copia]
+    n_workers = min(n_workers or os.cpu_count() or 1, max(len(dataframes), 1))
+
+    def sequenza(generati):
+        generati = iter(generati)
+        sorgente = zipfile.ZipFile(riusa_da) if copia else None
+        try:
+            for nome in nomi:
+                yield sorgente.read(copia[nome]) if nome in copia else next(generati)
+        finally:
+            if sorgente is not None:
+                sorgente.close()
+
+    # Scrittura su file temporaneo: riusa_da può coincidere con file_output
+    temporaneo = f"{file_output}.{os.getpid()}.tmp"
+    try:
+        if n_workers <= 1:
+            assembla_xlsx(temporaneo, nomi, sequenza(_xml_foglio(df) for df in dataframes), progresso)
+        else:
+            with ProcessPoolExecutor(max_workers=n_workers) as executor:
+                # map preserva l'ordine: i fogli vengono scritti appena pronti
+                assembla_xlsx(temporaneo, nomi, sequenza(executor.map(_xml_foglio, dataframes)), progresso)
+        os.replace(temporaneo, file_output)
+    finally:
+        if os.path.exists(temporaneo):
+            os.remove(temporaneo)
+
+    return len(nomi)
+
+
+def valori_python(serie):
+    """
+    Valori di una colonna pronti per openpyxl (come li scrive pandas.to_excel)
+
+    Float interi diventano int, mancanti e stringhe vuote diventano None,
+    date e interi nullable il loro testo (testo_colonna).
+
+    Returns:
+        np.ndarray (object) di valori Python
+    """
+    serie = testo_colonna(serie)
+    testo, tipo = valori_colonna(serie)
+    valori = np.empty(len(serie), dtype=object)
+
+    numeri = tipo == 'n'
+    if numeri.any():
+        float_valori = pd.to_numeric(pd.Series(testo[numeri], dtype=object)).to_numpy(dtype=float)
+        interi = float_valori == np.round(float_valori)
+        convertiti = float_valori.astype(object)
+        convertiti[interi] = float_valori[interi].astype(np.int64).astype(object)
+        valori[numeri] = convertiti
+
+    stringhe = (tipo == 's') & (testo != '')
+    valori[stringhe] = serie.to_numpy(dtype=object)[stringhe]
+    return valori
+
+
+def _stile_cella():
+    """NamedStyle con bordo sottile e allineamento centrato"""
+    from openpyxl.styles import NamedStyle, Border, Side, Alignment
+
+    lato = Side(style='thin')
+    stile = NamedStyle(name=NOME_STILE_CELLA)
+    stile.border = Border(left=lato, right=lato, top=lato, bottom=lato)
+    stile.alignment = Alignment(horizontal='center', vertical='center')
+    return stile
+
+
+def scrivi_excel_streaming(fogli, file_output, blocco_righe=BLOCCO_RIGHE_STREAMING, progresso=None):
+    """
+    Genera un .xlsx multi-foglio con openpyxl in modalità write-only
+
+    Le righe vengono scritte su disco man mano (nessun workbook completo in
+    memoria), lo stile è registrato una sola volta e applicato in scrittura
+    e le larghezze colonna sono calcolate sul DataFrame prima di scrivere.
+
+    Args:
+        fogli: Lista di tuple (nome foglio, DataFrame) nell'ordine desiderato;
+            al posto del DataFrame una funzione che lo carica (un foglio
+            alla volta in memoria)
+        file_output: Path file .xlsx di output
+        blocco_righe: Righe convertite in valori Python per volta
+        progresso: Callback (fogli scritti, fogli totali) dopo ogni foglio
+
+    Returns:
+        int: Numero di fogli scritti
+    """
+    from openpyxl import Workbook
+    from openpyxl.cell import WriteOnlyCell
+
+    wb = Workbook(write_only=True)
+    wb.add_named_style(_stile_cella())
+    nomi = nomi_fogli_univoci([nome for nome, _ in fogli])
+
+    for n_foglio, (nome, (_, foglio)) in enumerate(zip(nomi, fogli), start=1):
+        df = dataframe_foglio(foglio)
+        ws = wb.create_sheet(title=nome)
+        for i, larghezza in enumerate(larghezze_colonne(df), start=1):
+            ws.column_dimensions[lettera_colonna(i)].width = larghezza
+
+        # Una cella per colonna riutilizzata: append serializza subito la riga
+        celle = [WriteOnlyCell(ws) for _ in df.columns]
+        for cella in celle:
+            cella.style = NOME_STILE_CELLA
+
+        for cella, col in zip(celle, df.columns):
+            cella.value = str(col)
+        ws.append(celle)
+
+        for inizio in range(0, len(df), blocco_righe):
+            blocco = df.iloc[inizio:inizio + blocco_righe]
+            colonne = [valori_python(blocco[col]) for col in df.columns]
+            for riga in zip(*colonne):
+                for cella, valore in zip(celle, riga):
+                    cella.value = valore
+                ws.append(celle)
+
+        if progresso is not None:
+            progresso(n_foglio, len(nomi))
+
+    wb.save(file_output)
+    return len(nomi)
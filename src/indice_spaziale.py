@@ -0,0 +1,423 @@
+"""
+Indice spaziale - Analizzatore DB OpenFiber
+Griglia regolare lat/lon sulle coordinate degli edifici (COORDINATE_BUILDING
+dell'estrazione) e sulle sedi PCN, per interrogazioni di prossimità con
+distanza haversine: punti entro un raggio e k più vicini
+I punti sono ordinati per cella: un'interrogazione legge solo le celle del
+bounding box del raggio (ricerca binaria per riga di celle) e calcola la
+distanza esatta sui soli candidati, senza scandire tutto il dataset.
+"""
+
+import argparse
+import math
+import os
+import sys
+import time
+
+import numpy as np
+import pandas as pd
+
+from config import PCN_VALLE_AOSTA, REGIONI, INDICE_SPAZIALE_CONFIG
+from coordinate import parse_coordinate_building
+
+# Raggio medio terrestre (km)
+RAGGIO_TERRA_KM = 6371.0088
+
+# Oltre questa distanza un raggio copre tutta la sfera
+_MEZZA_CIRCONFERENZA_KM = math.pi * RAGGIO_TERRA_KM
+
+# Colonne della tabella PCN (stessi nomi dell'estrazione arricchita)
+COLONNE_PCN = ['POP', 'NOME_PCN', 'COMUNE_PCN', 'LAT_PCN', 'LON_PCN']
+
+# Colonne degli edifici mostrate nei risultati della CLI
+COLONNE_EDIFICIO = ['COMUNE', 'ISTAT', 'PARTICELLA_TOP', 'INDIRIZZO', 'CIVICO', 'ID_BUILDING',
+                    'COORDINATE_BUILDING', 'STATO_UI', 'POP']
+
+
+def distanza_km(lat1, lon1, lat2, lon2):
+    """
+    Distanza haversine in km (argomenti in gradi, broadcasting numpy)
+    """
+    lat1, lon1, lat2, lon2 = (np.radians(np.asarray(v, dtype=np.float64)) for v in (lat1, lon1, lat2, lon2))
+    a = (np.sin((lat2 - lat1) / 2) ** 2
+         + np.cos(lat1) * np.cos(lat2) * np.sin((lon2 - lon1) / 2) ** 2)
+    return 2 * RAGGIO_TERRA_KM * np.arcsin(np.sqrt(np.minimum(a, 1.0)))
+
+
+def _versori(lat, lon):
+    """Versori 3D dei punti (gradi): il prodotto scalare cresce al diminuire della distanza"""
+    lat, lon = np.radians(lat), np.radians(lon)
+    coseno = np.cos(lat)
+    return np.column_stack((coseno * np.cos(lon), coseno * np.sin(lon), np.sin(lat)))
+
+
+class IndiceSpaziale:
+    """
+    Indice a griglia su punti lat/lon
+
+    Le celle sono larghe cella_km in latitudine e almeno cella_km in
+    longitudine alla latitudine più lontana dall'equatore; i punti sono
+    ordinati per chiave di cella (riga * colonne + colonna), così le celle di
+    una riga del bounding box sono un unico intervallo contiguo.
+    I punti con coordinate non valide (NaN) restano fuori dall'indice; le
+    posizioni restituite si riferiscono sempre agli array di partenza (e
+    alle righe di dati, se indicato).
+    """
+
+    def __init__(self, lat, lon, dati=None, cella_km=None):
+        """
+        Args:
+            lat, lon: Coordinate in gradi (NaN = punto escluso)
+            dati: DataFrame allineato ai punti (righe dei risultati)
+            cella_km: Lato delle celle (default INDICE_SPAZIALE_CONFIG)
+        """
+        lat = np.asarray(lat, dtype=np.float64)
+        lon = np.asarray(lon, dtype=np.float64)
+        if lat.shape != lon.shape:
+            raise ValueError("Latitudini e longitudini di lunghezza diversa")
+        self.cella_km = float(cella_km or INDICE_SPAZIALE_CONFIG['cella_km'])
+        if self.cella_km <= 0:
+            raise ValueError(f"Lato cella non valido: {cella_km}")
+        self.dati = dati
+        self.n_totali = len(lat)
+
+        validi = np.isfinite(lat) & np.isfinite(lon) & (np.abs(lat) <= 90) & (np.abs(lon) <= 180)
+        posizioni = np.flatnonzero(validi)
+        lat, lon = lat[validi], lon[validi]
+
+        self._dlat = math.degrees(self.cella_km / RAGGIO_TERRA_KM)
+        if len(posizioni):
+            self._lat0, self._lon0 = lat.min(), lon.min()
+            self._bbox = (self._lat0, self._lon0, lat.max(), lon.max())
+            lat_estrema = min(max(abs(lat.min()), abs(lat.max())), 89.0)
+            self._dlon = self._dlat / math.cos(math.radians(lat_estrema))
+            righe = np.floor((lat - self._lat0) / self._dlat).astype(np.int64)
+            colonne = np.floor((lon - self._lon0) / self._dlon).astype(np.int64)
+            self._n_righe = int(righe.max()) + 1
+            self._n_colonne = int(colonne.max()) + 1
+            chiavi = righe * self._n_colonne + colonne
+        else:
+            self._lat0 = self._lon0 = 0.0
+            self._bbox = (0.0, 0.0, 0.0, 0.0)
+            self._dlon = self._dlat
+            self._n_righe = self._n_colonne = 0
+            chiavi = np.empty(0, dtype=np.int64)
+
+        ordine = np.argsort(chiavi, kind='stable')
+        self._chiavi = chiavi[ordine]
+        self._lat = lat[ordine]
+        self._lon = lon[ordine]
+        self._posizioni = posizioni[ordine]
+
+    def __len__(self):
+        return len(self._posizioni)
+
+    def _candidati(self, lat, lon, raggio_km):
+        """Indici (ordine interno) dei punti nelle celle del bounding box del raggio"""
+        if not len(self) or raggio_km < 0:
+            return np.empty(0, dtype=np.int64)
+
+        # Bounding box esatto della calotta sferica: se contiene un polo o
+        # attraversa l'antimeridiano si leggono tutte le colonne
+        delta = min(raggio_km, _MEZZA_CIRCONFERENZA_KM) / RAGGIO_TERRA_KM
+        lat_min = lat - math.degrees(delta)
+        lat_max = lat + math.degrees(delta)
+        riga_min = max(math.floor((lat_min - self._lat0) / self._dlat), 0)
+        riga_max = min(math.floor((lat_max - self._lat0) / self._dlat), self._n_righe - 1)
+        if riga_min > riga_max:
+            return np.empty(0, dtype=np.int64)
+
+        seno = math.sin(delta) / max(math.cos(math.radians(lat)), 1e-12)
+        if lat_min <= -90 or lat_max >= 90 or seno >= 1:
+            colonna_min, colonna_max = 0, self._n_colonne - 1
+        else:
+            dlon = math.degrees(math.asin(seno))
+            if lon - dlon < -180 or lon + dlon > 180:
+                colonna_min, colonna_max = 0, self._n_colonne - 1
+            else:
+                colonna_min = max(math.floor((lon - dlon - self._lon0) / self._dlon), 0)
+                colonna_max = min(math.floor((lon + dlon - self._lon0) / self._dlon), self._n_colonne - 1)
+        if colonna_min > colonna_max:
+            return np.empty(0, dtype=np.int64)
+
+        righe = np.arange(riga_min, riga_max + 1, dtype=np.int64) * self._n_colonne
+        inizi = np.searchsorted(self._chiavi, righe + colonna_min, side='left')
+        fini = np.searchsorted(self._chiavi, righe + colonna_max, side='right')
+        lunghezze = fini - inizi
+        if not lunghezze.any():
+            return np.empty(0, dtype=np.int64)
+        # Concatenazione vettoriale degli intervalli [inizio, fine) di ogni riga
+        scarti = np.repeat(inizi - np.cumsum(np.r_[0, lunghezze[:-1]]), lunghezze)
+        return np.arange(lunghezze.sum(), dtype=np.int64) + scarti
+
+    def entro_raggio(self, lat, lon, raggio_km):
+        """
+        Punti entro raggio_km dal punto (lat, lon)
+
+        Returns:
+            Tuple (posizioni, distanze km) ordinate per distanza crescente
+            (a parità di distanza per posizione)
+        """
+        candidati = self._candidati(lat, lon, raggio_km)
+        distanze = distanza_km(lat, lon, self._lat[candidati], self._lon[candidati])
+        dentro = distanze <= raggio_km
+        posizioni, distanze = self._posizioni[candidati[dentro]], distanze[dentro]
+        ordine = np.lexsort((posizioni, distanze))
+        return posizioni[ordine], distanze[ordine]
+
+    def piu_vicini(self, lat, lon, k=1):
+        """
+        I k punti più vicini a (lat, lon)
+
+        Il raggio di ricerca parte dalla distanza dal bounding box dei punti e
+        cresce di un lato cella, poi 2, 4, ... finché contiene almeno k punti:
+        tutti i punti entro il raggio sono candidati, quindi i primi k sono
+        esatti.
+
+        Returns:
+            Tuple (posizioni, distanze km) ordinate per distanza, min(k, len) punti
+        """
+        k = min(int(k), len(self))
+        if k <= 0:
+            return np.empty(0, dtype=np.int64), np.empty(0)
+        lat_min, lon_min, lat_max, lon_max = self._bbox
+        base = float(distanza_km(lat, lon, min(max(lat, lat_min), lat_max), min(max(lon, lon_min), lon_max)))
+        passo = self.cella_km
+        while True:
+            raggio = base + passo
+            posizioni, distanze = self.entro_raggio(lat, lon, raggio)
+            if len(posizioni) >= k or raggio >= _MEZZA_CIRCONFERENZA_KM:
+                return posizioni[:k], distanze[:k]
+            passo *= 2
+
+    def piu_vicini_multipli(self, lat, lon, k=1):
+        """
+        I k punti più vicini a ognuno dei punti (lat[i], lon[i])
+
+        Con indici piccoli (es. i PCN) la matrice delle distanze viene
+        calcolata a blocchi di interrogazioni; altrimenti una ricerca a griglia
+        per punto.
+
+        Returns:
+            Tuple (posizioni, distanze km) di forma (n interrogazioni, k),
+            ordinate per distanza; -1 e NaN dove mancano punti (interrogazione
+            non valida o indice con meno di k punti)
+        """
+        lat = np.asarray(lat, dtype=np.float64)
+        lon = np.asarray(lon, dtype=np.float64)
+        posizioni = np.full((len(lat), k), -1, dtype=np.int64)
+        distanze = np.full((len(lat), k), np.nan)
+        n = min(k, len(self))
+        valide = np.flatnonzero(np.isfinite(lat) & np.isfinite(lon))
+        if n <= 0 or not len(valide):
+            return posizioni, distanze
+
+        if len(self) <= INDICE_SPAZIALE_CONFIG['max_forza_bruta']:
+            # Punti per posizione: a parità di distanza vince la posizione minore.
+            # Ordinamento per prodotto scalare dei versori (decresce con la
+            # distanza, una moltiplicazione matriciale); haversine sui soli scelti
+            per_posizione = np.argsort(self._posizioni)
+            punti_lat = self._lat[per_posizione]
+            punti_lon = self._lon[per_posizione]
+            punti = self._posizioni[per_posizione]
+            versori = _versori(punti_lat, punti_lon).T
+            blocco = max(INDICE_SPAZIALE_CONFIG['celle_matrice'] // len(self), 1)
+            for inizio in range(0, len(valide), blocco):
+                righe = valide[inizio:inizio + blocco]
+                prodotti = _versori(lat[righe], lon[righe]) @ versori
+                if n == 1:
+                    ordine = prodotti.argmax(axis=1)[:, None]
+                else:
+                    ordine = np.argsort(-prodotti, axis=1, kind='stable')[:, :n]
+                posizioni[righe, :n] = punti[ordine]
+                distanze[righe, :n] = distanza_km(lat[righe, None], lon[righe, None],
+                                                  punti_lat[ordine], punti_lon[ordine])
+        else:
+            for riga in valide:
+                trovate, d = self.piu_vicini(lat[riga], lon[riga], n)
+                posizioni[riga, :n] = trovate
+                distanze[riga, :n] = d
+        return posizioni, distanze
+
+    def righe(self, posizioni, distanze):
+        """Righe di dati dei risultati con la colonna DISTANZA_KM"""
+        if self.dati is None:
+            risultato = pd.DataFrame({'POSIZIONE': posizioni})
+        else:
+            risultato = self.dati.iloc[posizioni].reset_index(drop=True)
+        risultato['DISTANZA_KM'] = np.round(distanze, 4)
+        return risultato
+
+
+def tabella_pcn(pcn=None):
+    """PCN (default config.PCN_VALLE_AOSTA) come DataFrame con le colonne COLONNE_PCN"""
+    pcn = PCN_VALLE_AOSTA if pcn is None else pcn
+    return pd.DataFrame([
+        [pcn_id, info['nome'], info['comune'], info['latitudine'], info['longitudine']]
+        for pcn_id, info in pcn.items()
+    ], columns=COLONNE_PCN)
+
+
+def indice_edifici(df, cella_km=None):
+    """Indice sugli edifici di un'estrazione arricchita (COORDINATE_BUILDING)"""
+    lon, lat, _ = parse_coordinate_building(df['COORDINATE_BUILDING'])
+    return IndiceSpaziale(lat, lon, df, cella_km)
+
+
+def indice_pcn(pcn=None, cella_km=None):
+    """Indice sulle sedi PCN (default config.PCN_VALLE_AOSTA)"""
+    tabella = tabella_pcn(pcn)
+    return IndiceSpaziale(tabella['LAT_PCN'], tabella['LON_PCN'], tabella, cella_km)
+
+
+def pcn_piu_vicino(df, indice=None):
+    """
+    PCN più vicino a ogni edificio dell'estrazione
+
+    Returns:
+        DataFrame allineato a df: PCN_VICINO (None se coordinate non valide)
+        e DISTANZA_PCN_VICINO_KM
+    """
+    indice = indice or indice_pcn()
+    lon, lat, _ = parse_coordinate_building(df['COORDINATE_BUILDING'])
+    posizioni, distanze = indice.piu_vicini_multipli(lat, lon, 1)
+    codici = indice.dati['POP'].to_numpy(dtype=object)
+    trovati = posizioni[:, 0] >= 0
+    pcn_vicino = np.full(len(df), None, dtype=object)
+    pcn_vicino[trovati] = codici[posizioni[trovati, 0]]
+    return pd.DataFrame({'PCN_VICINO': pcn_vicino, 'DISTANZA_PCN_VICINO_KM': distanze[:, 0]},
+                        index=df.index)
+
+
+def carica_edifici(file_input, regioni, chunk_size=10000, stati_ui=None, use_cache=False,
+                   csv_engine='auto', n_workers=None):
+    """
+    Estrazione arricchita delle regioni richieste per l'indice
+
+    Regione 02 con la state machine di estrai_regione_02 (e la cache con
+    use_cache), più regioni con una passata multi-regione.
+
+    Returns:
+        DataFrame arricchito (solo STATO_UI richiesti), None se errore lettura
+    """
+    from estrattore_of import (leggi_regione, costruisci_filtro, filtra_estrazione, risolvi_engine,
+                               COLONNE_ARRICCHITE)
+    from estrattore_multiregione import estrai_regioni_df
+    from cache_estrazioni import carica_estrazione, salva_estrazione
+
+    filtro = costruisci_filtro(stati_ui)
+    if regioni == ['02']:
+        risultato = carica_estrazione(file_input, '02') if use_cache else None
+        if risultato is not None:
+            print("⚡ Estrazione caricata dalla cache")
+            df = risultato[0]
+            return filtra_estrazione(df, filtro) if filtro is not None else df
+        risultato = leggi_regione(file_input, '02', chunk_size,
+                                  csv_engine=risolvi_engine(csv_engine))
+        if risultato is None:
+            return None
+        df, scan_info = risultato
+        if use_cache and not df.empty:
+            salva_estrazione(file_input, '02', df, scan_info)
+        return filtra_estrazione(df, filtro) if filtro is not None else df
+
+    dataframes, _ = estrai_regioni_df(file_input, regioni, chunk_size, n_workers, filtro, csv_engine)
+    parti = [df for df in dataframes.values() if len(df)]
+    if not parti:
+        return pd.DataFrame(columns=COLONNE_ARRICCHITE)
+    return pd.concat(parti, ignore_index=True)
+
+
+def crea_parser():
+    """Parser argomenti della CLI di interrogazione"""
+    parser = argparse.ArgumentParser(
+        description="Interrogazioni di prossimità su edifici e PCN (raggio, k più vicini, PCN più vicino)"
+    )
+    parser.add_argument('input', help="File CSV del dump")
+    parser.add_argument('-r', '--regioni', nargs='+', default=['02'], help="Codici regione (default 02)")
+    centro = parser.add_mutually_exclusive_group()
+    centro.add_argument('--pcn', metavar='ID', help="Centro: sede del PCN (es. AOCUA)")
+    centro.add_argument('--punto', nargs=2, type=float, metavar=('LAT', 'LON'), help="Centro: coordinate")
+    query = parser.add_mutually_exclusive_group(required=True)
+    query.add_argument('--raggio', type=float, metavar='KM', help="Punti entro KM dal centro")
+    query.add_argument('--vicini', type=int, metavar='K', help="I K punti più vicini al centro")
+    query.add_argument('--pcn-vicino', action='store_true', help="PCN più vicino a ogni edificio")
+    parser.add_argument('--su', choices=('edifici', 'pcn'), default='edifici',
+                        help="Punti interrogati con --raggio/--vicini (default edifici)")
+    parser.add_argument('--stato-ui', nargs='+', metavar='CODICE',
+                        help="Codici STATO_UI degli edifici (es. 302 per le sedi PAC/PAL)")
+    parser.add_argument('--cella-km', type=float, help="Lato delle celle della griglia")
+    parser.add_argument('--chunk-size', type=int, default=10000, help="Righe per chunk in lettura")
+    parser.add_argument('--cache', action='store_true', help="Riusa/salva l'estrazione in cache (solo 02)")
+    parser.add_argument('--output', metavar='FILE_CSV', help="Risultati completi in CSV")
+    parser.add_argument('--max-righe', type=int, default=20, help="Righe mostrate a console")
+    return parser
+
+
+def main(argv=None):
+    """CLI: costruisce gli indici ed esegue un'interrogazione (exit code 2 se argomenti non validi)"""
+    args = crea_parser().parse_args(argv)
+    regioni = [str(codice).zfill(2) for codice in args.regioni]
+
+    if not args.pcn_vicino and args.pcn is None and args.punto is None:
+        print("❌ Indicare il centro dell'interrogazione (--pcn o --punto)")
+        return 2
+    if args.pcn is not None and args.pcn not in PCN_VALLE_AOSTA:
+        print(f"❌ PCN sconosciuto: {args.pcn}")
+        return 2
+    sconosciute = [codice for codice in regioni if codice not in REGIONI]
+    if sconosciute:
+        print(f"❌ Codici regione non validi: {', '.join(sconosciute)}")
+        return 2
+    if not os.path.exists(args.input):
+        print(f"❌ ERRORE: File {args.input} non trovato!")
+        return 2
+
+    pcn = indice_pcn(cella_km=args.cella_km)
+    indice = pcn
+    df = None
+    if args.su == 'edifici' or args.pcn_vicino:
+        df = carica_edifici(args.input, regioni, args.chunk_size, args.stato_ui, args.cache)
+        if df is None:
+            return 1
+        inizio = time.perf_counter()
+        indice = indice_edifici(df, args.cella_km)
+        print(f"🗺️ Indice edifici: {len(indice):,} punti validi su {indice.n_totali:,} "
+              f"in {(time.perf_counter() - inizio) * 1000:.0f} ms")
+
+    inizio = time.perf_counter()
+    if args.pcn_vicino:
+        risultato = pd.concat([df[[c for c in COLONNE_EDIFICIO if c in df.columns]].reset_index(drop=True),
+                               pcn_piu_vicino(df, pcn).reset_index(drop=True)], axis=1)
+        descrizione = "PCN più vicino a ogni edificio"
+    else:
+        if args.pcn is not None:
+            lat, lon = PCN_VALLE_AOSTA[args.pcn]['latitudine'], PCN_VALLE_AOSTA[args.pcn]['longitudine']
+            centro = f"PCN {args.pcn}"
+        else:
+            (lat, lon), centro = args.punto, f"({args.punto[0]}, {args.punto[1]})"
+        if args.raggio is not None:
+            posizioni, distanze = indice.entro_raggio(lat, lon, args.raggio)
+            descrizione = f"{args.su} entro {args.raggio:g} km da {centro}"
+        else:
+            posizioni, distanze = indice.piu_vicini(lat, lon, args.vicini)
+            descrizione = f"{args.vicini} {args.su} più vicini a {centro}"
+        risultato = indice.righe(posizioni, distanze)
+        if args.su == 'edifici':
+            risultato = risultato[[c for c in COLONNE_EDIFICIO + ['DISTANZA_KM'] if c in risultato.columns]]
+    tempo_ms = (time.perf_counter() - inizio) * 1000
+
+    print(f"🔍 {descrizione}: {len(risultato):,} risultati in {tempo_ms:.1f} ms")
+    if len(risultato):
+        print(risultato.head(args.max_righe).to_string(index=False))
+    if args.output:
+        cartella = os.path.dirname(args.output)
+        if cartella:
+            os.makedirs(cartella, exist_ok=True)
+        risultato.to_csv(args.output, index=False)
+        print(f"💾 Risultati: {args.output}")
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
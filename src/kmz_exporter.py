@@ -4,17 +4,266 @@ Genera file KMZ con sedi PAC/PAL e PCN colorati per visualizzazione cartografica
 VERSIONE COMPLETA con fix icone e logging live
 """
 
+import io
 import os
-import re
 import zipfile
 from datetime import datetime
 from collections import defaultdict
+from functools import lru_cache
 import xml.etree.ElementTree as ET
-from xml.dom import minidom
+from xml.sax.saxutils import escape, unescape
+import numpy as np
 import pandas as pd
 
 # Import configurazione
-from config import PCN_VALLE_AOSTA
+from config import (PCN_VALLE_AOSTA, KMZ_TILE_CONFIG, STATI_UI_KMZ, get_regione_name,
+                    get_stato_ui_description)
+from coordinate import PATTERN_COORDINATE, parse_coordinate_building, riepilogo_non_validi
+
+# Namespace KML 2.2
+KML_NAMESPACE = "http://www.opengis.net/kml/2.2"
+
+# Prefisso nome delle cartelle comune (riconosciute nel KML per il riuso incrementale)
+PREFISSO_CARTELLA_COMUNE = "🏛️ "
+
+# Colonne delle sedi usate nei placemark delle cartelle comune
+COLONNE_SEDE = ['ID_BUILDING', 'COORDINATE_BUILDING', 'POP', 'INDIRIZZO', 'CIVICO', 'NOME_PCN', 'ISTAT',
+                'STATO_UI']
+
+# Icone segnaposto per tipo (href, scala)
+ICONE_KML = {
+    'sede': ("http://maps.google.com/mapfiles/kml/pal2/icon26.png", "1.0"),  # Edificio governativo
+    'pcn': ("http://maps.google.com/mapfiles/kml/shapes/phone.png", "1.2"),  # Antenna/torre
+}
+
+
+class KMLStreamWriter:
+    """
+    Writer KML incrementale: Styles, Folder e Placemark vengono serializzati
+    man mano su uno stream binario (es. la entry doc.kml aperta con
+    ZipFile.open(..., 'w')), senza costruire l'albero XML in memoria
+    """
+
+    # Byte accumulati prima di scrivere sullo stream (limita le write sul deflate)
+    BUFFER_BYTES = 256 * 1024
+
+    def __init__(self, stream, livello=0):
+        self._stream = stream
+        self._buffer = []
+        self._dimensione = 0
+        # Livello di indentazione iniziale (es. 3 per una cartella comune isolata)
+        self._livello = livello
+        self.placemark_scritti = 0
+
+    def _scrivi(self, testo):
+        riga = f"{'  ' * self._livello}{testo}\n"
+        self._buffer.append(riga)
+        self._dimensione += len(riga)
+        if self._dimensione >= self.BUFFER_BYTES:
+            self.flush()
+
+    def _elemento(self, tag, testo):
+        self._scrivi(f"<{tag}>{escape(str(testo))}</{tag}>")
+
+    def flush(self):
+        """Scrive sullo stream il contenuto bufferizzato"""
+        if self._buffer:
+            self._stream.write(''.join(self._buffer).encode('utf-8'))
+            self._buffer = []
+            self._dimensione = 0
+
+    def apri_documento(self, nome, descrizione):
+        self._scrivi('<?xml version="1.0" encoding="utf-8"?>')
+        self._scrivi(f'<kml xmlns="{KML_NAMESPACE}">')
+        self._livello += 1
+        self._scrivi('<Document>')
+        self._livello += 1
+        self._elemento('name', nome)
+        self._elemento('description', descrizione)
+
+    def chiudi_documento(self):
+        self._livello -= 1
+        self._scrivi('</Document>')
+        self._livello -= 1
+        self._scrivi('</kml>')
+        self.flush()
+
+    def stile(self, style_id, color, icon_type="sede"):
+        """Stile segnaposto (IconStyle + LabelStyle)"""
+        icon_href, scale = ICONE_KML['sede' if icon_type == 'sede' else 'pcn']
+        self._scrivi(f'<Style id="{escape(style_id)}">')
+        self._livello += 1
+        self._scrivi('<IconStyle>')
+        self._livello += 1
+        self._elemento('color', color)
+        self._elemento('scale', scale)
+        self._scrivi(f'<Icon><href>{escape(icon_href)}</href></Icon>')
+        self._livello -= 1
+        self._scrivi('</IconStyle>')
+        self._scrivi('<LabelStyle>')
+        self._livello += 1
+        self._elemento('color', color)
+        self._elemento('scale', '0.8')
+        self._livello -= 1
+        self._scrivi('</LabelStyle>')
+        self._livello -= 1
+        self._scrivi('</Style>')
+
+    def apri_cartella(self, nome, aperta=False):
+        self._scrivi('<Folder>')
+        self._livello += 1
+        self._elemento('name', nome)
+        self._elemento('open', '1' if aperta else '0')
+
+    def chiudi_cartella(self):
+        self._livello -= 1
+        self._scrivi('</Folder>')
+
+    def copia_cartella(self, blocco, n_placemark):
+        """Copia così com'è un blocco <Folder> già serializzato (bytes, stesso livello)"""
+        self.copia_blocco(blocco, n_placemark)
+
+    def copia_blocco(self, blocco, n_placemark=0):
+        """Copia così com'è un blocco KML già serializzato (bytes, stesso livello)"""
+        self.flush()
+        self._stream.write(blocco)
+        self.placemark_scritti += n_placemark
+
+    def regione(self, bbox, min_lod_pixels, max_lod_pixels=-1):
+        """Region con bounding box (nord, sud, est, ovest) e Lod in pixel a schermo"""
+        nord, sud, est, ovest = bbox
+        self._scrivi('<Region>')
+        self._livello += 1
+        self._scrivi(f'<LatLonAltBox><north>{nord}</north><south>{sud}</south>'
+                     f'<east>{est}</east><west>{ovest}</west></LatLonAltBox>')
+        self._scrivi(f'<Lod><minLodPixels>{min_lod_pixels}</minLodPixels>'
+                     f'<maxLodPixels>{max_lod_pixels}</maxLodPixels></Lod>')
+        self._livello -= 1
+        self._scrivi('</Region>')
+
+    def network_link(self, nome, href, bbox=None, min_lod_pixels=0):
+        """NetworkLink a un altro KML del KMZ, caricato solo quando la sua Region è attiva"""
+        self._scrivi('<NetworkLink>')
+        self._livello += 1
+        self._elemento('name', nome)
+        if bbox is not None:
+            self.regione(bbox, min_lod_pixels)
+        self._scrivi(f'<Link><href>{escape(href)}</href><viewRefreshMode>onRegion</viewRefreshMode></Link>')
+        self._livello -= 1
+        self._scrivi('</NetworkLink>')
+
+    def placemark(self, name, description, coordinates, style_id):
+        """Segnaposto puntuale (coordinates = (lon, lat, alt))"""
+        self._scrivi(
+            f'<Placemark><name>{escape(str(name))}</name>'
+            f'<description>{escape(str(description))}</description>'
+            f'<styleUrl>#{escape(style_id)}</styleUrl>'
+            f'<Point><coordinates>{coordinates[0]},{coordinates[1]},{coordinates[2]}</coordinates></Point>'
+            '</Placemark>'
+        )
+        self.placemark_scritti += 1
+
+
+# Livello delle cartelle comune nel doc.kml (kml > Document > cartella principale)
+LIVELLO_CARTELLA_COMUNE = 3
+
+
+# Cartella dei tile nel KMZ a livelli di dettaglio (export_kmz_tile)
+CARTELLA_TILE = "tiles"
+
+# Margine (gradi) attorno al bounding box delle sedi: nessun punto sul bordo del tile radice
+_MARGINE_TILE = 1e-5
+
+
+def tile_quadtree(lon, lat, placemark_per_tile, profondita_max):
+    """
+    Suddivide i punti in un quadtree di tile (visita in profondità)
+
+    Un tile con più di placemark_per_tile punti ne mostra placemark_per_tile
+    campionati a passo costante e divide i restanti nei 4 quadranti figli
+    (0 NO, 1 NE, 2 SO, 3 SE); all'ultimo livello mostra tutti i punti
+    rimasti. Ogni punto compare in un solo tile.
+
+    Args:
+        lon, lat: Coordinate dei punti (array float64 validi)
+        placemark_per_tile: Punti massimi mostrati da un tile non foglia
+        profondita_max: Livelli del quadtree (1 = solo tile radice)
+
+    Yields:
+        Tuple (chiave, bbox, posizioni mostrate, figli): chiave = cifre dei
+        quadranti dalla radice ('' = radice), bbox = (nord, sud, est, ovest),
+        figli = lista di (chiave, bbox) dei quadranti non vuoti
+    """
+    if placemark_per_tile < 1 or profondita_max < 1:
+        raise ValueError(f"Tile non validi: {placemark_per_tile} placemark, profondità {profondita_max}")
+    if not len(lon):
+        return
+    bbox = (lat.max() + _MARGINE_TILE, lat.min() - _MARGINE_TILE,
+            lon.max() + _MARGINE_TILE, lon.min() - _MARGINE_TILE)
+    pila = [('', bbox, np.arange(len(lon)))]
+    while pila:
+        chiave, (nord, sud, est, ovest), posizioni = pila.pop()
+        if len(posizioni) <= placemark_per_tile or len(chiave) + 1 >= profondita_max:
+            yield chiave, (nord, sud, est, ovest), posizioni, []
+            continue
+
+        campione = np.linspace(0, len(posizioni) - 1, placemark_per_tile).astype(np.int64)
+        restanti = np.delete(posizioni, campione)
+        lat_media, lon_media = (nord + sud) / 2, (est + ovest) / 2
+        quadranti = (lat[restanti] < lat_media) * 2 + (lon[restanti] >= lon_media)
+        bbox_quadranti = [(nord, lat_media, lon_media, ovest), (nord, lat_media, est, lon_media),
+                          (lat_media, sud, lon_media, ovest), (lat_media, sud, est, lon_media)]
+        figli = [(f"{chiave}{q}", bbox_quadranti[q], restanti[quadranti == q])
+                 for q in range(4) if (quadranti == q).any()]
+        yield chiave, (nord, sud, est, ovest), posizioni[campione], [(c, b) for c, b, _ in figli]
+        # Primo quadrante visitato per primo
+        pila.extend(reversed(figli))
+
+
+def etichetta_sedi(stati_ui):
+    """
+    Etichetta delle sedi esportate dalle descrizioni STATI_UI dei codici
+    (es. 'Sede PAC/PAL'), 'Tutti gli edifici' se stati_ui è None
+    """
+    if stati_ui is None:
+        return "Tutti gli edifici"
+    codici = sorted({str(codice).strip() for codice in stati_ui})
+    return " + ".join(get_stato_ui_description(codice) for codice in codici)
+
+
+def cartelle_comuni_kmz(file_kmz):
+    """
+    Cartelle comune di un KMZ generato da KMZExporter, pronte per essere copiate
+
+    Returns:
+        dict nome comune -> (blocco <Folder> in bytes, numero placemark);
+        vuoto se il file manca o non è leggibile
+    """
+    apertura = '  ' * LIVELLO_CARTELLA_COMUNE + '<Folder>\n'
+    chiusura = '  ' * LIVELLO_CARTELLA_COMUNE + '</Folder>\n'
+    riga_nome = '  ' * (LIVELLO_CARTELLA_COMUNE + 1) + f'<name>{PREFISSO_CARTELLA_COMUNE}'
+
+    cartelle = {}
+    if not file_kmz or not os.path.exists(file_kmz):
+        return cartelle
+    try:
+        with zipfile.ZipFile(file_kmz) as kmz_file:
+            righe = kmz_file.read('doc.kml').decode('utf-8').splitlines(keepends=True)
+    except (zipfile.BadZipFile, KeyError, UnicodeDecodeError) as e:
+        print(f"⚠️ KMZ precedente non riutilizzabile: {e}")
+        return cartelle
+
+    i = 0
+    while i < len(righe) - 1:
+        if righe[i] == apertura and righe[i + 1].startswith(riga_nome):
+            nome = unescape(righe[i + 1].strip()[len('<name>') + len(PREFISSO_CARTELLA_COMUNE):-len('</name>')])
+            fine = righe.index(chiusura, i)
+            blocco = righe[i:fine + 1]
+            n_placemark = sum(riga.lstrip().startswith('<Placemark>') for riga in blocco)
+            cartelle[nome] = (''.join(blocco).encode('utf-8'), n_placemark)
+            i = fine
+        i += 1
+    return cartelle
 
 
 class KMZExporter:
@@ -69,9 +318,8 @@ class KMZExporter:
             return None
         
         try:
-            # Pattern per coordinate N/S + E/W
-            pattern = r'([NS])([0-9.]+)_([EW])([0-9.]+)'
-            match = re.match(pattern, str(coordinate_string).strip())
+            # Pattern per coordinate N/S + E/W (precompilato, vedi coordinate.py)
+            match = PATTERN_COORDINATE.match(str(coordinate_string).strip())
             
             if not match:
                 return None
@@ -104,14 +352,7 @@ class KMZExporter:
     
     def create_placemark_style(self, color, icon_type="sede"):
         """Crea stile per segnaposto con icone affidabili"""
-        if icon_type == "sede":
-            # AGGIORNATO: Icona più affidabile per sedi PAC/PAL
-            icon_href = "http://maps.google.com/mapfiles/kml/pal2/icon26.png"  # Edificio governativo
-            scale = "1.0"
-        else:  # PCN
-            # Icona antenna/torre per PCN (funziona già bene)
-            icon_href = "http://maps.google.com/mapfiles/kml/shapes/phone.png"
-            scale = "1.2"
+        icon_href, scale = ICONE_KML['sede' if icon_type == 'sede' else 'pcn']
         
         style = ET.Element("Style")
         
@@ -145,194 +386,419 @@ class KMZExporter:
         
         return placemark
     
-    def export_kmz(self, df_data, output_file):
+    def export_kmz(self, df_data, output_file, riusa_da=None, comuni_invariati=(), progresso=None,
+                   filtrato=False, cartelle_pronte=None, stati_ui=STATI_UI_KMZ, regione='02'):
         """
         Esporta DataFrame in formato KMZ per Google Earth - COMPLETO v2.1.1
         
         Args:
             df_data: DataFrame con dati (può essere già filtrato per PAC/PAL o completo)
             output_file: Path file KMZ di output
+            riusa_da: KMZ precedente da cui copiare le cartelle dei comuni invariati
+            comuni_invariati: Comuni le cui cartelle possono essere copiate da riusa_da
+            progresso: Callback (placemark scritti, placemark totali) dopo ogni cartella
+            filtrato: True se la selezione stati_ui è già stata applicata in
+                scansione (nessuna analisi né ri-filtro di STATO_UI)
+            cartelle_pronte: dict comune -> (blocco <Folder>, placemark) già
+                serializzati con cartella_comune (es. pipeline_comuni)
+            stati_ui: Codici STATO_UI delle sedi esportate (default
+                STATI_UI_KMZ, sedi PAC/PAL), None = tutti gli edifici; le
+                cartelle riusate devono venire da un KMZ con la stessa selezione
+            regione: Codice regione dei dati (nome del documento, REGIONI)
         """
+        # Scrittura su file temporaneo: riusa_da può coincidere con output_file
+        temporaneo = f"{output_file}.{os.getpid()}.tmp"
         try:
             print("🌍 Inizio generazione KMZ per Google Earth...")
             
             # Analisi dati input
             print(f"📊 Dati input: {len(df_data)} record")
             
-            if 'STATO_UI' not in df_data.columns:
-                print("❌ ERRORE: Colonna STATO_UI non trovata!")
+            df_pac_pal = self._seleziona_sedi(df_data, filtrato, stati_ui)
+            if df_pac_pal is None:
                 return False
             
-            # Determina se i dati sono già filtrati per PAC/PAL
-            stati_ui_unici = df_data['STATO_UI'].unique()
-            print(f"📋 STATO_UI presenti: {stati_ui_unici}")
-            
-            # Se c'è solo STATO_UI=302, i dati sono già filtrati
-            if len(stati_ui_unici) == 1 and (302 in stati_ui_unici or '302' in stati_ui_unici):
-                print("✅ Dati già filtrati per PAC/PAL")
-                df_pac_pal = df_data.copy()
-            else:
-                # Filtra per PAC/PAL (STATO_UI = 302)
-                print("🔍 Filtro per sedi PAC/PAL...")
-                
-                # Gestisci diversi tipi di dato
-                if df_data['STATO_UI'].dtype in ['int64', 'int32']:
-                    df_pac_pal = df_data[df_data['STATO_UI'] == 302].copy()
-                else:
-                    df_pac_pal = df_data[df_data['STATO_UI'] == '302'].copy()
-            
-            if df_pac_pal.empty:
-                print("⚠️ Nessuna sede PAC/PAL trovata (STATO_UI=302)")
-                return False
-            
-            print(f"✅ Trovate {len(df_pac_pal)} sedi PAC/PAL da esportare")
-            
             # Raggruppa per comune
-            comuni_groups = df_pac_pal.groupby('COMUNE')
-            
-            # Crea root KML
-            kml_root = ET.Element("kml", xmlns="http://www.opengis.net/kml/2.2")
-            document = ET.SubElement(kml_root, "Document")
+            comuni_groups = df_pac_pal.groupby('COMUNE', observed=True)
             
             # Nome documento
-            data_oggi = datetime.now().strftime("%Y%m%d")
-            doc_name = f"Sedi PAC/PAL VdA {data_oggi}"
-            ET.SubElement(document, "name").text = doc_name
-            ET.SubElement(document, "description").text = (
-                f"Sedi PAC/PAL Valle d'Aosta - Generato il {datetime.now().strftime('%d/%m/%Y %H:%M')}\n"
-                f"Analizzatore DB OpenFiber v2.1.1"
-            )
-            
-            # Crea stili per ogni PCN
-            style_counter = 0
-            pcn_styles = {}
-            sede_styles = {}
+            doc_name, doc_description = self._documento(stati_ui, regione)
             
-            for pcn_id, color in self.pcn_color_map.items():
-                # Stile per PCN
-                pcn_style_id = f"pcn_style_{style_counter}"
-                pcn_style = self.create_placemark_style(color, "pcn")
-                pcn_style.set("id", pcn_style_id)
-                document.append(pcn_style)
-                pcn_styles[pcn_id] = pcn_style_id
-                
-                # Stile per sedi dello stesso PCN
-                sede_style_id = f"sede_style_{style_counter}"
-                sede_style = self.create_placemark_style(color, "sede")
-                sede_style.set("id", sede_style_id)
-                document.append(sede_style)
-                sede_styles[pcn_id] = sede_style_id
-                
-                style_counter += 1
-            
-            # === CARTELLA PRINCIPALE ===
-            main_folder = ET.SubElement(document, "Folder")
-            ET.SubElement(main_folder, "name").text = doc_name
-            ET.SubElement(main_folder, "open").text = "1"
-            
-            # === CARTELLA PCN con logging live ===
-            pcn_folder = ET.SubElement(main_folder, "Folder")
-            ET.SubElement(pcn_folder, "name").text = "📡 PCN OpenFiber"
-            ET.SubElement(pcn_folder, "open").text = "1"
-            
-            # Aggiungi PCN unici con logging live
-            pcn_aggiunti = set()
-            pcn_count = 0
-            for _, row in df_pac_pal.iterrows():
-                pcn_id = str(row['POP']).strip()
-                
-                if pcn_id in pcn_aggiunti or pcn_id not in PCN_VALLE_AOSTA:
-                    continue
-                
-                pcn_coords = self.get_pcn_coordinates(pcn_id)
-                if not pcn_coords:
-                    continue
-                
-                pcn_info = PCN_VALLE_AOSTA[pcn_id]
-                pcn_name = pcn_info['nome']
-                pcn_description = (
-                    f"<b>PCN:</b> {pcn_name}<br/>"
-                    f"<b>ID:</b> {pcn_id}<br/>"
-                    f"<b>Comune:</b> {pcn_info['comune']}<br/>"
-                    f"<b>Coordinate:</b> {pcn_info['latitudine']:.6f}, {pcn_info['longitudine']:.6f}"
-                )
-                
-                style_id = pcn_styles.get(pcn_id, pcn_styles[list(pcn_styles.keys())[0]])
-                
-                placemark = self.create_placemark(
-                    pcn_name, pcn_description, pcn_coords, style_id
-                )
-                pcn_folder.append(placemark)
-                pcn_aggiunti.add(pcn_id)
-                pcn_count += 1
-                
-                # 🔧 FIX: Log ogni PCN singolarmente per dare "vitalità"
-                print(f"📡 PCN aggiunto: {pcn_name}")
+            print(f"💾 Salvataggio KMZ: {output_file}")
+            output_dir = os.path.dirname(output_file)
+            if output_dir:
+                os.makedirs(output_dir, exist_ok=True)
             
-            print(f"📡 Completati {pcn_count} PCN unici")
+            # Cartelle dei comuni invariati copiate dal KMZ precedente
+            cartelle_riusate = {}
+            if riusa_da and comuni_invariati:
+                invariati = set(comuni_invariati)
+                cartelle_riusate = {nome: cartella for nome, cartella in cartelle_comuni_kmz(riusa_da).items()
+                                    if nome in invariati}
+            if cartelle_pronte:
+                print(f"⚡ Cartelle comune già generate: {len(cartelle_pronte)}")
+                cartelle_riusate = {**cartelle_riusate, **cartelle_pronte}
+            
+            # KML scritto in streaming direttamente nella entry doc.kml del KMZ
+            with zipfile.ZipFile(temporaneo, 'w', zipfile.ZIP_DEFLATED) as kmz_file:
+                with kmz_file.open('doc.kml', 'w') as kml_stream:
+                    writer = KMLStreamWriter(kml_stream)
+                    writer.apri_documento(doc_name, doc_description)
+                    self._scrivi_contenuto(writer, doc_name, df_pac_pal, comuni_groups, cartelle_riusate,
+                                           progresso)
+                    writer.chiudi_documento()
+            os.replace(temporaneo, output_file)
+            
+            file_size = os.path.getsize(output_file) / 1024  # KB
+            print(f"✅ File KMZ salvato: {os.path.basename(output_file)} ({file_size:.1f} KB)")
+            return True
             
-            # === CARTELLE COMUNI con logging live ===
-            sedi_aggiunte = 0
+        except Exception as e:
+            print(f"❌ Errore durante generazione KMZ: {e}")
+            import traceback
+            traceback.print_exc()
+            # Nessun KMZ troncato su disco
+            if os.path.exists(temporaneo):
+                os.remove(temporaneo)
+            return False
+    
+    def export_kmz_tile(self, df_data, output_file, progresso=None, filtrato=False, placemark_per_tile=None,
+                        profondita_max=None, min_lod_pixels=None, stati_ui=STATI_UI_KMZ, regione='02'):
+        """
+        Esporta le sedi in un KMZ a livelli di dettaglio per dataset grandi
+        
+        doc.kml contiene la cartella PCN e un NetworkLink al tile radice; ogni
+        tile (tiles/t<quadranti>.kml, vedi tile_quadtree) mostra un campione
+        delle sedi della sua area e collega i quadranti figli con Region/Lod:
+        Google Earth carica un tile solo quando la sua area occupa almeno
+        min_lod_pixels a schermo, quindi non tutti i placemark insieme.
+        
+        Args:
+            df_data: DataFrame con dati (come export_kmz)
+            output_file: Path file KMZ di output
+            progresso: Callback (placemark scritti, placemark totali) dopo ogni tile
+            filtrato: True se la selezione stati_ui è già stata applicata in
+                scansione
+            placemark_per_tile, profondita_max, min_lod_pixels: Dimensione e
+                profondità del quadtree (default KMZ_TILE_CONFIG)
+            stati_ui: Codici STATO_UI delle sedi esportate (default sedi
+                PAC/PAL), None = tutti gli edifici
+            regione: Codice regione dei dati (nome del documento, REGIONI)
+        """
+        placemark_per_tile = placemark_per_tile or KMZ_TILE_CONFIG['placemark_per_tile']
+        profondita_max = profondita_max or KMZ_TILE_CONFIG['profondita_max']
+        min_lod_pixels = KMZ_TILE_CONFIG['min_lod_pixels'] if min_lod_pixels is None else min_lod_pixels
+        if progresso is None:
+            progresso = lambda scritti, totali: None  # noqa: E731
+        temporaneo = f"{output_file}.{os.getpid()}.tmp"
+        try:
+            print("🌍 Inizio generazione KMZ a tile per Google Earth...")
+            print(f"📊 Dati input: {len(df_data)} record")
+            df_sedi = self._seleziona_sedi(df_data, filtrato, stati_ui)
+            if df_sedi is None:
+                return False
             
-            for comune_nome, gruppo_data in comuni_groups:
-                # Cartella per comune
-                comune_folder = ET.SubElement(main_folder, "Folder")
-                ET.SubElement(comune_folder, "name").text = f"🏛️ {comune_nome}"
-                ET.SubElement(comune_folder, "open").text = "0"  # Chiuse di default
-                
-                comune_sedi_count = 0
-                for _, row in gruppo_data.iterrows():
-                    # Parse coordinate sede
-                    coordinate_building = row['COORDINATE_BUILDING']
-                    coords = self.parse_coordinates(coordinate_building)
-                    
-                    if not coords:
-                        print(f"⚠️ Coordinate non valide per {row['ID_BUILDING']}: {coordinate_building}")
-                        continue
-                    
-                    # Dati sede
-                    sede_name = str(row['ID_BUILDING'])
-                    pcn_id = str(row['POP']).strip()
-                    
-                    sede_description = (
-                        f"<b>Sede PAC/PAL</b><br/>"
-                        f"<b>ID Building:</b> {row['ID_BUILDING']}<br/>"
-                        f"<b>Indirizzo:</b> {row['INDIRIZZO']} {row['CIVICO']}<br/>"
-                        f"<b>Comune:</b> {comune_nome}<br/>"
-                        f"<b>PCN:</b> {row['NOME_PCN']}<br/>"
-                        f"<b>ISTAT:</b> {row['ISTAT']}<br/>"
-                        f"<b>Coordinate:</b> {coordinate_building}"
-                    )
-                    
-                    # Stile basato su PCN
-                    style_id = sede_styles.get(pcn_id, sede_styles[list(sede_styles.keys())[0]])
-                    
-                    # Crea placemark
-                    placemark = self.create_placemark(
-                        sede_name, sede_description, coords, style_id
-                    )
-                    
-                    comune_folder.append(placemark)
-                    comune_sedi_count += 1
-                    sedi_aggiunte += 1
-                
-                # 🔧 FIX: Log ogni comune singolarmente per dare "vitalità"
-                if comune_sedi_count > 0:
-                    print(f"🏛️ Comune {comune_nome}: {comune_sedi_count} sedi aggiunte")
+            lon, lat, validi = parse_coordinate_building(df_sedi['COORDINATE_BUILDING'])
+            riepilogo = riepilogo_non_validi(df_sedi['COORDINATE_BUILDING'], validi)
+            if riepilogo:
+                print(f"⚠️ Sedi escluse: {riepilogo}")
+            posizioni_valide = np.flatnonzero(validi)
+            valori = [df_sedi[col].to_numpy(dtype=object)[posizioni_valide] for col in COLONNE_SEDE]
+            comuni = df_sedi['COMUNE'].to_numpy(dtype=object)[posizioni_valide]
+            lon, lat = lon[posizioni_valide], lat[posizioni_valide]
+            
+            pcn_styles, sede_styles = self.stili_pcn()
+            stile_sede_default = next(iter(sede_styles.values()))
+            # Stili sede serializzati una volta e copiati nei tile che li usano
+            stili_sede = {}
+            for pcn_id, color in self.pcn_color_map.items():
+                stream = io.BytesIO()
+                writer = KMLStreamWriter(stream, livello=2)
+                writer.stile(sede_styles[pcn_id], color, "sede")
+                writer.flush()
+                stili_sede[sede_styles[pcn_id]] = stream.getvalue()
+            stili_righe = np.array([sede_styles.get(str(pop).strip(), stile_sede_default) for pop in valori[2]],
+                                   dtype=object)
+            doc_name, doc_description = self._documento(stati_ui, regione)
             
-            print(f"✅ Totale sedi PAC/PAL aggiunte: {sedi_aggiunte}")
+            output_dir = os.path.dirname(output_file)
+            if output_dir:
+                os.makedirs(output_dir, exist_ok=True)
+            print(f"💾 Salvataggio KMZ: {output_file}")
             
-            # === GENERA FILE KMZ ===
-            return self.save_kmz(kml_root, output_file)
+            n_tile = profondita = 0
+            with zipfile.ZipFile(temporaneo, 'w', zipfile.ZIP_DEFLATED) as kmz_file:
+                # Documento principale: stili PCN, cartella PCN e link al tile radice
+                with kmz_file.open('doc.kml', 'w') as kml_stream:
+                    writer = KMLStreamWriter(kml_stream)
+                    writer.apri_documento(doc_name, doc_description)
+                    for pcn_id, color in self.pcn_color_map.items():
+                        writer.stile(pcn_styles[pcn_id], color, "pcn")
+                    writer.apri_cartella(doc_name, aperta=True)
+                    pcn_count = self._scrivi_cartella_pcn(writer, df_sedi, pcn_styles)
+                    if len(lon):
+                        writer.network_link(f"🗺️ Sedi ({len(lon):,})",
+                                            f"{CARTELLA_TILE}/t.kml")
+                    writer.chiudi_cartella()
+                    writer.chiudi_documento()
+                placemark_scritti = writer.placemark_scritti
+                placemark_totali = pcn_count + len(lon)
+                progresso(placemark_scritti, placemark_totali)
+                
+                for chiave, _, posizioni, figli in tile_quadtree(lon, lat, placemark_per_tile, profondita_max):
+                    with kmz_file.open(f"{CARTELLA_TILE}/t{chiave}.kml", 'w') as kml_stream:
+                        writer = KMLStreamWriter(kml_stream)
+                        writer.apri_documento(f"Tile {chiave or 'radice'}", f"{len(posizioni)} sedi")
+                        # Ogni tile è un documento a sé: solo gli stili delle sue sedi
+                        for style_id in dict.fromkeys(stili_righe[posizioni]):
+                            writer.copia_blocco(stili_sede[style_id])
+                        for riga, x, y, comune in zip(zip(*(colonna[posizioni] for colonna in valori)),
+                                                      lon[posizioni], lat[posizioni], comuni[posizioni]):
+                            self._placemark_sede(writer, riga, x, y, comune, sede_styles, stile_sede_default)
+                        for chiave_figlio, bbox_figlio in figli:
+                            writer.network_link(f"Tile {chiave_figlio}", f"t{chiave_figlio}.kml", bbox_figlio,
+                                                min_lod_pixels)
+                        writer.chiudi_documento()
+                    placemark_scritti += writer.placemark_scritti
+                    n_tile += 1
+                    profondita = max(profondita, len(chiave) + 1)
+                    progresso(placemark_scritti, placemark_totali)
+            os.replace(temporaneo, output_file)
+            
+            print(f"🧩 Tile: {n_tile} su {profondita} livelli (max {placemark_per_tile} sedi per tile)")
+            print(f"✅ Totale sedi aggiunte: {len(lon)}")
+            file_size = os.path.getsize(output_file) / 1024  # KB
+            print(f"✅ File KMZ salvato: {os.path.basename(output_file)} ({file_size:.1f} KB)")
+            return True
             
         except Exception as e:
-            print(f"❌ Errore durante generazione KMZ: {e}")
+            print(f"❌ Errore durante generazione KMZ a tile: {e}")
             import traceback
             traceback.print_exc()
+            if os.path.exists(temporaneo):
+                os.remove(temporaneo)
             return False
     
+    def _seleziona_sedi(self, df_data, filtrato, stati_ui=STATI_UI_KMZ):
+        """
+        Sedi da esportare (STATO_UI in stati_ui, None = tutti gli edifici),
+        con i messaggi di analisi
+        
+        Returns:
+            DataFrame delle sedi, None se STATO_UI manca o nessuna sede
+        """
+        if 'STATO_UI' not in df_data.columns:
+            print("❌ ERRORE: Colonna STATO_UI non trovata!")
+            return None
+        
+        codici = None if stati_ui is None else sorted({str(codice).strip() for codice in stati_ui})
+        selezione = "tutti gli edifici" if codici is None else f"STATO_UI {', '.join(codici)}"
+        
+        if filtrato:
+            # Selezione già applicata (in scansione o da dati_kmz)
+            print(f"✅ Dati già selezionati ({selezione})")
+            df_sedi = df_data
+        elif codici is None:
+            print("✅ Nessun filtro STATO_UI: esportati tutti gli edifici")
+            df_sedi = df_data
+        else:
+            stati_ui_unici = df_data['STATO_UI'].unique()
+            print(f"📋 STATO_UI presenti: {stati_ui_unici}")
+            
+            # Confronto sul testo del codice: STATO_UI può essere numerico,
+            # testo o categoriale
+            selezionate = df_data['STATO_UI'].astype(str).str.strip().isin(codici).to_numpy()
+            if selezionate.all():
+                print(f"✅ Dati già filtrati ({selezione})")
+                df_sedi = df_data.copy()
+            else:
+                print(f"🔍 Filtro per sedi {selezione}...")
+                df_sedi = df_data[selezionate].copy()
+        
+        if df_sedi.empty:
+            print(f"⚠️ Nessuna sede trovata ({selezione})")
+            return None
+        
+        print(f"✅ Trovate {len(df_sedi)} sedi da esportare ({selezione})")
+        return df_sedi
+    
+    def _documento(self, stati_ui=STATI_UI_KMZ, regione='02'):
+        """Nome e descrizione del documento KML (sedi esportate e regione)"""
+        data_oggi = datetime.now().strftime("%Y%m%d")
+        titolo = f"{etichetta_sedi(stati_ui)} - {get_regione_name(regione)}"
+        doc_name = f"{titolo} {data_oggi}"
+        doc_description = (
+            f"{titolo} - Generato il {datetime.now().strftime('%d/%m/%Y %H:%M')}\n"
+            f"Analizzatore DB OpenFiber v2.1.1"
+        )
+        return doc_name, doc_description
+    
+    def _scrivi_cartella_pcn(self, writer, df_pac_pal, pcn_styles):
+        """
+        Cartella dei PCN delle sedi (nell'ordine di prima comparsa)
+        
+        Returns:
+            int: PCN scritti
+        """
+        stile_pcn_default = next(iter(pcn_styles.values()))
+        writer.apri_cartella("📡 PCN OpenFiber", aperta=True)
+        
+        # PCN unici nell'ordine di prima comparsa
+        pcn_count = 0
+        for pcn_id in df_pac_pal['POP'].astype(str).str.strip().unique():
+            if pcn_id not in PCN_VALLE_AOSTA:
+                continue
+            
+            pcn_coords = self.get_pcn_coordinates(pcn_id)
+            if not pcn_coords:
+                continue
+            
+            pcn_info = PCN_VALLE_AOSTA[pcn_id]
+            pcn_name = pcn_info['nome']
+            pcn_description = (
+                f"<b>PCN:</b> {pcn_name}<br/>"
+                f"<b>ID:</b> {pcn_id}<br/>"
+                f"<b>Comune:</b> {pcn_info['comune']}<br/>"
+                f"<b>Coordinate:</b> {pcn_info['latitudine']:.6f}, {pcn_info['longitudine']:.6f}"
+            )
+            
+            writer.placemark(pcn_name, pcn_description, pcn_coords,
+                             pcn_styles.get(pcn_id, stile_pcn_default))
+            pcn_count += 1
+            
+            # 🔧 FIX: Log ogni PCN singolarmente per dare "vitalità"
+            print(f"📡 PCN aggiunto: {pcn_name}")
+        
+        writer.chiudi_cartella()
+        print(f"📡 Completati {pcn_count} PCN unici")
+        return pcn_count
+    
+    def _scrivi_contenuto(self, writer, doc_name, df_pac_pal, comuni_groups, cartelle_riusate=None,
+                          progresso=None):
+        """Scrive stili, cartella PCN e cartelle comuni sul writer KML"""
+        cartelle_riusate = cartelle_riusate or {}
+        if progresso is None:
+            progresso = lambda scritti, totali: None  # noqa: E731
+        # Colonne convertite una sola volta (le cartelle comuni indicizzano per posizione)
+        valori = [df_pac_pal[col].to_numpy(dtype=object) for col in COLONNE_SEDE]
+
+        # Crea stili per ogni PCN
+        pcn_styles, sede_styles = self.stili_pcn()
+        for pcn_id, color in self.pcn_color_map.items():
+            writer.stile(pcn_styles[pcn_id], color, "pcn")
+            writer.stile(sede_styles[pcn_id], color, "sede")
+        
+        # === CARTELLA PRINCIPALE ===
+        writer.apri_cartella(doc_name, aperta=True)
+        
+        # === CARTELLA PCN con logging live ===
+        pcn_count = self._scrivi_cartella_pcn(writer, df_pac_pal, pcn_styles)
+        
+        # === CARTELLE COMUNI con logging live ===
+        sedi_aggiunte = 0
+        
+        # Parse coordinate di tutte le sedi in blocco, scarti riportati in un'unica riga
+        lon, lat, validi = parse_coordinate_building(df_pac_pal['COORDINATE_BUILDING'])
+        riepilogo = riepilogo_non_validi(df_pac_pal['COORDINATE_BUILDING'], validi)
+        if riepilogo:
+            print(f"⚠️ Sedi escluse: {riepilogo}")
+        posizioni_comuni = comuni_groups.indices
+        placemark_totali = pcn_count + int(validi.sum())
+        progresso(writer.placemark_scritti, placemark_totali)
+        
+        comuni_riusati = 0
+        for comune_nome in comuni_groups.groups:
+            # Comune invariato: cartella copiata dal KMZ precedente
+            if comune_nome in cartelle_riusate:
+                blocco, n_placemark = cartelle_riusate[comune_nome]
+                writer.copia_cartella(blocco, n_placemark)
+                sedi_aggiunte += n_placemark
+                comuni_riusati += 1
+                progresso(writer.placemark_scritti, placemark_totali)
+                continue
+            
+            # Solo le sedi del comune con coordinate valide
+            posizioni = posizioni_comuni[comune_nome]
+            posizioni = posizioni[validi[posizioni]]
+            comune_sedi_count = self._scrivi_cartella_comune(writer, comune_nome, valori, lon, lat, posizioni,
+                                                             sede_styles)
+            sedi_aggiunte += comune_sedi_count
+            progresso(writer.placemark_scritti, placemark_totali)
+            
+            # 🔧 FIX: Log ogni comune singolarmente per dare "vitalità"
+            if comune_sedi_count > 0:
+                print(f"🏛️ Comune {comune_nome}: {comune_sedi_count} sedi aggiunte")
+        
+        writer.chiudi_cartella()
+        if comuni_riusati:
+            print(f"♻️ Cartelle comune copiate senza rigenerazione: {comuni_riusati}")
+        print(f"✅ Totale sedi aggiunte: {sedi_aggiunte}")
+    
+    def stili_pcn(self):
+        """Id degli stili per PCN: (stili PCN, stili sedi) come dict PCN -> style id"""
+        pcn_styles = {pcn_id: f"pcn_style_{i}" for i, pcn_id in enumerate(self.pcn_color_map)}
+        sede_styles = {pcn_id: f"sede_style_{i}" for i, pcn_id in enumerate(self.pcn_color_map)}
+        return pcn_styles, sede_styles
+    
+    def _scrivi_cartella_comune(self, writer, comune_nome, valori, lon, lat, posizioni, sede_styles):
+        """
+        Cartella di un comune (chiusa di default) con le sedi alle posizioni indicate
+        
+        Returns:
+            int: Sedi scritte
+        """
+        stile_sede_default = next(iter(sede_styles.values()))
+        writer.apri_cartella(f"{PREFISSO_CARTELLA_COMUNE}{comune_nome}")
+        
+        comune_sedi_count = 0
+        for riga, x, y in zip(zip(*(colonna[posizioni] for colonna in valori)), lon[posizioni], lat[posizioni]):
+            self._placemark_sede(writer, riga, x, y, comune_nome, sede_styles, stile_sede_default)
+            comune_sedi_count += 1
+        
+        writer.chiudi_cartella()
+        return comune_sedi_count
+    
+    def _placemark_sede(self, writer, riga, x, y, comune_nome, sede_styles, stile_sede_default):
+        """Segnaposto di una sede (riga = valori di COLONNE_SEDE), titolato con lo STATO_UI"""
+        id_building, coordinate_building, pop, indirizzo, civico, nome_pcn, istat, stato_ui = riga
+        pcn_id = str(pop).strip()
+        sede_description = (
+            f"<b>{get_stato_ui_description(str(stato_ui).strip())}</b><br/>"
+            f"<b>ID Building:</b> {id_building}<br/>"
+            f"<b>Indirizzo:</b> {indirizzo} {civico}<br/>"
+            f"<b>Comune:</b> {comune_nome}<br/>"
+            f"<b>PCN:</b> {nome_pcn}<br/>"
+            f"<b>ISTAT:</b> {istat}<br/>"
+            f"<b>Coordinate:</b> {coordinate_building}"
+        )
+        
+        # Stile basato su PCN
+        writer.placemark(str(id_building), sede_description, (x, y, 0),
+                         sede_styles.get(pcn_id, stile_sede_default))
+    
+    def cartella_comune(self, comune_nome, df_comune):
+        """
+        Cartella di un comune serializzata a parte, identica a quella scritta
+        da export_kmz e copiabile con cartelle_pronte
+        
+        Args:
+            comune_nome: Nome del comune
+            df_comune: Sedi del comune nell'ordine del file
+        
+        Returns:
+            Tuple (blocco <Folder> in bytes, numero placemark)
+        """
+        stream = io.BytesIO()
+        writer = KMLStreamWriter(stream, LIVELLO_CARTELLA_COMUNE)
+        valori = [df_comune[col].to_numpy(dtype=object) for col in COLONNE_SEDE]
+        lon, lat, validi = parse_coordinate_building(df_comune['COORDINATE_BUILDING'])
+        n_placemark = self._scrivi_cartella_comune(writer, comune_nome, valori, lon, lat,
+                                                   np.flatnonzero(validi), self.stili_pcn()[1])
+        writer.flush()
+        return stream.getvalue(), n_placemark
+    
     def save_kmz(self, kml_root, output_file):
-        """Salva KML in file KMZ compresso"""
+        """Salva un albero KML (ElementTree) in file KMZ compresso"""
         try:
             print(f"💾 Salvataggio KMZ: {output_file}")
             
@@ -341,17 +807,11 @@ class KMZExporter:
             if output_dir:
                 os.makedirs(output_dir, exist_ok=True)
             
-            # Converti a stringa XML formattata
-            rough_string = ET.tostring(kml_root, encoding='utf-8')
-            reparsed = minidom.parseString(rough_string)
-            kml_content = reparsed.toprettyxml(indent="  ", encoding='utf-8')
-            
-            # Rimuovi riga vuota dopo XML declaration
-            kml_content = b'\n'.join(line for line in kml_content.split(b'\n') if line.strip())
-            
-            # Crea file KMZ (ZIP con KML dentro)
+            # Serializza l'albero direttamente nella entry doc.kml (niente re-parse minidom)
+            ET.indent(kml_root, space="  ")
             with zipfile.ZipFile(output_file, 'w', zipfile.ZIP_DEFLATED) as kmz_file:
-                kmz_file.writestr('doc.kml', kml_content)
+                with kmz_file.open('doc.kml', 'w') as kml_stream:
+                    ET.ElementTree(kml_root).write(kml_stream, encoding='utf-8', xml_declaration=True)
             
             # Verifica che il file sia stato creato
             if os.path.exists(output_file):
@@ -369,19 +829,58 @@ class KMZExporter:
 
 # === FUNZIONI STANDALONE ===
 
-def genera_kmz_pac_pal(df_data, output_file):
+def genera_kmz_pac_pal(df_data, output_file, riusa_da=None, comuni_invariati=(), progresso=None,
+                       filtrato=False, cartelle_pronte=None, tile=False, stati_ui=STATI_UI_KMZ,
+                       regione='02'):
     """
-    Funzione standalone per generare KMZ delle sedi PAC/PAL
+    Funzione standalone per generare KMZ delle sedi PAC/PAL (o degli STATO_UI
+    richiesti)
     
     Args:
-        df_data: DataFrame con dati Valle d'Aosta (completi o già filtrati per PAC/PAL)
+        df_data: DataFrame con dati della regione (completi o già selezionati)
         output_file: Path del file KMZ di output
+        riusa_da: KMZ precedente da cui copiare le cartelle dei comuni invariati
+        comuni_invariati: Comuni le cui cartelle possono essere copiate
+        progresso: Callback (placemark scritti, placemark totali)
+        filtrato: True se la selezione stati_ui è già applicata (filtro in scansione)
+        cartelle_pronte: Cartelle comune già serializzate (cartella_comune_kmz)
+        tile: KMZ a livelli di dettaglio (export_kmz_tile): i tile sono
+            ricostruiti da df_data, quindi riusa_da/comuni_invariati e
+            cartelle_pronte vengono ignorati (con un avviso)
+        stati_ui: Codici STATO_UI delle sedi esportate (default sedi
+            PAC/PAL), None = tutti gli edifici
+        regione: Codice regione dei dati (nome del documento)
     
     Returns:
         bool: True se successo, False se errore
     """
     exporter = KMZExporter()
-    return exporter.export_kmz(df_data, output_file)
+    if tile:
+        ignorati = [nome for nome, valore in (('riusa_da', riusa_da), ('comuni_invariati', comuni_invariati),
+                                              ('cartelle_pronte', cartelle_pronte)) if valore]
+        if ignorati:
+            print(f"⚠️ KMZ a tile: {', '.join(ignorati)} ignorati (tile rigenerati da tutte le sedi)")
+        return exporter.export_kmz_tile(df_data, output_file, progresso, filtrato, stati_ui=stati_ui,
+                                        regione=regione)
+    return exporter.export_kmz(df_data, output_file, riusa_da, comuni_invariati, progresso, filtrato,
+                               cartelle_pronte, stati_ui, regione)
+
+
+@lru_cache(maxsize=1)
+def _exporter_processo():
+    """KMZExporter condiviso dalle chiamate nello stesso processo (worker di un pool)"""
+    return KMZExporter()
+
+
+def cartella_comune_kmz(comune_nome, df_comune):
+    """
+    Worker: cartella KMZ di un comune (sedi selezionate) da passare a
+    genera_kmz_pac_pal come cartelle_pronte
+    
+    Returns:
+        Tuple (blocco <Folder> in bytes, numero placemark)
+    """
+    return _exporter_processo().cartella_comune(comune_nome, df_comune)
 
 
 def test_kmz_export():
@@ -0,0 +1,151 @@
+"""
+Lettore CSV - Analizzatore DB OpenFiber
+Backend di parsing intercambiabili per la lettura a chunk del DB:
+- pandas: pd.read_csv chunked (parser C single-thread)
+- pyarrow: pyarrow.csv.open_csv in streaming, blocchi di byte convertiti
+  con più thread
+Entrambi restituiscono chunk DataFrame con le stesse colonne, gli stessi
+valori mancanti e i codici a bassa cardinalità come categoriali.
+"""
+
+import pandas as pd
+
+# pyarrow opzionale: senza, il backend 'pyarrow' ripiega su pandas
+try:
+    import pyarrow as pa
+    import pyarrow.csv as pa_csv
+    PYARROW_SUPPORT = True
+except ImportError:
+    PYARROW_SUPPORT = False
+
+# Motori di parsing CSV ('auto' = pyarrow se disponibile)
+CSV_ENGINES = ('auto', 'pandas', 'pyarrow')
+
+# Stringhe lette come valore mancante: le stesse di pandas.read_csv
+VALORI_MANCANTI = [
+    '', '#N/A', '#N/A N/A', '#NA', '-1.#IND', '-1.#QNAN', '-NaN', '-nan', '1.#IND', '1.#QNAN',
+    '<NA>', 'N/A', 'NA', 'NULL', 'NaN', 'None', 'n/a', 'nan', 'null'
+]
+
+# Blocco pyarrow minimo in byte (una riga del DB deve sempre entrarci)
+BLOCCO_MINIMO = 1 << 16
+
+
+def risolvi_engine(engine):
+    """
+    Motore effettivo per il parsing
+
+    Raises:
+        ValueError: motore sconosciuto
+    """
+    if engine not in CSV_ENGINES:
+        raise ValueError(f"Motore CSV non valido: {engine} (disponibili: {', '.join(CSV_ENGINES)})")
+    if engine == 'pandas':
+        return 'pandas'
+    if PYARROW_SUPPORT:
+        return 'pyarrow'
+    if engine == 'pyarrow':
+        print("⚠️ pyarrow non disponibile: uso il parser pandas")
+    return 'pandas'
+
+
+def byte_per_riga(sorgente):
+    """Lunghezza media delle righe nel buffer iniziale della sorgente (senza consumarlo)"""
+    campione = sorgente.peek(1 << 16)
+    return max(len(campione) / max(campione.count(b'\n'), 1), 1.0)
+
+
+def blocco_per_chunk(chunk_size, byte_riga):
+    """Dimensione del blocco pyarrow equivalente a chunk_size righe"""
+    return max(int(chunk_size * byte_riga), BLOCCO_MINIMO)
+
+
+def leggi_csv_chunks(sorgente, chunk_size, colonne, categoriali=(), engine='pandas', separatore='|',
+                     encoding='utf-8', dimensione=None):
+    """
+    Apre la lettura a chunk del CSV con il motore indicato
+
+    L'intestazione viene letta subito (errori di formato sollevati qui), i
+    chunk durante l'iterazione.
+
+    Args:
+        sorgente: File binario bufferizzato posizionato sull'intestazione
+        chunk_size: Righe per chunk; con pyarrow le righe stimate per blocco
+            (block_size = chunk_size x byte medi per riga)
+        colonne: Colonne da leggere (quelle assenti nel file sono ignorate)
+        categoriali: Colonne restituite come categoriali
+        engine: Motore di parsing (CSV_ENGINES)
+        separatore: Separatore di campo
+        encoding: Encoding del file
+        dimensione: Funzione senza argomenti con le righe del prossimo chunk
+            (chunk size variabile durante la lettura, es. chunk_adattivo);
+            con pyarrow i blocchi restano di chunk_size righe stimate e
+            vengono riaggregati
+
+    Returns:
+        Iteratore di DataFrame
+    """
+    colonne = list(colonne)
+    if risolvi_engine(engine) == 'pandas':
+        reader = pd.read_csv(
+            sorgente,
+            sep=separatore,
+            encoding=encoding,
+            chunksize=chunk_size,
+            usecols=lambda colonna: colonna in colonne,
+            dtype={colonna: 'category' if colonna in categoriali else str for colonna in colonne},
+            low_memory=False
+        )
+        return reader if dimensione is None else _chunk_variabili_pandas(reader, dimensione)
+
+    blocco = blocco_per_chunk(chunk_size, byte_per_riga(sorgente))
+    # Intestazione letta a parte: le colonne assenti vanno escluse come con usecols
+    intestazione = sorgente.readline().decode(encoding).rstrip('\r\n')
+    nomi = [nome.strip('"') for nome in intestazione.split(separatore)]
+    presenti = [nome for nome in nomi if nome in colonne]
+    if not presenti:
+        raise ValueError("Nessuna delle colonne richieste è presente nell'intestazione del CSV")
+
+    tipo_categoriale = pa.dictionary(pa.int32(), pa.string())
+    reader = pa_csv.open_csv(
+        sorgente,
+        read_options=pa_csv.ReadOptions(column_names=nomi, block_size=blocco, use_threads=True,
+                                        encoding=encoding),
+        parse_options=pa_csv.ParseOptions(delimiter=separatore),
+        convert_options=pa_csv.ConvertOptions(
+            include_columns=presenti,
+            column_types={nome: tipo_categoriale if nome in categoriali else pa.string()
+                          for nome in presenti},
+            null_values=VALORI_MANCANTI,
+            strings_can_be_null=True
+        )
+    )
+    # Stringhe → colonne str, dizionari → Categorical (come dtype='category' di pandas)
+    if dimensione is None:
+        return (batch.to_pandas() for batch in reader)
+    return _chunk_variabili_arrow(reader, dimensione)
+
+
+def _chunk_variabili_pandas(reader, dimensione):
+    """Chunk pandas di dimensione scelta a ogni lettura"""
+    while True:
+        try:
+            yield reader.get_chunk(dimensione())
+        except StopIteration:
+            return
+
+
+def _chunk_variabili_arrow(reader, dimensione):
+    """Batch pyarrow riaggregati (senza copie) in chunk della dimensione richiesta"""
+    batches, righe = [], 0
+    for batch in reader:
+        batches.append(batch)
+        righe += batch.num_rows
+        while batches and righe >= dimensione():
+            tabella = pa.Table.from_batches(batches)
+            richieste = dimensione()
+            yield tabella.slice(0, richieste).to_pandas()
+            batches = tabella.slice(richieste).to_batches()
+            righe = max(righe - richieste, 0)
+    if righe:
+        yield pa.Table.from_batches(batches, schema=reader.schema).to_pandas()
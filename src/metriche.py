@@ -0,0 +1,175 @@
+"""
+Metriche estrazione - Analizzatore DB OpenFiber
+Tempi per fase (wall e CPU), conteggi, picco di memoria e file generati di
+una esecuzione di estrai_regione_02, raccolti in un oggetto risultato
+serializzabile (CLI, GUI, storico benchmark)
+"""
+
+import os
+import sys
+import time
+from contextlib import contextmanager, nullcontext
+
+# Picco memoria: resource (Unix) oppure psutil se disponibile (Windows)
+try:
+    import resource
+except ImportError:
+    resource = None
+
+try:
+    import psutil
+except ImportError:
+    psutil = None
+
+# Fasi misurate nell'ordine di esecuzione
+FASI_ESTRAZIONE = ('scansione', 'arricchimento', 'dataframe', 'excel', 'kmz')
+
+
+def tempo_cpu():
+    """Tempo CPU del processo e dei processi figli terminati (es. pool Excel)"""
+    t = os.times()
+    return t.user + t.system + t.children_user + t.children_system
+
+
+def picco_memoria_mb():
+    """Picco di memoria residente del processo in MB, None se non misurabile"""
+    if resource is not None:
+        picco = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+        # Linux in KB, macOS in byte
+        return picco / (1024 * 1024) if sys.platform == 'darwin' else picco / 1024
+    if psutil is not None:
+        info = psutil.Process().memory_info()
+        return getattr(info, 'peak_wset', info.rss) / (1024 * 1024)
+    return None
+
+
+def memoria_disponibile_mb():
+    """RAM di sistema disponibile in MB (psutil, /proc/meminfo o sysconf), None se non misurabile"""
+    if psutil is not None:
+        return psutil.virtual_memory().available / (1024 * 1024)
+    try:
+        with open('/proc/meminfo', 'r') as f:
+            for riga in f:
+                if riga.startswith('MemAvailable:'):
+                    return int(riga.split()[1]) / 1024
+    except OSError:
+        pass
+    try:
+        return os.sysconf('SC_AVPHYS_PAGES') * os.sysconf('SC_PAGE_SIZE') / (1024 * 1024)
+    except (AttributeError, ValueError, OSError):
+        return None
+
+
+class Metriche:
+    """Tempi wall/CPU accumulati per fase"""
+
+    def __init__(self):
+        self.fasi = {}
+
+    @contextmanager
+    def fase(self, nome):
+        """Misura il blocco e somma wall/CPU alla fase indicata"""
+        wall, cpu = time.perf_counter(), tempo_cpu()
+        try:
+            yield
+        finally:
+            self.aggiungi(nome, time.perf_counter() - wall, tempo_cpu() - cpu)
+
+    def aggiungi(self, nome, wall, cpu):
+        tempi = self.fasi.setdefault(nome, {'wall': 0.0, 'cpu': 0.0})
+        tempi['wall'] += wall
+        tempi['cpu'] += cpu
+
+    def escludi(self, nome, *interne):
+        """Rende esclusivo il tempo di una fase togliendo quello delle fasi annidate"""
+        tempi = self.fasi.get(nome)
+        if tempi is None:
+            return
+        for interna in interne:
+            if interna in self.fasi:
+                tempi['wall'] = max(tempi['wall'] - self.fasi[interna]['wall'], 0.0)
+                tempi['cpu'] = max(tempi['cpu'] - self.fasi[interna]['cpu'], 0.0)
+
+
+def misura(metriche, nome):
+    """Context manager di fase tollerante a metriche=None"""
+    return metriche.fase(nome) if metriche is not None else nullcontext()
+
+
+class RisultatoEstrazione:
+    """
+    Esito di estrai_regione_02
+
+    Vero solo se l'elaborazione è riuscita (compatibile con il vecchio
+    valore di ritorno bool). Contiene i tempi per fase (FASI_ESTRAZIONE,
+    wall e CPU in secondi), righe scansionate, record estratti, comuni e
+    PCN distinti, picco di memoria, chunk size usato in lettura (fisso o
+    scelto in modalità auto) e i path dei file generati.
+    """
+
+    def __init__(self, file_input, parametri=None):
+        self.successo = False
+        self.errore = None
+        self.file_input = file_input
+        self.parametri = parametri or {}
+        self.da_cache = False
+        self.righe_scansionate = 0
+        self.record_estratti = 0
+        self.start_row = 0
+        self.end_row = 0
+        self.comuni = 0
+        self.pcn = 0
+        self.fasi = {}
+        self.tempo_totale = 0.0
+        self.cpu_totale = 0.0
+        self.picco_memoria_mb = None
+        self.chunk = None
+        self.file_excel = None
+        self.file_kmz = None
+
+    def __bool__(self):
+        return self.successo
+
+    def __repr__(self):
+        stato = 'OK' if self.successo else f'ERRORE: {self.errore}'
+        return (f"RisultatoEstrazione({stato}, {self.record_estratti:,} record, "
+                f"{self.tempo_totale:.1f}s)")
+
+    @property
+    def artefatti(self):
+        """Path dei file generati"""
+        return [path for path in (self.file_excel, self.file_kmz) if path]
+
+    @property
+    def record_al_secondo(self):
+        return self.record_estratti / self.tempo_totale if self.tempo_totale > 0 else 0.0
+
+    def fallito(self, errore):
+        """Registra l'errore e restituisce il risultato (falso)"""
+        self.successo = False
+        self.errore = errore
+        return self
+
+    def to_dict(self):
+        """Dizionario serializzabile JSON (storico benchmark, output CLI)"""
+        return {
+            'successo': self.successo,
+            'errore': self.errore,
+            'file_input': self.file_input,
+            'parametri': self.parametri,
+            'da_cache': self.da_cache,
+            'righe_scansionate': self.righe_scansionate,
+            'record_estratti': self.record_estratti,
+            'start_row': self.start_row,
+            'end_row': self.end_row,
+            'comuni': self.comuni,
+            'pcn': self.pcn,
+            'fasi': {nome: dict(tempi) for nome, tempi in self.fasi.items()},
+            'tempo_totale': self.tempo_totale,
+            'cpu_totale': self.cpu_totale,
+            'record_al_secondo': self.record_al_secondo,
+            'picco_memoria_mb': self.picco_memoria_mb,
+            'chunk': self.chunk,
+            'file_excel': self.file_excel,
+            'file_kmz': self.file_kmz
+        }
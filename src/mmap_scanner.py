@@ -0,0 +1,218 @@
+"""
+Scanner mmap per DB OpenFiber pipe-separated
+Legge solo il campo REGIONE direttamente dal buffer grezzo e passa al
+parser CSV completo esclusivamente le righe del blocco richiesto
+"""
+
+import mmap
+import os
+
+import numpy as np
+
+from config import CSV_CONFIG
+
+# Finestre di scansione: partono piccole (blocco vicino all'inizio del file)
+# e raddoppiano fino al massimo; ogni finestra è estesa fino a fine riga
+FINESTRA_INIZIALE = 1024 * 1024
+FINESTRA_SCANSIONE = 32 * 1024 * 1024
+
+# Oltre questa lunghezza del primo campo il separatore è cercato riga per riga
+MAX_PRIMO_CAMPO = 256
+
+_SPAZI = np.frombuffer(b' \t\n\r\x0b\x0c', dtype=np.uint8)
+
+
+def _primo_separatore(blocco, inizi, fini, separatore):
+    """
+    Posizione del primo separatore di ogni riga (fine riga se assente)
+
+    Avanza di un byte alla volta su tutte le righe insieme: le iterazioni
+    sono pari alla lunghezza del primo campo, non al numero di righe.
+    """
+    s1 = fini.copy()
+    aperte = np.arange(len(inizi))
+    k = 0
+    while len(aperte) and k < MAX_PRIMO_CAMPO:
+        posizioni = inizi[aperte] + k
+        dentro = posizioni < fini[aperte]
+        aperte, posizioni = aperte[dentro], posizioni[dentro]
+        trovato = blocco[posizioni] == separatore
+        s1[aperte[trovato]] = posizioni[trovato]
+        aperte = aperte[~trovato]
+        k += 1
+
+    for i in aperte:
+        trovato = bytes(blocco[inizi[i]:fini[i]]).find(bytes([separatore]))
+        if trovato != -1:
+            s1[i] = inizi[i] + trovato
+    return s1
+
+
+def _scansiona_finestra(blocco, codice, separatore):
+    """
+    Classifica le righe di una finestra di byte allineata a inizio/fine riga
+
+    Args:
+        blocco: Array uint8 della finestra
+        codice: Codice regione in bytes
+        separatore: Byte del separatore di campo
+
+    Returns:
+        Tuple (inizi riga, mask righe contate, mask righe con REGIONE == codice)
+    """
+    dimensione = len(blocco)
+    newline = np.flatnonzero(blocco == 10)
+    inizi = np.concatenate(([0], newline + 1))
+    fini = np.append(newline + 1, dimensione)
+    if inizi[-1] == dimensione:
+        inizi, fini = inizi[:-1], fini[:-1]
+
+    s1 = _primo_separatore(blocco, inizi, fini, separatore)
+    con_separatore = s1 < fini
+
+    # REGIONE è il secondo campo: confronto byte per byte col codice, poi il
+    # byte successivo deve chiudere il campo (separatore, newline o fine file)
+    campo = s1 + 1
+    ultimo = dimensione - 1
+    uguali = con_separatore & (campo + len(codice) <= fini)
+    for k, byte in enumerate(codice):
+        uguali &= blocco[np.minimum(campo + k, ultimo)] == byte
+    dopo = campo + len(codice)
+    chiuso = (dopo >= dimensione) | np.isin(blocco[np.minimum(dopo, ultimo)], (separatore, 10))
+    prefisso = uguali.copy()
+    uguali &= chiuso
+
+    # Spazi attorno al codice: confronto dopo lo strip come il parser
+    sospette = con_separatore & (np.isin(blocco[np.minimum(campo, ultimo)], _SPAZI)
+                                 | (prefisso & ~chiuso & np.isin(blocco[np.minimum(dopo, ultimo)], _SPAZI)))
+    for i in np.flatnonzero(sospette):
+        valore = bytes(blocco[campo[i]:fini[i]]).split(bytes([separatore]), 1)[0]
+        uguali[i] = valore.strip() == codice
+
+    # Righe senza separatore: quelle vuote sono saltate da pd.read_csv senza contarle
+    contate = np.ones(len(inizi), dtype=bool)
+    for i in np.flatnonzero(~con_separatore):
+        if not bytes(blocco[inizi[i]:fini[i]]).strip():
+            contate[i] = False
+
+    return inizi, contate, uguali
+
+
+def _scansiona(mm, header_bytes, codice, separatore, finestra):
+    """Scansione a finestre del file mappato (vedi trova_blocco_regione)"""
+    size = len(mm)
+    pos = header_bytes
+    riga = 0
+    start_byte = None
+    start_row = 0
+
+    ampiezza = min(FINESTRA_INIZIALE, finestra)
+
+    while pos < size:
+        fine = mm.find(b'\n', min(pos + ampiezza, size) - 1)
+        fine = size if fine == -1 else fine + 1
+        ampiezza = min(ampiezza * 2, finestra)
+
+        inizi, contate, uguali = _scansiona_finestra(
+            np.frombuffer(mm, dtype=np.uint8, count=fine - pos, offset=pos), codice, separatore)
+        numeri = riga + np.cumsum(contate)
+
+        primo = -1
+        if start_byte is None:
+            trovate = np.flatnonzero(uguali)
+            if not len(trovate):
+                riga += int(contate.sum())
+                pos = fine
+                continue
+            primo = int(trovate[0])
+            start_byte = pos + int(inizi[primo])
+            start_row = int(numeri[primo])
+
+        # Il blocco finisce alla prima riga contata con REGIONE diversa
+        diverse = np.flatnonzero(contate & ~uguali)
+        diverse = diverse[diverse > primo]
+        if len(diverse):
+            fine_blocco = int(diverse[0])
+            riga = int(numeri[fine_blocco])
+            return {
+                'header_bytes': header_bytes,
+                'start_byte': start_byte,
+                'end_byte': pos + int(inizi[fine_blocco]),
+                'start_row': start_row,
+                'n_rows': riga - start_row,
+                'end_row': riga,
+                'righe_scansionate': riga
+            }
+
+        riga += int(contate.sum())
+        pos = fine
+
+    if start_byte is None:
+        return None
+
+    return {
+        'header_bytes': header_bytes,
+        'start_byte': start_byte,
+        'end_byte': size,
+        'start_row': start_row,
+        'n_rows': riga - start_row + 1,
+        'end_row': 0,
+        'righe_scansionate': riga
+    }
+
+
+def trova_blocco_regione(file_input, codice_regione='02', finestra=FINESTRA_SCANSIONE):
+    """
+    Individua il blocco contiguo di una regione scandendo il file via mmap
+
+    Stessa semantica della state machine di estrai_regione_02: il blocco
+    inizia alla prima riga con REGIONE == codice e termina alla prima riga
+    successiva con REGIONE diversa. Le righe vuote sono ignorate come fa
+    pd.read_csv. Assume campi non quotati (formato dump OpenFiber).
+
+    Il buffer è esaminato a finestre con ricerche numpy di newline e
+    separatori: nessun ciclo Python per riga, e la scansione si ferma alla
+    finestra in cui finisce il blocco.
+
+    Args:
+        file_input: Path file CSV di input
+        codice_regione: Codice regione da cercare (es. '02')
+        finestra: Byte per finestra di scansione
+
+    Returns:
+        dict con header_bytes, start_byte, end_byte, start_row, n_rows,
+        end_row (0 se il blocco arriva a fine file) e righe_scansionate,
+        oppure None se la regione non è presente
+    """
+    codice = codice_regione.encode(CSV_CONFIG['encoding'])
+    separatore = CSV_CONFIG['separator'].encode()[0]
+
+    if os.path.getsize(file_input) == 0:
+        return None
+
+    with open(file_input, 'rb') as f, mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ) as mm:
+        nl = mm.find(b'\n')
+        header_bytes = len(mm) if nl == -1 else nl + 1
+        # Le viste numpy sul buffer vivono solo dentro _scansiona: il mmap
+        # non si chiude finché ne esiste una
+        return _scansiona(mm, header_bytes, codice, separatore, finestra)
+
+
+if __name__ == "__main__":
+    import sys
+    import time
+
+    if len(sys.argv) < 2:
+        print("Uso: python mmap_scanner.py <file_csv> [codice_regione]")
+        sys.exit(1)
+
+    t0 = time.perf_counter()
+    blocco = trova_blocco_regione(sys.argv[1], sys.argv[2] if len(sys.argv) > 2 else '02')
+    elapsed = time.perf_counter() - t0
+
+    if blocco is None:
+        print("❌ Regione non trovata")
+    else:
+        mb = (blocco['end_byte'] - blocco['start_byte']) / (1024 * 1024)
+        print(f"✅ Blocco righe {blocco['start_row']:,} - {blocco['end_row']:,} "
+              f"({blocco['n_rows']:,} righe, {mb:.1f} MB) in {elapsed:.2f}s")
@@ -0,0 +1,316 @@
+"""
+Pipeline a stadi per comune - Analizzatore DB OpenFiber
+Lettura, arricchimento e scrittura dell'output sovrapposti invece che in
+sequenza:
+- lettura (thread): parsing dei chunk CSV
+- scansione (thread): state machine regione, arricchimento vettoriale e
+  suddivisione dei batch in blocchi comune completi
+- output (process pool): XML del foglio Excel e cartella KMZ di ogni comune,
+  generati appena il suo blocco è completo nell'input ordinato
+Gli stadi sono collegati da code limitate (config.PIPELINE_CONFIG): uno
+stadio più veloce si ferma finché il successivo non libera posto, e in
+memoria restano pochi chunk e pochi comuni alla volta.
+"""
+
+import os
+import queue
+import threading
+from concurrent.futures import ProcessPoolExecutor
+
+import numpy as np
+import pandas as pd
+
+from config import PIPELINE_CONFIG, STATI_UI_KMZ
+from chunk_adattivo import ChunkAdattivo, CHUNK_AUTO, info_chunk
+from excel_writer import XlsxIncrementale, xml_foglio, nomi_fogli_univoci
+from kmz_exporter import cartella_comune_kmz
+from estrattore_of import (apri_lettura_regione, batch_regione_vettoriale, tipizza_estrazione,
+                           costruisci_filtro, filtra_estrazione, selezione_kmz_applicata,
+                           sanitize_sheet_name, _foglio_excel)
+from metriche import misura
+
+
+class ComuniNonOrdinati(Exception):
+    """Un comune ricompare dopo un altro: l'input non è raggruppato per COMUNE"""
+
+
+# Marcatori di fine stadio nelle code
+_FINE = object()
+
+
+class _Errore:
+    """Eccezione di uno stadio, risollevata nel consumatore"""
+
+    def __init__(self, eccezione):
+        self.eccezione = eccezione
+
+
+def in_thread(iterabile, dimensione_coda, nome='stadio'):
+    """
+    Consuma un iterabile in un thread produttore e ne restituisce gli
+    elementi attraverso una coda limitata (uno stadio della pipeline)
+
+    Le eccezioni del produttore vengono risollevate nel consumatore; se il
+    consumatore si ferma prima della fine, anche il produttore si ferma e
+    l'iterabile viene chiuso.
+    """
+    coda = queue.Queue(maxsize=dimensione_coda)
+    stop = threading.Event()
+
+    def metti(elemento):
+        while not stop.is_set():
+            try:
+                coda.put(elemento, timeout=0.1)
+                return True
+            except queue.Full:
+                continue
+        return False
+
+    def produttore():
+        try:
+            for elemento in iterabile:
+                if not metti(elemento):
+                    return
+            metti(_FINE)
+        except BaseException as e:
+            metti(_Errore(e))
+        finally:
+            # Stadi annidati: ferma anche il thread che alimenta l'iterabile
+            chiudi = getattr(iterabile, 'close', None)
+            if chiudi is not None:
+                chiudi()
+
+    thread = threading.Thread(target=produttore, name=nome, daemon=True)
+    thread.start()
+    try:
+        while True:
+            elemento = coda.get()
+            if elemento is _FINE:
+                return
+            if isinstance(elemento, _Errore):
+                raise elemento.eccezione
+            yield elemento
+    finally:
+        stop.set()
+        thread.join()
+
+
+def blocchi_comune(batches):
+    """
+    Raggruppa i batch arricchiti (ordine del file) in blocchi comune completi
+
+    Un comune è completo quando nell'input compare il comune successivo: il
+    dump è ordinato per codice ISTAT all'interno della regione.
+
+    Yields:
+        Tuple (nome comune, DataFrame dei suoi record nell'ordine del file)
+
+    Raises:
+        ComuniNonOrdinati: un comune già completato ricompare più avanti
+    """
+    completati = set()
+    corrente, parti = None, []
+    for batch in batches:
+        comuni = batch['COMUNE'].to_numpy()
+        cambi = np.flatnonzero(comuni[1:] != comuni[:-1]) + 1
+        for inizio, fine in zip(np.r_[0, cambi], np.r_[cambi, len(batch)]):
+            comune = comuni[inizio]
+            if comune != corrente:
+                if parti:
+                    yield corrente, pd.concat(parti, ignore_index=True)
+                    completati.add(corrente)
+                if comune in completati:
+                    raise ComuniNonOrdinati(f"Il comune {comune} compare in più blocchi non contigui")
+                corrente, parti = comune, []
+            parti.append(batch.iloc[inizio:fine])
+    if parti:
+        yield corrente, pd.concat(parti, ignore_index=True)
+
+
+def _xml_comune(df):
+    """Worker: XML del foglio Excel di un comune"""
+    return xml_foglio(_foglio_excel(df))
+
+
+class EsitoPipeline:
+    """
+    Risultato della pipeline: conteggi dell'estrazione, Excel già scritto e
+    ingredienti del KMZ (sedi selezionate e cartelle comune già serializzate)
+
+    Come EstrazioneSpill espone __len__, empty, comuni e pcn al posto del
+    DataFrame, che non viene mai costruito per intero.
+    """
+
+    def __init__(self):
+        self.n_record = 0
+        self.comuni = []
+        self.pcn = set()
+        self.scan_info = {}
+        self.file_excel = None
+        self.pac_pal = None
+        self.cartelle = {}
+
+    def __len__(self):
+        return self.n_record
+
+    @property
+    def empty(self):
+        return self.n_record == 0
+
+
+def esegui_pipeline_regione(file_input, file_excel=None, export_kmz=False, codice_regione='02',
+                            chunk_size=10000, use_index=False, reader='pandas', csv_engine='pandas',
+                            filtro=None, avanzamento=None, metriche=None, n_workers=None,
+                            stati_ui_kmz=STATI_UI_KMZ, kmz_tile=False):
+    """
+    Estrae una regione con lettura, arricchimento e output sovrapposti
+
+    Ogni comune completo passa subito al process pool (foglio Excel e, con
+    export_kmz, cartella KMZ delle sue sedi) mentre la lettura
+    prosegue; i fogli vengono aggiunti al .xlsx appena pronti e il workbook
+    li ordina alfabeticamente come generate_multisheet_excel. Il KMZ si
+    completa con genera_kmz_pac_pal(esito.pac_pal, ..., filtrato=True,
+    cartelle_pronte=esito.cartelle, stati_ui=stati_ui_kmz).
+
+    Args:
+        file_input: Path file CSV di input
+        file_excel: Path .xlsx da generare (None = nessun Excel)
+        export_kmz: Prepara sedi e cartelle comune per il KMZ
+        codice_regione: Codice regione (es. '02')
+        chunk_size: Righe per chunk oppure CHUNK_AUTO
+        use_index: Usa l'indice byte-offset sidecar
+        reader: Backend di lettura ('pandas' o 'mmap')
+        csv_engine: Motore di parsing CSV già risolto (risolvi_engine)
+        filtro: Filtro STATO_UI/COMUNE (costruisci_filtro) applicato in scansione
+        avanzamento: Avanzamento (progresso.py) della fase di lettura
+        metriche: Metriche (metriche.py): fasi 'pipeline' e 'arricchimento'
+        n_workers: Processi per fogli e cartelle (default: tutti i core)
+        stati_ui_kmz: Codici STATO_UI delle sedi del KMZ (default sedi
+            PAC/PAL), None = tutti gli edifici
+        kmz_tile: KMZ a tile: solo le sedi, nessuna cartella comune
+
+    Returns:
+        EsitoPipeline
+
+    Raises:
+        ComuniNonOrdinati: input non raggruppato per comune (nessun file scritto)
+    """
+    adattivo = ChunkAdattivo() if chunk_size == CHUNK_AUTO else None
+    esito = EsitoPipeline()
+    esito.scan_info = {'righe_totali': 0, 'start_row': 0, 'end_row': 0}
+    lettura = apri_lettura_regione(file_input, codice_regione, chunk_size, use_index, reader, csv_engine,
+                                   adattivo)
+    if lettura is None:
+        esito.scan_info['chunk'] = info_chunk(chunk_size, adattivo)
+        return esito
+    blocco = lettura['blocco']
+    riga_iniziale = blocco['start_row'] - 1 if blocco is not None else 0
+
+    progresso = None
+    if avanzamento is not None:
+        avanzamento.aggiorna('lettura', forza=True, bytes_totali=lettura['bytes_totali'])
+        progresso = avanzamento.lettura(lettura['byte_letti'])
+
+    # Sedi per il KMZ: già selezionate se il filtro in scansione lascia solo quegli STATO_UI
+    selezione_applicata = selezione_kmz_applicata(filtro, stati_ui_kmz)
+    filtro_sedi = costruisci_filtro(stati_ui=stati_ui_kmz)
+    n_workers = max(n_workers or os.cpu_count() or 1, 1)
+
+    temporaneo = f"{file_excel}.{os.getpid()}.tmp" if file_excel else None
+    xlsx = XlsxIncrementale(temporaneo) if file_excel else None
+    parti_fogli = {}
+    cartelle = {}
+    pac_pal = []
+
+    # Writer dei fogli (thread): part aggiunte al pacchetto nell'ordine di invio;
+    # la coda limitata ferma lo stadio di output se i fogli si accumulano
+    coda_fogli = queue.Queue(maxsize=n_workers * PIPELINE_CONFIG['lavori_per_worker'])
+    errori = []
+
+    def scrittore():
+        while True:
+            voce = coda_fogli.get()
+            if voce is _FINE:
+                return
+            comune, foglio = voce
+            if errori:
+                foglio.cancel()
+                continue
+            try:
+                parti_fogli[comune] = xlsx.aggiungi(foglio.result())
+            except BaseException as e:
+                errori.append(e)
+
+    thread_scrittore = threading.Thread(target=scrittore, name='scrittura_excel', daemon=True)
+    try:
+        with misura(metriche, 'pipeline'), ProcessPoolExecutor(max_workers=n_workers) as executor:
+            # Worker avviati prima dei thread degli stadi (fork sicuro)
+            executor.submit(int).result()
+            thread_scrittore.start()
+
+            chunks = in_thread(lettura['chunks'], PIPELINE_CONFIG['coda_chunk'], 'lettura_csv')
+            batches = batch_regione_vettoriale(chunks, codice_regione, riga_iniziale, progresso, metriche,
+                                               filtro, esito.scan_info)
+            comuni = in_thread(blocchi_comune(batches), PIPELINE_CONFIG['coda_comuni'], 'scansione')
+
+            try:
+                # Tipi e date del foglio applicati nel worker: qui solo conteggi e invio
+                for comune, df_comune in comuni:
+                    esito.n_record += len(df_comune)
+                    esito.comuni.append(comune)
+                    esito.pcn.update(df_comune['POP'])
+
+                    if xlsx is not None:
+                        coda_fogli.put((comune, executor.submit(_xml_comune, df_comune)))
+                    if export_kmz:
+                        sedi = df_comune if selezione_applicata else filtra_estrazione(df_comune, filtro_sedi)
+                        if len(sedi):
+                            pac_pal.append(sedi)
+                            if not kmz_tile:
+                                cartelle[comune] = executor.submit(cartella_comune_kmz, comune, sedi)
+                    print(f"⚡ Comune {comune}: {len(df_comune):,} record inviati all'output")
+                    if errori:
+                        raise errori[0]
+            except BaseException:
+                # Lavori non ancora avviati annullati, stadi fermati
+                for cartella in cartelle.values():
+                    cartella.cancel()
+                raise
+            finally:
+                comuni.close()
+                chunks.close()
+                if thread_scrittore.is_alive():
+                    coda_fogli.put(_FINE)
+                    thread_scrittore.join()
+            if errori:
+                raise errori[0]
+            esito.cartelle = {comune: cartella.result() for comune, cartella in cartelle.items()}
+
+        if xlsx is not None:
+            if esito.comuni:
+                # Ordine alfabetico dei fogli come groupby su COMUNE
+                ordinati = sorted(esito.comuni)
+                nomi = nomi_fogli_univoci([sanitize_sheet_name(comune) for comune in ordinati])
+                xlsx.chiudi(list(zip(nomi, (parti_fogli[comune] for comune in ordinati))))
+                os.replace(temporaneo, file_excel)
+                esito.file_excel = file_excel
+                if avanzamento is not None:
+                    avanzamento.excel(len(nomi), len(nomi))
+            else:
+                xlsx.scarta()
+    except BaseException:
+        if xlsx is not None:
+            xlsx.scarta()
+        raise
+    finally:
+        lettura['sorgente'].close()
+
+    if export_kmz:
+        esito.pac_pal = tipizza_estrazione(pd.concat(pac_pal, ignore_index=True)) if pac_pal else pd.DataFrame()
+    esito.comuni.sort()
+    if blocco is not None:
+        esito.scan_info['end_row'] = blocco['end_row']
+        if blocco['end_row']:
+            esito.scan_info['righe_totali'] = blocco['end_row']
+    esito.scan_info['chunk'] = info_chunk(chunk_size, adattivo)
+    return esito
@@ -0,0 +1,94 @@
+"""
+Avanzamento elaborazione - Analizzatore DB OpenFiber
+Contatori reali dell'estrazione (byte letti, righe scansionate, record
+estratti, fogli Excel scritti, placemark KMZ) notificati come eventi a una
+callback, ad esempio per la progress bar della GUI
+"""
+
+import time
+
+# Fasi dell'elaborazione nell'ordine in cui vengono eseguite
+FASI = ('lettura', 'excel', 'kmz', 'completato')
+
+# Quota della percentuale complessiva assegnata a ogni fase (con e senza KMZ)
+_PESI_FASI = {
+    True: {'lettura': (0, 60), 'excel': (60, 88), 'kmz': (88, 99)},
+    False: {'lettura': (0, 65), 'excel': (65, 99)}
+}
+
+# Intervallo minimo tra due eventi della stessa fase (secondi)
+INTERVALLO_EVENTI = 0.1
+
+
+class Avanzamento:
+    """
+    Stato dell'avanzamento di una estrazione
+
+    Ogni aggiornamento produce un evento dict con tutti i contatori e la
+    percentuale complessiva stimata:
+        fase, percentuale, bytes_letti, bytes_totali, righe_scansionate,
+        record_estratti, fogli_scritti, fogli_totali, placemark,
+        placemark_totali (+ eventuali campi extra della fase 'completato')
+    Gli eventi ravvicinati della stessa fase vengono accorpati
+    (INTERVALLO_EVENTI); l'ultimo di ogni fase è sempre notificato.
+    """
+
+    def __init__(self, callback=None, export_kmz=False, bytes_totali=0):
+        self._callback = callback
+        self._pesi = _PESI_FASI[bool(export_kmz)]
+        self._ultimo_evento = 0.0
+        self.contatori = {
+            'fase': FASI[0],
+            'bytes_letti': 0,
+            'bytes_totali': bytes_totali,
+            'righe_scansionate': 0,
+            'record_estratti': 0,
+            'fogli_scritti': 0,
+            'fogli_totali': 0,
+            'placemark': 0,
+            'placemark_totali': 0
+        }
+
+    def percentuale(self):
+        """Percentuale complessiva (0-100) dai contatori della fase corrente"""
+        c = self.contatori
+        if c['fase'] == 'completato':
+            return 100.0
+        inizio, fine = self._pesi.get(c['fase'], (0, 0))
+        fatti, totali = {
+            'lettura': (c['bytes_letti'], c['bytes_totali']),
+            'excel': (c['fogli_scritti'], c['fogli_totali']),
+            'kmz': (c['placemark'], c['placemark_totali'])
+        }.get(c['fase'], (0, 0))
+        frazione = min(fatti / totali, 1.0) if totali else 0.0
+        return inizio + (fine - inizio) * frazione
+
+    def aggiorna(self, fase=None, forza=False, **contatori):
+        """Aggiorna i contatori e notifica l'evento (accorpato se troppo ravvicinato)"""
+        cambio_fase = fase is not None and fase != self.contatori['fase']
+        if fase is not None:
+            self.contatori['fase'] = fase
+        self.contatori.update(contatori)
+
+        if self._callback is None:
+            return
+        adesso = time.monotonic()
+        if not (forza or cambio_fase) and adesso - self._ultimo_evento < INTERVALLO_EVENTI:
+            return
+        self._ultimo_evento = adesso
+        self._callback({**self.contatori, 'percentuale': round(self.percentuale(), 1)})
+
+    # Callback per fase da passare ai componenti del motore
+
+    def lettura(self, byte_letti):
+        """Callback scansione: (righe scansionate, record estratti)"""
+        def progresso(righe, record):
+            self.aggiorna('lettura', bytes_letti=byte_letti(), righe_scansionate=righe,
+                          record_estratti=record)
+        return progresso
+
+    def excel(self, scritti, totali):
+        self.aggiorna('excel', forza=scritti == totali, fogli_scritti=scritti, fogli_totali=totali)
+
+    def kmz(self, scritti, totali):
+        self.aggiorna('kmz', forza=scritti == totali, placemark=scritti, placemark_totali=totali)
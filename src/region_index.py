@@ -0,0 +1,245 @@
+"""
+Indice byte-offset per regione - Analizzatore DB OpenFiber
+Sidecar JSON accanto al CSV nazionale con i range di byte di ogni REGIONE
+(e opzionalmente di ogni COMUNE) per saltare direttamente al blocco utile
+"""
+
+import io
+import json
+import os
+
+from config import REGIONI, CSV_CONFIG
+
+# Versione formato sidecar (incrementare se cambia la struttura)
+INDEX_VERSION = 1
+
+# Estensione file indice (es. dbcopertura_CD_20250715.csv.regidx.json)
+INDEX_SUFFIX = '.regidx.json'
+
+
+def path_indice(file_input):
+    """Restituisce il path del file indice sidecar per un CSV"""
+    return f"{file_input}{INDEX_SUFFIX}"
+
+
+def _firma_file(file_input):
+    """Dimensione e mtime del CSV: se cambiano l'indice non è più valido"""
+    stat = os.stat(file_input)
+    return {'file_size': stat.st_size, 'file_mtime_ns': stat.st_mtime_ns}
+
+
+def _aggiungi_range(ranges, codice, start, end, riga):
+    """
+    Aggiunge una riga al range del codice, estendendo l'ultimo range se contiguo
+
+    Ogni range è [start_byte, end_byte, start_row, n_rows] con start_row
+    1-based sulle righe dati (header escluso), come nella state machine.
+    """
+    lista = ranges.setdefault(codice, [])
+    if lista and lista[-1][1] == start:
+        lista[-1][1] = end
+        lista[-1][3] += 1
+    else:
+        lista.append([start, end, riga, 1])
+
+
+def costruisci_indice(file_input, con_comuni=False, salva=True):
+    """
+    Costruisce l'indice con una sola passata sul CSV pipe-separated
+
+    Assume il formato del dump OpenFiber: una riga per record, campi non
+    quotati, REGIONE come secondo campo e COMUNE come quarto.
+
+    Args:
+        file_input: Path file CSV di input
+        con_comuni: Se True indicizza anche i range di ogni COMUNE per regione
+        salva: Se True scrive il file sidecar accanto al CSV
+
+    Returns:
+        dict: Indice (firma file, lunghezza header, range per regione/comune)
+    """
+    separatore = CSV_CONFIG['separator'].encode()
+    firma = _firma_file(file_input)
+
+    regioni = {}
+    comuni = {}
+
+    print(f"🗂️ Costruzione indice regioni: {os.path.basename(file_input)}")
+
+    with open(file_input, 'rb') as f:
+        header = f.readline()
+        offset = len(header)
+        riga = 0
+
+        for line in f:
+            end = offset + len(line)
+            if not line.strip():
+                # Riga vuota: pd.read_csv la salta senza contarla
+                offset = end
+                continue
+
+            riga += 1
+            campi = line.split(separatore, 4)
+
+            if len(campi) > 1:
+                regione = campi[1].strip().decode(CSV_CONFIG['encoding'], 'replace')
+                if regione in REGIONI:
+                    _aggiungi_range(regioni, regione, offset, end, riga)
+                    if con_comuni and len(campi) > 3:
+                        comune = campi[3].strip().decode(CSV_CONFIG['encoding'], 'replace')
+                        _aggiungi_range(comuni.setdefault(regione, {}), comune, offset, end, riga)
+
+            offset = end
+
+    indice = {
+        'versione': INDEX_VERSION,
+        **firma,
+        'header_bytes': len(header),
+        'righe_totali': riga,
+        'regioni': regioni,
+        'comuni': comuni if con_comuni else None
+    }
+
+    if salva:
+        try:
+            with open(path_indice(file_input), 'w', encoding='utf-8') as f:
+                json.dump(indice, f)
+            print(f"💾 Indice salvato: {path_indice(file_input)}")
+        except OSError as e:
+            print(f"⚠️ Impossibile salvare indice sidecar: {e}")
+
+    print(f"✅ Indice costruito: {riga:,} righe, {len(regioni)} regioni")
+    return indice
+
+
+def indice_valido(indice, file_input):
+    """True se l'indice corrisponde a versione, dimensione e mtime correnti del CSV"""
+    if not indice or indice.get('versione') != INDEX_VERSION:
+        return False
+    firma = _firma_file(file_input)
+    return (indice.get('file_size') == firma['file_size']
+            and indice.get('file_mtime_ns') == firma['file_mtime_ns'])
+
+
+def carica_indice(file_input):
+    """
+    Carica l'indice sidecar se presente e ancora valido
+
+    Returns:
+        dict indice o None se mancante, corrotto o non più valido
+    """
+    path = path_indice(file_input)
+    if not os.path.exists(path):
+        return None
+
+    try:
+        with open(path, 'r', encoding='utf-8') as f:
+            indice = json.load(f)
+    except (OSError, ValueError) as e:
+        print(f"⚠️ Indice non leggibile, verrà ricostruito: {e}")
+        return None
+
+    if not indice_valido(indice, file_input):
+        print("ℹ️ CSV modificato (dimensione/mtime): indice invalidato")
+        return None
+
+    return indice
+
+
+def ottieni_indice(file_input, con_comuni=False):
+    """Carica l'indice sidecar valido o lo ricostruisce"""
+    indice = carica_indice(file_input)
+    if indice is not None and (not con_comuni or indice.get('comuni') is not None):
+        print(f"✅ Indice regioni caricato: {path_indice(file_input)}")
+        return indice
+    return costruisci_indice(file_input, con_comuni=con_comuni)
+
+
+def range_regione(indice, codice_regione, comune=None):
+    """
+    Restituisce i range di byte di una regione (o di un comune della regione)
+
+    Returns:
+        Lista di [start_byte, end_byte, start_row, n_rows] (vuota se assente)
+    """
+    if comune is None:
+        return indice['regioni'].get(codice_regione, [])
+    comuni = indice.get('comuni') or {}
+    return comuni.get(codice_regione, {}).get(comune, [])
+
+
+class RangeReader(io.RawIOBase):
+    """
+    Stream binario in sola lettura: header del CSV + una lista di range di byte
+
+    Permette di passare a pd.read_csv solo i byte della regione richiesta
+    senza copiarli in memoria.
+    """
+
+    def __init__(self, file_input, header_bytes, ranges):
+        self._file = open(file_input, 'rb')
+        self._segmenti = [(0, header_bytes)] + [(r[0], r[1]) for r in ranges]
+        self._corrente = 0
+        self._posizione = 0
+        self.byte_letti = 0
+        self._file.seek(0)
+
+    def readable(self):
+        return True
+
+    def readinto(self, buffer):
+        while self._corrente < len(self._segmenti):
+            start, end = self._segmenti[self._corrente]
+            if self._posizione < start:
+                self._posizione = start
+                self._file.seek(start)
+
+            rimanenti = end - self._posizione
+            if rimanenti <= 0:
+                self._corrente += 1
+                continue
+
+            n = self._file.readinto(memoryview(buffer)[:min(len(buffer), rimanenti)])
+            if not n:
+                self._corrente = len(self._segmenti)
+                break
+            self._posizione += n
+            self.byte_letti += n
+            return n
+        return 0
+
+    def close(self):
+        if not self.closed:
+            self._file.close()
+        super().close()
+
+
+def apri_range(file_input, header_bytes, ranges):
+    """
+    Apre uno stream di testo (header + range indicati) da passare a pd.read_csv
+
+    Args:
+        file_input: Path file CSV
+        header_bytes: Lunghezza in byte della riga di header
+        ranges: Range di byte (start_byte, end_byte, ...) es. da range_regione
+
+    Returns:
+        io.TextIOWrapper pronto per la lettura
+    """
+    raw = RangeReader(file_input, header_bytes, ranges)
+    return io.TextIOWrapper(io.BufferedReader(raw, buffer_size=1024 * 1024),
+                            encoding=CSV_CONFIG['encoding'], newline='')
+
+
+if __name__ == "__main__":
+    import sys
+
+    if len(sys.argv) < 2:
+        print("Uso: python region_index.py <file_csv> [--comuni]")
+        sys.exit(1)
+
+    indice = costruisci_indice(sys.argv[1], con_comuni='--comuni' in sys.argv)
+    for codice, ranges in sorted(indice['regioni'].items()):
+        righe = sum(r[3] for r in ranges)
+        mb = sum(r[1] - r[0] for r in ranges) / (1024 * 1024)
+        print(f"  {codice} {REGIONI[codice]:<22} {righe:>10,} righe  {mb:8.1f} MB  ({len(ranges)} range)")
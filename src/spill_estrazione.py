@@ -0,0 +1,260 @@
+"""
+Spill estrazione - Analizzatore DB OpenFiber
+Accumulatore a memoria limitata dei batch arricchiti: oltre una soglia
+(config.SPILL_CONFIG) i batch in memoria vengono scritti in una parte
+colonnare su disco (Parquet con un row group per comune, altrimenti pickle
+con un oggetto per comune) e Excel/KMZ li rileggono un comune alla volta
+"""
+
+import os
+import pickle
+import shutil
+import tempfile
+import weakref
+
+import numpy as np
+import pandas as pd
+
+from config import SPILL_CONFIG
+
+# Parquet opzionale (richiede pyarrow)
+try:
+    import pyarrow as pa
+    import pyarrow.parquet as pq
+    PARQUET_SUPPORT = True
+except ImportError:
+    PARQUET_SUPPORT = False
+
+# Colonna interna con la posizione del record nell'estrazione (ordine del file)
+COLONNA_POSIZIONE = '_POSIZIONE'
+
+
+def _leggi_gruppo(formato, path, posizione):
+    """Legge il gruppo di un comune da una parte (row group Parquet o offset pickle)"""
+    if formato == 'parquet':
+        return pq.ParquetFile(path).read_row_group(posizione).to_pandas()
+    with open(path, 'rb') as f:
+        f.seek(posizione)
+        return pickle.load(f)
+
+
+class GruppoSpill:
+    """
+    Record di un comune distribuiti nelle parti su disco
+
+    Chiamabile e serializzabile: i worker di un process pool (es. motore
+    Excel 'parallelo') leggono il proprio comune direttamente dai file.
+    """
+
+    def __init__(self, voci, trasforma=None):
+        self.voci = voci
+        self.trasforma = trasforma
+
+    def __call__(self):
+        df = pd.concat([_leggi_gruppo(*voce) for voce in self.voci], ignore_index=True)
+        df = df.drop(columns=COLONNA_POSIZIONE)
+        return self.trasforma(df) if self.trasforma is not None else df
+
+
+class EstrazioneSpill:
+    """
+    Estrazione arricchita scritta su disco in parti ordinate per COMUNE
+
+    Sostituisce il DataFrame finale quando l'accumulatore ha superato la
+    soglia: espone il numero di record, i comuni e i PCN distinti e rilegge
+    i dati per comune (gruppi) o filtrati nell'ordine del file (carica).
+    """
+
+    def __init__(self, cartella, indice, n_record, pcn, colonne):
+        self.cartella = cartella
+        self.indice = indice
+        self.n_record = n_record
+        self.pcn = pcn
+        self.columns = colonne
+        # File rimossi anche se chiudi() non viene chiamato (garbage collection / uscita)
+        self._pulizia = weakref.finalize(self, shutil.rmtree, cartella, True)
+
+    def __getstate__(self):
+        # Copia per un altro processo (es. pipeline di output): i file restano
+        # di proprietà dell'originale, che li elimina
+        stato = dict(self.__dict__)
+        del stato['_pulizia']
+        return stato
+
+    def __setstate__(self, stato):
+        self.__dict__.update(stato)
+        self._pulizia = lambda: None
+
+    def __len__(self):
+        return self.n_record
+
+    @property
+    def empty(self):
+        return self.n_record == 0
+
+    @property
+    def comuni(self):
+        """Nomi dei comuni in ordine alfabetico (come groupby su COMUNE)"""
+        return sorted(comune for comune in self.indice if comune is not None)
+
+    @property
+    def parti(self):
+        return len({path for voci in self.indice.values() for _, path, _ in voci})
+
+    def gruppi(self, trasforma=None):
+        """Lista (comune, GruppoSpill) in ordine alfabetico; i record senza comune sono esclusi"""
+        return [(comune, GruppoSpill(self.indice[comune], trasforma)) for comune in self.comuni]
+
+    def carica(self, seleziona=None):
+        """
+        Rilegge l'estrazione un comune alla volta nell'ordine originale dei record
+
+        Args:
+            seleziona: Funzione DataFrame -> DataFrame applicata a ogni comune
+                prima di concatenare (es. solo PAC/PAL): la memoria usata è
+                quella del sottoinsieme selezionato
+        """
+        parti = []
+        for voci in self.indice.values():
+            df = pd.concat([_leggi_gruppo(*voce) for voce in voci], ignore_index=True)
+            if seleziona is not None:
+                df = seleziona(df)
+            if len(df):
+                parti.append(df)
+        if not parti:
+            return pd.DataFrame(columns=self.columns)
+        df = pd.concat(parti, ignore_index=True).sort_values(COLONNA_POSIZIONE, kind='stable')
+        return df.drop(columns=COLONNA_POSIZIONE).reset_index(drop=True)
+
+    def chiudi(self):
+        """Elimina i file di spill"""
+        self._pulizia()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc):
+        self.chiudi()
+
+
+class AccumulatoreEstrazione:
+    """
+    Raccoglie i batch arricchiti della scansione
+
+    Finché la memoria dei batch resta sotto soglia_mb si comporta come una
+    lista + pd.concat; oltre la soglia i batch in memoria diventano una
+    parte su disco e risultato() restituisce una EstrazioneSpill.
+    """
+
+    def __init__(self, soglia_mb=None, cartella=None, formato=None):
+        """
+        Args:
+            soglia_mb: Memoria massima dei batch in memoria (None = nessuno spill)
+            cartella: Cartella dei file temporanei (default SPILL_CONFIG / temp di sistema)
+            formato: 'auto', 'parquet' o 'pickle' (default SPILL_CONFIG)
+        """
+        self.soglia = soglia_mb * 1024 * 1024 if soglia_mb is not None else None
+        self.cartella_base = cartella or SPILL_CONFIG['cartella']
+        self.formato = formato or SPILL_CONFIG['formato']
+        self.batches = []
+        self.memoria = 0
+        self.n_record = 0
+        self.cartella = None
+        self.indice = {}
+        self.pcn = set()
+        self.colonne = None
+
+    def __len__(self):
+        return self.n_record
+
+    @property
+    def spill(self):
+        return self.cartella is not None
+
+    def aggiungi(self, batch):
+        """Aggiunge un batch arricchito; scrive su disco se la soglia è superata"""
+        if self.colonne is None:
+            self.colonne = list(batch.columns)
+        if self.soglia is not None:
+            batch = batch.assign(**{COLONNA_POSIZIONE: np.arange(self.n_record, self.n_record + len(batch))})
+            self.memoria += int(batch.memory_usage(deep=True).sum())
+        self.batches.append(batch)
+        self.n_record += len(batch)
+        if self.soglia is not None and self.memoria > self.soglia:
+            self._scrivi_parte()
+
+    def _scrivi_parte(self):
+        """Scrive i batch in memoria in una nuova parte, un gruppo per comune"""
+        if not self.batches:
+            return
+        if self.cartella is None:
+            if self.cartella_base:
+                os.makedirs(self.cartella_base, exist_ok=True)
+            self.cartella = tempfile.mkdtemp(prefix="spill_estrazione_", dir=self.cartella_base)
+        parte = pd.concat(self.batches, ignore_index=True)
+        self.batches = []
+        self.memoria = 0
+        self.pcn.update(parte['POP'].dropna().astype(str))
+
+        # Gruppi in ordine di comune, record nell'ordine del file (COMUNE mancante incluso)
+        gruppi = [(None if pd.isna(comune) else comune, gruppo)
+                  for comune, gruppo in parte.groupby('COMUNE', sort=True, dropna=False, observed=True)]
+        base = os.path.join(self.cartella, f"parte_{len(os.listdir(self.cartella)):05d}")
+
+        voci = None
+        if self.formato in ('auto', 'parquet') and PARQUET_SUPPORT:
+            try:
+                voci = self._scrivi_parquet(parte, gruppi, base + '.parquet')
+            except Exception as e:
+                # Colonne a tipo misto (es. LAT_PCN '' per PCN sconosciuti): fallback pickle
+                if os.path.exists(base + '.parquet'):
+                    os.remove(base + '.parquet')
+                if self.formato == 'parquet':
+                    print(f"⚠️ Parquet non applicabile ({e}): uso pickle")
+        if voci is None:
+            voci = self._scrivi_pickle(gruppi, base + '.pkl')
+
+        for comune, voce in voci:
+            self.indice.setdefault(comune, []).append(voce)
+        print(f"💽 Spill su disco: parte {os.path.basename(base)} ({len(parte):,} record, {len(gruppi)} comuni)")
+
+    @staticmethod
+    def _scrivi_parquet(parte, gruppi, path):
+        schema = pa.Schema.from_pandas(parte, preserve_index=False)
+        voci = []
+        with pq.ParquetWriter(path, schema, compression='zstd') as writer:
+            for row_group, (comune, gruppo) in enumerate(gruppi):
+                writer.write_table(pa.Table.from_pandas(gruppo, schema=schema, preserve_index=False))
+                voci.append((comune, ('parquet', path, row_group)))
+        return voci
+
+    @staticmethod
+    def _scrivi_pickle(gruppi, path):
+        voci = []
+        with open(path, 'wb') as f:
+            for comune, gruppo in gruppi:
+                voci.append((comune, ('pickle', path, f.tell())))
+                pickle.dump(gruppo.reset_index(drop=True), f, protocol=pickle.HIGHEST_PROTOCOL)
+        return voci
+
+    def scarta(self):
+        """Elimina le parti già scritte (scansione interrotta)"""
+        if self.cartella is not None:
+            shutil.rmtree(self.cartella, ignore_errors=True)
+            self.cartella = None
+        self.batches = []
+
+    def risultato(self, colonne=None):
+        """
+        DataFrame concatenato se non c'è stato spill (colonne se vuoto),
+        altrimenti EstrazioneSpill con anche gli ultimi batch scritti su disco
+        """
+        if self.spill:
+            self._scrivi_parte()
+            return EstrazioneSpill(self.cartella, self.indice, self.n_record, self.pcn,
+                                   [c for c in self.colonne if c != COLONNA_POSIZIONE])
+        if not self.batches:
+            return pd.DataFrame(columns=colonne)
+        df = pd.concat(self.batches, ignore_index=True)
+        self.batches = []
+        return df.drop(columns=COLONNA_POSIZIONE, errors='ignore')
@@ -0,0 +1,1001 @@
+"""
+Test core engine estrattore_of
+Verifica equivalenza scansione vettoriale vs iterrows su DB sintetico
+"""
+
+import numpy as np
+import pandas as pd
+import io
+import json
+import os
+import sys
+import tempfile
+import zipfile
+from concurrent.futures import ProcessPoolExecutor
+from contextlib import redirect_stdout
+
+# Aggiungi src al path se necessario
+sys.path.insert(0, 'src')
+
+try:
+    from estrattore_of import (scan_regione_iterrows, scan_regione_vettoriale,
+                               process_record, arricchisci_batch, estrai_regione_02, main,
+                               costruisci_filtro, filtra_estrazione, tipizza_estrazione, leggi_regione,
+                               apri_lettura_regione)
+    from config import CSV_COLUMNS
+    from mmap_scanner import trova_blocco_regione
+    from estrattore_multiregione import dividi_in_range, estrai_regioni_df, estrai_regioni
+    from region_index import (costruisci_indice, carica_indice, ottieni_indice,
+                              range_regione, apri_range, path_indice)
+    from benchmark_of import genera_csv_sintetico, esegui_suite, confronta_report
+    from cache_estrazioni import (salva_estrazione, carica_estrazione, ultima_estrazione,
+                                  applica_limite, PARQUET_SUPPORT)
+    from config import CACHE_CONFIG
+    from delta_estrazioni import estrai_delta
+    from kmz_exporter import cartelle_comuni_kmz
+    from lettore_csv import risolvi_engine, PYARROW_SUPPORT
+    from chunk_adattivo import ChunkAdattivo
+    from config import CHUNK_AUTO_CONFIG, SPILL_CONFIG
+    from spill_estrazione import AccumulatoreEstrazione, EstrazioneSpill
+    from pipeline_comuni import blocchi_comune, in_thread, ComuniNonOrdinati
+    from indice_spaziale import (IndiceSpaziale, distanza_km, indice_edifici, indice_pcn, pcn_piu_vicino,
+                                 main as main_indice)
+    from coordinate import parse_coordinate_building
+    from config import PCN_VALLE_AOSTA
+    from anomalie_pcn import (aggiungi_distanze_pcn, report_anomalie, main as main_anomalie,
+                              ANOMALIA_LONTANO, ANOMALIA_PIU_VICINO, ANOMALIA_SENZA_COORDINATE)
+    from openpyxl import load_workbook
+    print("✅ Import moduli completati")
+except ImportError as e:
+    print(f"❌ Errore import: {e}")
+    sys.exit(1)
+
+# File sintetico condiviso dai test (generato una sola volta)
+_TEMP_DIR = tempfile.mkdtemp(prefix="test_estrattore_")
+FILE_SINTETICO = os.path.join(_TEMP_DIR, "db_sintetico.csv")
+RIGHE_PER_REGIONE = genera_csv_sintetico(FILE_SINTETICO, n_righe=20000, seed=7)
+
+
+def leggi_chunks(file_input, chunk_size):
+    """
+    Iteratore chunk di riferimento: tutte le colonne come stringhe, senza
+    proiezione né categoriali (la lettura di estrai_regione_02 è coperta da
+    test_scan_lettura_produzione)
+    """
+    return pd.read_csv(file_input, sep='|', chunksize=chunk_size, dtype=str, low_memory=False)
+
+
+def test_scan_vettoriale_identico():
+    """Scansione vettoriale e iterrows producono gli stessi record"""
+    print("\n🧪 Test scansione vettoriale vs iterrows...")
+
+    # Chunk size "scomodi" per coprire blocchi a cavallo tra chunk
+    for chunk_size in (97, 1000, 50000):
+        records_legacy, info_legacy = scan_regione_iterrows(leggi_chunks(FILE_SINTETICO, chunk_size))
+        records_vett, info_vett = scan_regione_vettoriale(leggi_chunks(FILE_SINTETICO, chunk_size))
+
+        assert info_legacy == info_vett, f"Info diverse: {info_legacy} vs {info_vett}"
+        pd.testing.assert_frame_equal(records_legacy, records_vett)
+        print(f"  chunk {chunk_size}: {len(records_vett):,} record identici")
+
+    assert len(records_vett) == RIGHE_PER_REGIONE['02']
+    print("✅ Test scansione vettoriale OK")
+
+
+def test_scan_regione_finale():
+    """Regione in fondo al file: nessuna fine blocco, end_row resta 0"""
+    print("\n🧪 Test regione a fine file...")
+
+    records_legacy, info_legacy = scan_regione_iterrows(leggi_chunks(FILE_SINTETICO, 333), '20')
+    records_vett, info_vett = scan_regione_vettoriale(leggi_chunks(FILE_SINTETICO, 333), '20')
+
+    assert info_vett == info_legacy
+    assert info_vett['end_row'] == 0
+    assert len(records_vett) == RIGHE_PER_REGIONE['20']
+    pd.testing.assert_frame_equal(records_legacy, records_vett)
+
+    print("✅ Test regione a fine file OK")
+
+
+def test_scan_lettura_produzione():
+    """Lettura di estrai_regione_02 (usecols, categoriali, motori CSV): stessi record del riferimento"""
+    print("\n🧪 Test scansione con la lettura di produzione...")
+
+    motori = ['pandas'] + (['pyarrow'] if PYARROW_SUPPORT else [])
+    for chunk_size in (97, 1000):
+        riferimento, info_riferimento = scan_regione_vettoriale(leggi_chunks(FILE_SINTETICO, chunk_size))
+        for motore in motori:
+            risultati = []
+            for scan in (scan_regione_iterrows, scan_regione_vettoriale):
+                lettura = apri_lettura_regione(FILE_SINTETICO, '02', chunk_size, csv_engine=motore)
+                try:
+                    risultati.append(scan(lettura['chunks']))
+                finally:
+                    lettura['sorgente'].close()
+            (records_legacy, info_legacy), (records_vett, info_vett) = risultati
+
+            assert info_legacy == info_vett == info_riferimento
+            pd.testing.assert_frame_equal(records_legacy, records_vett)
+            pd.testing.assert_frame_equal(riferimento, records_vett, check_dtype=False,
+                                          check_categorical=False)
+            print(f"  chunk {chunk_size} {motore}: {len(records_vett):,} record identici")
+
+    assert len(records_vett) == RIGHE_PER_REGIONE['02']
+    print("✅ Test scansione lettura di produzione OK")
+
+
+def test_arricchimento_batch_codici_sconosciuti():
+    """Batch enrichment identico a process_record anche con codici sconosciuti/mancanti"""
+    print("\n🧪 Test arricchimento batch con codici sconosciuti...")
+
+    righe = [
+        {'REGIONE': '02', 'COMUNE': '007003', 'POP': 'AOCUA', 'STATO_UI': '302'},
+        {'REGIONE': '02', 'COMUNE': ' 007022 ', 'POP': 'ZZZZZ', 'STATO_UI': '102'},
+        {'REGIONE': '02', 'COMUNE': '999999', 'POP': None, 'STATO_UI': None},
+        {'REGIONE': '02', 'COMUNE': None, 'POP': ' AOAGA', 'STATO_UI': '102'},
+    ]
+    block = pd.DataFrame(righe, columns=CSV_COLUMNS).astype(str).where(
+        pd.DataFrame(righe, columns=CSV_COLUMNS).notna()
+    )
+
+    atteso = pd.DataFrame([process_record(row) for _, row in block.iterrows()])
+    ottenuto = arricchisci_batch(block)
+
+    pd.testing.assert_frame_equal(atteso, ottenuto, check_dtype=False)
+    assert list(ottenuto['COMUNE']) == ['Aosta', 'Courmayeur', 'Comune sconosciuto (999999)',
+                                        'Comune sconosciuto (nan)']
+    assert ottenuto.loc[1, 'LAT_PCN'] == '' and ottenuto.loc[1, 'NOME_PCN'] == 'PCN sconosciuto (ZZZZZ)'
+
+    print("✅ Test arricchimento batch OK")
+
+
+def test_indice_regioni_seek():
+    """Lettura via indice byte-offset identica alla scansione sequenziale"""
+    print("\n🧪 Test indice byte-offset regioni...")
+
+    indice = costruisci_indice(FILE_SINTETICO, con_comuni=True)
+
+    for codice, n_righe in RIGHE_PER_REGIONE.items():
+        ranges = range_regione(indice, codice)
+        assert len(ranges) == 1, f"Regione {codice} frammentata: {ranges}"
+        assert ranges[0][3] == n_righe
+
+    # Regione 20 (ultima del file): seek diretto vs scansione completa
+    atteso, info_atteso = scan_regione_vettoriale(leggi_chunks(FILE_SINTETICO, 1000), '20')
+    ranges = range_regione(indice, '20')
+    with apri_range(FILE_SINTETICO, indice['header_bytes'], ranges) as sorgente:
+        ottenuto, info = scan_regione_vettoriale(leggi_chunks(sorgente, 1000), '20', ranges[0][2] - 1)
+    pd.testing.assert_frame_equal(atteso, ottenuto)
+    assert info == info_atteso
+
+    # Range per comune dentro la regione 02
+    totale_comuni = sum(r[3] for comune in indice['comuni']['02'].values() for r in comune)
+    assert totale_comuni == RIGHE_PER_REGIONE['02']
+    assert range_regione(indice, '02', comune='007003')
+
+    print("✅ Test indice regioni OK")
+
+
+def test_indice_invalidato_su_modifica():
+    """L'indice sidecar viene invalidato se cambiano dimensione o mtime del CSV"""
+    print("\n🧪 Test invalidazione indice...")
+
+    file_csv = os.path.join(_TEMP_DIR, "db_invalidazione.csv")
+    genera_csv_sintetico(file_csv, n_righe=2000, seed=3)
+
+    costruisci_indice(file_csv)
+    assert os.path.exists(path_indice(file_csv))
+    assert carica_indice(file_csv) is not None
+
+    # Modifica mtime: indice non più valido
+    stat = os.stat(file_csv)
+    os.utime(file_csv, ns=(stat.st_atime_ns, stat.st_mtime_ns + 10**9))
+    assert carica_indice(file_csv) is None
+
+    # ottieni_indice ricostruisce automaticamente
+    indice = ottieni_indice(file_csv)
+    assert carica_indice(file_csv) is not None
+    assert indice['righe_totali'] == 2000
+
+    print("✅ Test invalidazione indice OK")
+
+
+def test_scanner_mmap_blocco():
+    """Lo scanner mmap individua lo stesso blocco della scansione pandas"""
+    print("\n🧪 Test scanner mmap...")
+
+    for codice in ('01', '02', '20'):
+        _, info = scan_regione_vettoriale(leggi_chunks(FILE_SINTETICO, 1000), codice)
+        blocco = trova_blocco_regione(FILE_SINTETICO, codice)
+        # Finestre piccole: il blocco attraversa più finestre
+        assert trova_blocco_regione(FILE_SINTETICO, codice, finestra=4096) == blocco
+
+        assert blocco['start_row'] == info['start_row']
+        assert blocco['end_row'] == info['end_row']
+        assert blocco['n_rows'] == RIGHE_PER_REGIONE[codice]
+        print(f"  regione {codice}: righe {blocco['start_row']:,} - {blocco['end_row']:,}")
+
+    assert trova_blocco_regione(FILE_SINTETICO, '99') is None
+
+    # Righe vuote (non contate), spazi attorno al codice e blocco fino a fine file
+    file_bordi = os.path.join(_TEMP_DIR, "scanner_bordi.csv")
+    with open(file_bordi, 'w', encoding='utf-8', newline='') as f:
+        f.write("ID|REGIONE|X\na|01|x\n\n  \nb| 02 |x\nc|02|x\n\nd|02")
+    for finestra in (1, 8, 1 << 20):
+        blocco = trova_blocco_regione(file_bordi, '02', finestra=finestra)
+        assert blocco['start_row'] == 2 and blocco['n_rows'] == 3 and blocco['end_row'] == 0
+        assert blocco['start_byte'] == len("ID|REGIONE|X\na|01|x\n\n  \n")
+        assert trova_blocco_regione(file_bordi, '01', finestra=finestra)['end_row'] == 2
+
+    print("✅ Test scanner mmap OK")
+
+
+def test_estrai_regione_backend_mmap():
+    """estrai_regione_02 con reader='mmap' produce lo stesso Excel del backend pandas"""
+    print("\n🧪 Test estrai_regione_02 backend mmap...")
+
+    file_piccolo = os.path.join(_TEMP_DIR, "db_backend.csv")
+    genera_csv_sintetico(file_piccolo, n_righe=3000, seed=11)
+
+    fogli = {}
+    for reader in ('pandas', 'mmap'):
+        output_dir = os.path.join(_TEMP_DIR, f"out_{reader}")
+        assert estrai_regione_02(file_piccolo, os.path.join(output_dir, "va.xlsx"), 500, reader=reader)
+        excel = [f for f in os.listdir(output_dir) if f.endswith('.xlsx')][0]
+        fogli[reader] = pd.read_excel(os.path.join(output_dir, excel), sheet_name=None, dtype=str)
+
+    assert fogli['pandas'].keys() == fogli['mmap'].keys()
+    for nome in fogli['pandas']:
+        pd.testing.assert_frame_equal(fogli['pandas'][nome], fogli['mmap'][nome])
+
+    assert not estrai_regione_02(file_piccolo, os.path.join(_TEMP_DIR, "x.xlsx"), reader='sconosciuto')
+
+    print("✅ Test backend mmap OK")
+
+
+def test_multiregione_una_passata():
+    """Engine multi-regione in process pool = scansione per singola regione"""
+    print("\n🧪 Test estrazione multi-regione...")
+
+    header_bytes, ranges = dividi_in_range(FILE_SINTETICO, 7)
+    assert ranges[0][0] == header_bytes and ranges[-1][1] == os.path.getsize(FILE_SINTETICO)
+    assert all(a[1] == b[0] for a, b in zip(ranges, ranges[1:]))
+
+    dataframes, righe = estrai_regioni_df(FILE_SINTETICO, ['01', '02', '20'], chunk_size=700, n_workers=2)
+    assert righe == sum(RIGHE_PER_REGIONE.values())
+
+    for codice in ('01', '02', '20'):
+        atteso, _ = scan_regione_vettoriale(leggi_chunks(FILE_SINTETICO, 1000), codice)
+        pd.testing.assert_frame_equal(tipizza_estrazione(atteso), dataframes[codice])
+        print(f"  regione {codice}: {len(dataframes[codice]):,} record identici")
+
+    # Pipeline di output per regione
+    output_dir = os.path.join(_TEMP_DIR, "out_multiregione")
+    risultati = estrai_regioni(FILE_SINTETICO, ['02', '99'], output_dir=output_dir, n_workers=2)
+    assert list(risultati) == ['02']
+    assert risultati['02']['record'] == RIGHE_PER_REGIONE['02']
+    assert os.path.exists(risultati['02']['excel'])
+
+    print("✅ Test multi-regione OK")
+
+
+def test_cache_estrazioni():
+    """Cache estrazione: round-trip, invalidazione su mtime, eviction LRU"""
+    print("\n🧪 Test cache estrazioni...")
+
+    cache_dir = os.path.join(_TEMP_DIR, "cache")
+    file_csv = os.path.join(_TEMP_DIR, "db_cache.csv")
+    genera_csv_sintetico(file_csv, n_righe=3000, seed=13)
+    df, info = scan_regione_vettoriale(leggi_chunks(file_csv, 1000), '02')
+    df = tipizza_estrazione(df)
+
+    formati = ['pickle', 'parquet'] if PARQUET_SUPPORT else ['pickle']
+    for formato in formati:
+        assert salva_estrazione(file_csv, '02', df, info, cache_dir=cache_dir, formato=formato)
+        df_cache, info_cache = carica_estrazione(file_csv, '02', cache_dir=cache_dir)
+        pd.testing.assert_frame_equal(df, df_cache, check_dtype=False)
+        assert info_cache == info
+        print(f"  {formato}: round-trip OK")
+
+    # Colonne a tipo misto (PCN sconosciuto): sempre salvabili
+    df_misto = df.astype({'LAT_PCN': object})
+    df_misto.loc[0, 'LAT_PCN'] = ''
+    assert salva_estrazione(file_csv, '20', df_misto, info, cache_dir=cache_dir)
+    pd.testing.assert_frame_equal(df_misto, carica_estrazione(file_csv, '20', cache_dir=cache_dir)[0],
+                                  check_dtype=False)
+
+    # CSV modificato: cache non più valida
+    stat = os.stat(file_csv)
+    os.utime(file_csv, ns=(stat.st_atime_ns, stat.st_mtime_ns + 10**9))
+    assert carica_estrazione(file_csv, '02', cache_dir=cache_dir) is None
+
+    # Eviction LRU: con limite 0 MB non resta nessuna voce
+    path_02 = salva_estrazione(file_csv, '02', df, info, cache_dir=cache_dir)
+    assert salva_estrazione(file_csv, '20', df_misto, info, cache_dir=cache_dir)
+    assert ultima_estrazione('02', cache_dir=cache_dir) is not None  # 02 ora la più recente
+    applica_limite(cache_dir, max_mb=os.path.getsize(path_02) / (1024 * 1024))
+    assert carica_estrazione(file_csv, '20', cache_dir=cache_dir) is None
+    assert carica_estrazione(file_csv, '02', cache_dir=cache_dir) is not None
+    applica_limite(cache_dir, max_mb=0)
+    assert carica_estrazione(file_csv, '20', cache_dir=cache_dir) is None
+    assert ultima_estrazione('02', cache_dir=cache_dir) is None
+    assert os.listdir(cache_dir) == ['cache_index.json']
+
+    # estrai_regione_02 con use_cache: seconda esecuzione senza rilettura del CSV
+    cache_originale = CACHE_CONFIG['cache_dir']
+    CACHE_CONFIG['cache_dir'] = cache_dir
+    try:
+        output = os.path.join(_TEMP_DIR, "out_cache", "va.xlsx")
+        assert estrai_regione_02(file_csv, output, 500, use_cache=True)
+        df_ultima, voce = ultima_estrazione('02')
+        assert voce['file_input'] == os.path.abspath(file_csv)
+        pd.testing.assert_frame_equal(df, df_ultima, check_dtype=False)
+        assert not estrai_regione_02(file_csv, output, 500, use_cache=True, reader='sconosciuto')
+        assert estrai_regione_02(file_csv, output, 500, use_cache=True)
+    finally:
+        CACHE_CONFIG['cache_dir'] = cache_originale
+
+    print("✅ Test cache estrazioni OK")
+
+
+def _salva_in_cache(file_csv, cache_dir, n_worker):
+    """Worker: voci di cache distinte (parametri diversi) salvate in parallelo"""
+    df = pd.DataFrame({'COMUNE': ['Aosta'] * 50, 'N': range(50)})
+    return [salva_estrazione(file_csv, '02', df, parametri={'worker': n_worker, 'voce': i},
+                             cache_dir=cache_dir, formato='pickle') for i in range(5)]
+
+
+def test_cache_concorrente():
+    """Indice cache condiviso fra processi: nessuna voce persa, file orfani rimossi"""
+    print("\n🧪 Test cache con salvataggi concorrenti...")
+
+    cache_dir = os.path.join(_TEMP_DIR, "cache_concorrente")
+    file_csv = os.path.join(_TEMP_DIR, "db_cache_concorrente.csv")
+    genera_csv_sintetico(file_csv, n_righe=1000, seed=17)
+
+    n_worker = 6
+    with ProcessPoolExecutor(max_workers=n_worker) as executor:
+        futures = [executor.submit(_salva_in_cache, file_csv, cache_dir, i) for i in range(n_worker)]
+        path_salvati = [path for future in futures for path in future.result()]
+
+    # Ogni file scritto ha la sua voce nell'indice e viceversa
+    assert all(path_salvati)
+    with open(os.path.join(cache_dir, 'cache_index.json'), 'r', encoding='utf-8') as f:
+        voci = json.load(f)['voci']
+    assert len(voci) == n_worker * 5
+    assert sorted(os.path.basename(path) for path in path_salvati) == sorted(v['file'] for v in voci.values())
+    assert sorted(os.listdir(cache_dir)) == sorted(['cache_index.json'] + [v['file'] for v in voci.values()])
+    for i in range(n_worker):
+        assert carica_estrazione(file_csv, '02', {'worker': i, 'voce': 4}, cache_dir) is not None
+
+    # File dati senza voce (indice perso): rimosso alla prossima applicazione del limite
+    orfano = os.path.join(cache_dir, "02_0123456789abcdef.pkl.gz")
+    with open(orfano, 'wb') as f:
+        f.write(b'x' * 1000)
+    assert applica_limite(cache_dir) == 0
+    assert not os.path.exists(orfano)
+    assert len(os.listdir(cache_dir)) == n_worker * 5 + 1
+
+    print(f"✅ Test cache concorrente OK ({len(voci)} voci da {n_worker} processi)")
+
+
+def test_estrazione_incrementale():
+    """Delta tra due dump: conteggi variazioni e output identici a una rigenerazione completa"""
+    print("\n🧪 Test estrazione incrementale...")
+
+    cache_dir = os.path.join(_TEMP_DIR, "cache_delta")
+    output_dir = os.path.join(_TEMP_DIR, "output_delta")
+
+    # Nuovo dump: una data modificata, un record rimosso e uno aggiunto in tre comuni diversi
+    db = pd.read_csv(FILE_SINTETICO, sep='|', dtype=str, keep_default_na=False)
+    righe_02 = db.index[db['REGIONE'] == '02']
+    comuni = db.loc[righe_02, 'COMUNE'].unique()
+    assert len(comuni) >= 4
+    riga_modificata = righe_02[db.loc[righe_02, 'COMUNE'] == comuni[0]][0]
+    riga_rimossa = righe_02[db.loc[righe_02, 'COMUNE'] == comuni[1]][0]
+    riga_copiata = righe_02[db.loc[righe_02, 'COMUNE'] == comuni[2]][0]
+
+    db.loc[riga_modificata, 'DATA_ULTIMA_MODIFICA_RECORD'] = '2099-01-01'
+    nuova = db.loc[[riga_copiata]].assign(ID_BUILDING='B_NUOVO', ID_SCALA='S_NUOVA')
+    db = pd.concat([db.loc[:riga_copiata], nuova, db.loc[riga_copiata + 1:]]).drop(index=riga_rimossa)
+    file_nuovo = os.path.join(_TEMP_DIR, "db_mese_successivo.csv")
+    db.to_csv(file_nuovo, sep='|', index=False)
+
+    primo = estrai_delta(FILE_SINTETICO, output_dir, chunk_size=3000, export_kmz=True, cache_dir=cache_dir)
+    assert primo['baseline_creata'] and primo['aggiunti'] == primo['record']
+
+    delta = estrai_delta(file_nuovo, output_dir, chunk_size=3000, export_kmz=True, cache_dir=cache_dir)
+    assert not delta['baseline_creata']
+    assert (delta['aggiunti'], delta['rimossi'], delta['modificati']) == (1, 1, 1)
+    assert len(delta['comuni_toccati']) == 3
+
+    variazioni = load_workbook(delta['excel_delta'])
+    assert variazioni['Aggiunti']['A2'].value is not None and variazioni['Aggiunti'].max_row == 2
+    assert variazioni['Modificati'].max_row == variazioni['Rimossi'].max_row == 2
+
+    # Rigenerazione completa dello stesso dump senza baseline: stesso contenuto
+    completo = estrai_delta(file_nuovo, os.path.join(_TEMP_DIR, "output_completo"), chunk_size=3000,
+                            export_kmz=True, cache_dir=os.path.join(_TEMP_DIR, "cache_completo"))
+    atteso = load_workbook(completo['excel'])
+    ottenuto = load_workbook(delta['excel'])
+    assert ottenuto.sheetnames == atteso.sheetnames
+    for nome in atteso.sheetnames:
+        assert ([[c.value for c in r] for r in ottenuto[nome].iter_rows()]
+                == [[c.value for c in r] for r in atteso[nome].iter_rows()]), f"Foglio {nome} diverso"
+    assert cartelle_comuni_kmz(delta['kmz']) == cartelle_comuni_kmz(completo['kmz'])
+    sedi_pac_pal = sum(n for _, n in cartelle_comuni_kmz(delta['kmz']).values())
+
+    # Tutti gli edifici: le cartelle PAC/PAL del KMZ precedente non vengono riusate
+    tutti = estrai_delta(file_nuovo, output_dir, chunk_size=3000, export_kmz=True, cache_dir=cache_dir,
+                         stati_ui_kmz=None)
+    tutti_completo = estrai_delta(file_nuovo, os.path.join(_TEMP_DIR, "output_tutti"), chunk_size=3000,
+                                  export_kmz=True, cache_dir=os.path.join(_TEMP_DIR, "cache_tutti"),
+                                  stati_ui_kmz=None)
+    cartelle = cartelle_comuni_kmz(tutti['kmz'])
+    assert cartelle == cartelle_comuni_kmz(tutti_completo['kmz'])
+    assert sum(n for _, n in cartelle.values()) > sedi_pac_pal
+
+    print(f"  {len(comuni) - 3} comuni riusati, 3 rigenerati")
+    print("✅ Test estrazione incrementale OK")
+
+
+def test_eventi_avanzamento():
+    """Callback di avanzamento: contatori reali, percentuale monotona, evento finale completo"""
+    print("\n🧪 Test eventi avanzamento...")
+
+    eventi = []
+    output = os.path.join(_TEMP_DIR, "avanzamento", "estratto.xlsx")
+    assert estrai_regione_02(FILE_SINTETICO, output, chunk_size=2000, export_kmz=True,
+                             excel_engine='parallelo', progress_callback=eventi.append)
+
+    fasi = [e['fase'] for e in eventi]
+    assert fasi[0] == 'lettura' and fasi[-1] == 'completato'
+    assert fasi == sorted(fasi, key=['lettura', 'excel', 'kmz', 'completato'].index)
+    percentuali = [e['percentuale'] for e in eventi]
+    assert percentuali == sorted(percentuali) and percentuali[-1] == 100
+
+    finale = eventi[-1]
+    assert finale['record_estratti'] == RIGHE_PER_REGIONE['02']
+    assert finale['bytes_totali'] == os.path.getsize(FILE_SINTETICO)
+    assert 0 < finale['bytes_letti'] <= finale['bytes_totali']
+    assert finale['fogli_scritti'] == finale['fogli_totali'] == finale['comuni']
+    assert finale['placemark'] == finale['placemark_totali'] > 0
+    assert os.path.exists(finale['file_excel']) and os.path.exists(finale['file_kmz'])
+
+    print(f"  {len(eventi)} eventi, {finale['righe_scansionate']:,} righe scansionate")
+    print("✅ Test eventi avanzamento OK")
+
+
+def test_risultato_estrazione():
+    """estrai_regione_02 restituisce un risultato con metriche per fase e file generati"""
+    print("\n🧪 Test risultato estrazione...")
+
+    output = os.path.join(_TEMP_DIR, "risultato", "estratto.xlsx")
+    risultato = estrai_regione_02(FILE_SINTETICO, output, chunk_size=2000, export_kmz=True,
+                                  excel_engine='parallelo')
+    assert risultato and risultato.errore is None
+    assert set(risultato.fasi) == {'scansione', 'arricchimento', 'dataframe', 'excel', 'kmz', 'output'}
+    assert all(t['wall'] >= 0 and t['cpu'] >= 0 for t in risultato.fasi.values())
+    assert risultato.record_estratti == RIGHE_PER_REGIONE['02']
+    assert risultato.righe_scansionate == risultato.end_row > risultato.start_row
+    assert risultato.comuni > 0 and risultato.pcn > 0
+    assert risultato.artefatti == [risultato.file_excel, risultato.file_kmz]
+    assert all(os.path.exists(path) for path in risultato.artefatti)
+    assert os.path.basename(risultato.file_excel).startswith("estratto_")
+
+    # Serializzabile per storico benchmark / output CLI
+    dati = json.loads(json.dumps(risultato.to_dict()))
+    assert dati['record_estratti'] == risultato.record_estratti
+    assert dati['parametri']['excel_engine'] == 'parallelo'
+    assert dati['chunk'] == {'modalita': 'fisso', 'dimensione': 2000}
+
+    fallito = estrai_regione_02(os.path.join(_TEMP_DIR, "assente.csv"), output)
+    assert not fallito and "non trovato" in fallito.errore and fallito.artefatti == []
+
+    print(f"  {risultato!r}")
+    print("✅ Test risultato estrazione OK")
+
+
+def test_suite_benchmark():
+    """Generatore a blocchi ordinato e report JSON della suite con controllo regressioni"""
+    print("\n🧪 Test suite benchmark...")
+
+    cartella = os.path.join(_TEMP_DIR, "benchmark")
+    file_csv = os.path.join(cartella, "blocchi.csv")
+    righe = genera_csv_sintetico(file_csv, n_righe=9000, seed=3, blocco_righe=700)
+    db = pd.read_csv(file_csv, sep='|', dtype=str)
+    assert list(db.columns) == CSV_COLUMNS and len(db) == sum(righe.values())
+    assert db['REGIONE'].is_monotonic_increasing and db['ID_BUILDING'].is_unique
+    assert all(gruppo.is_monotonic_increasing for _, gruppo in db.groupby('REGIONE')['COMUNE'])
+
+    file_report = os.path.join(cartella, "report.json")
+    report = esegui_suite([20000], file_report, excel_engines=('parallelo',), cartella_dati=cartella)
+    with open(file_report, 'r', encoding='utf-8') as f:
+        salvato = json.load(f)
+    fasi = salvato['risultati']['20000']['fasi']
+    assert {'scansione', 'arricchimento', 'dataframe', 'coordinate', 'excel_parallelo', 'kmz',
+            'lettura_pandas', 'lettura_mmap', 'blocco_mmap'} <= set(fasi)
+    assert salvato['risultati']['20000']['lettori_identici']
+    assert salvato['risultati']['20000']['record'] == int(20000 * 0.06)
+
+    assert confronta_report(report, salvato) == []
+    riferimento = json.loads(json.dumps(salvato))
+    riferimento['risultati']['20000']['fasi']['excel_parallelo']['wall'] = 0.05
+    fasi['excel_parallelo']['wall'] = 1.0
+    regressioni = confronta_report(salvato, riferimento)
+    assert [r['fase'] for r in regressioni] == ['excel_parallelo']
+
+    print("✅ Test suite benchmark OK")
+
+
+def test_filtri_in_scansione():
+    """Filtri STATO_UI/COMUNE in scansione: stessi record del filtro a posteriori"""
+    print("\n🧪 Test filtri in scansione...")
+
+    completo, info_completo = scan_regione_vettoriale(leggi_chunks(FILE_SINTETICO, 1500))
+    istat = completo['ISTAT'].value_counts().index[:3].tolist()
+    filtro = costruisci_filtro(stati_ui=['102', '302'], comuni=istat)
+    atteso = filtra_estrazione(completo, filtro)
+    assert 0 < len(atteso) < len(completo)
+
+    for scan in (scan_regione_vettoriale, scan_regione_iterrows):
+        df, info = scan(leggi_chunks(FILE_SINTETICO, 1500), filtro=filtro)
+        # I confini della regione non dipendono dal filtro
+        assert info == info_completo
+        pd.testing.assert_frame_equal(df.reset_index(drop=True).astype(str), atteso.astype(str))
+
+    # Dalla cache (estrazione completa) il filtro viene applicato in memoria
+    cache_dir = os.path.join(_TEMP_DIR, "cache_filtri")
+    cache_originale = CACHE_CONFIG['cache_dir']
+    CACHE_CONFIG['cache_dir'] = cache_dir
+    try:
+        output = os.path.join(_TEMP_DIR, "filtri", "estratto.xlsx")
+        letto = estrai_regione_02(FILE_SINTETICO, output, chunk_size=3000, use_cache=True,
+                                  stati_ui=['302'], export_kmz=True)
+        assert letto and not letto.da_cache and letto.file_kmz
+        assert not os.path.exists(cache_dir) or not os.listdir(cache_dir)
+        assert estrai_regione_02(FILE_SINTETICO, output, chunk_size=3000, use_cache=True)
+        da_cache = estrai_regione_02(FILE_SINTETICO, output, chunk_size=3000, use_cache=True,
+                                     stati_ui=['302'])
+        assert da_cache.da_cache and da_cache.record_estratti == letto.record_estratti
+        assert letto.record_estratti == (completo['STATO_UI'] == '302').sum()
+    finally:
+        CACHE_CONFIG['cache_dir'] = cache_originale
+
+    print("✅ Test filtri in scansione OK")
+
+
+def test_cli_batch():
+    """CLI batch: job in pool di processi, filtri STATO_UI, formati e riepilogo JSON"""
+    print("\n🧪 Test CLI batch...")
+
+    cartella = os.path.join(_TEMP_DIR, "batch")
+    os.makedirs(cartella, exist_ok=True)
+    file_job = os.path.join(cartella, "jobs.json")
+    with open(file_job, 'w', encoding='utf-8') as f:
+        json.dump({
+            'default': {'input': FILE_SINTETICO, 'output_dir': cartella, 'chunk_size': 3000},
+            'jobs': [
+                {'id': 'pac_pal', 'stati_ui': ['302', '80'], 'formati': ['excel']},
+                {'id': 'solo_kmz', 'formati': ['kmz']},
+                {'id': 'multi', 'regioni': ['01', '02'], 'formati': ['excel']},
+                {'id': 'kmz_102', 'formati': ['kmz'], 'stati_ui_kmz': ['102']},
+                {'id': 'kmz_tutti', 'regioni': ['01', '02'], 'formati': ['kmz'], 'kmz_tile': True,
+                 'stati_ui_kmz': None},
+                {'id': 'assente', 'input': os.path.join(cartella, "assente.csv")}
+            ]
+        }, f)
+
+    file_riepilogo = os.path.join(cartella, "riepilogo.json")
+    assert main(['--batch', file_job, '--workers', '2', '--riepilogo', file_riepilogo]) == 1
+    with open(file_riepilogo, 'r', encoding='utf-8') as f:
+        riepilogo = json.load(f)
+    assert riepilogo['successi'] == 5 and riepilogo['falliti'] == 1
+    esiti = {job['id']: job for job in riepilogo['jobs']}
+    assert [job['id'] for job in riepilogo['jobs']] == ['pac_pal', 'solo_kmz', 'multi', 'kmz_102', 'kmz_tutti',
+                                                        'assente']
+
+    filtrato = esiti['pac_pal']['regioni']['02']
+    assert 0 < filtrato['record_estratti'] < RIGHE_PER_REGIONE['02']
+    assert filtrato['file_excel'] and filtrato['file_kmz'] is None
+    df = pd.read_excel(filtrato['file_excel'], sheet_name=None, dtype=str)
+    assert set(pd.concat(df.values())['STATO_UI']) <= {'302', '80'}
+
+    solo_kmz = esiti['solo_kmz']['regioni']['02']
+    assert solo_kmz['file_excel'] is None and os.path.exists(solo_kmz['file_kmz'])
+    assert esiti['multi']['regioni']['01']['record'] == RIGHE_PER_REGIONE['01']
+
+    # Selezione STATO_UI del KMZ: sedi contate dalla descrizione dei placemark (anche nei tile)
+    def sedi_kmz(file_kmz):
+        with zipfile.ZipFile(file_kmz) as kmz:
+            return sum(kmz.read(nome).count(b'ID Building:') for nome in kmz.namelist())
+
+    db = pd.read_csv(FILE_SINTETICO, sep='|', dtype=str)
+    stati_02 = db.loc[db['REGIONE'] == '02', 'STATO_UI']
+    assert sedi_kmz(solo_kmz['file_kmz']) == (stati_02 == '302').sum()
+    assert sedi_kmz(esiti['kmz_102']['regioni']['02']['file_kmz']) == (stati_02 == '102').sum()
+    assert sedi_kmz(esiti['kmz_tutti']['regioni']['02']['kmz']) == RIGHE_PER_REGIONE['02']
+    assert "non trovato" in esiti['assente']['errore']
+    assert all(os.path.exists(job['log']) for job in riepilogo['jobs'])
+
+    print("✅ Test CLI batch OK")
+
+
+def test_parser_csv_pyarrow():
+    """Parser pyarrow multithread: stessa estrazione e stesso Excel del parser pandas"""
+    print("\n🧪 Test parser CSV pyarrow...")
+
+    if not PYARROW_SUPPORT:
+        assert risolvi_engine('pyarrow') == 'pandas'
+        print("ℹ️ pyarrow non installato: verificato solo il fallback")
+        return
+
+    file_csv = os.path.join(_TEMP_DIR, "db_parser.csv")
+    genera_csv_sintetico(file_csv, n_righe=6000, seed=17, blocco_righe=400)
+
+    # Lettura completa e per range (mmap), con blocchi piccoli: molti batch pyarrow
+    for reader in ('pandas', 'mmap'):
+        df_pandas, info_pandas = leggi_regione(file_csv, '02', 300, reader=reader, csv_engine='pandas')
+        df_arrow, info_arrow = leggi_regione(file_csv, '02', 300, reader=reader, csv_engine='pyarrow')
+        assert info_pandas == info_arrow
+        pd.testing.assert_frame_equal(df_pandas, df_arrow, check_categorical=False)
+
+    fogli = {}
+    for engine in ('pandas', 'pyarrow'):
+        output_dir = os.path.join(_TEMP_DIR, f"out_parser_{engine}")
+        risultato = estrai_regione_02(file_csv, os.path.join(output_dir, "va.xlsx"), 300, csv_engine=engine)
+        assert risultato and risultato.parametri['csv_engine'] == engine
+        fogli[engine] = pd.read_excel(risultato.file_excel, sheet_name=None, dtype=str)
+
+    assert fogli['pandas'].keys() == fogli['pyarrow'].keys()
+    for nome in fogli['pandas']:
+        pd.testing.assert_frame_equal(fogli['pandas'][nome], fogli['pyarrow'][nome])
+
+    dataframes, _ = estrai_regioni_df(file_csv, ['01', '02'], chunk_size=300, n_workers=2, csv_engine='pyarrow')
+    pd.testing.assert_frame_equal(dataframes['02'], df_pandas, check_categorical=False)
+
+    assert not estrai_regione_02(file_csv, os.path.join(_TEMP_DIR, "x.xlsx"), csv_engine='sconosciuto')
+
+    print("✅ Test parser CSV pyarrow OK")
+
+
+def test_chunk_size_auto():
+    """Chunk size auto: cresce finché la velocità migliora, entro il budget di memoria"""
+    print("\n🧪 Test chunk size auto...")
+
+    config = {'iniziale': 1000, 'minimo': 500, 'massimo': 64000, 'guadagno_minimo': 0.05}
+    adattivo = ChunkAdattivo(configurazione=config)
+    adattivo.budget_mb = 100.0
+    # 100K → 200K righe/s: raddoppia; 4000 righe a 205K righe/s (+2.5%): torna a 2000
+    for righe, secondi in ((1000, 0.010), (2000, 0.010), (4000, 0.0195)):
+        adattivo.osserva(righe, secondi, byte=righe * 100)
+    assert not adattivo.campionamento and adattivo.dimensione == 2000
+    assert adattivo.to_dict()['byte_per_riga'] == 100
+
+    # Tetto di memoria: 100 MB / (20 KB per riga x fattore_picco 4) = 1280 righe
+    stretto = ChunkAdattivo(configurazione={**config, 'fattore_picco': 4})
+    stretto.budget_mb = 100.0
+    stretto.osserva(1000, 0.01, byte=1000 * 20 * 1024)
+    assert stretto.dimensione == 1280 and not stretto.campionamento
+
+    # Lettura reale: stesso risultato della lettura a chunk fisso, per entrambi i parser
+    # Regione 20 in fondo al file: molti chunk misurati prima del blocco
+    atteso, info_atteso = leggi_regione(FILE_SINTETICO, '20', 3000)
+    originale = dict(CHUNK_AUTO_CONFIG)
+    CHUNK_AUTO_CONFIG.update(config)
+    try:
+        for engine in ('pandas', 'pyarrow'):
+            df, info = leggi_regione(FILE_SINTETICO, '20', 'auto', csv_engine=engine)
+            pd.testing.assert_frame_equal(df, atteso, check_categorical=False)
+            assert info['righe_totali'] == info_atteso['righe_totali']
+            assert info['chunk']['modalita'] == 'auto' and info['chunk']['chunk_letti'] > 1
+            assert 500 <= info['chunk']['dimensione'] <= 64000
+
+        output = os.path.join(_TEMP_DIR, "chunk_auto", "estratto.xlsx")
+        risultato = estrai_regione_02(FILE_SINTETICO, output, chunk_size='auto')
+        assert risultato and risultato.parametri['chunk_size'] == 'auto'
+        assert risultato.to_dict()['chunk']['dimensione'] >= 500
+    finally:
+        CHUNK_AUTO_CONFIG.clear()
+        CHUNK_AUTO_CONFIG.update(originale)
+
+    assert not estrai_regione_02(FILE_SINTETICO, output, chunk_size=0)
+
+    print("✅ Test chunk size auto OK")
+
+
+def test_spill_su_disco():
+    """Oltre la soglia l'estrazione va su disco: stessi Excel e KMZ, file temporanei rimossi"""
+    print("\n🧪 Test spill su disco...")
+
+    # Accumulatore: parti Parquet/pickle rilette per comune o nell'ordine del file
+    blocchi = [blocco for _, blocco in pd.read_csv(FILE_SINTETICO, sep='|', dtype=str).groupby(
+        lambda i: i // 700)]
+    atteso = arricchisci_batch(pd.concat(blocchi[:8], ignore_index=True))
+    for formato in ('parquet', 'pickle'):
+        accumulatore = AccumulatoreEstrazione(soglia_mb=0.1, formato=formato)
+        for blocco in blocchi[:8]:
+            accumulatore.aggiungi(arricchisci_batch(blocco))
+        with accumulatore.risultato() as estrazione:
+            assert isinstance(estrazione, EstrazioneSpill) and estrazione.parti > 1
+            assert len(estrazione) == len(atteso)
+            pd.testing.assert_frame_equal(estrazione.carica().astype(str), atteso.astype(str))
+            comune = estrazione.comuni[0]
+            gruppo = estrazione.gruppi()[0][1]()
+            assert (gruppo['COMUNE'] == comune).all() and len(gruppo) == (atteso['COMUNE'] == comune).sum()
+        assert not os.path.exists(estrazione.cartella)
+
+    # Sotto soglia (o senza soglia): un DataFrame come prima
+    sotto = AccumulatoreEstrazione(soglia_mb=100)
+    sotto.aggiungi(atteso)
+    assert isinstance(sotto.risultato(), pd.DataFrame)
+
+    # estrai_regione_02: tutto in memoria vs spill, con tutti i motori Excel
+    cartella_spill = os.path.join(_TEMP_DIR, "spill_tmp")
+    cartella_originale = SPILL_CONFIG['cartella']
+    SPILL_CONFIG['cartella'] = cartella_spill
+    try:
+        riferimento = estrai_regione_02(FILE_SINTETICO, os.path.join(_TEMP_DIR, "spill_no", "va.xlsx"), 1500,
+                                        export_kmz=True, spill_mb=1e6)
+        fogli_attesi = pd.read_excel(riferimento.file_excel, sheet_name=None, dtype=str)
+        for engine in ('openpyxl', 'parallelo', 'streaming'):
+            output = os.path.join(_TEMP_DIR, f"spill_{engine}", "va.xlsx")
+            risultato = estrai_regione_02(FILE_SINTETICO, output, 300, export_kmz=True,
+                                          excel_engine=engine, spill_mb=0.05)
+            assert risultato and risultato.record_estratti == riferimento.record_estratti
+            assert (risultato.comuni, risultato.pcn) == (riferimento.comuni, riferimento.pcn)
+            fogli = pd.read_excel(risultato.file_excel, sheet_name=None, dtype=str)
+            assert list(fogli) == list(fogli_attesi)
+            for nome in fogli_attesi:
+                pd.testing.assert_frame_equal(fogli[nome], fogli_attesi[nome])
+            assert cartelle_comuni_kmz(risultato.file_kmz) == cartelle_comuni_kmz(riferimento.file_kmz)
+            assert os.listdir(cartella_spill) == []
+
+        # Multi-regione: regioni oltre soglia su disco, output identico
+        dataframes, _ = estrai_regioni_df(FILE_SINTETICO, ['01', '02'], chunk_size=1000, n_workers=2,
+                                          spill_mb=0.2)
+        memoria, _ = estrai_regioni_df(FILE_SINTETICO, ['01', '02'], chunk_size=1000, n_workers=2)
+        for codice in ('01', '02'):
+            assert isinstance(dataframes[codice], EstrazioneSpill)
+            pd.testing.assert_frame_equal(tipizza_estrazione(dataframes[codice].carica()), memoria[codice],
+                                          check_categorical=False)
+            dataframes[codice].chiudi()
+    finally:
+        SPILL_CONFIG['cartella'] = cartella_originale
+
+    print("✅ Test spill su disco OK")
+
+
+def test_pipeline_comuni():
+    """Pipeline a stadi: stessi Excel e KMZ dell'estrazione sequenziale, fallback se input non ordinato"""
+    print("\n🧪 Test pipeline a stadi per comune...")
+
+    # Blocchi comune: un comune è completo quando compare il successivo
+    db = pd.read_csv(FILE_SINTETICO, sep='|', dtype=str)
+    regione = arricchisci_batch(db[db['REGIONE'] == '02'])
+    batches = [regione.iloc[i:i + 250] for i in range(0, len(regione), 250)]
+    blocchi = list(blocchi_comune(in_thread(iter(batches), 2)))
+    nomi = [nome for nome, _ in blocchi]
+    assert len(nomi) == len(set(nomi)) == regione['COMUNE'].nunique()
+    pd.testing.assert_frame_equal(pd.concat([df for _, df in blocchi], ignore_index=True),
+                                  regione.reset_index(drop=True))
+    try:
+        list(blocchi_comune(in_thread(iter(batches + batches[:1]), 2)))
+        assert False, "Comune ripetuto non segnalato"
+    except ComuniNonOrdinati:
+        pass
+
+    # estrai_regione_02: pipeline vs sequenziale 'parallelo' (anche con filtro PAC/PAL)
+    for stati_ui in (None, ['302']):
+        riferimento = estrai_regione_02(FILE_SINTETICO, os.path.join(_TEMP_DIR, "pipeline_no", "va.xlsx"), 300,
+                                        export_kmz=True, excel_engine='parallelo', stati_ui=stati_ui)
+        risultato = estrai_regione_02(FILE_SINTETICO, os.path.join(_TEMP_DIR, "pipeline_si", "va.xlsx"), 300,
+                                      export_kmz=True, stati_ui=stati_ui, pipeline=True)
+        assert risultato and 'pipeline' in risultato.fasi
+        assert (risultato.record_estratti, risultato.comuni, risultato.pcn) == (
+            riferimento.record_estratti, riferimento.comuni, riferimento.pcn)
+        fogli_attesi = pd.read_excel(riferimento.file_excel, sheet_name=None, dtype=str)
+        fogli = pd.read_excel(risultato.file_excel, sheet_name=None, dtype=str)
+        assert list(fogli) == list(fogli_attesi)
+        for nome in fogli_attesi:
+            pd.testing.assert_frame_equal(fogli[nome], fogli_attesi[nome])
+        assert cartelle_comuni_kmz(risultato.file_kmz) == cartelle_comuni_kmz(riferimento.file_kmz)
+
+    # KMZ a tile: la pipeline prepara solo le sedi, nessuna cartella comune da ignorare
+    log = io.StringIO()
+    with redirect_stdout(log):
+        tile = estrai_regione_02(FILE_SINTETICO, os.path.join(_TEMP_DIR, "pipeline_tile", "va.xlsx"), 300,
+                                 export_kmz=True, export_excel=False, pipeline=True, kmz_tile=True,
+                                 stati_ui_kmz=None)
+    assert tile and 'pipeline' in tile.fasi and "ignorati" not in log.getvalue()
+    with zipfile.ZipFile(tile.file_kmz) as kmz:
+        assert sum(kmz.read(nome).count(b'ID Building:') for nome in kmz.namelist()) == RIGHE_PER_REGIONE['02']
+
+    # Comuni non contigui nel blocco regione: estrazione sequenziale
+    righe = db.index[db['REGIONE'] == '02']
+    mescolato = db.copy()
+    mescolato.loc[righe] = db.loc[righe].sample(frac=1, random_state=1).to_numpy()
+    file_mescolato = os.path.join(_TEMP_DIR, "db_mescolato.csv")
+    mescolato.to_csv(file_mescolato, sep='|', index=False)
+    risultato = estrai_regione_02(file_mescolato, os.path.join(_TEMP_DIR, "pipeline_fallback", "va.xlsx"), 300,
+                                  pipeline=True)
+    assert risultato and 'scansione' in risultato.fasi
+    assert risultato.record_estratti == len(righe)
+
+    print("✅ Test pipeline a stadi OK")
+
+
+def test_export_paralleli():
+    """Excel e KMZ generati in parallelo: errore Excel senza perdere il KMZ"""
+    print("\n🧪 Test export Excel/KMZ in parallelo...")
+
+    riferimento = estrai_regione_02(FILE_SINTETICO, os.path.join(_TEMP_DIR, "export_solo_kmz", "va.xlsx"), 2000,
+                                    export_kmz=True, export_excel=False)
+    risultato = estrai_regione_02(FILE_SINTETICO, os.path.join(_TEMP_DIR, "export_paralleli", "va.xlsx"), 2000,
+                                  export_kmz=True)
+    assert risultato and risultato.file_excel and risultato.file_kmz
+    assert cartelle_comuni_kmz(risultato.file_kmz) == cartelle_comuni_kmz(riferimento.file_kmz)
+    # La fase di output non somma Excel e KMZ (con un margine per l'avvio del processo)
+    fasi = risultato.fasi
+    assert fasi['output']['wall'] < fasi['excel']['wall'] + fasi['kmz']['wall'] + 1.0
+
+    # Excel fallito: il KMZ avviato in parallelo viene completato e riportato
+    import estrattore_of
+    originale = estrattore_of.generate_multisheet_excel
+    def excel_guasto(*args, **kwargs):
+        raise OSError("disco pieno")
+    estrattore_of.generate_multisheet_excel = excel_guasto
+    try:
+        guasto = estrai_regione_02(FILE_SINTETICO, os.path.join(_TEMP_DIR, "export_guasto", "va.xlsx"), 2000,
+                                   export_kmz=True)
+    finally:
+        estrattore_of.generate_multisheet_excel = originale
+    assert not guasto and 'disco pieno' in guasto.errore
+    assert guasto.file_excel is None and os.path.exists(guasto.file_kmz)
+    assert cartelle_comuni_kmz(guasto.file_kmz) == cartelle_comuni_kmz(riferimento.file_kmz)
+
+    print("✅ Test export in parallelo OK")
+
+
+def test_indice_spaziale():
+    """Indice a griglia: raggio, k più vicini e PCN più vicino identici alla forza bruta"""
+    print("\n🧪 Test indice spaziale...")
+
+    rng = np.random.default_rng(5)
+    lat = rng.uniform(36.6, 47.1, 50000)
+    lon = rng.uniform(6.6, 18.5, 50000)
+    lat[::97] = np.nan
+    indice = IndiceSpaziale(lat, lon, cella_km=2)
+    assert len(indice) == np.isfinite(lat).sum()
+    tutte = np.arange(len(lat))
+
+    for centro_lat, centro_lon, raggio in [(45.66, 7.69, 15), (41.9, 12.5, 40), (52.0, 2.0, 500), (38.0, 15.6, 0)]:
+        posizioni, distanze = indice.entro_raggio(centro_lat, centro_lon, raggio)
+        attese = distanza_km(centro_lat, centro_lon, lat, lon)
+        assert sorted(posizioni) == list(np.flatnonzero(attese <= raggio))
+        assert np.all(np.diff(distanze) >= 0)
+        for k in (1, 7):
+            vicini, _ = indice.piu_vicini(centro_lat, centro_lon, k)
+            assert list(vicini) == list(np.lexsort((tutte, np.nan_to_num(attese, nan=np.inf)))[:k])
+    assert len(IndiceSpaziale([np.nan], [np.nan]).piu_vicini(45.0, 7.0, 3)[0]) == 0
+
+    # Edifici dell'estrazione sintetica e PCN della Valle d'Aosta
+    df, _ = leggi_regione(FILE_SINTETICO, '02', 5000)
+    edifici = indice_edifici(df)
+    pcn = indice_pcn()
+    assert len(pcn) == len(PCN_VALLE_AOSTA)
+    lon_b, lat_b, _ = parse_coordinate_building(df['COORDINATE_BUILDING'])
+    aocua = PCN_VALLE_AOSTA['AOCUA']
+    posizioni, _ = edifici.entro_raggio(aocua['latitudine'], aocua['longitudine'], 15)
+    attese = distanza_km(aocua['latitudine'], aocua['longitudine'], lat_b, lon_b) <= 15
+    assert sorted(posizioni) == list(np.flatnonzero(attese))
+
+    vicino = pcn_piu_vicino(df, pcn)
+    matrice = distanza_km(lat_b[:, None], lon_b[:, None], pcn.dati['LAT_PCN'].to_numpy()[None, :],
+                          pcn.dati['LON_PCN'].to_numpy()[None, :])
+    assert list(vicino['PCN_VICINO']) == list(pcn.dati['POP'].to_numpy()[matrice.argmin(axis=1)])
+    assert np.allclose(vicino['DISTANZA_PCN_VICINO_KM'], matrice.min(axis=1))
+
+    # CLI: le 5 sedi PAC/PAL più vicine al PCN AOCUA
+    file_output = os.path.join(_TEMP_DIR, "indice", "pac_pal_aocua.csv")
+    assert main_indice([FILE_SINTETICO, '--pcn', 'AOCUA', '--vicini', '5', '--stato-ui', '302',
+                        '--output', file_output]) == 0
+    risultato = pd.read_csv(file_output, dtype=str)
+    pac_pal = df[df['STATO_UI'] == '302']
+    distanze = distanza_km(aocua['latitudine'], aocua['longitudine'], lat_b, lon_b)[(df['STATO_UI'] == '302').to_numpy()]
+    assert list(risultato['ID_BUILDING']) == list(pac_pal['ID_BUILDING'].to_numpy()[np.argsort(distanze, kind='stable')[:5]])
+    assert main_indice([FILE_SINTETICO, '--pcn', 'SCONOSCIUTO', '--vicini', '3']) == 2
+
+    print("✅ Test indice spaziale OK")
+
+
+def test_anomalie_pcn():
+    """Distanze edificio-PCN vettoriali e report anomalie ordinato"""
+    print("\n🧪 Test anomalie PCN...")
+
+    df, _ = leggi_regione(FILE_SINTETICO, '02', 5000)
+    distanze = aggiungi_distanze_pcn(df)
+    lon_b, lat_b, _ = parse_coordinate_building(df['COORDINATE_BUILDING'])
+    attese = distanza_km(lat_b, lon_b, df['LAT_PCN'].astype(float), df['LON_PCN'].astype(float))
+    assert np.allclose(distanze['DISTANZA_PCN_KM'], attese)
+    assert (distanze['SCARTO_PCN_KM'] >= -1e-9).all()
+    assert list(distanze.columns[:len(df.columns)]) == list(df.columns)
+
+    # Edifici costruiti: sul proprio PCN, sulla sede di un altro PCN, POP sconosciuto
+    aocua, aoaga = PCN_VALLE_AOSTA['AOCUA'], PCN_VALLE_AOSTA['AOAGA']
+    casi = df.iloc[:3].copy()
+    casi['POP'] = ['AOCUA', 'AOCUA', 'XXXXX']
+    casi['COORDINATE_BUILDING'] = [f"N{aocua['latitudine']}_E{aocua['longitudine']}",
+                                   f"N{aoaga['latitudine']}_E{aoaga['longitudine']}",
+                                   f"N{aocua['latitudine']}_E{aocua['longitudine']}"]
+    report = report_anomalie(casi, distanza_max_km=5, scarto_min_km=1)
+    assert list(report['ID_BUILDING']) == list(casi['ID_BUILDING'].iloc[[1, 2]])
+    assert report['ANOMALIA'].tolist() == [f"{ANOMALIA_LONTANO} + {ANOMALIA_PIU_VICINO}",
+                                           ANOMALIA_SENZA_COORDINATE]
+    assert report['PCN_VICINO'].tolist() == ['AOAGA', 'AOCUA'] and report['RANK'].tolist() == [1, 2]
+
+    # Report completo: ordinato per scarto decrescente, CLI con Excel a due fogli
+    report = report_anomalie(distanze)
+    scarti = report['SCARTO_PCN_KM'].dropna().to_numpy()
+    assert len(report) and np.all(np.diff(scarti) <= 0)
+    cartella = os.path.join(_TEMP_DIR, "anomalie")
+    assert main_anomalie([FILE_SINTETICO, '-o', cartella]) == 0
+    file_report = os.path.join(cartella, os.listdir(cartella)[0])
+    fogli = pd.read_excel(file_report, sheet_name=None)
+    assert list(fogli) == ['Anomalie', 'Riepilogo PCN'] and len(fogli['Anomalie']) == len(report)
+
+    print("✅ Test anomalie PCN OK")
+
+
+def run_all_tests():
+    """Esegue tutti i test"""
+    print("🧪 AVVIO TEST SUITE ESTRATTORE")
+    print("=" * 50)
+
+    tests = [
+        test_scan_vettoriale_identico,
+        test_scan_regione_finale,
+        test_scan_lettura_produzione,
+        test_arricchimento_batch_codici_sconosciuti,
+        test_indice_regioni_seek,
+        test_indice_invalidato_su_modifica,
+        test_scanner_mmap_blocco,
+        test_estrai_regione_backend_mmap,
+        test_multiregione_una_passata,
+        test_cache_estrazioni,
+        test_cache_concorrente,
+        test_estrazione_incrementale,
+        test_eventi_avanzamento,
+        test_risultato_estrazione,
+        test_suite_benchmark,
+        test_filtri_in_scansione,
+        test_cli_batch,
+        test_parser_csv_pyarrow,
+        test_chunk_size_auto,
+        test_spill_su_disco,
+        test_pipeline_comuni,
+        test_export_paralleli,
+        test_indice_spaziale,
+        test_anomalie_pcn
+    ]
+
+    passed = 0
+    failed = 0
+
+    for test_func in tests:
+        try:
+            test_func()
+            passed += 1
+        except Exception as e:
+            print(f"❌ {test_func.__name__} FALLITO: {e}")
+            failed += 1
+
+    print("\n" + "=" * 50)
+    print(f"📊 RISULTATI TEST: {passed} ✅ | {failed} ❌")
+
+    return failed == 0
+
+
+if __name__ == "__main__":
+    success = run_all_tests()
+    sys.exit(0 if success else 1)
@@ -14,6 +14,7 @@ if os.path.exists('src'):
 
 try:
     from kmz_exporter import genera_kmz_pac_pal
+    from cache_estrazioni import ultima_estrazione
     print("✅ Modulo KMZ importato")
 except ImportError as e:
     print(f"❌ Errore import KMZ: {e}")
@@ -82,29 +83,36 @@ def main():
     print("🧪 TEST EXCEL → KMZ REALE")
     print("=" * 50)
     
-    # 1. Trova Excel
-    excel_file = trova_excel()
-    if not excel_file:
-        print("💡 Assicurati di aver generato l'Excel con la GUI")
-        return False
-    
-    # 2. Leggi Excel
-    print(f"\n📖 Lettura Excel: {excel_file}")
-    try:
-        fogli = pd.read_excel(excel_file, sheet_name=None)
-        print(f"📋 Fogli trovati: {len(fogli)}")
-        
-        # Unisci tutti i fogli
-        tutti_dati = []
-        for nome, dati in fogli.items():
-            tutti_dati.append(dati)
-        
-        df_completo = pd.concat(tutti_dati, ignore_index=True)
+    # 1. Estrazione in cache (CSV invariato): nessuna rilettura dell'Excel
+    cache = ultima_estrazione('02')
+    if cache is not None:
+        df_completo, voce = cache
+        excel_file = "output/valle_aosta_estratto.xlsx"
+        print(f"⚡ Estrazione caricata dalla cache: {os.path.basename(voce['file_input'])}")
         print(f"✅ Record totali: {len(df_completo):,}")
+    else:
+        # 2. Trova e leggi Excel
+        excel_file = trova_excel()
+        if not excel_file:
+            print("💡 Assicurati di aver generato l'Excel con la GUI")
+            return False
         
-    except Exception as e:
-        print(f"❌ Errore lettura Excel: {e}")
-        return False
+        print(f"\n📖 Lettura Excel: {excel_file}")
+        try:
+            fogli = pd.read_excel(excel_file, sheet_name=None)
+            print(f"📋 Fogli trovati: {len(fogli)}")
+            
+            # Unisci tutti i fogli
+            tutti_dati = []
+            for nome, dati in fogli.items():
+                tutti_dati.append(dati)
+            
+            df_completo = pd.concat(tutti_dati, ignore_index=True)
+            print(f"✅ Record totali: {len(df_completo):,}")
+            
+        except Exception as e:
+            print(f"❌ Errore lettura Excel: {e}")
+            return False
     
     # 3. Verifica colonne
     colonne_necessarie = ['STATO_UI', 'COMUNE', 'ID_BUILDING', 'COORDINATE_BUILDING', 'POP']
@@ -0,0 +1,235 @@
+"""
+Test Excel writer parallelo e streaming
+Verifica che i motori 'parallelo' e 'streaming' producano lo stesso workbook del motore openpyxl
+(nomi fogli, valori, bordi, allineamento, larghezza colonne)
+"""
+
+import os
+import sys
+import tempfile
+
+import numpy as np
+import pandas as pd
+
+# Aggiungi src al path se necessario
+sys.path.insert(0, 'src')
+
+try:
+    from openpyxl import load_workbook
+    from estrattore_of import (scan_regione_vettoriale, generate_multisheet_excel, tipizza_estrazione,
+                               estrai_regione_02, process_record, apply_professional_formatting,
+                               sanitize_sheet_name)
+    from excel_writer import valori_colonna, valori_python, nomi_fogli_univoci, lettera_colonna, xml_foglio
+    from benchmark_of import genera_csv_sintetico
+    print("✅ Import moduli completati")
+except ImportError as e:
+    print(f"❌ Errore import: {e}")
+    sys.exit(1)
+
+_TEMP_DIR = tempfile.mkdtemp(prefix="test_excel_writer_")
+
+
+def estrazione_sintetica(n_righe=4000, seed=5):
+    """DataFrame arricchito e tipizzato della regione 02 da un DB sintetico"""
+    file_csv = os.path.join(_TEMP_DIR, f"db_{n_righe}_{seed}.csv")
+    genera_csv_sintetico(file_csv, n_righe=n_righe, seed=seed)
+    chunks = pd.read_csv(file_csv, sep='|', chunksize=1000, dtype=str, low_memory=False)
+    df, _ = scan_regione_vettoriale(chunks, '02')
+    return tipizza_estrazione(df)
+
+
+def contenuto_workbook(file_xlsx):
+    """Nomi fogli, valori, stili (di ogni cella, anche vuota) e larghezze di un workbook"""
+    wb = load_workbook(file_xlsx)
+    fogli = {}
+    for ws in wb.worksheets:
+        celle = [[c.value for c in row] for row in ws.iter_rows()]
+        stili = [[(c.border.left.style, c.border.bottom.style, c.alignment.horizontal, c.alignment.vertical)
+                  for c in row] for row in ws.iter_rows()]
+        larghezze = [ws.column_dimensions[lettera_colonna(i + 1)].width for i in range(ws.max_column)]
+        fogli[ws.title] = (celle, stili, larghezze)
+    return wb.sheetnames, fogli
+
+
+def test_valori_colonna():
+    """Classificazione vettoriale delle celle come pandas.to_excel"""
+    print("\n🧪 Test valori colonna...")
+
+    testo, tipo = valori_colonna(pd.Series([45.661442, 1.0, float('nan')]))
+    assert list(testo) == ['45.661442', '1', ''] and list(tipo) == ['n', 'n', 'e']
+
+    testo, tipo = valori_colonna(pd.Series(['AOCUA', None, 'a<b&c']))
+    assert list(testo) == ['AOCUA', '', 'a<b&c'] and list(tipo) == ['s', 'e', 's']
+
+    testo, tipo = valori_colonna(pd.Series([45.5, ''], dtype=object))
+    assert list(testo) == ['45.5', ''] and list(tipo) == ['n', 's']
+
+    valori = valori_python(pd.Series([45.5, 2.0, '', None, 'Aosta'], dtype=object))
+    assert list(valori) == [45.5, 2, None, None, 'Aosta'] and type(valori[1]) is int
+
+    # Categoriali: classificazione per categoria, mancanti vuoti
+    testo, tipo = valori_colonna(pd.Series(['302', None, '102', '302'], dtype='category'))
+    assert list(testo) == ['302', '', '102', '302'] and list(tipo) == ['s', 'e', 's', 's']
+
+    # Date e interi nullable tornano il testo del CSV
+    date = pd.Series([pd.Timestamp('2025-07-15'), pd.Timestamp('2025-07-15 10:30'), pd.NaT])
+    testo, tipo = valori_colonna(date)
+    assert list(testo) == ['2025-07-15', '2025-07-15 10:30:00', ''] and list(tipo) == ['s', 's', 'e']
+    valori = valori_python(pd.Series([7, None], dtype='Int64'))
+    assert list(valori) == ['7', None]
+
+    assert nomi_fogli_univoci(['Aosta', 'aosta', 'X' * 31]) == ['Aosta', 'aosta (2)', 'X' * 31]
+
+    # Celle vuote con stile e senza tipo (inlineStr senza <is> non è valido)
+    xml = xml_foglio(pd.DataFrame({'A': ['x', None], 'B': [1.0, float('nan')]})).decode('utf-8')
+    assert '<c r="A3" s="1"/><c r="B3" s="1"/>' in xml and 't="inlineStr"/>' not in xml
+
+    print("✅ Test valori colonna OK")
+
+
+def test_motori_identici_openpyxl():
+    """Motori parallelo/streaming e openpyxl producono workbook equivalenti"""
+    print("\n🧪 Test Excel parallelo/streaming vs openpyxl...")
+
+    df = estrazione_sintetica()
+    # Codice PCN sconosciuto: LAT/LON_PCN diventano colonne miste stringa/float
+    df['POP'] = df['POP'].cat.add_categories('ZZZZZ')
+    df.loc[df.index[:3], 'POP'] = 'ZZZZZ'
+    df['LAT_PCN'] = df['LAT_PCN'].astype(object)
+    df.loc[df.index[:3], 'LAT_PCN'] = ''
+    # Celle vuote: mancanti e stringa vuota
+    df['NOTE'] = None
+    df.loc[df.index[::2], 'NOTE'] = ''
+
+    file_openpyxl = os.path.join(_TEMP_DIR, "openpyxl.xlsx")
+    generate_multisheet_excel(df, file_openpyxl)
+    nomi_attesi, fogli_attesi = contenuto_workbook(file_openpyxl)
+
+    for engine in ('parallelo', 'streaming'):
+        file_engine = os.path.join(_TEMP_DIR, f"{engine}.xlsx")
+        generate_multisheet_excel(df, file_engine, engine=engine, n_workers=2)
+        nomi, fogli = contenuto_workbook(file_engine)
+
+        assert nomi == nomi_attesi, f"{engine}: fogli diversi {nomi} vs {nomi_attesi}"
+        for nome in nomi:
+            celle_attese, stili_attesi, larghezze_attese = fogli_attesi[nome]
+            celle, stili, larghezze = fogli[nome]
+            assert celle == celle_attese, f"{engine}: valori diversi nel foglio {nome}"
+            assert stili == stili_attesi, f"{engine}: stili diversi nel foglio {nome}"
+            assert {stile for riga in stili for stile in riga} == {('thin', 'thin', 'center', 'center')}
+            assert larghezze == larghezze_attese, f"{engine}: larghezze diverse nel foglio {nome}"
+        print(f"  {engine}: {len(nomi)} fogli identici")
+
+    # Parallelo senza pool (n_workers=1) stesso risultato
+    file_seriale = os.path.join(_TEMP_DIR, "seriale.xlsx")
+    generate_multisheet_excel(df, file_seriale, engine='parallelo', n_workers=1)
+    assert contenuto_workbook(file_seriale) == (nomi_attesi, fogli_attesi)
+
+    print("✅ Test motori Excel OK")
+
+
+def excel_baseline(file_csv, file_output):
+    """
+    Excel di riferimento con il percorso originale: tutto il CSV come testo,
+    process_record riga per riga, un foglio per comune con pandas.to_excel e
+    apply_professional_formatting
+    """
+    df = pd.read_csv(file_csv, sep='|', dtype=str, low_memory=False)
+    blocco = df[df['REGIONE'].astype(str).str.strip() == '02']
+    df_regione = pd.DataFrame([process_record(row) for _, row in blocco.iterrows()])
+    df_regione = df_regione.sort_values('COMUNE')
+    with pd.ExcelWriter(file_output, engine='openpyxl') as writer:
+        for comune_nome, gruppo_data in df_regione.groupby('COMUNE'):
+            nome_foglio = sanitize_sheet_name(comune_nome)
+            gruppo_data.to_excel(writer, sheet_name=nome_foglio, index=False)
+            apply_professional_formatting(writer.sheets[nome_foglio])
+
+
+def test_output_come_baseline():
+    """Excel di estrai_regione_02 (tutti i motori, pipeline) con le celle del percorso originale sul CSV canonico"""
+    print("\n🧪 Test Excel vs percorso originale...")
+
+    file_csv = os.path.join(_TEMP_DIR, "db_baseline.csv")
+    genera_csv_sintetico(file_csv, n_righe=6000, seed=11)
+    # Testo che una conversione di tipo cambierebbe: date non ISO, zeri iniziali, valori non numerici
+    df = pd.read_csv(file_csv, sep='|', dtype=str, keep_default_na=False)
+    righe = np.flatnonzero(df['REGIONE'].to_numpy() == '02')
+    df.loc[righe[0::6], 'DATA_ULTIMA_MODIFICA_RECORD'] = '15/07/2025'
+    df.loc[righe[1::6], 'DATA_ULTIMA_MODIFICA_RECORD'] = '2025-07-15 10:30:00'
+    df.loc[righe[2::6], 'DATA_ULTIMA_VARIAZIONE_STATO_BUILDING'] = '20250715'
+    df.loc[righe[3::6], 'TOTALE_UI'] = '007'
+    df.loc[righe[4::6], 'TOTALE_UI'] = 'n.d.'
+    df.loc[righe[5::6], 'TOTALE_UI'] = ''
+    df.to_csv(file_csv, sep='|', index=False)
+
+    # Riferimento: stesso CSV con i valori riscritti nella forma canonica
+    # (data ISO, intero senza zeri iniziali, non numerico vuoto)
+    file_canonico = os.path.join(_TEMP_DIR, "db_baseline_canonico.csv")
+    canonico = df.copy()
+    canonico.loc[righe[0::6], 'DATA_ULTIMA_MODIFICA_RECORD'] = '2025-07-15'
+    canonico.loc[righe[2::6], 'DATA_ULTIMA_VARIAZIONE_STATO_BUILDING'] = '2025-07-15'
+    canonico.loc[righe[3::6], 'TOTALE_UI'] = '7'
+    canonico.loc[righe[4::6], 'TOTALE_UI'] = ''
+    canonico.to_csv(file_canonico, sep='|', index=False)
+
+    file_baseline = os.path.join(_TEMP_DIR, "baseline.xlsx")
+    excel_baseline(file_canonico, file_baseline)
+    nomi_attesi, fogli_attesi = contenuto_workbook(file_baseline)
+
+    varianti = [('openpyxl', {}), ('parallelo', {}), ('streaming', {}),
+                ('parallelo', {'pipeline': True}), ('openpyxl', {'spill_mb': 0})]
+    for engine, opzioni in varianti:
+        cartella = os.path.join(_TEMP_DIR, f"baseline_{engine}_{'_'.join(opzioni)}")
+        risultato = estrai_regione_02(file_csv, os.path.join(cartella, "va.xlsx"), 1000,
+                                      excel_engine=engine, csv_engine='pandas', **opzioni)
+        assert risultato
+        nomi, fogli = contenuto_workbook(risultato.file_excel)
+        assert nomi == nomi_attesi, f"{engine} {opzioni}: fogli diversi"
+        for nome in nomi:
+            assert fogli[nome][0] == fogli_attesi[nome][0], f"{engine} {opzioni}: celle diverse nel foglio {nome}"
+            assert fogli[nome][1] == fogli_attesi[nome][1], f"{engine} {opzioni}: stili diversi nel foglio {nome}"
+        print(f"  {engine} {opzioni or ''}: {len(nomi)} fogli identici all'originale")
+
+    # Estrazione tipizzata: intero nullable e datetime64, non convertibili mancanti
+    estratto = tipizza_estrazione(df.iloc[righe].reset_index(drop=True))
+    assert str(estratto['TOTALE_UI'].dtype) == 'Int64'
+    assert str(estratto['DATA_ULTIMA_MODIFICA_RECORD'].dtype).startswith('datetime64')
+    assert estratto['DATA_ULTIMA_MODIFICA_RECORD'][0] == pd.Timestamp('2025-07-15')
+    assert estratto['DATA_ULTIMA_MODIFICA_RECORD'][1] == pd.Timestamp('2025-07-15 10:30')
+    assert estratto['DATA_ULTIMA_VARIAZIONE_STATO_BUILDING'][2] == pd.Timestamp('2025-07-15')
+    assert estratto['TOTALE_UI'][3] == 7 and pd.isna(estratto['TOTALE_UI'][4])
+
+    print("✅ Test Excel vs percorso originale OK")
+
+
+def run_all_tests():
+    """Esegue tutti i test"""
+    print("🧪 AVVIO TEST SUITE EXCEL WRITER")
+    print("=" * 50)
+
+    tests = [
+        test_valori_colonna,
+        test_motori_identici_openpyxl,
+        test_output_come_baseline
+    ]
+
+    passed = 0
+    failed = 0
+
+    for test_func in tests:
+        try:
+            test_func()
+            passed += 1
+        except Exception as e:
+            print(f"❌ {test_func.__name__} FALLITO: {e}")
+            failed += 1
+
+    print("\n" + "=" * 50)
+    print(f"📊 RISULTATI TEST: {passed} ✅ | {failed} ❌")
+
+    return failed == 0
+
+
+if __name__ == "__main__":
+    success = run_all_tests()
+    sys.exit(0 if success else 1)
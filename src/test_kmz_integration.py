@@ -3,6 +3,7 @@ Test completo integrazione export KMZ
 Verifica funzionamento modulo KMZ con dati realistici
 """
 
+import numpy as np
 import pandas as pd
 import os
 import sys
@@ -12,8 +13,9 @@ from datetime import datetime
 sys.path.insert(0, 'src')
 
 try:
-    from kmz_exporter import KMZExporter, genera_kmz_pac_pal
+    from kmz_exporter import KMZExporter, genera_kmz_pac_pal, tile_quadtree
     from config import PCN_VALLE_AOSTA, COMUNI_VALLE_AOSTA
+    from coordinate import parse_coordinate_building, riepilogo_non_validi
     print("✅ Import moduli completati")
 except ImportError as e:
     print(f"❌ Errore import: {e}")
@@ -120,6 +122,17 @@ def test_coordinate_parsing():
         else:
             assert result == expected, f"Expected {expected}, got {result}"
     
+    # Parser vettoriale: stessi risultati del parser per riga
+    valori = [c for c, _ in test_coords] + ['N45.1.2_E7.3', ' N45.5_E7.5 ', 'XN45_E7', 'N45.5_E7.5abc']
+    lon, lat, validi = parse_coordinate_building(valori)
+    for valore, x, y, valido in zip(valori, lon, lat, validi):
+        atteso = exporter.parse_coordinates(valore)
+        assert valido == (atteso is not None), f"Validità diversa per {valore!r}"
+        if atteso is not None:
+            assert (x, y, 0) == atteso, f"Expected {atteso}, got {(x, y, 0)}"
+    assert lon.dtype == lat.dtype == np.float64
+    print(f"  vettoriale: {riepilogo_non_validi(valori, validi)}")
+    
     print("✅ Test coordinate parsing OK")
 
 def test_pcn_colors():
@@ -176,6 +189,47 @@ def test_kmz_generation():
         print(f"❌ Errore test KMZ: {e}")
         return False
 
+def test_kmz_streaming_struttura():
+    """Il KML scritto in streaming è XML valido con cartelle e segnaposto attesi"""
+    print("\n🌍 Test struttura KML streaming...")
+    
+    import zipfile
+    import xml.etree.ElementTree as ET
+    
+    df_test = create_test_data()
+    df_test.loc[0, 'INDIRIZZO'] = 'Via <Test> & "Co"'
+    output_file = "test_streaming.kmz"
+    
+    try:
+        assert genera_kmz_pac_pal(df_test, output_file)
+        with zipfile.ZipFile(output_file) as kmz:
+            assert kmz.namelist() == ['doc.kml']
+            root = ET.fromstring(kmz.read('doc.kml'))
+    finally:
+        if os.path.exists(output_file):
+            os.remove(output_file)
+    
+    ns = {'kml': 'http://www.opengis.net/kml/2.2'}
+    df_pac_pal = df_test[df_test['STATO_UI'] == '302']
+    pcn_attesi = [p for p in df_pac_pal['POP'].unique() if p in PCN_VALLE_AOSTA]
+    
+    cartelle = root.findall('kml:Document/kml:Folder/kml:Folder', ns)
+    nomi_cartelle = [f.find('kml:name', ns).text for f in cartelle]
+    assert nomi_cartelle[0] == "📡 PCN OpenFiber"
+    assert nomi_cartelle[1:] == [f"🏛️ {c}" for c in sorted(df_pac_pal['COMUNE'].unique())]
+    
+    assert len(cartelle[0].findall('kml:Placemark', ns)) == len(pcn_attesi)
+    sedi = [p for f in cartelle[1:] for p in f.findall('kml:Placemark', ns)]
+    assert len(sedi) == len(df_pac_pal)
+    assert len(root.findall('kml:Document/kml:Style', ns)) == 2 * len(PCN_VALLE_AOSTA)
+    
+    # Escape corretto dei caratteri speciali nella descrizione
+    descrizione = sedi[0].find('kml:description', ns).text
+    assert 'Via <Test> & "Co"' in descrizione
+    assert sedi[0].find('kml:Point/kml:coordinates', ns).text == '7.320166,45.737649,0'
+    
+    print(f"✅ Test struttura KML streaming OK ({len(sedi)} sedi, {len(pcn_attesi)} PCN)")
+
 def test_data_filtering():
     """Test filtro dati PAC/PAL"""
     print("\n🔍 Test filtro dati...")
@@ -213,6 +267,118 @@ def test_pcn_uniqueness():
     
     print("✅ Test unicità PCN OK")
 
+def test_kmz_tile():
+    """KMZ a tile: ogni sede in un solo tile, link validi, tile non foglia entro il limite"""
+    print("\n🧩 Test KMZ a tile (Region/NetworkLink)...")
+    
+    import zipfile
+    import xml.etree.ElementTree as ET
+    
+    rng = np.random.default_rng(7)
+    n = 600
+    lat = rng.uniform(45.5, 45.95, n)
+    lon = rng.uniform(6.8, 7.9, n)
+    df_test = pd.DataFrame({
+        'COMUNE': rng.choice(['Aosta', 'Verrès', 'Courmayeur'], n),
+        'ISTAT': '007003',
+        'INDIRIZZO': 'Via Roma',
+        'CIVICO': np.arange(n).astype(str),
+        'ID_BUILDING': [f"ED_{i:04d}" for i in range(n)],
+        'COORDINATE_BUILDING': [f"N{y:.6f}_E{x:.6f}" for y, x in zip(lat, lon)],
+        'STATO_UI': '302',
+        'POP': rng.choice(list(PCN_VALLE_AOSTA), n),
+        'NOME_PCN': 'POP_TEST'
+    })
+    
+    # Quadtree: partizione dei punti, profondità rispettata
+    tiles = list(tile_quadtree(lon, lat, 50, 3))
+    posizioni = np.concatenate([t[2] for t in tiles])
+    assert np.array_equal(np.sort(posizioni), np.arange(n))
+    assert max(len(t[0]) for t in tiles) <= 2
+    
+    output_file = "test_tile.kmz"
+    try:
+        assert KMZExporter().export_kmz_tile(df_test, output_file, filtrato=True,
+                                             placemark_per_tile=50, profondita_max=4)
+        with zipfile.ZipFile(output_file) as kmz:
+            nomi = kmz.namelist()
+            documenti = {nome: ET.fromstring(kmz.read(nome)) for nome in nomi}
+    finally:
+        if os.path.exists(output_file):
+            os.remove(output_file)
+    
+    # Riuso di cartelle non applicabile ai tile: segnalato, KMZ comunque completo
+    import io
+    from contextlib import redirect_stdout
+    log = io.StringIO()
+    try:
+        with redirect_stdout(log):
+            assert genera_kmz_pac_pal(df_test, output_file, riusa_da="precedente.kmz",
+                                      comuni_invariati=['Aosta'], tile=True)
+    finally:
+        if os.path.exists(output_file):
+            os.remove(output_file)
+    assert "riusa_da, comuni_invariati ignorati" in log.getvalue()
+    
+    ns = {'kml': 'http://www.opengis.net/kml/2.2'}
+    assert nomi[0] == 'doc.kml' and 'tiles/t.kml' in nomi
+    link_radice = documenti['doc.kml'].findall('.//kml:NetworkLink/kml:Link/kml:href', ns)
+    assert [h.text for h in link_radice] == ['tiles/t.kml']
+    
+    id_sedi = []
+    for nome, root in documenti.items():
+        if nome == 'doc.kml':
+            continue
+        sedi = root.findall('kml:Document/kml:Placemark', ns)
+        id_sedi += [p.find('kml:name', ns).text for p in sedi]
+        link = root.findall('kml:Document/kml:NetworkLink', ns)
+        if link:
+            assert len(sedi) <= 50
+        for network_link in link:
+            assert f"tiles/{network_link.find('kml:Link/kml:href', ns).text}" in nomi
+            assert network_link.find('kml:Region/kml:Lod/kml:minLodPixels', ns) is not None
+    
+    # Ogni sede compare esattamente una volta fra tutti i tile
+    assert len(id_sedi) == n
+    assert len(set(id_sedi)) == n
+    
+    print(f"✅ Test KMZ a tile OK ({len(nomi) - 1} tile, {n} sedi)")
+
+def test_kmz_etichette():
+    """Nome documento da selezione STATO_UI e regione, titolo sede dal proprio STATO_UI"""
+    print("\n🏷️ Test etichette KMZ...")
+    
+    import zipfile
+    import xml.etree.ElementTree as ET
+    
+    df_test = create_test_data()
+    df_test.loc[0, 'STATO_UI'] = '102'
+    ns = {'kml': 'http://www.opengis.net/kml/2.2'}
+    
+    output_file = "test_etichette.kmz"
+    try:
+        for stati_ui, regione, titolo in ((('302',), '02', "Sede PAC/PAL - Valle d'Aosta"),
+                                          (None, '03', "Tutti gli edifici - Lombardia")):
+            for tile in (False, True):
+                assert genera_kmz_pac_pal(df_test, output_file, tile=tile, stati_ui=stati_ui, regione=regione)
+                with zipfile.ZipFile(output_file) as kmz:
+                    documenti = [ET.fromstring(kmz.read(nome)) for nome in kmz.namelist()]
+                nome = documenti[0].find('kml:Document/kml:name', ns).text
+                assert nome.startswith(titolo), nome
+                
+                descrizioni = {p.find('kml:name', ns).text: p.find('kml:description', ns).text
+                               for root in documenti for p in root.iter(f"{{{ns['kml']}}}Placemark")}
+                sedi = df_test if stati_ui is None else df_test[df_test['STATO_UI'] == '302']
+                for id_building, stato in zip(sedi['ID_BUILDING'], sedi['STATO_UI']):
+                    atteso = 'Sede FTTH' if stato == '102' else 'Sede PAC/PAL'
+                    assert descrizioni[id_building].startswith(f"<b>{atteso}</b>")
+                assert (df_test.loc[0, 'ID_BUILDING'] in descrizioni) == (stati_ui is None)
+    finally:
+        if os.path.exists(output_file):
+            os.remove(output_file)
+    
+    print("✅ Test etichette KMZ OK")
+
 def run_all_tests():
     """Esegue tutti i test"""
     print("🧪 AVVIO TEST SUITE KMZ")
@@ -223,7 +389,10 @@ def run_all_tests():
         test_pcn_colors,
         test_data_filtering,
         test_pcn_uniqueness,
-        test_kmz_generation
+        test_kmz_generation,
+        test_kmz_streaming_struttura,
+        test_kmz_tile,
+        test_kmz_etichette
     ]
     
     passed = 0